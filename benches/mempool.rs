@@ -0,0 +1,97 @@
+//! Fills a Mempool with CHAIN_GANG_BENCH_TXS (default 1,000,000) transactions under a memory
+//! budget, then confirms a block of them
+//!
+//! Every tenth transaction starts a new chain and the rest spend the one before, so the pool
+//! holds chains of ten. The budget, CHAIN_GANG_BENCH_MEMPOOL_MB (default 300), is smaller than
+//! the transactions need, so the lowest fee rates are evicted as the pool fills.
+//!
+//! Run with `cargo bench --bench mempool`.
+
+use chain_gang::mempool::{Mempool, MempoolConfig};
+use chain_gang::messages::{OutPoint, Tx, TxIn, TxOut};
+use chain_gang::script::Script;
+use chain_gang::util::Hash256;
+use std::time::Instant;
+
+fn env(name: &str, default: usize) -> usize {
+    std::env::var(name)
+        .ok()
+        .and_then(|value| value.parse().ok())
+        .unwrap_or(default)
+}
+
+fn tx(n: usize, prev: Option<Hash256>) -> Tx {
+    let prev_output = match prev {
+        Some(hash) => OutPoint { hash, index: 0 },
+        None => OutPoint {
+            hash: Hash256([7; 32]),
+            index: n as u32,
+        },
+    };
+    Tx {
+        version: 1,
+        inputs: vec![TxIn {
+            prev_output,
+            unlock_script: Script(vec![1; 107]),
+            sequence: 0xffffffff,
+        }],
+        outputs: vec![
+            TxOut {
+                satoshis: 1000,
+                lock_script: Script(vec![2; 25]),
+            },
+            TxOut {
+                satoshis: 2000,
+                lock_script: Script(vec![2; 25]),
+            },
+        ],
+        lock_time: 0,
+    }
+}
+
+fn main() {
+    let count = env("CHAIN_GANG_BENCH_TXS", 1_000_000);
+    let max_bytes = env("CHAIN_GANG_BENCH_MEMPOOL_MB", 300) * 1000 * 1000;
+    let txs: Vec<Tx> = {
+        let mut prev = None;
+        (0..count)
+            .map(|n| {
+                let tx = tx(n, if n % 10 == 0 { None } else { prev });
+                prev = Some(tx.hash());
+                tx
+            })
+            .collect()
+    };
+
+    let mut mempool = Mempool::new(MempoolConfig {
+        max_bytes,
+        ..Default::default()
+    });
+    let start = Instant::now();
+    let mut rejected = 0;
+    for (n, tx) in txs.iter().enumerate() {
+        if mempool.insert(tx, 50 + (n % 1000) as i64).is_err() {
+            rejected += 1;
+        }
+    }
+    let elapsed = start.elapsed();
+    let stats = mempool.stats();
+    println!(
+        "insert: {count} txs in {elapsed:?} ({:.0} tx/s), {} pooled, {} evicted, {rejected} rejected, {:.1}MB used of {:.1}MB",
+        count as f64 / elapsed.as_secs_f64(),
+        stats.count,
+        stats.evicted,
+        stats.usage as f64 / 1e6,
+        stats.max_bytes as f64 / 1e6,
+    );
+
+    let block: Vec<Tx> = txs.iter().rev().take(count / 10).rev().cloned().collect();
+    let start = Instant::now();
+    let removal = mempool.remove_confirmed(&block);
+    println!(
+        "block: {} confirmed, {} conflicted in {:?}",
+        removal.confirmed.len(),
+        removal.conflicted.len(),
+        start.elapsed()
+    );
+}
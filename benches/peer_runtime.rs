@@ -0,0 +1,124 @@
+//! Compares the event loop PeerRuntime with thread-per-peer Peer::connect
+//!
+//! Connects CHAIN_GANG_BENCH_PEERS (default 1000) peers to a loopback stand-in node, then times a
+//! round of ping/pong with every peer.
+//!
+//! Run with `cargo bench --bench peer_runtime`. Raise the open file limit (`ulimit -n`) first for
+//! large peer counts.
+
+use chain_gang::messages::{Message, Ping, Version, NODE_BITCOIN_CASH, PROTOCOL_VERSION};
+use chain_gang::network::Network;
+use chain_gang::peer::{Peer, PeerMessage, PeerNodeFilter, PeerRuntime};
+use chain_gang::util::rx::{Observable, Observer};
+use chain_gang::util::secs_since;
+use std::net::{IpAddr, TcpListener};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Arc;
+use std::thread;
+use std::time::{Duration, Instant, UNIX_EPOCH};
+
+const NETWORK: Network = Network::BSV_Testnet;
+
+fn version() -> Version {
+    Version {
+        version: PROTOCOL_VERSION,
+        services: NODE_BITCOIN_CASH,
+        timestamp: secs_since(UNIX_EPOCH) as i64,
+        user_agent: "/Bitcoin SV:1.0.0/".to_string(),
+        ..Default::default()
+    }
+}
+
+/// Stand-in node that completes the handshake and answers pings, a thread per connection
+fn node() -> u16 {
+    let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+    let port = listener.local_addr().unwrap().port();
+    thread::spawn(move || {
+        for stream in listener.incoming() {
+            let Ok(mut stream) = stream else { continue };
+            thread::spawn(move || {
+                let magic = NETWORK.magic();
+                let mut serve = || -> Result<(), chain_gang::util::ChainGangError> {
+                    Message::read(&mut stream, magic)?;
+                    Message::Version(version()).write(&mut stream, magic)?;
+                    Message::Verack.write(&mut stream, magic)?;
+                    loop {
+                        if let Message::Ping(ping) = Message::read(&mut stream, magic)? {
+                            Message::Pong(ping).write(&mut stream, magic)?;
+                        }
+                    }
+                };
+                let _ = serve();
+            });
+        }
+    });
+    port
+}
+
+#[derive(Default)]
+struct PongCounter {
+    pongs: AtomicUsize,
+}
+
+impl Observer<PeerMessage> for PongCounter {
+    fn next(&self, event: &PeerMessage) {
+        if let Message::Pong(_) = event.message {
+            self.pongs.fetch_add(1, Ordering::Relaxed);
+        }
+    }
+}
+
+fn run(name: &str, count: usize, connect: &dyn Fn() -> Arc<Peer>) {
+    let start = Instant::now();
+    let peers: Vec<Arc<Peer>> = (0..count).map(|_| connect()).collect();
+    let connected = peers
+        .iter()
+        .filter(|peer| {
+            peer.connected_event()
+                .poll_timeout(Duration::from_secs(30))
+                .is_ok()
+        })
+        .count();
+    let connect_time = start.elapsed();
+
+    let counter = Arc::new(PongCounter::default());
+    for peer in &peers {
+        peer.messages().subscribe(&counter);
+    }
+    let start = Instant::now();
+    for peer in &peers {
+        let _ = peer.send(&Message::Ping(Ping { nonce: 1 }));
+    }
+    let deadline = start + Duration::from_secs(30);
+    while counter.pongs.load(Ordering::Relaxed) < connected && Instant::now() < deadline {
+        thread::sleep(Duration::from_millis(1));
+    }
+    let ping_time = start.elapsed();
+    let pongs = counter.pongs.load(Ordering::Relaxed);
+
+    println!(
+        "{name:>8}: {connected}/{count} connected in {connect_time:?}, {pongs} pongs in {ping_time:?} ({:.0} msg/s)",
+        pongs as f64 / ping_time.as_secs_f64()
+    );
+    for peer in &peers {
+        peer.disconnect();
+    }
+}
+
+fn main() {
+    let count = std::env::var("CHAIN_GANG_BENCH_PEERS")
+        .ok()
+        .and_then(|count| count.parse().ok())
+        .unwrap_or(1000);
+    let port = node();
+    let ip: IpAddr = "127.0.0.1".parse().unwrap();
+    let filter = Arc::new(PeerNodeFilter::default());
+
+    let runtime = PeerRuntime::new(chain_gang::util::parallel::worker_count()).unwrap();
+    run("runtime", count, &|| {
+        runtime.connect(ip, port, NETWORK, version(), filter.clone())
+    });
+    run("threaded", count, &|| {
+        Peer::connect(ip, port, NETWORK, version(), filter.clone())
+    });
+}
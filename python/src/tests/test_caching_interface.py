@@ -0,0 +1,202 @@
+""" Tests of the caching interface decorator
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+from typing import Dict
+
+from tx_engine.interface.blockchain_interface import BlockchainInterface
+from tx_engine.interface.caching_interface import CachingInterface, DiskStore
+
+
+class CountingInterface(BlockchainInterface):
+    """ Records every call that reaches the wrapped interface
+    """
+    def __init__(self, delay: float = 0.0):
+        self.calls: Dict[str, int] = {}
+        self.delay = delay
+        self.height = 100
+        self.lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        time.sleep(self.delay)
+
+    def set_config(self, config):
+        pass
+
+    def get_utxo(self, address: str):
+        self._count("get_utxo")
+        return [{"tx_hash": address}]
+
+    def get_block_count(self) -> int:
+        self._count("get_block_count")
+        return self.height
+
+    def get_raw_transaction(self, txid: str):
+        self._count("get_raw_transaction")
+        return None if txid == "unknown" else txid * 2
+
+    def get_raw_transactions(self, txids):
+        self._count("get_raw_transactions")
+        return [None if txid == "unknown" else txid * 2 for txid in txids]
+
+    def get_transaction(self, txid: str) -> Dict:
+        self._count("get_transaction")
+        return {"txid": txid}
+
+    def broadcast_tx(self, tx: str):
+        self._count("broadcast_tx")
+        return tx
+
+    def is_testnet(self) -> bool:
+        return True
+
+    def get_balance(self, address) -> int:
+        self._count("get_balance")
+        return 5
+
+    def get_best_block_hash(self) -> str:
+        return "00"
+
+    def get_tx_out(self, txid: str, txindex: int) -> Dict:
+        return {}
+
+    def get_block(self, blockhash: str) -> Dict:
+        return {}
+
+    def get_merkle_proof(self, block_hash: str, tx_id: str):
+        self._count("get_merkle_proof")
+        if tx_id == "unknown":
+            return {"error": "unknown transaction"}
+        return [{"index": 0, "txOrId": tx_id, "target": block_hash, "nodes": ["*"]}]
+
+    def get_block_header(self, block_hash: str) -> Dict:
+        self._count("get_block_header")
+        return {"hash": block_hash, "confirmations": self.height, "nextblockhash": "n" + block_hash}
+
+    def verifyscript(self, scripts: list, stop_on_first_invalid: bool = True, timeout: int = 100):
+        return []
+
+    def get_addr_history(self, address):
+        return [address]
+
+
+class CachingInterfaceTest(unittest.TestCase):
+    """ Caching interface decorator
+    """
+
+    def test_immutable_data_is_cached(self):
+        inner = CountingInterface()
+        cache = CachingInterface(inner)
+        for _ in range(3):
+            self.assertEqual(cache.get_raw_transaction("ab"), "abab")
+            # Fields that change as the chain grows are not cached
+            self.assertEqual(cache.get_block_header("h1"), {"hash": "h1"})
+        self.assertEqual(inner.calls["get_raw_transaction"], 1)
+        self.assertEqual(inner.calls["get_block_header"], 1)
+        # Misses are not cached
+        cache.get_raw_transaction("unknown")
+        cache.get_raw_transaction("unknown")
+        self.assertEqual(inner.calls["get_raw_transaction"], 3)
+        stats = cache.cache_stats()
+        self.assertEqual(stats["hits"], 4)
+        self.assertEqual(stats["misses"], 4)
+        # Calls not cached are passed through
+        self.assertEqual(cache.get_addr_history("a1"), ["a1"])
+
+    def test_results_are_copies(self):
+        inner = CountingInterface()
+        cache = CachingInterface(inner)
+        cache.get_block_header("h1")["hash"] = "changed"
+        self.assertEqual(cache.get_block_header("h1"), {"hash": "h1"})
+        cache.get_utxos(["a1"])[0].clear()
+        self.assertEqual(cache.get_utxo("a1"), [{"tx_hash": "a1"}])
+        self.assertEqual(inner.calls["get_block_header"], 1)
+
+    def test_only_proofs_are_cached(self):
+        inner = CountingInterface()
+        cache = CachingInterface(inner)
+        for _ in range(2):
+            self.assertEqual(cache.get_merkle_proof("h1", "t1")[0]["nodes"], ["*"])
+            self.assertEqual(cache.get_merkle_proof("h1", "unknown"), {"error": "unknown transaction"})
+        self.assertEqual(inner.calls["get_merkle_proof"], 3)
+
+    def test_mutable_data_expires(self):
+        inner = CountingInterface()
+        cache = CachingInterface(inner)
+        cache.cache_ttl = 0.05
+        self.assertEqual(cache.get_block_count(), 100)
+        inner.height = 101
+        self.assertEqual(cache.get_block_count(), 100)
+        time.sleep(0.1)
+        self.assertEqual(cache.get_block_count(), 101)
+
+        cache.get_utxo("a1")
+        cache.broadcast_tx("00")
+        cache.get_utxo("a1")
+        self.assertEqual(inner.calls["get_utxo"], 2)
+
+    def test_lru_is_bounded(self):
+        cache = CachingInterface(CountingInterface())
+        cache.cache_size = 3
+        for txid in ["a", "b", "c", "a", "d"]:
+            cache.get_raw_transaction(txid)
+        self.assertEqual(cache.cache_stats()["entries"], 3)
+        # "b" was least recently used
+        cache.get_raw_transaction("b")
+        self.assertEqual(cache.cache_stats()["hits"], 1)
+
+    def test_concurrent_requests_are_coalesced(self):
+        inner = CountingInterface(delay=0.1)
+        cache = CachingInterface(inner)
+        threads = [threading.Thread(target=cache.get_raw_transaction, args=("ab",)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(inner.calls["get_raw_transaction"], 1)
+        self.assertEqual(cache.cache_stats()["coalesced"], 7)
+
+    def test_bulk_fetches_only_missing(self):
+        inner = CountingInterface()
+        cache = CachingInterface(inner)
+        cache.get_raw_transaction("a")
+        self.assertEqual(cache.get_raw_transactions(["b", "a", "unknown", "b"]), ["bb", "aa", None, "bb"])
+        self.assertEqual(inner.calls["get_raw_transactions"], 1)
+        self.assertEqual(cache.get_raw_transactions(["b", "a"]), ["bb", "aa"])
+        self.assertEqual(inner.calls["get_raw_transactions"], 1)
+
+        cache.get_utxo("a1")
+        self.assertEqual(cache.get_utxos(["a2", "a1", "a3"]), [[{"tx_hash": a}] for a in ["a2", "a1", "a3"]])
+        cache.get_utxos(["a2", "a3"])
+        self.assertEqual(inner.calls["get_utxo"], 3)
+        self.assertEqual(cache.get_balances(["a1", "a2"]), [5, 5])
+        self.assertEqual(cache.get_balances(["a2"]), [5])
+        self.assertEqual(inner.calls["get_balance"], 2)
+
+    def test_disk_store_persists(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.db")
+            first = CachingInterface(CountingInterface())
+            first.store = DiskStore(path)
+            first.get_raw_transaction("ab")
+            first.get_utxo("a1")
+            first.store.close()
+
+            inner = CountingInterface()
+            second = CachingInterface(inner)
+            second.store = DiskStore(path)
+            self.assertEqual(second.get_raw_transaction("ab"), "abab")
+            self.assertNotIn("get_raw_transaction", inner.calls)
+            self.assertEqual(second.cache_stats()["disk_hits"], 1)
+            # Mutable data is only held in memory
+            self.assertEqual(len(second.store), 1)
+            second.store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
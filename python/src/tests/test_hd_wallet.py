@@ -2,7 +2,7 @@
 """
 import unittest
 
-from tx_engine import HdWallet, HdWatchWallet, bip32_path, bip44_path, bsv_coin_type, derive_extended_key, mnemonic_to_seed
+from tx_engine import HdWallet, HdWatchWallet, bip32_path, bip44_path, bsv_coin_type, derive_extended_key, mnemonic_to_seed, p2pkh_script
 
 
 ABANDON_MNEMONIC = (
@@ -46,6 +46,69 @@ class HdWalletTest(unittest.TestCase):
         )
         self.assertEqual(watch.derive_xpub("M/0/0"), hd.derive_xpub(bip32_path(0, 0, 0)))
 
+    def test_derive_indices_matches_path(self):
+        hd = HdWallet.from_mnemonic("BSV_Mainnet", ABANDON_MNEMONIC)
+        hardened = 0x80000000
+        indices = [44 + hardened, bsv_coin_type() + hardened, hardened, 0, 3]
+        self.assertEqual(hd.derive_xprv_indices(indices), hd.derive_xprv(bip44_path(bsv_coin_type(), 0, True, 3)))
+
+        account_xpub = hd.derive_xpub("m/0'")
+        watch = HdWatchWallet.from_xpub(account_xpub)
+        self.assertEqual(watch.derive_xpub_indices([0, 2]), watch.derive_xpub("M/0/2"))
+
+    def test_derivation_cache(self):
+        hd = HdWallet.from_mnemonic("BSV_Mainnet", ABANDON_MNEMONIC)
+        expected = [hd.address_at(0, True, i) for i in range(5)]
+        stats = hd.derivation_cache_stats()
+        self.assertEqual(stats["hits"], 4)
+        self.assertEqual(stats["misses"], 1)
+
+        hd.set_derivation_cache(0)
+        self.assertEqual([hd.address_at(0, True, i) for i in range(5)], expected)
+        self.assertEqual(hd.derivation_cache_stats()["size"], 0)
+
+    def test_watch_wallet_ranges(self):
+        hd = HdWallet.from_mnemonic("BSV_Mainnet", ABANDON_MNEMONIC)
+        watch = HdWatchWallet.from_xpub(hd.derive_xpub("m/0'"))
+
+        addresses = watch.addresses_range(True, 10, 600)
+        hashes = watch.pubkey_hashes_range(True, 10, 600)
+        scripts = watch.locking_scripts_range(True, 10, 600)
+        self.assertEqual(len(addresses), 600)
+        self.assertEqual(len(hashes), 600 * 20)
+        self.assertEqual(len(scripts), 600 * 25)
+
+        for i in [0, 1, 599]:
+            self.assertEqual(addresses[i], watch.address_at(True, 10 + i))
+            self.assertEqual(addresses[i], hd.address_at(0, True, 10 + i))
+            pkh = hashes[i * 20:(i + 1) * 20]
+            self.assertEqual(scripts[i * 25:(i + 1) * 25], p2pkh_script(pkh).raw_serialize())
+
+    def test_batched_gap_scan(self):
+        hd = HdWallet.from_mnemonic("BSV_Mainnet", ABANDON_MNEMONIC)
+        watch = HdWatchWallet.from_xpub(hd.derive_xpub("m/0'"))
+        used = {watch.address_at(True, i) for i in [0, 2, 9]} | {watch.address_at(False, 1)}
+        calls = []
+
+        def are_used(addrs):
+            calls.append(len(addrs))
+            return [a in used for a in addrs]
+
+        expected = watch.scan_addresses(True, 5, lambda a: a in used)
+        self.assertEqual(watch.scan_addresses_batched(True, 5, are_used), expected)
+        self.assertEqual(calls, [5, 5])
+        self.assertEqual(watch.scan_addresses_batched(True, 5, are_used, window=2), expected)
+
+        external, internal = watch.scan_chains(5, are_used)
+        self.assertEqual(external, expected)
+        self.assertEqual(internal, [watch.address_at(False, 1)])
+
+        scans = hd.scan_accounts([0, 1], 5, are_used, window=50)
+        self.assertEqual(scans, [(expected, internal), ([], [])])
+
+        with self.assertRaises(Exception):
+            watch.scan_addresses_batched(True, 5, lambda addrs: [True])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,159 @@
+""" Tests of the hedged multi-backend interface
+"""
+import threading
+import time
+import unittest
+from typing import Any, Dict, Optional
+
+from tx_engine.interface.blockchain_interface import BlockchainInterface
+from tx_engine.interface.hedged_interface import HedgedInterface, broadcast_status
+from tx_engine.interface.rate_limit import CircuitBreaker
+
+
+class BroadcastResult:
+    """ Stands in for a WoC response or an RPCReturnInfo
+    """
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+
+class FakeBackend(BlockchainInterface):
+    """ Answers after `delay` seconds, or raises `error`
+    """
+    def __init__(self, name: str, delay: float = 0.0, error: Optional[Exception] = None, broadcast: Any = None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.broadcast = broadcast
+        self.calls: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def _answer(self, method: str, value: Any) -> Any:
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return value
+
+    def set_config(self, config):
+        pass
+
+    def get_utxo(self, address: str):
+        return self._answer("get_utxo", [{"backend": self.name}])
+
+    def get_block_count(self) -> int:
+        return self._answer("get_block_count", 100)
+
+    def get_raw_transaction(self, txid: str):
+        return self._answer("get_raw_transaction", None if self.name == "b" else f"{self.name}:{txid}")
+
+    def get_transaction(self, txid: str) -> Dict:
+        return self._answer("get_transaction", {"txid": txid})
+
+    def broadcast_tx(self, tx: str):
+        return self._answer("broadcast_tx", self.broadcast)
+
+    def is_testnet(self) -> bool:
+        return True
+
+    def get_balance(self, address) -> int:
+        return self._answer("get_balance", 5)
+
+    def get_best_block_hash(self) -> str:
+        return self._answer("get_best_block_hash", self.name)
+
+    def get_tx_out(self, txid: str, txindex: int) -> Dict:
+        raise NotImplementedError("get_tx_out not available")
+
+    def get_block(self, blockhash: str) -> Dict:
+        return self._answer("get_block", {})
+
+    def get_merkle_proof(self, block_hash: str, tx_id: str) -> str:
+        return self._answer("get_merkle_proof", "")
+
+    def get_block_header(self, block_hash: str) -> Dict:
+        return self._answer("get_block_header", {})
+
+    def verifyscript(self, scripts: list, stop_on_first_invalid: bool = True, timeout: int = 100):
+        return []
+
+
+class HedgedInterfaceTest(unittest.TestCase):
+    """ Hedged multi-backend interface
+    """
+
+    def test_fast_primary_is_not_hedged(self):
+        primary, secondary = FakeBackend("a"), FakeBackend("b")
+        interface = HedgedInterface([primary, secondary], hedge_delay=0.5)
+        self.assertEqual(interface.get_utxo("a1"), [{"backend": "a"}])
+        self.assertNotIn("get_utxo", secondary.calls)
+        self.assertEqual(interface.hedges, 0)
+        self.assertEqual(interface.backend_stats()[0]["wins"], 1)
+
+    def test_slow_primary_is_hedged(self):
+        primary, secondary = FakeBackend("a", delay=0.5), FakeBackend("c")
+        interface = HedgedInterface([primary, secondary], hedge_delay=0.02)
+        start = time.monotonic()
+        self.assertEqual(interface.get_utxo("a1"), [{"backend": "c"}])
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(interface.hedges, 1)
+
+    def test_none_answers_fall_through(self):
+        # "b" does not know the transaction, "c" does
+        interface = HedgedInterface([FakeBackend("b"), FakeBackend("c")], hedge_delay=0.5)
+        self.assertEqual(interface.get_raw_transaction("t1"), "c:t1")
+        interface = HedgedInterface([FakeBackend("b")])
+        self.assertIsNone(interface.get_raw_transaction("t1"))
+
+    def test_failover(self):
+        primary = FakeBackend("a", error=ConnectionError("down"))
+        secondary = FakeBackend("c")
+        interface = HedgedInterface([primary, secondary], hedge_delay=0.5)
+        for _ in range(5):
+            self.assertEqual(interface.get_block_count(), 100)
+        # The primary's circuit opened after three failures, so it is skipped
+        self.assertEqual(primary.calls["get_block_count"], 3)
+        self.assertEqual(interface.backend_stats()[0]["circuit"], CircuitBreaker.OPEN)
+        self.assertEqual(interface.get_best_block_hash(), "c")
+
+        interface = HedgedInterface([FakeBackend("a", error=ConnectionError("down"))])
+        with self.assertRaises(ConnectionError):
+            interface.get_block_count()
+        # Unsupported calls do not count against the backend's health
+        with self.assertRaises(NotImplementedError):
+            HedgedInterface([secondary]).get_tx_out("t1", 0)
+
+        # A malformed response is a failure, not an unsupported call
+        malformed = FakeBackend("a", error=ValueError("Expecting value: line 1 column 1 (char 0)"))
+        interface = HedgedInterface([malformed, FakeBackend("c")], hedge_delay=0.5)
+        for _ in range(4):
+            self.assertEqual(interface.get_block_count(), 100)
+        self.assertEqual(malformed.calls["get_block_count"], 3)
+        self.assertEqual(interface.backend_stats()[0]["circuit"], CircuitBreaker.OPEN)
+
+    def test_broadcast_goes_to_every_backend(self):
+        accepted = BroadcastResult(200, b'"txid"')
+        known = BroadcastResult(-27, b"257: txn-already-known")
+        rejected = BroadcastResult(400, b"mandatory-script-verify-flag-failed")
+        backends = [FakeBackend("a", broadcast=rejected), FakeBackend("b", delay=0.05, broadcast=accepted), FakeBackend("c", broadcast=known)]
+        interface = HedgedInterface(backends)
+        self.assertIs(interface.broadcast_tx("00"), accepted)
+        time.sleep(0.1)
+        self.assertEqual([backend.calls["broadcast_tx"] for backend in backends], [1, 1, 1])
+
+        # Without an acceptance, "already known" beats a rejection
+        interface = HedgedInterface([FakeBackend("a", broadcast=rejected), FakeBackend("c", broadcast=known)])
+        self.assertIs(interface.broadcast_tx("00"), known)
+        interface = HedgedInterface([FakeBackend("a", broadcast=rejected), FakeBackend("c", error=ConnectionError("down"))])
+        self.assertIs(interface.broadcast_tx("00"), rejected)
+
+    def test_broadcast_status(self):
+        self.assertEqual(broadcast_status("txid"), "accepted")
+        self.assertEqual(broadcast_status(None), "rejected")
+        self.assertEqual(broadcast_status(BroadcastResult(400, b"Transaction already in the mempool")), "known")
+
+
+if __name__ == "__main__":
+    unittest.main()
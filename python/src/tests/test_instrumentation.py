@@ -0,0 +1,106 @@
+""" Tests of the interface instrumentation
+"""
+import unittest
+from typing import Dict
+
+from tx_engine.interface.blockchain_interface import BlockchainInterface
+from tx_engine.interface.instrumentation import METRICS, Span, record_bytes, record_retry
+
+
+class FakeInterface(BlockchainInterface):
+    """ Minimal interface whose calls report retries and bytes like a transport would
+    """
+    def set_config(self, config):
+        pass
+
+    def get_utxo(self, address: str):
+        record_retry(2)
+        record_bytes(sent=10, received=100)
+        return []
+
+    def get_balance(self, address) -> int:
+        # Calls to its own methods are not recorded separately
+        return len(self.get_utxo(address))
+
+    def get_block_count(self) -> int:
+        raise ConnectionError("node down")
+
+    def get_raw_transaction(self, txid: str):
+        return None
+
+    def get_transaction(self, txid: str) -> Dict:
+        return {}
+
+    def broadcast_tx(self, tx: str):
+        return None
+
+    def is_testnet(self) -> bool:
+        return True
+
+    def get_best_block_hash(self) -> str:
+        return ""
+
+    def get_tx_out(self, txid: str, txindex: int) -> Dict:
+        return {}
+
+    def get_block(self, blockhash: str) -> Dict:
+        return {}
+
+    def get_merkle_proof(self, block_hash: str, tx_id: str) -> str:
+        return ""
+
+    def get_block_header(self, block_hash: str) -> Dict:
+        return {}
+
+    def verifyscript(self, scripts: list, stop_on_first_invalid: bool = True, timeout: int = 100):
+        return []
+
+
+class InstrumentationTest(unittest.TestCase):
+    """ Interface instrumentation
+    """
+
+    def setUp(self):
+        METRICS.reset()
+
+    def test_records_calls_errors_retries_and_bytes(self):
+        interface = FakeInterface()
+        interface.get_utxo("a1")
+        interface.get_balance("a1")
+        with self.assertRaises(ConnectionError):
+            interface.get_block_count()
+        # The base class bulk default calls get_utxo internally
+        interface.get_utxos(["a1", "a2"])
+
+        stats = METRICS.snapshot()["FakeInterface"]
+        self.assertEqual(stats["get_utxo"]["calls"], 1)
+        self.assertEqual(stats["get_utxo"]["retries"], 2)
+        self.assertEqual(stats["get_utxo"]["bytes_received"], 100)
+        self.assertEqual(stats["get_balance"]["calls"], 1)
+        self.assertEqual(stats["get_balance"]["bytes_sent"], 10)
+        self.assertEqual(stats["get_block_count"]["errors"], {"ConnectionError": 1})
+        self.assertEqual(stats["get_utxos"]["retries"], 4)
+        self.assertLessEqual(stats["get_utxo"]["latency_p99"], 0.005)
+
+    def test_hooks_and_prometheus_export(self):
+        spans = []
+
+        def hook(span: Span):
+            spans.append(span)
+
+        METRICS.add_hook(hook)
+        try:
+            FakeInterface().get_utxo("a1")
+        finally:
+            METRICS.remove_hook(hook)
+        self.assertEqual([(s.interface, s.method, s.retries) for s in spans], [("FakeInterface", "get_utxo", 2)])
+
+        text = METRICS.to_prometheus()
+        self.assertIn('tx_engine_interface_calls_total{interface="FakeInterface",method="get_utxo"} 1', text)
+        self.assertIn('tx_engine_interface_call_duration_seconds_bucket{interface="FakeInterface",method="get_utxo",le="+Inf"} 1', text)
+        self.assertIn('tx_engine_interface_bytes_total{interface="FakeInterface",method="get_utxo",direction="sent"} 10', text)
+        self.assertIn("# TYPE tx_engine_interface_call_duration_seconds histogram", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+""" Mempool Python binding tests
+"""
+import unittest
+
+from tx_engine import Mempool, Script, Tx, TxIn, TxOut
+
+
+CONFIRMED = "ab" * 32
+
+
+def spend(prev_tx: str, prev_index: int, locktime: int = 0) -> Tx:
+    tx_in = TxIn(prev_tx, prev_index, Script(bytes([1] * 100)))
+    tx_outs = [TxOut(1000, Script(bytes([2] * 25))), TxOut(2000, Script(bytes([2] * 25)))]
+    return Tx(1, [tx_in], tx_outs, locktime)
+
+
+class MempoolTest(unittest.TestCase):
+    """ Mempool Python API
+    """
+
+    def test_add_and_double_spend(self):
+        mempool = Mempool()
+        tx = spend(CONFIRMED, 0)
+        self.assertEqual(mempool.add(tx, 100), [])
+        self.assertEqual(len(mempool), 1)
+        self.assertIn(tx.id(), mempool)
+        self.assertEqual(mempool.get(tx.id()), tx)
+        self.assertEqual(mempool.fee(tx.id()), 100)
+
+        double_spend = spend(CONFIRMED, 0, locktime=1)
+        self.assertEqual(mempool.conflicts(double_spend), [tx.id()])
+        with self.assertRaises(ValueError):
+            mempool.add(double_spend, 1000)
+
+    def test_chains(self):
+        mempool = Mempool()
+        parent = spend(CONFIRMED, 0)
+        child = spend(parent.id(), 0)
+        mempool.add(parent, 100)
+        mempool.add(child, 100)
+        self.assertEqual(mempool.ancestors(child.id()), [parent.id()])
+        self.assertEqual(mempool.descendants(parent.id()), [child.id()])
+        self.assertEqual(sorted(mempool.remove(parent.id())), sorted([parent.id(), child.id()]))
+        self.assertEqual(len(mempool), 0)
+
+    def test_remove_for_block(self):
+        mempool = Mempool()
+        confirmed = spend(CONFIRMED, 0)
+        conflicted = spend(CONFIRMED, 1)
+        mempool.add(confirmed, 100)
+        mempool.add(conflicted, 100)
+        block_txs = [confirmed, spend(CONFIRMED, 1, locktime=7)]
+        self.assertEqual(mempool.remove_for_block(block_txs), ([confirmed.id()], [conflicted.id()]))
+        self.assertEqual(mempool.stats()["count"], 0)
+
+    def test_eviction(self):
+        probe = Mempool()
+        probe.add(spend(CONFIRMED, 0), 0)
+        per_tx = probe.stats()["usage"]
+
+        mempool = Mempool(max_bytes=per_tx * 3)
+        txs = [spend(CONFIRMED, i) for i in range(4)]
+        for i, tx in enumerate(txs[:3]):
+            mempool.add(tx, 100 + i)
+        with self.assertRaises(ValueError):
+            mempool.add(txs[3], 50)
+        self.assertEqual(mempool.add(txs[3], 500), [txs[0].id()])
+        stats = mempool.stats()
+        self.assertEqual(stats["evicted"], 1)
+        self.assertLessEqual(stats["usage"], stats["max_bytes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+""" Tests of the RPC connection pool
+"""
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.client import CannotSendRequest, RemoteDisconnected
+
+from tx_engine.interface.rpc_interface import RPCConnectionPool, PooledConnection, RPCInterface
+
+
+class SlowConnection:
+    """ Stands in for AuthServiceProxy, recording how many calls run at once
+    """
+    active = 0
+    peak = 0
+    created = 0
+    lock = threading.Lock()
+
+    def __init__(self, fail_first: bool = False):
+        with self.lock:
+            SlowConnection.created += 1
+        self.in_use = False
+        self.fail_first = fail_first
+
+    def getrawtransaction(self, txid):
+        if self.fail_first:
+            self.fail_first = False
+            raise CannotSendRequest()
+        # A connection must never be used by two threads at once
+        assert not self.in_use
+        self.in_use = True
+        with self.lock:
+            SlowConnection.active += 1
+            SlowConnection.peak = max(SlowConnection.peak, SlowConnection.active)
+        time.sleep(0.02)
+        with self.lock:
+            SlowConnection.active -= 1
+        self.in_use = False
+        return txid
+
+
+class DroppingConnection:
+    """ Stands in for AuthServiceProxy, dropping the connection after the first request is sent
+    """
+    sent: list = []
+    drop = True
+
+    def _call(self, method, *params):
+        DroppingConnection.sent.append(method)
+        if DroppingConnection.drop:
+            DroppingConnection.drop = False
+            raise BrokenPipeError()
+        return method
+
+    def batch_(self, calls):
+        # Consumes the method names like python-bitcoinrpc
+        return self._call([call.pop(0) for call in calls])
+
+    def getrawtransaction(self, txid):
+        return self._call("getrawtransaction", txid)
+
+    def sendrawtransaction(self, tx):
+        return self._call("sendrawtransaction", tx)
+
+    def sendtoaddress(self, address, amount):
+        return self._call("sendtoaddress", address, amount)
+
+
+class IdleClosedConnection:
+    """ Stands in for AuthServiceProxy whose keep-alive socket the node closes after each request,
+        as bitcoind does once rpcservertimeout passes
+    """
+    created = 0
+
+    def __init__(self):
+        IdleClosedConnection.created += 1
+        self.used = False
+
+    def _call(self, result):
+        if self.used:
+            raise RemoteDisconnected("Remote end closed connection without response")
+        self.used = True
+        return result
+
+    def getblockcount(self):
+        return self._call(100)
+
+    def sendrawtransaction(self, tx):
+        return self._call("txid")
+
+
+class RPCConnectionPoolTest(unittest.TestCase):
+    """ RPC connection pool
+    """
+
+    def setUp(self):
+        DroppingConnection.sent = []
+        DroppingConnection.drop = True
+        SlowConnection.active = 0
+        SlowConnection.peak = 0
+        SlowConnection.created = 0
+        IdleClosedConnection.created = 0
+
+    def test_concurrent_calls_are_bounded(self):
+        connection = PooledConnection(RPCConnectionPool(SlowConnection, size=3))
+        txids = [f"t{i}" for i in range(24)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(connection.getrawtransaction, txids))
+        self.assertEqual(results, txids)
+        self.assertEqual(SlowConnection.created, 3)
+        self.assertEqual(SlowConnection.peak, 3)
+
+    def test_connection_errors_are_retried_on_new_connection(self):
+        pool = RPCConnectionPool(lambda: SlowConnection(fail_first=SlowConnection.created == 0), max_retries=2)
+        self.assertEqual(pool.call("getrawtransaction", "t1"), "t1")
+        self.assertEqual(SlowConnection.created, 2)
+
+        failing = RPCConnectionPool(lambda: SlowConnection(fail_first=True), max_retries=2)
+        with self.assertRaises(CannotSendRequest):
+            failing.call("getrawtransaction", "t1")
+
+    def test_only_resendable_calls_are_resent(self):
+        pool = RPCConnectionPool(DroppingConnection, max_retries=3)
+        self.assertEqual(pool.call("getrawtransaction", "t1"), "getrawtransaction")
+        self.assertEqual(DroppingConnection.sent, ["getrawtransaction"] * 2)
+
+        DroppingConnection.sent = []
+        DroppingConnection.drop = True
+        self.assertEqual(pool.call("sendrawtransaction", "00"), "sendrawtransaction")
+        self.assertEqual(DroppingConnection.sent, ["sendrawtransaction"] * 2)
+
+        DroppingConnection.sent = []
+        DroppingConnection.drop = True
+        with self.assertRaises(BrokenPipeError):
+            pool.call("sendtoaddress", "addr", 1)
+        self.assertEqual(DroppingConnection.sent, ["sendtoaddress"])
+
+    def test_broadcast_on_server_closed_connection(self):
+        interface = RPCInterface()
+        interface.rpc_connection = PooledConnection(RPCConnectionPool(IdleClosedConnection, size=1))
+        self.assertEqual(interface.get_block_count(), 100)
+        # The idle pooled connection was closed by the node, so the broadcast uses a new one
+        result = interface.broadcast_tx("00")
+        self.assertIsNotNone(result)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.content, "txid")
+        self.assertEqual(IdleClosedConnection.created, 2)
+
+    def test_retried_batches_keep_method_names(self):
+        pool = RPCConnectionPool(DroppingConnection, max_retries=3)
+        calls = [["getrawtransaction", "t1"], ["getblockcount"]]
+        self.assertEqual(pool.call("batch_", calls), ["getrawtransaction", "getblockcount"])
+        self.assertEqual(DroppingConnection.sent, [["getrawtransaction", "getblockcount"]] * 2)
+        self.assertEqual(calls, [["getrawtransaction", "t1"], ["getblockcount"]])
+
+        DroppingConnection.sent = []
+        DroppingConnection.drop = True
+        with self.assertRaises(BrokenPipeError):
+            pool.call("batch_", [["getblockcount"], ["sendtoaddress", "addr", 1]])
+        self.assertEqual(len(DroppingConnection.sent), 1)
+
+    def test_checkout_times_out_when_exhausted(self):
+        pool = RPCConnectionPool(SlowConnection, size=1, timeout=0.05)
+        with pool.checkout():
+            errors = []
+
+            def call():
+                try:
+                    pool.call("getrawtransaction", "t1")
+                except TimeoutError as e:
+                    errors.append(e)
+
+            thread = threading.Thread(target=call)
+            thread.start()
+            thread.join()
+            self.assertEqual(len(errors), 1)
+            # The holding thread can still make calls on its own connection
+            self.assertEqual(pool.call("getrawtransaction", "t2"), "t2")
+
+
+if __name__ == "__main__":
+    unittest.main()
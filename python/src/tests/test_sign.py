@@ -2,13 +2,14 @@
         * p2pkh_script
         * h160
         * address_to_public_key_hash
+        * addresses_to_public_key_hashes / public_key_hashes_to_addresses
 """
 
 import unittest
 import sys
 import logging
 
-from tx_engine import p2pkh_script, hash160, address_to_public_key_hash, public_key_to_address
+from tx_engine import p2pkh_script, hash160, address_to_public_key_hash, public_key_to_address, addresses_to_public_key_hashes, public_key_hashes_to_addresses
 
 
 log = logging.getLogger(__name__)
@@ -44,6 +45,27 @@ class SignTest(unittest.TestCase):
         result = public_key_to_address(public_key, "BSV_Testnet")
         self.assertEqual(result, address)
 
+    def test_bulk_address_conversion(self):
+        hashes = b"".join(hash160(i.to_bytes(4, "little")) for i in range(1000))
+        addresses = public_key_hashes_to_addresses(hashes, "BSV_Testnet")
+        self.assertEqual(len(addresses), 1000)
+        self.assertEqual(address_to_public_key_hash(addresses[10]), hashes[200:220])
+
+        packed, errors = addresses_to_public_key_hashes(addresses)
+        self.assertEqual(packed, hashes)
+        self.assertEqual(errors, [])
+
+        addresses[5] = "not an address"
+        buffer = "\n".join(addresses).encode()
+        packed, errors = addresses_to_public_key_hashes(buffer)
+        self.assertEqual(len(packed), len(hashes))
+        self.assertEqual(packed[100:120], bytes(20))
+        self.assertEqual(packed[120:], hashes[120:])
+        self.assertEqual([row for row, _ in errors], [5])
+
+        with self.assertRaises(ValueError):
+            public_key_hashes_to_addresses(hashes[:30], "BSV_Testnet")
+
 
 if __name__ == "__main__":
     unittest.main()
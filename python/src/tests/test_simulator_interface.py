@@ -0,0 +1,87 @@
+""" Tests of the chain simulator interface
+"""
+import unittest
+
+from tx_engine import Tx, TxIn, TxOut, Script, Wallet, hash256d, interface_factory
+from tx_engine.interface.simulator_interface import SimulatorInterface, merkle_root
+
+
+class SimulatorInterfaceTest(unittest.TestCase):
+    """ Chain simulator
+    """
+
+    def setUp(self):
+        self.sim = SimulatorInterface()
+        self.wallet = Wallet("cVvay9F4wkxrC6cLwThUnRHEajQ8FNoDEg1pbsgYjh7xYtkQ9LVZ")
+        self.address = self.wallet.get_address()
+
+    def spend(self, prev: Tx, index: int, amount: int) -> Tx:
+        tx = Tx(
+            version=1,
+            tx_ins=[TxIn(prev_tx=prev.id(), prev_index=index, script=Script([]))],
+            tx_outs=[TxOut(amount=amount, script_pubkey=self.wallet.get_locking_script())],
+        )
+        return self.wallet.sign_tx(0, prev, tx)
+
+    def test_factory(self):
+        interface = interface_factory.set_config({"interface_type": "simulator", "network_type": "testnet"})
+        self.assertTrue(isinstance(interface, SimulatorInterface))
+        self.assertEqual(interface.get_block_count(), 0)
+
+    def test_mine_and_spend(self):
+        block_hash = self.sim.mine_block(self.address)
+        self.assertEqual(self.sim.get_block_count(), 1)
+        self.assertEqual(self.sim.get_best_block_hash(), block_hash)
+
+        utxo = self.sim.get_utxo(self.address)
+        self.assertEqual(len(utxo), 1)
+        self.assertEqual(utxo[0]["height"], 1)
+        coinbase = Tx.parse_hexstr(self.sim.get_raw_transaction(utxo[0]["tx_hash"]))
+
+        tx = self.spend(coinbase, 0, utxo[0]["value"] - 500)
+        txid = self.sim.broadcast_tx(tx.to_hexstr())
+        self.assertEqual(txid, tx.id())
+        self.assertIn(txid, self.sim.mempool)
+        self.assertEqual(self.sim.get_balance(self.address), {"confirmed": 0, "unconfirmed": utxo[0]["value"] - 500})
+        self.assertIsNone(self.sim.get_tx_out(coinbase.id(), 0))
+
+        # Double spends are rejected
+        with self.assertRaises(ValueError):
+            self.sim.broadcast_tx(self.spend(coinbase, 0, 100).to_hexstr())
+
+        block_hash = self.sim.mine_block(self.address)
+        block = self.sim.get_block(block_hash)
+        self.assertEqual(block["tx"][1], txid)
+        self.assertEqual(self.sim.get_transaction(txid)["confirmations"], 1)
+        # The miner collects the fee
+        self.assertEqual(self.sim.get_balance(self.address)["confirmed"], 2 * self.sim.block_reward)
+
+        header = bytes.fromhex(block["header"])
+        self.assertEqual(len(header), 80)
+        self.assertEqual(hash256d(header)[::-1].hex(), block_hash)
+        self.assertEqual(header[36:68], merkle_root([Tx.parse_hexstr(self.sim.get_raw_transaction(t)).hash() for t in block["tx"]]))
+
+        proof = self.sim.get_merkle_proof(block_hash, txid)
+        self.assertEqual(proof["index"], 1)
+        self.assertEqual(proof["nodes"], [block["tx"][0]])
+
+    def test_rejects_invalid_signature(self):
+        self.sim.mine_block(self.address)
+        coinbase = Tx.parse_hexstr(self.sim.get_raw_transaction(self.sim.get_utxo(self.address)[0]["tx_hash"]))
+        unsigned = Tx(
+            version=1,
+            tx_ins=[TxIn(prev_tx=coinbase.id(), prev_index=0, script=Script([]))],
+            tx_outs=[TxOut(amount=100, script_pubkey=self.wallet.get_locking_script())],
+        )
+        with self.assertRaises(ValueError):
+            self.sim.broadcast_tx(unsigned.to_hexstr())
+        self.assertEqual(len(self.sim.mempool), 0)
+
+    def test_failure_injection(self):
+        self.sim.set_config({"network_type": "testnet", "failure_rate": 1.0, "seed": 1})
+        with self.assertRaises(ConnectionError):
+            self.sim.get_block_count()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,7 @@
 """
 
 import unittest
-from tx_engine import Wallet, hash160, Tx, TxIn, TxOut, Script, create_wallet_from_pem_bytes, create_pem_from_wallet
+from tx_engine import Wallet, hash160, Tx, TxIn, TxOut, Script, create_wallet_from_pem_bytes, create_pem_from_wallet, sig_hash, sign_many
 
 
 SIGHASH_ALL = 0x01
@@ -74,6 +74,34 @@ class WalletTest(unittest.TestCase):
         result = new_tx.validate([fund_tx])
         self.assertIsNone(result)
 
+    def test_sign_many(self):
+        funding_tx = "0100000001baa9ec5094816f5686371e701b3a4dcadc93df44d151496a58089018706b865c000000006b483045022100b53c9ab501032a626050651fb785967e1bdf03bca0cb17cb4f2c75a45a56d17d0220292a27ce9001efb9c41ab9a06ecaaefad91138e94d4407ee14952456274357a24121024f8d67f0a5ec11e72cc0f2fa5c272b69fd448b933f92a912210f5a35a8eb2d6affffffff0276198900000000001976a914661657ba0a6b276bb5cb313257af5cc416450c0888ac64000000000000001976a9147d981c463355c618e9666044315ef1ffc523e87088ac00000000"
+        fund_tx = Tx.parse(bytes.fromhex(funding_tx))
+        wallet = Wallet("cVvay9F4wkxrC6cLwThUnRHEajQ8FNoDEg1pbsgYjh7xYtkQ9LVZ")
+        vins = [TxIn(prev_tx=fund_tx.id(), prev_index=1, script=Script([]), sequence=0xFFFFFFFF)]
+        vouts = [TxOut(amount=50, script_pubkey=wallet.get_locking_script())]
+        tx = Tx(version=1, tx_ins=vins, tx_outs=vouts, locktime=0)
+
+        sighash_type = SIGHASH_ALL | SIGHASH_FORKID
+        z = sig_hash(tx, 0, fund_tx.tx_outs[1].script_pubkey, fund_tx.tx_outs[1].amount, sighash_type)
+        # Same signature as test_sign_tx_sighash produces for this input
+        expected = bytes.fromhex("3045022100a0334ea6f3a4fbb8e55ffe38763905a7fc69721a3fc888eaccd6b4379859f57302205baa86118837948582a4365ea67819f9df1c8218477dbd478d30895d6506012141")
+
+        packed = sign_many([(wallet, z, sighash_type), (bytes.fromhex(wallet.to_hex()), z, sighash_type)] * 50)
+        sigs = []
+        offset = 0
+        while offset < len(packed):
+            length = packed[offset]
+            sigs.append(packed[offset + 1:offset + 1 + length])
+            offset += 1 + length
+        self.assertEqual(sigs, [expected] * 100)
+        self.assertEqual(sign_many([]), b"")
+
+        with self.assertRaises(ValueError):
+            sign_many([(wallet, z[:31], sighash_type)])
+        with self.assertRaises(ValueError):
+            sign_many([(bytes(32), z, sighash_type)])
+
     def test_sign_tx_sighash_checksig_index(self):
         funding_tx = "0100000001baa9ec5094816f5686371e701b3a4dcadc93df44d151496a58089018706b865c000000006b483045022100b53c9ab501032a626050651fb785967e1bdf03bca0cb17cb4f2c75a45a56d17d0220292a27ce9001efb9c41ab9a06ecaaefad91138e94d4407ee14952456274357a24121024f8d67f0a5ec11e72cc0f2fa5c272b69fd448b933f92a912210f5a35a8eb2d6affffffff0276198900000000001976a914661657ba0a6b276bb5cb313257af5cc416450c0888ac64000000000000001976a9147d981c463355c618e9666044315ef1ffc523e87088ac00000000"
         fund_tx = Tx.parse(bytes.fromhex(funding_tx))
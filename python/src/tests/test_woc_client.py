@@ -0,0 +1,231 @@
+""" Tests of the pooled WhatsOnChain client against a local stand-in server
+"""
+import json
+import threading
+import time
+import unittest
+from typing import Optional
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from tx_engine.interface.instrumentation import METRICS
+from tx_engine.interface.rate_limit import CircuitBreaker, RateLimiter
+from tx_engine.interface.woc import WoCClient
+from tx_engine.interface.woc_interface import WoCInterface
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """ Serves a few WoC endpoints, failing the first request to each path with a 503
+    """
+    seen: set = set()
+    bulk_sizes: list = []
+    down_hits = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str, content_type: str = "application/json", headers: Optional[dict] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def do_GET(self):
+        with self.lock:
+            first = self.path not in self.seen
+            self.seen.add(self.path)
+        if first and "flaky" in self.path:
+            self._send(503, "{}")
+        elif first and "limited" in self.path:
+            self._send(429, "{}", headers={"Retry-After": "0.2"})
+        elif self.path == "/down":
+            with self.lock:
+                StandInHandler.down_hits += 1
+            self._send(503, "{}")
+        elif self.path.endswith("/hex"):
+            self._send(200, "00" * 10, "text/plain")
+        elif self.path.endswith("/unspent"):
+            self._send(200, json.dumps([{"tx_hash": "aa", "tx_pos": 0, "value": 1}, {"tx_hash": "bb", "tx_pos": 2, "value": 3}]))
+        elif self.path.startswith("/address/"):
+            self._send(200, json.dumps({"address": self.path.split("/")[2]}))
+        else:
+            self._send(404, "{}")
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        body = json.loads(self.rfile.read(length))
+        with self.lock:
+            first = self.path not in self.seen
+            self.seen.add(self.path)
+        if first and "flaky" in self.path:
+            self._send(503, "{}")
+        elif self.path == "/tx/raw":
+            self._send(200, json.dumps(body["txhex"][:4]))
+        elif self.path == "/txs/hex":
+            with self.lock:
+                self.bulk_sizes.append(len(body["txids"]))
+            # Reply out of order, with an error for unknown txids
+            results = [
+                {"txid": txid, "error": "unknown"} if txid.startswith("x") else {"txid": txid, "hex": txid * 2, "error": ""}
+                for txid in reversed(body["txids"])
+            ]
+            self._send(200, json.dumps(results))
+        elif self.path == "/addresses/balance":
+            results = [{"address": a, "balance": {"confirmed": len(a), "unconfirmed": 0}, "error": ""} for a in body["addresses"]]
+            self._send(200, json.dumps(results))
+        else:
+            self._send(404, "{}")
+
+
+class WoCClientTest(unittest.TestCase):
+    """ Pooled WoC client
+    """
+    server: ThreadingHTTPServer
+    thread: threading.Thread
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.client = WoCClient(max_workers=4, max_retries=3, timeout=5, limiter=RateLimiter(1000), breaker=CircuitBreaker(3, 0.2))
+        self.client.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_endpoints_retry_transient_errors(self):
+        self.assertEqual(self.client.get_raw_transaction("flaky1"), "00" * 10)
+        self.assertEqual(self.client.get_last_unspent("flaky2"), ("bb", 2, 3))
+        response = self.client.broadcast_tx("0100beef")
+        assert response is not None
+        self.assertEqual(response.json(), "0100")
+        self.assertIsNone(self.client.get_json("/missing"))
+
+    def test_broadcast_is_not_resent(self):
+        # A 503 may come after the server accepted the request
+        response = self.client.request("POST", "/flaky/post", {}, idempotent=False)
+        assert response is not None
+        self.assertEqual(response.status_code, 503)
+
+        # Nothing listens on the port, so the broadcast never reaches a server
+        closed = WoCClient(max_retries=2, timeout=5, limiter=RateLimiter(1000), breaker=CircuitBreaker(5, 0.2))
+        closed.base_url = "http://127.0.0.1:1"
+        with self.assertRaises(requests.ConnectionError):
+            closed.broadcast_tx("0100beef")
+        closed.close()
+
+    def test_map_preserves_order(self):
+        addresses = [f"addr{i}" for i in range(20)]
+        results = self.client.map(lambda a: self.client.get_json(f"/address/{a}/info"), addresses)
+        self.assertEqual([r["address"] for r in results], addresses)
+
+    def test_nested_map_does_not_deadlock(self):
+        # More outer items than workers, each making a bulk call of two chunks
+        groups = [[f"t{i}" for i in range(start, start + 25)] for start in range(0, 200, 25)]
+        results = self.client.map(self.client.get_raw_transactions, groups)
+        self.assertEqual(results, [[t * 2 for t in group] for group in groups])
+
+    def test_bulk_chunks_and_preserves_order(self):
+        StandInHandler.bulk_sizes.clear()
+        txids = [f"t{i}" for i in range(45)] + ["x1", "t3"]
+        results = self.client.get_raw_transactions(txids)
+        self.assertEqual(results[:45], [f"t{i}" * 2 for i in range(45)])
+        self.assertEqual(results[45:], [None, "t3t3"])
+        # Duplicates are only requested once
+        self.assertEqual(sorted(StandInHandler.bulk_sizes), [6, 20, 20])
+
+        balances = self.client.get_balances(["a", "bbb"])
+        self.assertEqual([b["confirmed"] for b in balances], [1, 3])
+
+    def test_backs_off_on_429(self):
+        start = time.monotonic()
+        self.assertEqual(self.client.get_json("/address/limited/info"), {"address": "limited"})
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        stats = self.client.stats()
+        self.assertEqual(stats["throttled"], 1)
+        self.assertLess(stats["rate"], stats["max_rate"])
+        self.assertEqual(stats["circuit"]["state"], "closed")
+
+    def test_circuit_breaker_fails_fast(self):
+        StandInHandler.down_hits = 0
+        self.assertIsNone(self.client.get_json("/down"))
+        self.assertEqual(StandInHandler.down_hits, 3)
+        # The circuit is open, so nothing is sent
+        start = time.monotonic()
+        self.assertIsNone(self.client.get_json("/down"))
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(StandInHandler.down_hits, 3)
+        self.assertEqual(self.client.stats()["circuit"]["state"], "open")
+        # After the reset timeout one trial request is let through
+        time.sleep(0.25)
+        self.assertEqual(self.client.get_json("/address/a1/info"), {"address": "a1"})
+        self.assertEqual(self.client.stats()["circuit"]["state"], "closed")
+
+    def test_unexpected_error_ends_circuit_trial(self):
+        self.assertIsNone(self.client.get_json("/down"))
+        self.assertEqual(self.client.stats()["circuit"]["state"], "open")
+        time.sleep(0.25)
+        # The trial request fails with an error the client does not retry
+        with mock.patch.object(self.client.session, "request", side_effect=requests.exceptions.ChunkedEncodingError()):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                self.client.get_json("/address/a1/info")
+        self.assertEqual(self.client.stats()["circuit"]["state"], "open")
+        # The failed trial reopened the circuit, so another trial follows the reset timeout
+        time.sleep(0.25)
+        self.assertEqual(self.client.get_json("/address/a1/info"), {"address": "a1"})
+        self.assertEqual(self.client.stats()["circuit"]["state"], "closed")
+
+    def test_interface_calls_are_instrumented(self):
+        METRICS.reset()
+        interface = WoCInterface()
+        interface.set_config({"network_type": "testnet"})
+        interface.client = self.client
+        interface.get_raw_transaction("flaky3")
+        interface.get_raw_transactions([f"t{i}" for i in range(30)])
+
+        stats = METRICS.snapshot()["WoCInterface"]
+        self.assertEqual(stats["get_raw_transaction"]["retries"], 1)
+        self.assertEqual(stats["get_raw_transaction"]["bytes_received"], 22)
+        self.assertEqual(stats["get_raw_transaction"]["errors"], {})
+        # Bytes of the bulk requests sent from the pool threads are attributed to the call
+        self.assertGreater(stats["get_raw_transactions"]["bytes_sent"], 30 * 4)
+
+
+class RateLimiterTest(unittest.TestCase):
+    """ Token bucket rate limiter
+    """
+
+    def test_limits_rate(self):
+        limiter = RateLimiter(20, burst=1)
+        start = time.monotonic()
+        for _ in range(5):
+            self.assertTrue(limiter.acquire())
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+        self.assertFalse(limiter.acquire(timeout=0))
+        self.assertEqual(limiter.stats()["rejected"], 1)
+
+    def test_recovers_after_throttling(self):
+        limiter = RateLimiter(32)
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 16)
+        for _ in range(100):
+            limiter.succeeded()
+        self.assertEqual(limiter.rate, 32)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,12 +3,15 @@ This is a tx_engine doc str
 """
 # noqa: F401 - 'x' - imported but unused
 
-from tx_engine.tx_engine import Tx, TxIn, TxOut, Script, Stack, Wallet, HdWallet, HdWatchWallet, p2pkh_script, hash160, hash256d, address_to_public_key_hash, public_key_to_address  # noqa: F401
-from tx_engine.tx_engine import sig_hash_preimage, sig_hash_preimage_checksig_index, sig_hash, sig_hash_checksig_index, wif_to_bytes, bytes_to_wif, wif_from_pw_nonce, mnemonic_to_seed, derive_extended_key, bip32_path, bip44_path, bsv_coin_type, watch_bip32_path, watch_bip44_path  # noqa: F401
+from tx_engine.tx_engine import Tx, TxIn, TxOut, Script, Stack, Wallet, HdWallet, HdWatchWallet, Mempool, p2pkh_script, hash160, hash256d, address_to_public_key_hash, public_key_to_address, addresses_to_public_key_hashes, public_key_hashes_to_addresses  # noqa: F401
+from tx_engine.tx_engine import sig_hash_preimage, sig_hash_preimage_checksig_index, sig_hash, sig_hash_checksig_index, wif_to_bytes, bytes_to_wif, wif_from_pw_nonce, sign_many, mnemonic_to_seed, derive_extended_key, bip32_path, bip44_path, bsv_coin_type, watch_bip32_path, watch_bip44_path  # noqa: F401
 from tx_engine.engine.context import Context  # noqa: F401
 from tx_engine.engine.util import encode_num, decode_num  # noqa: F401
 from tx_engine.tx.sighash import SIGHASH  # noqa: F401
 from tx_engine.interface.interface_factory import interface_factory   # noqa: F401
 from tx_engine.interface.woc_interface import WoCInterface   # noqa: F401
 from tx_engine.interface.mock_interface import MockInterface   # noqa: F401
+from tx_engine.interface.caching_interface import CachingInterface   # noqa: F401
+from tx_engine.interface.simulator_interface import SimulatorInterface   # noqa: F401
+from tx_engine.interface.hedged_interface import HedgedInterface   # noqa: F401
 from tx_engine.engine.cryptography_utils import create_wallet_from_pem_bytes, create_pem_from_wallet  # noqa: F401
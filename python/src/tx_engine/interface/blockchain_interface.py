@@ -1,17 +1,34 @@
 """ This contains the base class for all blockchain interfaces
 """
 
+import inspect
 from abc import ABC, abstractmethod
 from typing import Dict, Optional, MutableMapping, Any, List
 
+from .instrumentation import instrument
+
 ConfigType = MutableMapping[str, Any]
 
 
+def _instrument_methods(cls):
+    """ Instrument the public methods defined by the class
+    """
+    for name, value in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.isfunction(value) and not getattr(value, "__isabstractmethod__", False):
+            setattr(cls, name, instrument(value))
+
+
 class BlockchainInterface(ABC):
     """ This is a BlockchainInterface abstract base class
         This will need to be extended with the used methods
+
+        Public methods of every subclass are instrumented, see `instrumentation.METRICS`.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _instrument_methods(cls)
+
     @abstractmethod
     def set_config(self, config: ConfigType):
         """ Configures the interface based on the provided config
@@ -68,8 +85,9 @@ class BlockchainInterface(ABC):
         """
 
     @abstractmethod
-    def get_merkle_proof(self, block_hash: str, tx_id: str) -> str:
-        """ Given the blockhash and tx_id return the merkle proof
+    def get_merkle_proof(self, block_hash: str, tx_id: str) -> Any:
+        """ Given the blockhash and tx_id return the merkle proof.
+            Its form depends on the interface: a hex string (RPC) or TSC format JSON (WoC).
         """
 
     @abstractmethod
@@ -77,8 +95,30 @@ class BlockchainInterface(ABC):
         """ Given the block hash return the block header
         """
 
+    # Bulk lookups. Results are returned in input order; interfaces with batch support override these.
+    def get_raw_transactions(self, txids: List[str]) -> List[Optional[str]]:
+        """ Given many txids return the raw transactions, with None for unknown txids.
+            This default suits interfaces whose get_raw_transaction returns None for an unknown
+            txid; interfaces where it raises (Mock, RPC) override this to keep the None contract.
+        """
+        return [self.get_raw_transaction(txid) for txid in txids]
+
+    def get_utxos(self, addresses: List[str]) -> List[Any]:
+        """ Given many addresses return the UTXO of each
+        """
+        return [self.get_utxo(address) for address in addresses]
+
+    def get_balances(self, addresses: List[str]) -> List[Any]:
+        """ Given many addresses return the balance of each
+        """
+        return [self.get_balance(address) for address in addresses]
+
     @abstractmethod
     def verifyscript(self, scripts: list, stop_on_first_invalid: bool = True, timeout: int = 100) -> List[Any]:
         """ Given an script and context, verify the script
             This call is only available from local RPC interface
         """
+
+
+# The concrete default methods of the base class
+_instrument_methods(BlockchainInterface)
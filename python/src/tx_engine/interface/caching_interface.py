@@ -0,0 +1,329 @@
+""" A caching decorator for any BlockchainInterface
+"""
+import copy
+import json
+import logging
+import string
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .blockchain_interface import BlockchainInterface, ConfigType
+
+LOGGER = logging.getLogger(__name__)
+
+# Defaults for the caching config keys
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_CACHE_TTL = 10.0
+
+# Fields of block and header results that change as blocks are added on top
+CHAIN_POSITION_FIELDS = ("confirmations", "nextblockhash")
+
+
+def without_chain_position(value: Any) -> Any:
+    """ Return a block or header result without the fields that change as the chain grows
+    """
+    if isinstance(value, dict):
+        return {k: v for k, v in value.items() if k not in CHAIN_POSITION_FIELDS}
+    return value
+
+
+def is_merkle_proof(value: Any) -> bool:
+    """ Return True if the value has the shape of a merkle proof: a hex string (RPC), a TSC format
+        dict, or a non-empty list of them (WoC). "Not found" or error responses are not proofs.
+    """
+    if isinstance(value, str):
+        return len(value) > 0 and all(c in string.hexdigits for c in value)
+    if isinstance(value, dict):
+        return isinstance(value.get("nodes"), list) and isinstance(value.get("index"), int)
+    if isinstance(value, list):
+        return len(value) > 0 and all(isinstance(v, dict) and is_merkle_proof(v) for v in value)
+    return False
+
+
+def is_present(value: Any) -> bool:
+    """ Return True for any result other than None
+    """
+    return value is not None
+
+
+class DiskStore:
+    """ Persistent key-value file for immutable chain data (raw transactions, headers, proofs).
+        Values are stored as JSON in a single sqlite table. The store is thread safe.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """ Return the stored value, or None if the key is not present
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        """ Store the value under the key
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _Flight:
+    """ An in-progress request that identical concurrent requests wait on
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class CachingInterface(BlockchainInterface):
+    """ Wraps another BlockchainInterface and caches its responses.
+
+        Immutable data (raw transactions, block headers, blocks and merkle proofs) is held in a
+        bounded LRU and, if `cache_path` is configured, in a persistent `DiskStore`. Blocks and
+        headers are returned without `confirmations` and `nextblockhash`, which change with every
+        new block. Mutable data (chain info, transactions, UTXOs and balances) is cached for
+        `cache_ttl` seconds. Bulk lookups only ask the wrapped interface for the keys not cached.
+        Concurrent identical requests are coalesced into one call to the wrapped interface.
+        Each caller gets its own copy of a cached result, so it may be changed freely.
+        Methods not cached here are passed straight through.
+    """
+
+    def __init__(self, interface: Optional[BlockchainInterface] = None):
+        self.interface = interface
+        self.cache_size = DEFAULT_CACHE_SIZE
+        self.cache_ttl = DEFAULT_CACHE_TTL
+        self.store: Optional[DiskStore] = None
+        # key -> (expiry time, or None for immutable entries, value)
+        self._lru: OrderedDict[str, Tuple[Optional[float], Any]] = OrderedDict()
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+
+    def set_config(self, config: ConfigType):
+        """ Configure the cache and the wrapped interface.
+
+            `cached_interface_type` selects the wrapped interface, which is configured with the
+            same config. `cache_size` (default 4096 entries), `cache_ttl` (seconds, default 10)
+            and `cache_path` (no persistent store if absent) configure the cache.
+        """
+        # Imported here as the factory imports this module
+        from .interface_factory import INTERFACE_MAPPING
+
+        inner_config = dict(config)
+        inner_config["interface_type"] = config["cached_interface_type"]
+        self.interface = INTERFACE_MAPPING[inner_config["interface_type"]]()  # type: ignore[abstract]
+        self.interface.set_config(inner_config)
+
+        self.cache_size = int(config.get("cache_size", DEFAULT_CACHE_SIZE))
+        self.cache_ttl = float(config.get("cache_ttl", DEFAULT_CACHE_TTL))
+        if config.get("cache_path"):
+            self.store = DiskStore(config["cache_path"])
+
+    def _inner(self) -> BlockchainInterface:
+        assert self.interface is not None
+        return self.interface
+
+    def __getattr__(self, name: str):
+        # Only called for attributes not found normally, e.g. RPC specific calls
+        if name == "interface":
+            raise AttributeError(name)
+        return getattr(self._inner(), name)
+
+    # Cache
+    def cache_stats(self) -> Dict[str, Any]:
+        """ Return hit, miss and coalesced request counts, the hit rate and the number of entries held
+        """
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = len(self._lru)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear_cache(self, mutable_only: bool = False):
+        """ Drop in-memory entries; the persistent store is kept
+        """
+        with self._lock:
+            if mutable_only:
+                for key in [k for k, (expiry, _) in self._lru.items() if expiry is not None]:
+                    del self._lru[key]
+            else:
+                self._lru.clear()
+
+    def _lookup(self, key: str) -> Tuple[bool, Any]:
+        """ Return (found, value) from memory, counting a hit if found. Expired entries are dropped.
+        """
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                expiry, value = entry
+                if expiry is None or expiry > time.monotonic():
+                    self._lru.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return True, value
+                del self._lru[key]
+        return False, None
+
+    def _remember(self, key: str, value: Any, immutable: bool):
+        expiry = None if immutable else time.monotonic() + self.cache_ttl
+        with self._lock:
+            self._lru[key] = (expiry, value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.cache_size:
+                self._lru.popitem(last=False)
+
+    def _cached(self, key: str, fetch: Callable[[], Any], immutable: bool, cacheable: Callable[[Any], bool] = is_present) -> Any:
+        """ Return a copy of the cached value of `key`, or call `fetch` once for all concurrent callers.
+            Only results for which `cacheable` returns True are cached, by default those not None.
+        """
+        found, value = self._lookup(key)
+        if found:
+            return copy.deepcopy(value)
+        if immutable and self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                self._remember(key, value, immutable)
+                return copy.deepcopy(value)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.value)
+
+        try:
+            flight.value = fetch()
+            if cacheable(flight.value):
+                self._remember(key, flight.value, immutable)
+                if immutable and self.store is not None:
+                    self.store.put(key, flight.value)
+            return copy.deepcopy(flight.value)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _cached_many(self, prefix: str, items: List[str], fetch: Callable[[List[str]], List[Any]], immutable: bool) -> List[Any]:
+        """ Return a copy of the cached value of each item and fetch the rest with one bulk call.
+            None results are not cached.
+        """
+        results: Dict[str, Any] = {}
+        missing = []
+        for item in dict.fromkeys(items):
+            key = f"{prefix}:{item}"
+            found, value = self._lookup(key)
+            if not found and immutable and self.store is not None:
+                value = self.store.get(key)
+                if value is not None:
+                    found = True
+                    with self._lock:
+                        self._stats["disk_hits"] += 1
+                    self._remember(key, value, immutable)
+            if found:
+                results[item] = value
+            else:
+                missing.append(item)
+
+        if missing:
+            with self._lock:
+                self._stats["misses"] += len(missing)
+            for item, value in zip(missing, fetch(missing)):
+                results[item] = value
+                if value is not None:
+                    self._remember(f"{prefix}:{item}", value, immutable)
+                    if immutable and self.store is not None:
+                        self.store.put(f"{prefix}:{item}", value)
+        return [copy.deepcopy(results[item]) for item in items]
+
+    # Immutable data
+    def get_raw_transaction(self, txid: str) -> Optional[str]:
+        return self._cached(f"rawtx:{txid}", lambda: self._inner().get_raw_transaction(txid), True)
+
+    def get_raw_transactions(self, txids: List[str]) -> List[Optional[str]]:
+        """ Return cached transactions and fetch the rest with one bulk call to the wrapped interface
+        """
+        return self._cached_many("rawtx", txids, self._inner().get_raw_transactions, True)
+
+    def get_block_header(self, block_hash: str) -> Dict:
+        return self._cached(f"header:{block_hash}", lambda: without_chain_position(self._inner().get_block_header(block_hash)), True)
+
+    def get_block(self, blockhash: str) -> Dict:
+        return self._cached(f"block:{blockhash}", lambda: without_chain_position(self._inner().get_block(blockhash)), True)
+
+    def get_merkle_proof(self, block_hash: str, tx_id: str) -> Any:
+        return self._cached(f"proof:{block_hash}:{tx_id}", lambda: self._inner().get_merkle_proof(block_hash, tx_id), True, is_merkle_proof)
+
+    # Mutable data
+    def get_block_count(self) -> int:
+        return self._cached("block_count", self._inner().get_block_count, False)
+
+    def get_best_block_hash(self) -> str:
+        return self._cached("best_block_hash", self._inner().get_best_block_hash, False)
+
+    def get_transaction(self, txid: str) -> Dict:
+        # Includes the confirmation count, so not immutable
+        return self._cached(f"tx:{txid}", lambda: self._inner().get_transaction(txid), False)
+
+    def get_utxo(self, address: str):
+        return self._cached(f"utxo:{address}", lambda: self._inner().get_utxo(address), False)
+
+    def get_utxos(self, addresses: List[str]) -> List[Any]:
+        return self._cached_many("utxo", addresses, self._inner().get_utxos, False)
+
+    def get_balance(self, address) -> int:
+        return self._cached(f"balance:{address}", lambda: self._inner().get_balance(address), False)
+
+    def get_balances(self, addresses: List[str]) -> List[Any]:
+        return self._cached_many("balance", addresses, self._inner().get_balances, False)
+
+    # Not cached
+    def broadcast_tx(self, tx: str):
+        """ Broadcast the transaction and drop cached mutable data, which it may have changed
+        """
+        result = self._inner().broadcast_tx(tx)
+        self.clear_cache(mutable_only=True)
+        return result
+
+    def is_testnet(self) -> bool:
+        return self._inner().is_testnet()
+
+    def get_tx_out(self, txid: str, txindex: int) -> Dict:
+        return self._inner().get_tx_out(txid, txindex)
+
+    def verifyscript(self, scripts: list, stop_on_first_invalid: bool = True, timeout: int = 100) -> List[Any]:
+        return self._inner().verifyscript(scripts, stop_on_first_invalid, timeout)
@@ -0,0 +1,321 @@
+""" A composite BlockchainInterface that hedges requests over several backends
+"""
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from .blockchain_interface import BlockchainInterface, ConfigType
+from .rate_limit import CircuitBreaker
+
+LOGGER = logging.getLogger(__name__)
+
+# Defaults for the hedging config keys
+DEFAULT_HEDGE_DELAY = 0.2
+DEFAULT_HEDGE_MAX_WORKERS = 16
+DEFAULT_BACKEND_FAILURE_THRESHOLD = 3
+DEFAULT_BACKEND_RESET_TIMEOUT = 30.0
+
+# Config keys of the composite, not passed on to the backends
+HEDGED_CONFIG_KEYS = (
+    "hedged_backends", "hedge_delay", "hedge_max_workers", "backend_failure_threshold", "backend_reset_timeout",
+)
+
+# Errors that mean the backend does not support the call rather than that it is unhealthy.
+# Others, including ValueError from a malformed response, count against the backend.
+UNSUPPORTED_ERRORS = (NotImplementedError,)
+
+# Broadcast rejections that mean the backend already has the transaction
+ALREADY_KNOWN_MARKERS = ("txn-already-known", "txn-already-in-mempool", "already in the mempool", "already in block chain")
+
+
+def broadcast_status(result: Any) -> str:
+    """ Classify a broadcast_tx result as "accepted", "known" (already in the mempool or chain) or "rejected".
+        WoC returns a response and RPC an RPCReturnInfo, both with a status_code; Mock returns the txid.
+    """
+    if result is None:
+        return "rejected"
+    status_code = getattr(result, "status_code", None)
+    if status_code is None or status_code == 200:
+        return "accepted"
+    content = getattr(result, "content", b"")
+    message = content.decode(errors="replace") if isinstance(content, bytes) else str(content)
+    if any(marker in message.lower() for marker in ALREADY_KNOWN_MARKERS):
+        return "known"
+    return "rejected"
+
+
+class Backend:
+    """ One interface of a HedgedInterface, with its health and statistics
+    """
+
+    def __init__(self, name: str, interface: BlockchainInterface, breaker: CircuitBreaker):
+        self.name = name
+        self.interface = interface
+        self.breaker = breaker
+        self.calls = 0
+        self.wins = 0
+        self.errors = 0
+        # Exponentially weighted moving average of successful call latency in seconds
+        self.latency: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def call(self, method: str, args: Tuple) -> Any:
+        """ Call the interface method, recording the outcome against the backend's health
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self.calls += 1
+        try:
+            result = getattr(self.interface, method)(*args)
+        except UNSUPPORTED_ERRORS:
+            # The backend answered, it just can not serve this call
+            self.breaker.record_success()
+            raise
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            self.breaker.record_failure()
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        self.breaker.record_success()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {"name": self.name, "calls": self.calls, "wins": self.wins, "errors": self.errors, "latency": self.latency}
+        stats["circuit"] = self.breaker.stats()["state"]
+        return stats
+
+
+class HedgedInterface(BlockchainInterface):
+    """ Sends each request to several BlockchainInterface backends and returns the first answer.
+
+        Reads go to the primary (the first healthy backend in configured order). If it has not
+        answered after `hedge_delay` seconds, the request is also sent to the next healthy backend,
+        and so on; the first non-None result wins. A failed backend is replaced straight away.
+        Each backend has a CircuitBreaker, so a backend that keeps failing is skipped until it
+        recovers and the next one takes over as primary. Broadcasts go to every backend in
+        parallel and return one result, the first that shows the transaction was accepted.
+        Methods not handled here are passed to the primary backend.
+    """
+
+    def __init__(self, backends: Optional[Sequence[BlockchainInterface]] = None, hedge_delay: float = DEFAULT_HEDGE_DELAY):
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = DEFAULT_BACKEND_FAILURE_THRESHOLD
+        self.reset_timeout = DEFAULT_BACKEND_RESET_TIMEOUT
+        self.max_workers = DEFAULT_HEDGE_MAX_WORKERS
+        self.backends: List[Backend] = []
+        self.hedges = 0
+        # Network given by the config, or None to ask the primary backend
+        self.testnet: Optional[bool] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        for interface in backends or []:
+            self.add_backend(interface)
+
+    def add_backend(self, interface: BlockchainInterface, name: Optional[str] = None):
+        """ Add a backend after the existing ones
+        """
+        name = name or f"{type(interface).__name__}[{len(self.backends)}]"
+        breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        self.backends.append(Backend(name, interface, breaker))
+
+    def set_config(self, config: ConfigType):
+        """ Configure the hedging and the backends.
+
+            `hedged_backends` is a list of backend configs, primary first. Each is merged over
+            this config, so shared keys such as `network_type` need only be given once.
+            `hedge_delay` (seconds, default 0.2), `backend_failure_threshold` (default 3),
+            `backend_reset_timeout` (seconds, default 30) and `hedge_max_workers` (default 16)
+            configure the hedging.
+        """
+        # Imported here as the factory imports this module
+        from .interface_factory import INTERFACE_MAPPING
+
+        self.hedge_delay = float(config.get("hedge_delay", DEFAULT_HEDGE_DELAY))
+        self.failure_threshold = int(config.get("backend_failure_threshold", DEFAULT_BACKEND_FAILURE_THRESHOLD))
+        self.reset_timeout = float(config.get("backend_reset_timeout", DEFAULT_BACKEND_RESET_TIMEOUT))
+        self.max_workers = int(config.get("hedge_max_workers", DEFAULT_HEDGE_MAX_WORKERS))
+        if "network_type" in config:
+            # Other values default to testnet, as in WoCInterface
+            self.testnet = config["network_type"] != "mainnet"
+
+        shared = {key: value for key, value in config.items() if key not in HEDGED_CONFIG_KEYS}
+        self.backends = []
+        for backend_config in config["hedged_backends"]:
+            inner_config = dict(shared)
+            inner_config.update(backend_config)
+            interface = INTERFACE_MAPPING[inner_config["interface_type"]]()  # type: ignore[abstract]
+            interface.set_config(inner_config)
+            self.add_backend(interface)
+        if not self.backends:
+            raise ValueError("hedged_backends must contain at least one backend")
+
+    def _primary(self) -> BlockchainInterface:
+        assert self.backends, "HedgedInterface has no backends"
+        for backend in self.backends:
+            if backend.breaker.state == CircuitBreaker.CLOSED:
+                return backend.interface
+        return self.backends[0].interface
+
+    def __getattr__(self, name: str):
+        # Only called for attributes not found normally, e.g. RPC specific calls
+        if name == "backends":
+            raise AttributeError(name)
+        return getattr(self._primary(), name)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedged")
+            return self._executor
+
+    def backend_stats(self) -> List[Dict[str, Any]]:
+        """ Return the calls, wins, errors, latency and circuit state of each backend
+        """
+        return [backend.stats() for backend in self.backends]
+
+    def _hedged(self, method: str, *args) -> Any:
+        """ Call the method on the primary, hedging to the next backends, and return the first non-None result.
+            If every backend fails the first error is raised; if any returned None, None is returned.
+        """
+        candidates = iter(self.backends)
+        pending: Dict[Future, Backend] = {}
+        errors: List[BaseException] = []
+        answered_none = False
+
+        def launch() -> bool:
+            for backend in candidates:
+                if backend.breaker.allow():
+                    pending[self._pool().submit(backend.call, method, args)] = backend
+                    return True
+            return False
+
+        more = launch()
+        if not pending:
+            raise ConnectionError(f"No healthy backend for {method}")
+        while pending:
+            done: Set[Future]
+            done, _ = wait(pending, timeout=self.hedge_delay if more else None, return_when=FIRST_COMPLETED)
+            if not done:
+                # The backends in flight are slow, hedge to the next one
+                more = launch()
+                if more:
+                    with self._lock:
+                        self.hedges += 1
+                continue
+            for future in done:
+                backend = pending.pop(future)
+                error = future.exception()
+                if error is None and future.result() is not None:
+                    with backend._lock:
+                        backend.wins += 1
+                    return future.result()
+                if error is not None:
+                    LOGGER.warning(f"{backend.name}.{method} failed: {error!r}")
+                    errors.append(error)
+                else:
+                    answered_none = True
+                # Fail over without waiting for the hedge delay
+                more = more and launch()
+        if errors and not answered_none:
+            raise errors[0]
+        return None
+
+    # Reads
+    def get_utxo(self, address: str):
+        return self._hedged("get_utxo", address)
+
+    def get_block_count(self) -> int:
+        return self._hedged("get_block_count")
+
+    def get_raw_transaction(self, txid: str) -> Optional[str]:
+        return self._hedged("get_raw_transaction", txid)
+
+    def get_transaction(self, txid: str) -> Dict:
+        return self._hedged("get_transaction", txid)
+
+    def get_balance(self, address) -> int:
+        return self._hedged("get_balance", address)
+
+    def get_best_block_hash(self) -> str:
+        return self._hedged("get_best_block_hash")
+
+    def get_tx_out(self, txid: str, txindex: int) -> Dict:
+        return self._hedged("get_tx_out", txid, txindex)
+
+    def get_block(self, blockhash: str) -> Dict:
+        return self._hedged("get_block", blockhash)
+
+    def get_merkle_proof(self, block_hash: str, tx_id: str) -> Any:
+        return self._hedged("get_merkle_proof", block_hash, tx_id)
+
+    def get_block_header(self, block_hash: str) -> Dict:
+        return self._hedged("get_block_header", block_hash)
+
+    def get_addr_history(self, address):
+        return self._hedged("get_addr_history", address)
+
+    def get_raw_transactions(self, txids: List[str]) -> List[Optional[str]]:
+        return self._hedged("get_raw_transactions", txids)
+
+    def get_utxos(self, addresses: List[str]) -> List[Any]:
+        return self._hedged("get_utxos", addresses)
+
+    def get_balances(self, addresses: List[str]) -> List[Any]:
+        return self._hedged("get_balances", addresses)
+
+    def verifyscript(self, scripts: list, stop_on_first_invalid: bool = True, timeout: int = 100) -> List[Any]:
+        return self._hedged("verifyscript", scripts, stop_on_first_invalid, timeout)
+
+    def is_testnet(self) -> bool:
+        """ Return the configured network, as backends such as MockInterface do not know it
+        """
+        if self.testnet is not None:
+            return self.testnet
+        return self._primary().is_testnet()
+
+    # Writes
+    def broadcast_tx(self, tx: str):
+        """ Broadcast the transaction through every backend in parallel and return one result.
+            The first acceptance is returned at once, the other backends finish in the background.
+            Otherwise an "already known" result is preferred, then the first backend's rejection.
+            Raises if every backend failed.
+        """
+        assert self.backends, "HedgedInterface has no backends"
+        pending = {self._pool().submit(backend.call, "broadcast_tx", (tx,)): backend for backend in self.backends}
+        known = None
+        rejected: Dict[str, Any] = {}
+        errors: List[BaseException] = []
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                backend = pending.pop(future)
+                error = future.exception()
+                if error is not None:
+                    LOGGER.warning(f"{backend.name}.broadcast_tx failed: {error!r}")
+                    errors.append(error)
+                    continue
+                result = future.result()
+                status = broadcast_status(result)
+                if status == "accepted":
+                    with backend._lock:
+                        backend.wins += 1
+                    return result
+                if status == "known":
+                    known = known or result
+                else:
+                    LOGGER.warning(f"{backend.name}.broadcast_tx rejected: {getattr(result, 'content', result)!r}")
+                    rejected[backend.name] = result
+        if known is not None:
+            return known
+        for backend in self.backends:
+            if rejected.get(backend.name) is not None:
+                return rejected[backend.name]
+        if errors:
+            raise errors[0]
+        return None
@@ -0,0 +1,239 @@
+""" Call instrumentation for BlockchainInterface implementations
+
+    Every public method of a BlockchainInterface subclass is timed and recorded in `METRICS`,
+    per interface class and method: call counts, a latency histogram, error classes, retries and
+    bytes transferred. Transports report retries and bytes with `record_retry()` and
+    `record_bytes()`, which are attributed to the call in progress. Hooks receive a `Span` for
+    every finished call, e.g. to forward it to a tracing system.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Latency histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Span:
+    """ One instrumented call
+    """
+    def __init__(self, interface: str, method: str, owner: Any = None):
+        self.interface = interface
+        self.method = method
+        # Wall clock start time, for tracing systems
+        self.start = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._owner = owner
+
+    def __repr__(self) -> str:
+        return (
+            f"Span({self.interface}.{self.method}, duration={self.duration:.6f}, error={self.error}, "
+            f"retries={self.retries}, bytes_sent={self.bytes_sent}, bytes_received={self.bytes_received})"
+        )
+
+
+class MethodStats:
+    """ Accumulated statistics of one interface method
+    """
+    def __init__(self, buckets: Sequence[float]):
+        self.calls = 0
+        self.errors: Dict[str, int] = {}
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        # One count per bucket plus one for +Inf, not cumulative
+        self.bucket_counts = [0] * (len(buckets) + 1)
+
+
+class Metrics:
+    """ Thread safe registry of interface call statistics
+    """
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.enabled = True
+        self._stats: Dict[Tuple[str, str], MethodStats] = {}
+        self._hooks: List[Callable[[Span], None]] = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[Span], None]):
+        """ Call `hook(span)` after every instrumented call
+        """
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[Span], None]):
+        with self._lock:
+            self._hooks.remove(hook)
+
+    def record(self, span: Span):
+        """ Add a finished call to the statistics and pass it to the hooks
+        """
+        with self._lock:
+            stats = self._stats.get((span.interface, span.method))
+            if stats is None:
+                stats = MethodStats(self.buckets)
+                self._stats[(span.interface, span.method)] = stats
+            stats.calls += 1
+            if span.error is not None:
+                stats.errors[span.error] = stats.errors.get(span.error, 0) + 1
+            stats.retries += span.retries
+            stats.bytes_sent += span.bytes_sent
+            stats.bytes_received += span.bytes_received
+            stats.latency_sum += span.duration
+            stats.bucket_counts[bisect.bisect_left(self.buckets, span.duration)] += 1
+            hooks = list(self._hooks)
+        for hook in hooks:
+            try:
+                hook(span)
+            except Exception as e:
+                LOGGER.warning(f"Instrumentation hook {hook} failed: {e!r}")
+
+    def reset(self):
+        """ Discard all statistics
+        """
+        with self._lock:
+            self._stats.clear()
+
+    def _quantile(self, stats: MethodStats, q: float) -> float:
+        """ Upper bound of the bucket holding quantile q (the largest bucket bound for +Inf)
+        """
+        rank = q * stats.calls
+        seen = 0
+        for bound, count in zip(self.buckets, stats.bucket_counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """ Return {interface: {method: statistics}}, where the latency quantiles are bucket upper bounds
+        """
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        with self._lock:
+            for (interface, method), stats in sorted(self._stats.items()):
+                result.setdefault(interface, {})[method] = {
+                    "calls": stats.calls,
+                    "errors": dict(stats.errors),
+                    "retries": stats.retries,
+                    "bytes_sent": stats.bytes_sent,
+                    "bytes_received": stats.bytes_received,
+                    "latency_sum": stats.latency_sum,
+                    "latency_mean": stats.latency_sum / stats.calls,
+                    "latency_p50": self._quantile(stats, 0.5),
+                    "latency_p90": self._quantile(stats, 0.9),
+                    "latency_p99": self._quantile(stats, 0.99),
+                }
+        return result
+
+    def to_prometheus(self, prefix: str = "tx_engine_interface") -> str:
+        """ Return the statistics in the Prometheus text exposition format
+        """
+        lines = [
+            f"# HELP {prefix}_calls_total Interface calls.",
+            f"# TYPE {prefix}_calls_total counter",
+        ]
+        calls, errors, retries, transferred, durations = [], [], [], [], []
+        with self._lock:
+            for (interface, method), stats in sorted(self._stats.items()):
+                labels = f'interface="{interface}",method="{method}"'
+                calls.append(f"{prefix}_calls_total{{{labels}}} {stats.calls}")
+                for error, count in sorted(stats.errors.items()):
+                    errors.append(f'{prefix}_errors_total{{{labels},error="{_escape(error)}"}} {count}')
+                retries.append(f"{prefix}_retries_total{{{labels}}} {stats.retries}")
+                transferred.append(f'{prefix}_bytes_total{{{labels},direction="sent"}} {stats.bytes_sent}')
+                transferred.append(f'{prefix}_bytes_total{{{labels},direction="received"}} {stats.bytes_received}')
+                cumulative = 0
+                for bound, count in zip(self.buckets, stats.bucket_counts):
+                    cumulative += count
+                    durations.append(f'{prefix}_call_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                durations.append(f'{prefix}_call_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.calls}')
+                durations.append(f"{prefix}_call_duration_seconds_sum{{{labels}}} {stats.latency_sum}")
+                durations.append(f"{prefix}_call_duration_seconds_count{{{labels}}} {stats.calls}")
+        lines += calls
+        lines += [f"# HELP {prefix}_errors_total Interface calls that failed, by error class.", f"# TYPE {prefix}_errors_total counter"] + errors
+        lines += [f"# HELP {prefix}_retries_total Retried requests.", f"# TYPE {prefix}_retries_total counter"] + retries
+        lines += [f"# HELP {prefix}_bytes_total Bytes transferred.", f"# TYPE {prefix}_bytes_total counter"] + transferred
+        lines += [f"# HELP {prefix}_call_duration_seconds Interface call latency.", f"# TYPE {prefix}_call_duration_seconds histogram"] + durations
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Process wide registry used by all interfaces
+METRICS = Metrics()
+
+# The instrumented call in progress on this thread or task
+_ACTIVE: ContextVar[Optional[Span]] = ContextVar("tx_engine_interface_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """ Return the instrumented call in progress, if any
+    """
+    return _ACTIVE.get()
+
+
+def record_retry(count: int = 1):
+    """ Count a retried request against the call in progress
+    """
+    span = _ACTIVE.get()
+    if span is not None:
+        span.retries += count
+
+
+def record_bytes(sent: int = 0, received: int = 0):
+    """ Count bytes transferred against the call in progress
+    """
+    span = _ACTIVE.get()
+    if span is not None:
+        span.bytes_sent += sent
+        span.bytes_received += received
+
+
+def record_error(error: str):
+    """ Mark the call in progress as failed, for transports that report errors without raising
+    """
+    span = _ACTIVE.get()
+    if span is not None:
+        span.error = error
+
+
+def instrument(func: Callable) -> Callable:
+    """ Wrap an interface method so that its calls are recorded in `METRICS`.
+        Calls an interface makes to its own methods are not recorded separately.
+    """
+    if getattr(func, "__instrumented__", False):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        parent = _ACTIVE.get()
+        if not METRICS.enabled or (parent is not None and parent._owner is self):
+            return func(self, *args, **kwargs)
+        span = Span(type(self).__name__, func.__name__, self)
+        token = _ACTIVE.set(span)
+        start = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            _ACTIVE.reset(token)
+            METRICS.record(span)
+
+    wrapper.__instrumented__ = True  # type: ignore[attr-defined]
+    return wrapper
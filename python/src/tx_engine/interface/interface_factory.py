@@ -4,19 +4,25 @@ from .blockchain_interface import ConfigType
 from .mock_interface import MockInterface
 from .woc_interface import WoCInterface
 from .rpc_interface import RPCInterface
+from .caching_interface import CachingInterface
+from .simulator_interface import SimulatorInterface
+from .hedged_interface import HedgedInterface
 
 
 INTERFACE_MAPPING = {
     "mock": MockInterface,
     "woc": WoCInterface,
     "rpc": RPCInterface,
+    "caching": CachingInterface,
+    "simulator": SimulatorInterface,
+    "hedged": HedgedInterface,
 }
 
 
 class InterfaceFactory:
     """ A class for creating interfaces to the BSV blockchain """
 
-    def set_config(self, config: ConfigType) -> MockInterface | WoCInterface | RPCInterface:
+    def set_config(self, config: ConfigType) -> MockInterface | WoCInterface | RPCInterface | CachingInterface | SimulatorInterface | HedgedInterface:
         """ Given a config returns the required configured Interface
         """
         interface_type = config['interface_type']
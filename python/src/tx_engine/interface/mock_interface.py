@@ -1,6 +1,6 @@
 """ Mock BSV Client for use in unit tests
 """
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from .blockchain_interface import BlockchainInterface
 from tx_engine import Tx
 
@@ -60,7 +60,7 @@ class MockInterface(BlockchainInterface):
         self.utxo = utxo
 
     # Normal client methods
-    def get_raw_transaction(self, txid: str) -> str:
+    def get_raw_transaction(self, txid: str) -> Optional[str]:
         try:
             return self.transactions[txid]
         except KeyError:
@@ -71,12 +71,18 @@ class MockInterface(BlockchainInterface):
         self.broadcast[txid] = tx
         return txid
 
+    def get_raw_transactions(self, txids: List[str]) -> List[Optional[str]]:
+        return [self.transactions.get(txid, self.broadcast.get(txid)) for txid in txids]
+
     def get_utxo(self, address: str) -> List:
         try:
             return self.utxo[address]
         except KeyError:
             return []
 
+    def get_utxos(self, addresses: List[str]) -> List[List]:
+        return [self.utxo.get(address, []) for address in addresses]
+
     def get_block_count(self) -> int:
         return self.block_count
 
@@ -96,13 +102,16 @@ class MockInterface(BlockchainInterface):
     def get_balance(self, address: str) -> int:
         return self.balance
 
+    def get_balances(self, addresses: List[str]) -> List[int]:
+        return [self.balance for _ in addresses]
+
     def is_testnet(self) -> bool:
         return False
 
     def get_block_header(self, block_hash: str) -> Dict:
         raise NotImplementedError('get_block_header not implemented for the mock client api')
 
-    def get_merkle_proof(self, block_hash: str, tx_id: str) -> str:
+    def get_merkle_proof(self, block_hash: str, tx_id: str) -> Any:
         raise NotImplementedError('get_merkle_proof not implemented for the mock client api')
 
     def verifyscript(self, scripts: list, stop_on_first_invalid: bool = True, timeout: int = 100) -> List[Any]:
@@ -0,0 +1,142 @@
+""" Client side rate limiting and circuit breaking for REST APIs
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """ Token bucket limiting requests to `rate` per second, with bursts of up to `burst`.
+
+        The rate adapts to the server: `throttled()` (on a 429 response) halves the current rate
+        and pauses every caller for the Retry-After period, and each `succeeded()` call adds back
+        a fraction of a request per second until the configured rate is reached again.
+        The limiter is thread safe and meant to be shared by every client using the same budget.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, min_rate: Optional[float] = None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate, 1.0)
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled_count = 0
+        self.rejected = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """ Wait for a token. Returns False, counting a rejection, if none is available within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.requests += 1
+                    return True
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+                if deadline is not None and now + wait > deadline:
+                    self.rejected += 1
+                    return False
+            time.sleep(wait)
+
+    def throttled(self, retry_after: Optional[float] = None):
+        """ Record a 429 response: halve the rate and pause all callers for `retry_after` seconds
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttled_count += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            LOGGER.warning(f"Rate limited, reducing rate to {self.rate:.2f}/s")
+
+    def succeeded(self):
+        """ Record a successful request, recovering the rate towards its configured value
+        """
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 32)
+
+    def stats(self) -> Dict[str, Any]:
+        """ Return the current rate and the request, throttled and rejected counts
+        """
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "max_rate": self.max_rate,
+                "requests": self.requests,
+                "throttled": self.throttled_count,
+                "rejected": self.rejected,
+            }
+
+
+class CircuitBreaker:
+    """ Fails fast while a service is down.
+
+        After `failure_threshold` consecutive failures the circuit opens and `allow()` returns
+        False for `reset_timeout` seconds. Then one trial request is let through (half open):
+        success closes the circuit, failure opens it again. Thread safe.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """ Return True if a request may be sent
+        """
+        with self._lock:
+            if self.state == CircuitBreaker.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = CircuitBreaker.HALF_OPEN
+                self._trial = False
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+            if self.state == CircuitBreaker.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != CircuitBreaker.OPEN:
+                    LOGGER.warning(f"Circuit opened after {self.failures} failures")
+                self.state = CircuitBreaker.OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """ Return the circuit state, consecutive failures and rejected count
+        """
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
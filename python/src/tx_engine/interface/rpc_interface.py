@@ -1,17 +1,28 @@
 """This is an RPC (Regtest, etc) interface to the BSV network
 """
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple, Callable
+from contextlib import contextmanager
+import copy
 import logging
+import queue
+import threading
 import time
 
-from http.client import CannotSendRequest
+from http.client import CannotSendRequest, HTTPException
 from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException
 
 from .blockchain_interface import BlockchainInterface
+from .instrumentation import record_retry
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Maximum number of calls sent in one JSON-RPC batch request
+RPC_BATCH_LIMIT = 500
+
+# listunspent maxconf used when filtering by address
+LISTUNSPENT_MAX_CONF = 9999999
+
 
 class RPCReturnInfo:
     """ Info returned from RPC call
@@ -21,25 +32,174 @@ class RPCReturnInfo:
         self.status_code = -1
 
 
-def retry_call(func):
-    """ Decorator to retry calls that fail due to connection issues
+# Defaults for the rpc_pool_size, rpc_max_retries and rpc_timeout config keys
+DEFAULT_RPC_POOL_SIZE = 4
+DEFAULT_RPC_MAX_RETRIES = 5
+DEFAULT_RPC_TIMEOUT = 30.0
+
+# Backoff between retries doubles from RPC_BACKOFF seconds up to RPC_MAX_BACKOFF
+RPC_BACKOFF = 0.25
+RPC_MAX_BACKOFF = 4.0
+
+# Errors after which a connection is replaced and the call retried.
+# These include CannotSendRequest, BrokenPipeError and socket timeouts.
+RETRYABLE_ERRORS = (ConnectionError, TimeoutError, HTTPException)
+
+# Errors raised before any of the request was sent, after which any call can be retried
+NOT_SENT_ERRORS = (CannotSendRequest, ConnectionRefusedError)
+
+# Methods that do not change node state, so are safe to resend after any connection error
+READ_ONLY_METHODS = {
+    "getblock", "getblockchaininfo", "getblockcount", "getblockhash", "getblockheader",
+    "getinfo", "getmininginfo", "getrawmempool", "getrawtransaction", "gettransaction",
+    "gettxout", "gettxoutproof", "getwalletinfo", "listaddressgroupings", "listtransactions",
+    "listunspent", "verifyscript",
+}
+
+# Methods that are safe to resend after any connection error, as a repeat has no further effect.
+# A resent sendrawtransaction that already reached the node is answered with txn-already-known.
+RESENDABLE_METHODS = READ_ONLY_METHODS | {"sendrawtransaction"}
+
+
+def is_resendable(method: str, params: Tuple) -> bool:
+    """ Return True if the call can be resent after a connection error. A batch is resendable if all its calls are.
     """
+    if method == "batch_":
+        return all(call[0] in RESENDABLE_METHODS for call in params[0])
+    return method in RESENDABLE_METHODS
 
-    def _inner_call(*args, **kwargs):
-        while True:
-            try:
-                return func(*args, **kwargs)
-            except (
-                ConnectionError,
-                ConnectionRefusedError,
-                ConnectionAbortedError,
-                ConnectionResetError,
-                CannotSendRequest,
-            ) as e:
-                print(e)
-                time.sleep(0.25)
 
-    return _inner_call
+class RPCCallError:
+    """ Stands in for the result of one call in a JSON-RPC batch that the node answered with an error
+    """
+    def __init__(self, error: Dict):
+        self.error = error
+
+
+class BatchingAuthServiceProxy(AuthServiceProxy):
+    """ AuthServiceProxy whose batch_ returns an RPCCallError in place of each failing call,
+        instead of raising for the whole batch when any one call fails
+    """
+    def _get_response(self):
+        response = super()._get_response()
+        if isinstance(response, list):
+            return [
+                {"error": None, "result": RPCCallError(entry["error"])} if entry.get("error") is not None else entry
+                for entry in response
+            ]
+        return response
+
+
+class RPCConnectionPool:
+    """ Bounded pool of RPC connections, safe to use from many threads.
+
+        Each call checks a connection out for the calling thread (nested calls on the same thread
+        reuse it), so concurrent calls use separate sockets. Connections are created on demand up
+        to `size`; when all are in use a call waits up to `timeout` seconds for one and then raises
+        TimeoutError. A call failing with a connection error is retried on a new connection up to
+        `max_retries` attempts in all, with exponential backoff, and the error raised after that.
+        Calls that may change node state, other than sendrawtransaction, are only retried if the
+        request was never sent.
+    """
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        size: int = DEFAULT_RPC_POOL_SIZE,
+        timeout: float = DEFAULT_RPC_TIMEOUT,
+        max_retries: int = DEFAULT_RPC_MAX_RETRIES,
+    ):
+        self.factory = factory
+        self.size = max(size, 1)
+        self.timeout = timeout
+        self.max_retries = max(max_retries, 1)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            return self.factory()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No RPC connection became available within {self.timeout}s") from None
+
+    @contextmanager
+    def checkout(self):
+        """ Check out a connection for the calling thread
+        """
+        held = getattr(self._local, "connection", None)
+        if held is not None:
+            yield held
+            return
+        self._local.connection = self._acquire()
+        try:
+            yield self._local.connection
+        finally:
+            # The connection may have been replaced after an error
+            self._idle.put(self._local.connection)
+            self._local.connection = None
+
+    def call(self, method: str, *params) -> Any:
+        """ Call the RPC method on a checked out connection, retrying connection errors
+        """
+        resendable = is_resendable(method, params)
+        with self.checkout():
+            for attempt in range(self.max_retries):
+                try:
+                    # Each attempt gets its own copy, as batch_ consumes the calls it is given
+                    return getattr(self._local.connection, method)(*copy.deepcopy(params))
+                except RETRYABLE_ERRORS as e:
+                    if attempt + 1 >= self.max_retries or not (resendable or isinstance(e, NOT_SENT_ERRORS)):
+                        raise
+                    LOGGER.warning(f"RPC {method} failed ({e!r}), retrying ({attempt + 1}/{self.max_retries})")
+                    record_retry()
+                    self._local.connection = self.factory()
+                    time.sleep(min(RPC_BACKOFF * 2 ** attempt, RPC_MAX_BACKOFF))
+
+
+class PooledConnection:
+    """ Stands in for a single AuthServiceProxy, sending each call through an RPCConnectionPool
+    """
+    def __init__(self, pool: RPCConnectionPool):
+        self.pool = pool
+
+    def __getattr__(self, method: str) -> Callable[..., Any]:
+        if method.startswith("__"):
+            raise AttributeError(method)
+        return lambda *params: self.pool.call(method, *params)
+
+
+class UTXOIndex:
+    """ Per-address cache of listunspent entries, valid at one block height.
+
+        Only addresses that have been queried are indexed. The index is not updated
+        incrementally: when the block height changes (or the index is invalidated) every indexed
+        address is reloaded in one filtered listunspent call. It saves requests between blocks;
+        otherwise a query only loads addresses not yet indexed.
+    """
+    def __init__(self):
+        self.height: Optional[int] = None
+        self.by_address: Dict[str, List] = {}
+        # Changes whenever the index is reloaded or invalidated
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """ Force a reload on the next query, e.g. after a broadcast
+        """
+        with self.lock:
+            self.height = None
+            self.generation += 1
 
 
 class RPCInterface(BlockchainInterface):
@@ -52,8 +212,9 @@ class RPCInterface(BlockchainInterface):
         self.user = None
         self.password = None
         self.address = None
-        self.rpc_connection: AuthServiceProxy
+        self.rpc_connection: PooledConnection
         self.network_type = None
+        self.utxo_index: Optional[UTXOIndex] = None
 
     def set_config(self, config):
         """Configure the client based on the provided config"""
@@ -71,9 +232,18 @@ class RPCInterface(BlockchainInterface):
         self.address = config["address"]
         self.network_type = config["network_type"]
 
-        self.rpc_connection = AuthServiceProxy(
-            f"http://{self.user}:{self.password}@{self.address}"
+        url = f"http://{self.user}:{self.password}@{self.address}"
+        timeout = float(config.get("rpc_timeout", DEFAULT_RPC_TIMEOUT))
+        self.rpc_connection = PooledConnection(
+            RPCConnectionPool(
+                lambda: BatchingAuthServiceProxy(url, timeout=timeout),
+                size=int(config.get("rpc_pool_size", DEFAULT_RPC_POOL_SIZE)),
+                timeout=timeout,
+                max_retries=int(config.get("rpc_max_retries", DEFAULT_RPC_MAX_RETRIES)),
+            )
         )
+        if config.get("rpc_utxo_index"):
+            self.utxo_index = UTXOIndex()
 
     def is_testnet(self) -> bool:
         assert self.network_type is not None
@@ -90,23 +260,10 @@ class RPCInterface(BlockchainInterface):
         return int(value * satoshis)
 
     def get_unspent(self, address=None):
-        """Private function to return unspent"""
-        while True:
-            try:
-                unspent = self.rpc_connection.listunspent(0)
-            except (
-                ConnectionError,
-                ConnectionRefusedError,
-                ConnectionAbortedError,
-                ConnectionResetError,
-                CannotSendRequest,
-            ) as e:
-                LOGGER.error(f"Connection failed {e}")
-                time.sleep(2)
-            else:
-                if address is None:
-                    return unspent
-                return list(filter(lambda x: x["address"] == address, unspent))
+        """Return the node wallet unspent outputs, only those of address if provided"""
+        if address is None:
+            return self.rpc_connection.listunspent(0)
+        return self.rpc_connection.listunspent(0, LISTUNSPENT_MAX_CONF, [address])
 
     def _get_chain_info(self) -> Dict:
         return self.rpc_connection.getblockchaininfo()
@@ -118,11 +275,16 @@ class RPCInterface(BlockchainInterface):
         """Return the transaction history with this address"""
         return self._get_history(address)
 
-    def get_utxo(self, address):
-        """Return ordered list of UTXOs for this address"""
-        unspent_address = self.get_unspent(address)
-        block_count = self.get_block_count()
+    def _group_by_address(self, unspent, addresses) -> Dict[str, List]:
+        """Group listunspent entries by the requested addresses"""
+        by_address: Dict[str, List] = {address: [] for address in addresses}
+        for x in unspent:
+            if x["address"] in by_address:
+                by_address[x["address"]].append(x)
+        return by_address
 
+    def _as_utxo(self, unspent_address, block_count):
+        """Convert listunspent entries to an ordered UTXO list"""
         response = [
             {
                 "height": self._calc_block_height(block_count, x["confirmations"]),
@@ -135,9 +297,84 @@ class RPCInterface(BlockchainInterface):
         response.sort(key=lambda x: x["height"])
         return response
 
+    def _listunspent_each(self, addresses: List[str]) -> List:
+        """Return the listunspent entries of the addresses, one call per address.
+        Used when a filtered call failed, so that the error of a bad address is raised.
+        """
+        unspent: List = []
+        for address in addresses:
+            unspent.extend(self.rpc_connection.listunspent(0, LISTUNSPENT_MAX_CONF, [address]))
+        return unspent
+
+    def _unspent_by_address(self, addresses: List[str]) -> Tuple[int, Dict[str, List]]:
+        """Return the block height and the listunspent entries of each address.
+        Uses the UTXO index if configured, otherwise one batched request filtered by address.
+        Raises JSONRPCException if an address is rejected by the node.
+        """
+        if not addresses:
+            # listunspent treats an empty address filter as no filter
+            return self.get_block_count(), {}
+        if self.utxo_index is None:
+            unique = list(dict.fromkeys(addresses))
+            block_count, unspent = self._batch(
+                [["getblockcount"], ["listunspent", 0, LISTUNSPENT_MAX_CONF, unique]]
+            )
+            if block_count is None:
+                block_count = self.get_block_count()
+            if unspent is None:
+                unspent = self._listunspent_each(unique)
+            return block_count, self._group_by_address(unspent, addresses)
+
+        index = self.utxo_index
+        block_count = self.get_block_count()
+        with index.lock:
+            generation = index.generation
+            reload = index.height != block_count
+            if reload:
+                load = list(dict.fromkeys(list(index.by_address) + addresses))
+                cached = {}
+            else:
+                cached = {a: index.by_address[a] for a in addresses if a in index.by_address}
+                load = [a for a in dict.fromkeys(addresses) if a not in cached]
+        # Query the node without holding the lock, so a slow call does not hold up other threads
+        loaded: Dict[str, List] = {}
+        if load:
+            (unspent,) = self._batch([["listunspent", 0, LISTUNSPENT_MAX_CONF, load]])
+            if unspent is None:
+                unspent = self._listunspent_each(load)
+            loaded = self._group_by_address(unspent, load)
+        with index.lock:
+            # Only store the results if the index has not changed since it was read
+            if index.generation == generation:
+                if reload:
+                    index.by_address = loaded
+                    index.height = block_count
+                    index.generation += 1
+                else:
+                    index.by_address.update(loaded)
+        cached.update(loaded)
+        return block_count, {a: cached[a] for a in addresses}
+
+    def get_utxo(self, address):
+        """Return ordered list of UTXOs for this address"""
+        return self.get_utxos([address])[0]
+
+    def get_utxos(self, addresses: List[str]) -> List[Any]:
+        """Return the ordered UTXO list of each address from one batched request"""
+        block_count, by_address = self._unspent_by_address(addresses)
+        return [self._as_utxo(by_address[address], block_count) for address in addresses]
+
     def get_balance(self, address, confirmations=6):
         """Return the confirmed and unconfirmed balance associated with this address"""
-        unspent_address = self.get_unspent(address)
+        return self.get_balances([address], confirmations)[0]
+
+    def get_balances(self, addresses: List[str], confirmations=6) -> List[Any]:
+        """Return the balance of each address from one listunspent request"""
+        _, by_address = self._unspent_by_address(addresses)
+        return [self._as_balance(by_address[address], confirmations) for address in addresses]
+
+    def _as_balance(self, unspent_address, confirmations):
+        """Sum listunspent entries into confirmed and unconfirmed satoshis"""
         confirmed = sum(
             [
                 x["amount"] if x["confirmations"] >= confirmations else 0
@@ -155,12 +392,10 @@ class RPCInterface(BlockchainInterface):
             "unconfirmed": self._as_satoshis(unconfirmed),
         }
 
-    @retry_call
     def get_block_count(self):
         """Return the block height"""
         return self.rpc_connection.getblockcount()
 
-    @retry_call
     def get_transaction(self, txid: str):
         """ Return the transaction associated with this txid
             Note that the returned format is different from that returned by WOC
@@ -168,55 +403,76 @@ class RPCInterface(BlockchainInterface):
         return self.rpc_connection.gettransaction(txid)
 
     # extra
-    @retry_call
     def get_raw_transaction(self, txid: str) -> str:
         """ Given txid return associated transaction
         """
         return self.rpc_connection.getrawtransaction(txid)
 
-    @retry_call
+    def get_raw_transactions(self, txids: List[str]) -> List[Optional[str]]:
+        """ Given many txids return the transactions from JSON-RPC batch requests.
+            Unknown txids return None.
+        """
+        return self._batch([["getrawtransaction", txid] for txid in txids])
+
+    def _batch(self, calls: List[List[Any]]) -> List[Any]:
+        """ Send `[method, params...]` calls as JSON-RPC batches of up to RPC_BATCH_LIMIT,
+            returning the results in call order, with None as the result of each failing call.
+            Only if the node rejects a batch as a whole is it resent one call at a time.
+        """
+        results: List[Any] = []
+        for start in range(0, len(calls), RPC_BATCH_LIMIT):
+            chunk = calls[start:start + RPC_BATCH_LIMIT]
+            try:
+                answers = self.rpc_connection.batch_(chunk)
+            except JSONRPCException:
+                answers = []
+                for method, *params in chunk:
+                    try:
+                        answers.append(getattr(self.rpc_connection, method)(*params))
+                    except JSONRPCException:
+                        answers.append(None)
+            results.extend(None if isinstance(answer, RPCCallError) else answer for answer in answers)
+        return results
+
     def get_tx_out(self, txid: str, txindex: int) -> Dict:
         """ Returns a dictionary describing the unspent tx out point
         """
         return self.rpc_connection.gettxout(txid, txindex)
 
-    @retry_call
     def get_best_block_hash(self) -> str:
         """ Returns the best block hash
         """
         chain_info = self._get_chain_info()
         return chain_info["bestblockhash"]
 
-    @retry_call
     def get_merkle_proof(self, block_hash: str, tx_id: str) -> str:
         """ returns the merkle proof for a tx
         """
 
         return self.rpc_connection.gettxoutproof([tx_id], block_hash)
 
+    def _invalidate_utxo_index(self):
+        """ Reload the UTXO index on the next query, after a call that changed the node's UTXO set.
+            Called once the call has returned, so that a concurrent query can not reload the old state.
+        """
+        if self.utxo_index is not None:
+            self.utxo_index.invalidate()
+
     def broadcast_tx(self, hexstring: str):
-        for _ in range(5):
-            try:
-                message = self.rpc_connection.sendrawtransaction(hexstring)
-                api_return = RPCReturnInfo(message)
-                api_return.status_code = 200
-                return api_return
-            except JSONRPCException as err:
-                api_return = RPCReturnInfo(err.message)
-                api_return.status_code = err.code
-                return api_return
-            except BrokenPipeError as err:
-                print(f"BrokenPipeError: {err}")
-                time.sleep(0.25)
-            except (
-                ConnectionError,
-                ConnectionRefusedError,
-                ConnectionAbortedError,
-                ConnectionResetError,
-                CannotSendRequest
-            ) as err:
-                print(f"ConnectionError: {err}")
-                time.sleep(0.25)
+        try:
+            message = self.rpc_connection.sendrawtransaction(hexstring)
+        except JSONRPCException as err:
+            api_return = RPCReturnInfo(err.message)
+            api_return.status_code = err.code
+            return api_return
+        except RETRYABLE_ERRORS as err:
+            LOGGER.error(f"Broadcast failed: {err!r}")
+            return None
+        finally:
+            self._invalidate_utxo_index()
+        api_return = RPCReturnInfo(message)
+        api_return.status_code = 200
+        return api_return
 
     def get_block_hash(self, index: int) -> str:
         """Given a block index return the block hash"""
@@ -227,19 +483,16 @@ class RPCInterface(BlockchainInterface):
         return self.rpc_connection.getblock(hash)
 
     # Comands used in regtest container
-    @retry_call
     def get_info(self):
         """ Return information about the mining node
         """
         return self.rpc_connection.getinfo()
 
-    @retry_call
     def get_mining_info(self):
         """ Return mining information
         """
         return self.rpc_connection.getmininginfo()
 
-    @retry_call
     def get_wallet_info(self):
         """ Return mining wallet information
         """
@@ -250,10 +503,16 @@ class RPCInterface(BlockchainInterface):
 
     def generate_to_address(self, addr: str, amount=101):
         """Generate blocks and pay them to this account"""
-        return self.rpc_connection.generatetoaddress(amount, addr)
+        try:
+            return self.rpc_connection.generatetoaddress(amount, addr)
+        finally:
+            self._invalidate_utxo_index()
 
     def send_to_address(self, addr: str, amount=5):
-        return self.rpc_connection.sendtoaddress(addr, amount)
+        try:
+            return self.rpc_connection.sendtoaddress(addr, amount)
+        finally:
+            self._invalidate_utxo_index()
 
     def list_accounts(self):
         # listaccounts will be removed from api
@@ -263,7 +522,6 @@ class RPCInterface(BlockchainInterface):
     def import_address(self, address: str):
         return self.rpc_connection.importaddress(address)
 
-    @retry_call
     def get_raw_mempool(self):
         """ Return the mempool
         """
@@ -272,15 +530,16 @@ class RPCInterface(BlockchainInterface):
     def generate_blocks(self, n=1):
         """ Generate n blocks
         """
-        return self.rpc_connection.generate(n)
+        try:
+            return self.rpc_connection.generate(n)
+        finally:
+            self._invalidate_utxo_index()
 
-    @retry_call
     def get_block_header(self, block_hash: str):
         """ Given the block hash return the associated block header
         """
         return self.rpc_connection.getblockheader(block_hash)
 
-    @retry_call
     def verifyscript(self, scripts: List[Any], stop_on_first_invalid: bool = True, timeout: int = 100) -> List[Any]:
         """ Verify the provided script, based on provided context
         """
@@ -0,0 +1,417 @@
+""" Stateful in-process chain simulator for offline and load tests
+"""
+import random
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .blockchain_interface import ConfigType
+from .mock_interface import MockInterface
+from tx_engine import Tx, TxIn, TxOut, Script, hash256d, p2pkh_script, address_to_public_key_hash, public_key_hashes_to_addresses
+
+# Defaults for the simulator config keys
+DEFAULT_BLOCK_REWARD = 50 * 100_000_000
+DEFAULT_BLOCK_INTERVAL = 600
+
+# Header fields of simulated blocks; bits is the regtest minimum difficulty and no proof of work is done
+BLOCK_VERSION = 0x20000000
+BLOCK_BITS = 0x207FFFFF
+GENESIS_TIME = 1_700_000_000
+
+COINBASE_PREV_TX = "00" * 32
+COINBASE_PREV_INDEX = 0xFFFFFFFF
+
+
+def merkle_root(hashes: List[bytes]) -> bytes:
+    """ Return the merkle root of transaction hashes (internal byte order)
+    """
+    if not hashes:
+        return bytes(32)
+    level = list(hashes)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hash256d(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def merkle_branch(hashes: List[bytes], index: int) -> List[Optional[bytes]]:
+    """ Return the sibling hashes from leaf `index` to the root; None where a node is paired with itself
+    """
+    branch: List[Optional[bytes]] = []
+    level = list(hashes)
+    while len(level) > 1:
+        sibling = index ^ 1
+        branch.append(level[sibling] if sibling < len(level) else None)
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hash256d(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+        index //= 2
+    return branch
+
+
+class SimulatorInterface(MockInterface):
+    """ A MockInterface that simulates a chain.
+
+        Broadcast transactions are checked against the UTXO set and with `Tx.validate`, then held
+        in a mempool until `mine_block()` includes them in a block with a coinbase, merkle root and
+        header. All BlockchainInterface methods answer from this state and are thread safe.
+
+        `latency` (seconds, or a (min, max) range) is added to every call and `failure_rate` is
+        the probability that a call raises ConnectionError, so clients can be load tested offline.
+        Only P2PKH outputs are indexed by address. Coinbase maturity and proof of work are not simulated.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.network = "BSV_Testnet"
+        self.block_reward = DEFAULT_BLOCK_REWARD
+        self.block_interval = DEFAULT_BLOCK_INTERVAL
+        self.latency: Tuple[float, float] = (0.0, 0.0)
+        self.failure_rate = 0.0
+        self.random = random.Random()
+        # txid -> hex of every accepted transaction
+        self.txs: Dict[str, str] = {}
+        # txid -> hash of the block that includes it
+        self.tx_block: Dict[str, str] = {}
+        self.mempool: OrderedDict[str, Tx] = OrderedDict()
+        # txid -> fee of each mempool transaction
+        self.fees: Dict[str, int] = {}
+        # (txid, index) -> {"address", "value", "script", "height"}, height 0 while in the mempool
+        self.utxo_set: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        # address -> outpoints in the UTXO set paying to it
+        self.address_utxo: Dict[str, Dict[Tuple[str, int], None]] = {}
+        # address -> txids of transactions paying to or spending from it
+        self.history: Dict[str, List[str]] = {}
+        self.blocks: List[Dict[str, Any]] = []
+        self.block_index: Dict[str, int] = {}
+        self.lock = threading.RLock()
+        self._mine(None)
+
+    def set_config(self, config: ConfigType):
+        """ `network_type`, `block_reward` (satoshis), `latency` (seconds or [min, max]),
+            `failure_rate` (0 to 1) and `seed` configure the simulator.
+        """
+        self.network = "BSV_Mainnet" if config.get("network_type") == "mainnet" else "BSV_Testnet"
+        self.block_reward = int(config.get("block_reward", DEFAULT_BLOCK_REWARD))
+        self.set_latency(config.get("latency", 0.0))
+        self.failure_rate = float(config.get("failure_rate", 0.0))
+        if "seed" in config:
+            self.random.seed(config["seed"])
+
+    def set_latency(self, latency):
+        """ Set the delay added to each call, in seconds or as a (min, max) range
+        """
+        if isinstance(latency, (int, float)):
+            self.latency = (float(latency), float(latency))
+        else:
+            low, high = latency
+            self.latency = (float(low), float(high))
+
+    def _simulate(self):
+        low, high = self.latency
+        if high > 0:
+            time.sleep(self.random.uniform(low, high))
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise ConnectionError("Simulated connection failure")
+
+    def _address(self, script: Script) -> Optional[str]:
+        if not script.is_p2pkh():
+            return None
+        return public_key_hashes_to_addresses(script.raw_serialize()[3:23], self.network)[0]
+
+    def _add_outputs(self, tx: Tx, txid: str, height: int):
+        for index, tx_out in enumerate(tx.tx_outs):
+            address = self._address(tx_out.script_pubkey)
+            self.utxo_set[(txid, index)] = {
+                "address": address,
+                "value": tx_out.amount,
+                "script": tx_out.script_pubkey.raw_serialize().hex(),
+                "height": height,
+            }
+            if address is not None:
+                self.address_utxo.setdefault(address, {})[(txid, index)] = None
+                self.history.setdefault(address, []).append(txid)
+
+    def _spend(self, outpoint: Tuple[str, int], txid: str):
+        address = self.utxo_set.pop(outpoint)["address"]
+        if address is not None:
+            del self.address_utxo[address][outpoint]
+            self.history.setdefault(address, []).append(txid)
+
+    # Simulator control
+    def mine_block(self, address: Optional[str] = None) -> str:
+        """ Mine a block holding the mempool transactions, paying the reward and fees to `address`
+            if given. Without an address the block has no coinbase and its fees are not paid
+            to anyone. Returns the block hash.
+        """
+        with self.lock:
+            return self._mine(address)
+
+    def generate_blocks(self, n: int = 1, address: Optional[str] = None) -> List[str]:
+        """ Mine n blocks, returning their hashes
+        """
+        with self.lock:
+            return [self._mine(address) for _ in range(n)]
+
+    def _mine(self, address: Optional[str]) -> str:
+        height = len(self.blocks)
+        txids = list(self.mempool)
+        hashes = [tx.hash() for tx in self.mempool.values()]
+
+        if address is not None:
+            fees = sum(self.fees.values())
+            script_sig = Script()
+            script_sig.append_pushdata(height.to_bytes(4, "little"))
+            coinbase = Tx(
+                version=1,
+                tx_ins=[TxIn(prev_tx=COINBASE_PREV_TX, prev_index=COINBASE_PREV_INDEX, script=script_sig)],
+                tx_outs=[TxOut(amount=self.block_reward + fees, script_pubkey=p2pkh_script(address_to_public_key_hash(address)))],
+                locktime=0,
+            )
+            coinbase_id = coinbase.id()
+            self.txs[coinbase_id] = coinbase.to_hexstr()
+            self._add_outputs(coinbase, coinbase_id, height)
+            txids.insert(0, coinbase_id)
+            hashes.insert(0, coinbase.hash())
+
+        root = merkle_root(hashes)
+        prev_hash = self.blocks[-1]["hash"] if self.blocks else "00" * 32
+        block_time = GENESIS_TIME + height * self.block_interval
+        header = struct.pack("<I", BLOCK_VERSION) + bytes.fromhex(prev_hash)[::-1] + root
+        header += struct.pack("<III", block_time, BLOCK_BITS, 0)
+        block_hash = hash256d(header)[::-1].hex()
+
+        for txid in txids:
+            self.tx_block[txid] = block_hash
+        for txid, tx in self.mempool.items():
+            for index in range(len(tx.tx_outs)):
+                if (txid, index) in self.utxo_set:
+                    self.utxo_set[(txid, index)]["height"] = height
+        self.mempool.clear()
+        self.fees.clear()
+
+        self.blocks.append({
+            "hash": block_hash,
+            "height": height,
+            "version": BLOCK_VERSION,
+            "merkleroot": root[::-1].hex(),
+            "time": block_time,
+            "bits": f"{BLOCK_BITS:08x}",
+            "nonce": 0,
+            "previousblockhash": prev_hash,
+            "header": header.hex(),
+            "tx": txids,
+            "hashes": hashes,
+        })
+        self.block_index[block_hash] = height
+        self.block_count = height
+        return block_hash
+
+    # Normal client methods
+    def broadcast_tx(self, tx: str):
+        """ Validate the transaction against the UTXO set and add it to the mempool.
+            Returns the txid, raises ValueError if the transaction is rejected.
+        """
+        self._simulate()
+        parsed = Tx.parse_hexstr(tx)
+        txid = parsed.id()
+        with self.lock:
+            if txid in self.txs:
+                return txid
+            if parsed.is_coinbase():
+                raise ValueError(f"Transaction {txid} rejected: coinbase transactions can not be broadcast")
+
+            spent = [(tx_in.prev_tx, tx_in.prev_index) for tx_in in parsed.tx_ins]
+            if len(set(spent)) != len(spent):
+                raise ValueError(f"Transaction {txid} rejected: duplicate inputs")
+            missing = [outpoint for outpoint in spent if outpoint not in self.utxo_set]
+            if missing:
+                raise ValueError(f"Transaction {txid} rejected: missing or spent inputs {missing}")
+
+            inputs = [Tx.parse_hexstr(self.txs[prev_txid]) for prev_txid in dict.fromkeys(o[0] for o in spent)]
+            try:
+                parsed.validate(inputs)
+            except (RuntimeError, ValueError) as e:
+                raise ValueError(f"Transaction {txid} rejected: {e}") from None
+            value_in = sum(self.utxo_set[outpoint]["value"] for outpoint in spent)
+            if value_in < sum(tx_out.amount for tx_out in parsed.tx_outs):
+                raise ValueError(f"Transaction {txid} rejected: outputs exceed inputs")
+
+            for outpoint in spent:
+                self._spend(outpoint, txid)
+            self._add_outputs(parsed, txid, 0)
+            self.mempool[txid] = parsed
+            self.fees[txid] = value_in - sum(tx_out.amount for tx_out in parsed.tx_outs)
+            self.txs[txid] = tx
+            self.broadcast[txid] = tx
+        return txid
+
+    def get_raw_transaction(self, txid: str) -> Optional[str]:
+        self._simulate()
+        with self.lock:
+            return self.txs.get(txid, self.transactions.get(txid))
+
+    def get_raw_transactions(self, txids: List[str]) -> List[Optional[str]]:
+        self._simulate()
+        with self.lock:
+            return [self.txs.get(txid, self.transactions.get(txid)) for txid in txids]
+
+    def _confirmations(self, height: int) -> int:
+        return 0 if height == 0 else len(self.blocks) - height
+
+    def get_transaction(self, txid: str) -> Dict:
+        self._simulate()
+        with self.lock:
+            if txid not in self.txs:
+                raise ValueError(f"Unknown transaction {txid}")
+            result: Dict[str, Any] = {"txid": txid, "hex": self.txs[txid], "confirmations": 0}
+            block_hash = self.tx_block.get(txid)
+            if block_hash is not None:
+                height = self.block_index[block_hash]
+                result.update({
+                    "blockhash": block_hash,
+                    "blockheight": height,
+                    "blocktime": self.blocks[height]["time"],
+                    "confirmations": self._confirmations(height),
+                })
+            return result
+
+    def _utxo_of(self, address: str) -> List[Dict[str, Any]]:
+        utxo = [
+            {"height": self.utxo_set[(txid, index)]["height"], "tx_pos": index, "tx_hash": txid, "value": self.utxo_set[(txid, index)]["value"]}
+            for txid, index in self.address_utxo.get(address, {})
+        ]
+        utxo.sort(key=lambda x: x["height"] or len(self.blocks))
+        return utxo
+
+    def get_utxo(self, address: str) -> List:
+        self._simulate()
+        with self.lock:
+            return self._utxo_of(address)
+
+    def get_utxos(self, addresses: List[str]) -> List[List]:
+        self._simulate()
+        with self.lock:
+            return [self._utxo_of(address) for address in addresses]
+
+    def _balance_of(self, address: str) -> Dict[str, int]:
+        utxo = self._utxo_of(address)
+        return {
+            "confirmed": sum(x["value"] for x in utxo if x["height"] > 0),
+            "unconfirmed": sum(x["value"] for x in utxo if x["height"] == 0),
+        }
+
+    def get_balance(self, address: str):  # type: ignore[override]
+        self._simulate()
+        with self.lock:
+            return self._balance_of(address)
+
+    def get_balances(self, addresses: List[str]):  # type: ignore[override]
+        self._simulate()
+        with self.lock:
+            return [self._balance_of(address) for address in addresses]
+
+    def get_addr_history(self, address):
+        self._simulate()
+        with self.lock:
+            return [
+                {"tx_hash": txid, "height": self.block_index[self.tx_block[txid]] if txid in self.tx_block else 0}
+                for txid in dict.fromkeys(self.history.get(address, []))
+            ]
+
+    def get_block_count(self) -> int:
+        self._simulate()
+        with self.lock:
+            return len(self.blocks) - 1
+
+    def get_best_block_hash(self) -> str:
+        self._simulate()
+        with self.lock:
+            return self.blocks[-1]["hash"]
+
+    def get_tx_out(self, txid: str, txindex: int) -> Dict:
+        """ Return the unspent output in the format of the node gettxout call, or None if spent or unknown
+        """
+        self._simulate()
+        with self.lock:
+            entry = self.utxo_set.get((txid, txindex))
+            if entry is None:
+                return None  # type: ignore[return-value]
+            return {
+                "bestblock": self.blocks[-1]["hash"],
+                "confirmations": self._confirmations(entry["height"]),
+                "value": entry["value"] / 100_000_000,
+                "scriptPubKey": {"hex": entry["script"], "addresses": [entry["address"]] if entry["address"] else []},
+                "coinbase": Tx.parse_hexstr(self.txs[txid]).is_coinbase(),
+            }
+
+    def _block(self, block_hash: str) -> Dict[str, Any]:
+        if block_hash not in self.block_index:
+            raise ValueError(f"Unknown block {block_hash}")
+        return self.blocks[self.block_index[block_hash]]
+
+    def get_block(self, blockhash: str) -> Dict:
+        self._simulate()
+        with self.lock:
+            block = self._block(blockhash)
+            result = {k: v for k, v in block.items() if k != "hashes"}
+            result["tx"] = list(block["tx"])
+            result["confirmations"] = len(self.blocks) - block["height"]
+            return result
+
+    def get_block_header(self, block_hash: str) -> Dict:
+        self._simulate()
+        with self.lock:
+            block = self._block(block_hash)
+            result = {k: v for k, v in block.items() if k not in ("hashes", "tx")}
+            result["num_tx"] = len(block["tx"])
+            result["confirmations"] = len(self.blocks) - block["height"]
+            return result
+
+    def get_merkle_proof(self, block_hash: str, tx_id: str) -> Dict:
+        """ Return the merkle proof of a mined transaction in TSC format, with "*" for duplicated nodes
+        """
+        self._simulate()
+        with self.lock:
+            block = self._block(block_hash)
+            if tx_id not in block["tx"]:
+                raise ValueError(f"Transaction {tx_id} is not in block {block_hash}")
+            index = block["tx"].index(tx_id)
+            nodes = merkle_branch(block["hashes"], index)
+            return {
+                "index": index,
+                "txOrId": tx_id,
+                "target": block_hash,
+                "nodes": ["*" if node is None else node[::-1].hex() for node in nodes],
+            }
+
+    def verifyscript(self, scripts: list, stop_on_first_invalid: bool = True, timeout: int = 100) -> List[Any]:
+        """ Verify the inputs given as {"tx": hex, "n": index} against known transactions,
+            answering in the format of the node verifyscript call
+        """
+        self._simulate()
+        results: List[Any] = []
+        for script in scripts:
+            if stop_on_first_invalid and results and results[-1]["result"] != "ok":
+                results.append({"result": "skipped"})
+                continue
+            tx = Tx.parse_hexstr(script["tx"])
+            with self.lock:
+                prev_txids = dict.fromkeys(tx_in.prev_tx for tx_in in tx.tx_ins)
+                unknown = [txid for txid in prev_txids if txid not in self.txs]
+                inputs = [Tx.parse_hexstr(self.txs[txid]) for txid in prev_txids if txid in self.txs]
+            if unknown:
+                results.append({"result": "error", "description": f"Unknown inputs {unknown}"})
+                continue
+            try:
+                tx.validate(inputs)
+                results.append({"result": "ok"})
+            except (RuntimeError, ValueError) as e:
+                results.append({"result": "error", "description": str(e)})
+        return results
+
+    def is_testnet(self) -> bool:
+        return self.network == "BSV_Testnet"
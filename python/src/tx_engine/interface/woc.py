@@ -1,13 +1,44 @@
 """ What's on Chain interface
 """
 import logging
+import random
+import threading
 import time
-from typing import Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from .instrumentation import record_bytes, record_error, record_retry
+from .rate_limit import CircuitBreaker, RateLimiter
 
 
 LOGGER = logging.getLogger(__name__)
 
+T = TypeVar("T")
+R = TypeVar("R")
+
+# HTTP responses worth retrying
+TRANSIENT_STATUS = {429, 502, 503, 504}
+
+# Maximum number of txids or addresses accepted by one WoC bulk request
+WOC_BULK_LIMIT = 20
+
+# Requests per second allowed by each WoC plan
+WOC_PLAN_RATES = {
+    "free": 3.0,
+    "starter": 10.0,
+    "pro": 20.0,
+    "premium": 40.0,
+}
+
+# Backoff between retries of failed requests doubles from RETRY_BACKOFF seconds up to RETRY_MAX_BACKOFF
+RETRY_BACKOFF = 0.5
+RETRY_MAX_BACKOFF = 8.0
+
 
 def get_url(testnet: bool = True) -> str:
     """ Based on the network return the URL string
@@ -17,122 +48,428 @@ def get_url(testnet: bool = True) -> str:
     return "https://api.whatsonchain.com/v1/bsv/main"
 
 
-def get_response(url: str, max_retries: int = 5):
-    """This is the guts of all the WoC requests.
+# Limiters are shared per plan and circuit breakers per network by every client in the process
+_LIMITERS: Dict[str, RateLimiter] = {}
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def get_limiter(plan: str = "free") -> RateLimiter:
+    """ Return the process wide rate limiter for the WoC plan
+    """
+    if plan not in WOC_PLAN_RATES:
+        raise ValueError(f"Unknown WoC plan '{plan}', expected one of {list(WOC_PLAN_RATES)}")
+    with _SHARED_LOCK:
+        if plan not in _LIMITERS:
+            _LIMITERS[plan] = RateLimiter(WOC_PLAN_RATES[plan])
+        return _LIMITERS[plan]
+
 
-    Retries on connection errors and transient HTTP responses (429/502/503/504).
+def get_breaker(base_url: str) -> CircuitBreaker:
+    """ Return the process wide circuit breaker for the WoC url
     """
-    transient_status = {429, 502, 503, 504}
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(url, timeout=30)
-        except (ConnectionError, requests.Timeout) as e:
-            LOGGER.warning(f"WoC request error for {url}: {e}")
-            if attempt + 1 >= max_retries:
-                return None
-            time.sleep(1 + attempt)
-            continue
-
-        if response.status_code == 200:
+    with _SHARED_LOCK:
+        if base_url not in _BREAKERS:
+            _BREAKERS[base_url] = CircuitBreaker()
+        return _BREAKERS[base_url]
+
+
+def never_sent(error: requests.RequestException) -> bool:
+    """ Return True if the request failed before any of it reached the server
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """ Return the Retry-After header of the response in seconds, if present
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class WoCClient:
+    """ WhatsOnChain client sharing one pooled keep-alive session.
+
+        Every endpoint goes through `request()`, which retries connection errors, timeouts and
+        transient HTTP responses. Requests wait on a `RateLimiter` shared by every client on the
+        same WoC plan, which backs off on 429 responses, and fail fast while the network's
+        `CircuitBreaker` is open. `map()` fans a lookup out over a bounded thread pool.
+        The client is thread safe.
+
+        Requests that are not idempotent, such as broadcasts, are only retried when the server
+        cannot have seen them: when the connection could not be made or the server answered 429.
+    """
+
+    def __init__(
+        self,
+        testnet: bool = True,
+        max_workers: int = 8,
+        max_retries: int = 5,
+        timeout: float = 30.0,
+        plan: str = "free",
+        api_key: Optional[str] = None,
+        limiter: Optional[RateLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.base_url = get_url(testnet)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.limiter = limiter if limiter is not None else get_limiter(plan)
+        self.breaker = breaker if breaker is not None else get_breaker(self.base_url)
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers["Authorization"] = api_key
+        # One keep-alive connection per worker, no urllib3 level retries (handled in request())
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Marks the pool's worker threads
+        self._local = threading.local()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[Any] = None,
+        max_retries: Optional[int] = None,
+        idempotent: bool = True,
+    ) -> Optional[requests.Response]:
+        """ Send a request to `base_url + path` (or to `path` if it is an absolute url), retrying
+            connection errors and transient responses. If the request is not `idempotent`, only
+            failures to connect and 429 responses are retried.
+
+            Returns the last response received, or None if no response could be obtained or the
+            circuit breaker is open.
+        """
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        max_retries = self.max_retries if max_retries is None else max_retries
+        response = None
+        for attempt in range(max_retries):
+            if attempt > 0:
+                record_retry()
+            if not self.breaker.allow():
+                LOGGER.warning(f"WoC circuit open, not sending {url}")
+                record_error("CircuitOpen")
+                return response
+            self.limiter.acquire()
+            try:
+                response = self.session.request(method, url, json=body, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                LOGGER.warning(f"WoC request error for {url}: {e}")
+                self.breaker.record_failure()
+                if attempt + 1 >= max_retries or not (idempotent or never_sent(e)):
+                    record_error(type(e).__name__)
+                    return None
+                self._backoff(attempt)
+                continue
+            except BaseException:
+                # Any other error still ends a half open trial, or the circuit would stay shut
+                self.breaker.record_failure()
+                raise
+            request_body = response.request.body
+            record_bytes(len(request_body) if request_body else 0, len(response.content))
+
+            if response.status_code == 429:
+                # Throttling means WoC is up
+                self.breaker.record_success()
+                self.limiter.throttled(retry_after_seconds(response))
+            elif response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+                self.limiter.succeeded()
+
+            retry = response.status_code in TRANSIENT_STATUS if idempotent else response.status_code == 429
+            if retry and attempt + 1 < max_retries:
+                LOGGER.warning(
+                    f"WoC HTTP {response.status_code} for {url}, retrying "
+                    f"({attempt + 1}/{max_retries})"
+                )
+                if response.status_code != 429:
+                    # The limiter already pauses callers after a 429
+                    self._backoff(attempt)
+                continue
+            break
+        if response is not None and response.status_code >= 400:
+            record_error(f"HTTP {response.status_code}")
+        return response
+
+    def _backoff(self, attempt: int):
+        """ Sleep for an exponentially growing, jittered period
+        """
+        time.sleep(min(RETRY_BACKOFF * 2 ** attempt, RETRY_MAX_BACKOFF) * random.uniform(0.5, 1.0))
+
+    def stats(self) -> Dict[str, Any]:
+        """ Return the rate limiter counters and the circuit breaker state
+        """
+        stats = self.limiter.stats()
+        stats["circuit"] = self.breaker.stats()
+        return stats
+
+    def get_json(self, path: str, max_retries: Optional[int] = None) -> Any:
+        """ GET `path` and return the decoded JSON, or None on failure
+        """
+        response = self.request("GET", path, max_retries=max_retries)
+        if response is not None and response.status_code == 200:
             data = response.json()
             LOGGER.debug(f"data = {data}")
             return data
+        LOGGER.debug(f"response = {response}")
+        return None
 
-        if response.status_code in transient_status and attempt + 1 < max_retries:
-            LOGGER.warning(
-                f"WoC HTTP {response.status_code} for {url}, retrying "
-                f"({attempt + 1}/{max_retries})"
-            )
-            time.sleep(1 + attempt)
-            continue
+    def post_json(self, path: str, body: Any) -> Any:
+        """ POST `body` as JSON to `path` and return the decoded JSON, or None on failure
+        """
+        response = self.request("POST", path, body)
+        if response is not None and response.status_code == 200:
+            return response.json()
+        LOGGER.debug(f"response = {response}")
+        return None
 
+    def get_text(self, path: str) -> Optional[str]:
+        """ GET `path` and return the response body, or None on failure
+        """
+        response = self.request("GET", path)
+        if response is not None and response.status_code == 200:
+            LOGGER.debug(f"data = {response.text}")
+            return response.text
         LOGGER.debug(f"response = {response}")
         return None
 
-    return None
+    def map(self, fn: Callable[[T], R], items: Iterable[T]) -> List[R]:
+        """ Apply `fn` to every item using at most `max_workers` concurrent requests.
+            Results are returned in input order.
+            Calls made from a worker thread, such as a nested `map` or `bulk`, run inline, as
+            waiting on the pool from inside it could use up every worker and deadlock.
+        """
+        items = list(items)
+        if len(items) <= 1 or getattr(self._local, "worker", False):
+            return [fn(item) for item in items]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="woc")
+            executor = self._executor
+
+        def run(context, item):
+            self._local.worker = True
+            return context.run(fn, item)
+
+        # Run each item in a copy of the caller's context so instrumentation is attributed to the calling method
+        contexts = [copy_context() for _ in items]
+        return list(executor.map(run, contexts, items))
+
+    def bulk(self, path: str, key: str, items: List[str], item_key: str, value_key: str) -> List[Any]:
+        """ POST `items` to a WoC bulk endpoint as `{key: [...]}` in chunks of `WOC_BULK_LIMIT`,
+            fanned out over the pool.
+
+            Returns the `value_key` field of the result for each item, in input order, or None for
+            items the endpoint reported an error for or that were in a failed request.
+        """
+        unique = list(dict.fromkeys(items))
+        chunks = [unique[i:i + WOC_BULK_LIMIT] for i in range(0, len(unique), WOC_BULK_LIMIT)]
+        found: Dict[str, Any] = {}
+        for results in self.map(lambda chunk: self.post_json(path, {key: chunk}), chunks):
+            for entry in results or []:
+                if not entry.get("error") and value_key in entry:
+                    found[entry[item_key]] = entry[value_key]
+        return [found.get(item) for item in items]
+
+    def close(self):
+        """ Close the pooled connections and worker threads
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self.session.close()
+
+    # Endpoints
+    def get_unspent_transactions(self, address: str):
+        """Return the unspent transations associated with this address"""
+        return self.get_json(f"/address/{address}/unspent")
+
+    def get_last_unspent(self, address: str):
+        """Return (tx_hash, tx_pos, value) of the last unspent output of this address"""
+        data = self.get_unspent_transactions(address)
+        if not data:
+            return (None, 0, 0)
+        return (data[-1]["tx_hash"], data[-1]["tx_pos"], data[-1]["value"])
+
+    def get_unspent_transactions_bulk(self, addresses: List[str]) -> List[Any]:
+        """Return the unspent transactions of each address, in input order"""
+        return self.bulk("/addresses/unspent", "addresses", addresses, "address", "unspent")
+
+    def get_transaction(self, tx_id: str):
+        """Return the transaction associated with this txid"""
+        return self.get_json(f"/tx/hash/{tx_id}")
+
+    def get_raw_transaction(self, tx_id: str) -> Optional[str]:
+        """Return the raw transaction associated with this txid"""
+        return self.get_text(f"/tx/{tx_id}/hex")
+
+    def get_raw_transactions(self, tx_ids: List[str]) -> List[Optional[str]]:
+        """Return the raw transaction of each txid, in input order"""
+        return self.bulk("/txs/hex", "txids", tx_ids, "txid", "hex")
+
+    def get_address(self, address: str):
+        """Return the data associated with this address"""
+        return self.get_json(f"/address/{address}/info")
+
+    def get_history(self, address: str):
+        """Return the transaction history associated with this address"""
+        return self.get_json(f"/address/{address}/history")
+
+    def get_balance(self, address: str):
+        """Return the balance associated with this address"""
+        return self.get_json(f"/address/{address}/balance")
+
+    def get_balances(self, addresses: List[str]) -> List[Any]:
+        """Return the balance of each address, in input order"""
+        return self.bulk("/addresses/balance", "addresses", addresses, "address", "balance")
+
+    def get_chain_info(self):
+        """This endpoint retrieves information about the state of the chain for the selected network."""
+        return self.get_json("/chain/info")
+
+    def get_merkle_proof(self, tx_id: str):
+        """ This endpoint retrieves the merkle tree info for a given confirmed tx
+        """
+        return self.get_json(f"/tx/{tx_id}/proof/tsc")
+
+    def broadcast_tx(self, transaction: str) -> requests.Response:
+        """ Broadcast the transaction, return the response (txid or error message).
+
+            Raises requests.ConnectionError if no response was received. The broadcast is only resent if
+            the server cannot have received it.
+        """
+        response = self.request("POST", "/tx/raw", {"txhex": transaction}, idempotent=False)
+        if response is None:
+            raise requests.ConnectionError(f"No response to transaction broadcast from {self.base_url}")
+        return response
+
+    def get_block_by_hash(self, block_hash: str):
+        """ Get a block by hash
+        """
+        return self.get_json(f"/block/hash/{block_hash}")
+
+    def get_block_header(self, block_hash: str) -> Dict:
+        """ Get a blockheader by hash
+        """
+        return self.get_json(f"/block/{block_hash}/header")
+
+
+# Shared clients, one per network, so module level calls reuse pooled connections
+_CLIENTS: Dict[bool, WoCClient] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(testnet: bool = True) -> WoCClient:
+    """ Return the shared client for the network
+    """
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(testnet)
+        if client is None:
+            client = WoCClient(testnet)
+            _CLIENTS[testnet] = client
+        return client
+
+
+def get_response(url: str, max_retries: int = 5):
+    """ GET an absolute WoC url through the shared client and return the decoded JSON,
+        or None on failure.
+    """
+    return get_client(url.startswith(get_url(True))).get_json(url, max_retries)
 
 
 def get_unspent_transactions(address: str, testnet: bool = True):
     """Return the unspent transations associated with this address"""
-    return get_response(f"{get_url(testnet)}/address/{address}/unspent")
+    return get_client(testnet).get_unspent_transactions(address)
 
 
 def get_last_unspent(address: str, testnet: bool = True):
     """Return the unspent transations associated with this address"""
-    tx_hash = None
-    tx_pos = 0
-    value = 0
-    url = "{}/address/{}/unspent".format(get_url(testnet), address)
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        LOGGER.debug(f"data = {data}")
-        tx_hash = data[-1]["tx_hash"]
-        tx_pos = data[-1]["tx_pos"]
-        value = data[-1]["value"]
-    else:
-        LOGGER.info(f"response = {response}")
-    return (tx_hash, tx_pos, value)
+    return get_client(testnet).get_last_unspent(address)
+
+
+def get_unspent_transactions_bulk(addresses: List[str], testnet: bool = True) -> List[Any]:
+    """Return the unspent transactions of each address, in input order"""
+    return get_client(testnet).get_unspent_transactions_bulk(addresses)
 
 
 def get_transaction(tx_id: str, testnet: bool = True):
     """Return the transaction associated with this txid"""
-    return get_response(f"{get_url(testnet)}/tx/hash/{tx_id}")
+    return get_client(testnet).get_transaction(tx_id)
 
 
 def get_raw_transaction(tx_id: str, testnet: bool = True) -> Optional[str]:
     """Return the raw transaction associated with this txid"""
-    data = None
-    response = requests.get(f"{get_url(testnet)}/tx/{tx_id}/hex")
-    if response.status_code == 200:
-        data = response.text
-        LOGGER.debug(f"data = {data}")
-    else:
-        LOGGER.debug(f"response = {response}")
-    return data
+    return get_client(testnet).get_raw_transaction(tx_id)
+
+
+def get_raw_transactions(tx_ids: List[str], testnet: bool = True) -> List[Optional[str]]:
+    """Return the raw transaction of each txid, in input order"""
+    return get_client(testnet).get_raw_transactions(tx_ids)
 
 
 def get_address(address: str, testnet: bool = True):
     """Return the data associated with this address"""
-    return get_response(f"{get_url(testnet)}/address/{address}/info")
+    return get_client(testnet).get_address(address)
 
 
 def get_history(address: str, testnet: bool = True):
     """Return the transaction history associated with this address"""
-    return get_response(f"{get_url(testnet)}/address/{address}/history")
+    return get_client(testnet).get_history(address)
 
 
 def get_balance(address: str, testnet: bool = True):
     """Return the balance associated with this address"""
-    return get_response(f"{get_url(testnet)}/address/{address}/balance")
+    return get_client(testnet).get_balance(address)
+
+
+def get_balances(addresses: List[str], testnet: bool = True) -> List[Any]:
+    """Return the balance of each address, in input order"""
+    return get_client(testnet).get_balances(addresses)
 
 
 def get_chain_info(testnet: bool = True):
     """This endpoint retrieves information about the state of the chain for the selected network."""
-    return get_response(f"{get_url(testnet)}/chain/info")
+    return get_client(testnet).get_chain_info()
 
 
 def get_merkle_proof(tx_id: str, testnet: bool = True):
     """ This endpoint retrieves the merkle tree info for a given confirmed tx
     """
-    return get_response(f"{get_url(testnet)}/tx/{tx_id}/proof/tsc")
+    return get_client(testnet).get_merkle_proof(tx_id)
 
 
 def broadcast_tx(transaction: str, testnet: bool = True):
     """ Broadcast the transaction, return the txid or error message.
     """
-    data = '{"txhex":"' + transaction + '"}'
-    url = f"{get_url(testnet)}/tx/raw"
-    return requests.post(url, data=data)
+    return get_client(testnet).broadcast_tx(transaction)
 
 
 def get_block_by_hash(block_hash: str, testnet: bool = True):
     """ Get a block by hash
     """
-    return get_response(f"{get_url(testnet)}/block/hash/{block_hash}")
+    return get_client(testnet).get_block_by_hash(block_hash)
 
 
 def get_block_header(block_hash: str, testnet: bool = True) -> Dict:
     """ Get a blockheader by hash
     """
-    return get_response(f"{get_url(testnet)}/block/{block_hash}/header")
+    return get_client(testnet).get_block_header(block_hash)
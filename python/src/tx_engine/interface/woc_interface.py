@@ -16,11 +16,15 @@ class WoCInterface(BlockchainInterface):
     def __init__(self):
         """ Initial setup
         """
-        self.rawtx_cache = {}
         self.network_type = None
+        self.client: Optional[woc.WoCClient] = None
 
     def set_config(self, config):
         """ Set the network configuration
+
+            Interfaces share one pooled client per network unless any of `woc_max_workers`,
+            `woc_max_retries`, `woc_timeout`, `woc_plan` or `woc_api_key` are configured.
+            All clients on the same plan share one rate limiter.
         """
         if config["network_type"] == "testnet":
             self.network_type = "test"
@@ -30,6 +34,26 @@ class WoCInterface(BlockchainInterface):
             LOGGER.warning("No address type specified Setting the network type to test")
             self.network_type = "test"
 
+        client_options = {
+            option: config[key]
+            for key, option in (
+                ("woc_max_workers", "max_workers"),
+                ("woc_max_retries", "max_retries"),
+                ("woc_timeout", "timeout"),
+                ("woc_plan", "plan"),
+                ("woc_api_key", "api_key"),
+            )
+            if key in config
+        }
+        if client_options:
+            self.client = woc.WoCClient(self.is_testnet(), **client_options)
+        else:
+            self.client = woc.get_client(self.is_testnet())
+
+    def _client(self) -> woc.WoCClient:
+        assert self.client is not None
+        return self.client
+
     def is_testnet(self) -> bool:
         """ Return true if the current network is testnet
         """
@@ -38,17 +62,25 @@ class WoCInterface(BlockchainInterface):
 
     def get_addr_history(self, address):
         """Return the transaction history with this address"""
-        return woc.get_history(address, testnet=self.is_testnet())
+        return self._client().get_history(address)
 
     def get_utxo(self, address):
         """Return the utxo associated with this address"""
-        return woc.get_unspent_transactions(address, testnet=self.is_testnet())
+        return self._client().get_unspent_transactions(address)
 
     def get_balance(self, address):
-        return woc.get_balance(address, testnet=self.is_testnet())
+        return self._client().get_balance(address)
+
+    def get_utxos(self, addresses: List[str]) -> List[Any]:
+        """Return the utxos of each address using the bulk endpoint"""
+        return self._client().get_unspent_transactions_bulk(addresses)
+
+    def get_balances(self, addresses: List[str]) -> List[Any]:
+        """Return the balance of each address using the bulk endpoint"""
+        return self._client().get_balances(addresses)
 
     def _get_chain_info(self):
-        return woc.get_chain_info(testnet=self.is_testnet())
+        return self._client().get_chain_info()
 
     def get_block_count(self):
         """Return the height of the chain"""
@@ -63,33 +95,37 @@ class WoCInterface(BlockchainInterface):
         chain_info = self._get_chain_info()
         return chain_info["bestblockhash"]
 
-    def get_merkle_proof(self, block_hash: str, tx_id: str) -> str:
-        return woc.get_merkle_proof(tx_id, testnet=self.is_testnet())
+    def get_merkle_proof(self, block_hash: str, tx_id: str) -> Any:
+        return self._client().get_merkle_proof(tx_id)
 
     def get_transaction(self, txid: str):
         """Return the transaction associated with this txid"""
-        return woc.get_transaction(txid, testnet=self.is_testnet())
+        return self._client().get_transaction(txid)
 
     def get_raw_transaction(self, txid: str) -> Optional[str]:
         """Return the transaction associated with this txid.
         """
-        return woc.get_raw_transaction(txid, testnet=self.is_testnet())
+        return self._client().get_raw_transaction(txid)
+
+    def get_raw_transactions(self, txids: List[str]) -> List[Optional[str]]:
+        """Return the raw transaction of each txid using the bulk endpoint"""
+        return self._client().get_raw_transactions(txids)
 
     def broadcast_tx(self, transaction: str):
-        """broadcast this tx to the network"""
-        return woc.broadcast_tx(transaction, testnet=self.is_testnet())
+        """broadcast this tx to the network, raising requests.ConnectionError if WoC could not be reached"""
+        return self._client().broadcast_tx(transaction)
 
     def get_tx_out(self, txid: str, txindex: int) -> Dict:
         raise ValueError("get_tx_out call not available via the WoC rest api")
 
     def get_block(self, blockhash: str) -> Dict:
-        return woc.get_block_by_hash(blockhash, testnet=self.is_testnet())
+        return self._client().get_block_by_hash(blockhash)
 
     def get_block_header(self, blockhash: str) -> Dict:
         ''' Returns te block_header for a given block hash
             NB -> It's more than the block header.
         '''
-        return woc.get_block_header(blockhash, testnet=self.is_testnet())
+        return self._client().get_block_header(blockhash)
 
     def verifyscript(self, scripts: list, stop_on_first_invalid: bool = True, timeout: int = 100) -> List[Any]:
         raise NotImplementedError("verifyscript not implemented for the WoC interface")
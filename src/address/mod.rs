@@ -25,7 +25,7 @@
 //!
 use crate::network::Network;
 use crate::util::{sha256d, ChainGangError, Hash160};
-use base58::{FromBase58, ToBase58};
+use crate::wallet::base58_checksum::{decode_base58, encode_base58};
 
 /// Address type which is either P2PKH or P2SH
 #[derive(Debug, Clone, Copy, PartialEq, Eq)]
@@ -49,8 +49,7 @@ pub fn addr_encode(hash160: &Hash160, addr_type: AddressType, network: Network)
     v.push(checksum[1]);
     v.push(checksum[2]);
     v.push(checksum[3]);
-    let b: &[u8] = v.as_ref();
-    b.to_base58()
+    encode_base58(&v)
 }
 
 /// Decodes a base-58 address to a public key hash
@@ -60,9 +59,7 @@ pub fn addr_decode(
 ) -> Result<(Hash160, AddressType), ChainGangError> {
     // Make sure addr is at least some minimum to verify checksum and addr type
     // We will check the private key size later.
-    let v = input
-        .from_base58()
-        .map_err(|e| ChainGangError::Base58Error(format!("{e:?}")))?;
+    let v = decode_base58(input)?;
     if v.len() < 6 {
         let msg = format!("Base58 address not long enough: {}", v.len());
         return Err(ChainGangError::BadData(msg));
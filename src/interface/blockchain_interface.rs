@@ -1,4 +1,5 @@
 use async_trait::async_trait;
+use futures::stream::{self, StreamExt};
 
 use crate::{
     messages::{BlockHeader, Tx},
@@ -28,6 +29,9 @@ pub struct UtxoEntry {
 /// Type to represent UTXO set
 pub type Utxo = Vec<UtxoEntry>;
 
+/// Default number of requests the batch methods have in flight at once
+pub const DEFAULT_BATCH_CONCURRENCY: usize = 8;
+
 /// Trait of the blockchain interface
 ///
 #[async_trait]
@@ -51,4 +55,43 @@ pub trait BlockchainInterface: Send + Sync {
     async fn get_latest_block_header(&self) -> Result<BlockHeader, ChainGangError>;
 
     async fn get_block_headers(&self) -> Result<String, ChainGangError>;
+
+    /// Number of requests the batch methods have in flight at once
+    fn batch_concurrency(&self) -> usize {
+        DEFAULT_BATCH_CONCURRENCY
+    }
+
+    /// Get many txs, results in input order
+    ///
+    /// By default calls `get_tx` for each txid, with at most `batch_concurrency()` calls in flight.
+    async fn get_txs(&self, txids: &[String]) -> Vec<Result<Tx, ChainGangError>> {
+        stream::iter(txids)
+            .map(|txid| self.get_tx(txid))
+            .buffered(self.batch_concurrency().max(1))
+            .collect()
+            .await
+    }
+
+    /// Get the UTXO of many addresses, results in input order
+    ///
+    /// By default calls `get_utxo` for each address, with at most `batch_concurrency()` calls in flight.
+    async fn get_utxos(&self, addresses: &[String]) -> Vec<Result<Utxo, ChainGangError>> {
+        stream::iter(addresses)
+            .map(|address| self.get_utxo(address))
+            .buffered(self.batch_concurrency().max(1))
+            .collect()
+            .await
+    }
+
+    /// Broadcast many txs, returning the txid or error of each in input order
+    ///
+    /// Calls `broadcast_tx` for each tx, with at most `batch_concurrency()` calls in flight.
+    /// Txs are not ordered, so a tx should not spend another tx in the same batch.
+    async fn broadcast_txs(&self, txs: &[Tx]) -> Vec<Result<String, ChainGangError>> {
+        stream::iter(txs)
+            .map(|tx| self.broadcast_tx(tx))
+            .buffered(self.batch_concurrency().max(1))
+            .collect()
+            .await
+    }
 }
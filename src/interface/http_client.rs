@@ -0,0 +1,76 @@
+//! Shared HTTP client for the REST interfaces.
+//!
+//! A [`reqwest::Client`] owns a connection pool, so building one per request throws away
+//! keep-alive connections and TLS sessions. Each interface builds a client when it is created
+//! instead, and clones of the interface share its pool. HTTP/2 is negotiated through TLS ALPN
+//! where the server supports it.
+//!
+//! Pooled connections are tied to the tokio runtime that opened them, so a client must not be
+//! used from more than one runtime. The process wide [`shared_client`] is only for callers that
+//! run every request on a single runtime.
+
+use std::sync::OnceLock;
+use std::time::Duration;
+
+use crate::util::ChainGangError;
+
+/// Settings for building an HTTP client.
+#[derive(Debug, Clone)]
+pub struct HttpConfig {
+    /// Total time allowed for a request, including reading the response
+    pub timeout: Duration,
+    pub connect_timeout: Duration,
+    /// How long an idle pooled connection is kept open
+    pub pool_idle_timeout: Duration,
+    pub pool_max_idle_per_host: usize,
+    /// TCP keep-alive probe interval
+    pub tcp_keepalive: Duration,
+    pub user_agent: String,
+}
+
+impl Default for HttpConfig {
+    fn default() -> Self {
+        HttpConfig {
+            timeout: Duration::from_secs(30),
+            connect_timeout: Duration::from_secs(10),
+            pool_idle_timeout: Duration::from_secs(90),
+            pool_max_idle_per_host: 16,
+            tcp_keepalive: Duration::from_secs(60),
+            user_agent: concat!("chain-gang/", env!("CARGO_PKG_VERSION")).to_string(),
+        }
+    }
+}
+
+impl HttpConfig {
+    /// Builds a client with these settings.
+    pub fn build(&self) -> Result<reqwest::Client, ChainGangError> {
+        let client = reqwest::Client::builder()
+            .timeout(self.timeout)
+            .connect_timeout(self.connect_timeout)
+            .pool_idle_timeout(self.pool_idle_timeout)
+            .pool_max_idle_per_host(self.pool_max_idle_per_host)
+            .tcp_keepalive(self.tcp_keepalive)
+            .user_agent(self.user_agent.clone())
+            .build()?;
+        Ok(client)
+    }
+}
+
+/// Builds a client from the default [`HttpConfig`].
+pub fn default_client() -> reqwest::Client {
+    HttpConfig::default()
+        .build()
+        .expect("failed to build the HTTP client")
+}
+
+static SHARED_CLIENT: OnceLock<reqwest::Client> = OnceLock::new();
+
+/// Returns the process wide client built from the default [`HttpConfig`].
+///
+/// Opt in with `with_client(shared_client())`. Only use it if every request runs on the same
+/// tokio runtime, as requests from another runtime fail once its pooled connections are reused.
+pub fn shared_client() -> reqwest::Client {
+    SHARED_CLIENT
+        .get_or_init(default_client)
+        .clone()
+}
@@ -0,0 +1,494 @@
+//! Call instrumentation for [`BlockchainInterface`] implementations.
+//!
+//! [`Instrumented`] wraps any interface and records per-method call counts, latency histograms,
+//! error classes and payload bytes in a shared [`InterfaceMetrics`], which can be queried or
+//! exported in the Prometheus text format. Hooks receive a [`CallRecord`] for every finished call,
+//! e.g. to forward it to a tracing system.
+
+use async_trait::async_trait;
+use std::collections::BTreeMap;
+use std::fmt::Write as _;
+use std::future::Future;
+use std::sync::{Arc, Mutex, RwLock};
+use std::time::{Duration, Instant, SystemTime};
+
+use crate::{
+    interface::blockchain_interface::{Balance, BlockchainInterface, Utxo},
+    messages::{BlockHeader, Payload, Tx},
+    network::Network,
+    util::ChainGangError,
+};
+
+/// Latency histogram bucket upper bounds in seconds.
+pub const DEFAULT_LATENCY_BUCKETS: [f64; 11] = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+];
+
+/// One finished interface call.
+#[derive(Debug, Clone)]
+pub struct CallRecord {
+    pub interface: &'static str,
+    pub method: &'static str,
+    /// Wall clock start time, for tracing systems
+    pub started: SystemTime,
+    pub duration: Duration,
+    /// Error class (the [`ChainGangError`] variant) if the call failed
+    pub error: Option<String>,
+    pub bytes_sent: u64,
+    pub bytes_received: u64,
+}
+
+/// Accumulated statistics of one interface method.
+#[derive(Debug, Clone, Default, PartialEq)]
+pub struct MethodStats {
+    pub calls: u64,
+    pub errors: BTreeMap<String, u64>,
+    pub bytes_sent: u64,
+    pub bytes_received: u64,
+    pub latency_sum: f64,
+    /// One count per bucket plus one for +Inf, not cumulative
+    pub bucket_counts: Vec<u64>,
+}
+
+/// Callback run for every finished call.
+pub type MetricsHook = Box<dyn Fn(&CallRecord) + Send + Sync>;
+
+/// Thread safe registry of interface call statistics, keyed by interface and method name.
+pub struct InterfaceMetrics {
+    buckets: Vec<f64>,
+    stats: Mutex<BTreeMap<(&'static str, &'static str), MethodStats>>,
+    hooks: RwLock<Vec<MetricsHook>>,
+}
+
+impl Default for InterfaceMetrics {
+    fn default() -> Self {
+        InterfaceMetrics::new()
+    }
+}
+
+impl InterfaceMetrics {
+    /// Creates a registry using [`DEFAULT_LATENCY_BUCKETS`].
+    pub fn new() -> InterfaceMetrics {
+        InterfaceMetrics::with_buckets(&DEFAULT_LATENCY_BUCKETS)
+    }
+
+    /// Creates a registry with the given ascending latency bucket bounds in seconds.
+    pub fn with_buckets(buckets: &[f64]) -> InterfaceMetrics {
+        InterfaceMetrics {
+            buckets: buckets.to_vec(),
+            stats: Mutex::new(BTreeMap::new()),
+            hooks: RwLock::new(Vec::new()),
+        }
+    }
+
+    /// Adds a hook called with every finished call.
+    pub fn add_hook(&self, hook: MetricsHook) {
+        self.hooks.write().unwrap().push(hook);
+    }
+
+    /// Adds a finished call to the statistics and passes it to the hooks.
+    pub fn record(&self, record: &CallRecord) {
+        {
+            let mut stats = self.stats.lock().unwrap();
+            let entry = stats
+                .entry((record.interface, record.method))
+                .or_insert_with(|| MethodStats {
+                    bucket_counts: vec![0; self.buckets.len() + 1],
+                    ..MethodStats::default()
+                });
+            let seconds = record.duration.as_secs_f64();
+            entry.calls += 1;
+            if let Some(error) = &record.error {
+                *entry.errors.entry(error.clone()).or_insert(0) += 1;
+            }
+            entry.bytes_sent += record.bytes_sent;
+            entry.bytes_received += record.bytes_received;
+            entry.latency_sum += seconds;
+            let bucket = self.buckets.partition_point(|bound| *bound < seconds);
+            entry.bucket_counts[bucket] += 1;
+        }
+        for hook in self.hooks.read().unwrap().iter() {
+            hook(record);
+        }
+    }
+
+    /// Returns a copy of the statistics of every interface method called so far.
+    pub fn snapshot(&self) -> BTreeMap<(&'static str, &'static str), MethodStats> {
+        self.stats.lock().unwrap().clone()
+    }
+
+    /// Returns the statistics of one interface method.
+    pub fn method_stats(&self, interface: &str, method: &str) -> Option<MethodStats> {
+        let stats = self.stats.lock().unwrap();
+        stats
+            .iter()
+            .find(|((i, m), _)| *i == interface && *m == method)
+            .map(|(_, s)| s.clone())
+    }
+
+    /// Discards all statistics.
+    pub fn reset(&self) {
+        self.stats.lock().unwrap().clear();
+    }
+
+    /// Returns the statistics in the Prometheus text exposition format.
+    pub fn to_prometheus(&self, prefix: &str) -> String {
+        let stats = self.snapshot();
+        let mut out = String::new();
+        // Writing to a String can not fail
+        let _ = writeln!(out, "# HELP {prefix}_calls_total Interface calls.");
+        let _ = writeln!(out, "# TYPE {prefix}_calls_total counter");
+        for ((interface, method), s) in &stats {
+            let _ = writeln!(
+                out,
+                "{prefix}_calls_total{{interface=\"{interface}\",method=\"{method}\"}} {}",
+                s.calls
+            );
+        }
+        let _ = writeln!(
+            out,
+            "# HELP {prefix}_errors_total Interface calls that failed, by error class."
+        );
+        let _ = writeln!(out, "# TYPE {prefix}_errors_total counter");
+        for ((interface, method), s) in &stats {
+            for (error, count) in &s.errors {
+                let _ = writeln!(
+                    out,
+                    "{prefix}_errors_total{{interface=\"{interface}\",method=\"{method}\",error=\"{error}\"}} {count}"
+                );
+            }
+        }
+        let _ = writeln!(
+            out,
+            "# HELP {prefix}_bytes_total Payload bytes transferred."
+        );
+        let _ = writeln!(out, "# TYPE {prefix}_bytes_total counter");
+        for ((interface, method), s) in &stats {
+            for (direction, bytes) in [("sent", s.bytes_sent), ("received", s.bytes_received)] {
+                let _ = writeln!(
+                    out,
+                    "{prefix}_bytes_total{{interface=\"{interface}\",method=\"{method}\",direction=\"{direction}\"}} {bytes}"
+                );
+            }
+        }
+        let _ = writeln!(
+            out,
+            "# HELP {prefix}_call_duration_seconds Interface call latency."
+        );
+        let _ = writeln!(out, "# TYPE {prefix}_call_duration_seconds histogram");
+        for ((interface, method), s) in &stats {
+            let labels = format!("interface=\"{interface}\",method=\"{method}\"");
+            let mut cumulative = 0;
+            for (bound, count) in self.buckets.iter().zip(&s.bucket_counts) {
+                cumulative += count;
+                let _ = writeln!(
+                    out,
+                    "{prefix}_call_duration_seconds_bucket{{{labels},le=\"{bound}\"}} {cumulative}"
+                );
+            }
+            let _ = writeln!(
+                out,
+                "{prefix}_call_duration_seconds_bucket{{{labels},le=\"+Inf\"}} {}",
+                s.calls
+            );
+            let _ = writeln!(
+                out,
+                "{prefix}_call_duration_seconds_sum{{{labels}}} {}",
+                s.latency_sum
+            );
+            let _ = writeln!(
+                out,
+                "{prefix}_call_duration_seconds_count{{{labels}}} {}",
+                s.calls
+            );
+        }
+        out
+    }
+}
+
+/// Returns the error class of an error: its [`ChainGangError`] variant name.
+pub fn error_class(err: &ChainGangError) -> String {
+    let debug = format!("{err:?}");
+    debug
+        .split(|c: char| !c.is_alphanumeric() && c != '_')
+        .next()
+        .unwrap_or_default()
+        .to_string()
+}
+
+/// A [`BlockchainInterface`] that records every call made to the wrapped interface.
+pub struct Instrumented<T> {
+    inner: T,
+    name: &'static str,
+    metrics: Arc<InterfaceMetrics>,
+}
+
+impl<T: BlockchainInterface> Instrumented<T> {
+    /// Wraps `inner`, recording its calls under `name` in `metrics`.
+    pub fn new(inner: T, name: &'static str, metrics: Arc<InterfaceMetrics>) -> Instrumented<T> {
+        Instrumented {
+            inner,
+            name,
+            metrics,
+        }
+    }
+
+    /// The wrapped interface.
+    pub fn inner(&self) -> &T {
+        &self.inner
+    }
+
+    /// The registry calls are recorded in.
+    pub fn metrics(&self) -> &Arc<InterfaceMetrics> {
+        &self.metrics
+    }
+
+    /// Runs `call`, recording it with `bytes_sent` and the bytes `received` reports for the result.
+    async fn timed<R, F>(
+        &self,
+        method: &'static str,
+        bytes_sent: usize,
+        received: impl Fn(&R) -> usize,
+        call: F,
+    ) -> Result<R, ChainGangError>
+    where
+        F: Future<Output = Result<R, ChainGangError>>,
+    {
+        let started = SystemTime::now();
+        let start = Instant::now();
+        let result = call.await;
+        let (error, bytes_received) = match &result {
+            Ok(value) => (None, received(value)),
+            Err(err) => (Some(error_class(err)), 0),
+        };
+        self.metrics.record(&CallRecord {
+            interface: self.name,
+            method,
+            started,
+            duration: start.elapsed(),
+            error,
+            bytes_sent: bytes_sent as u64,
+            bytes_received: bytes_received as u64,
+        });
+        result
+    }
+
+    /// Runs a batch `call` as one call, recording the first item error as its error class.
+    async fn timed_batch<R, F>(
+        &self,
+        method: &'static str,
+        bytes_sent: usize,
+        received: impl Fn(&R) -> usize,
+        call: F,
+    ) -> Vec<Result<R, ChainGangError>>
+    where
+        F: Future<Output = Vec<Result<R, ChainGangError>>>,
+    {
+        let started = SystemTime::now();
+        let start = Instant::now();
+        let results = call.await;
+        let error = results
+            .iter()
+            .find_map(|result| result.as_ref().err())
+            .map(error_class);
+        let bytes_received: usize = results.iter().flatten().map(received).sum();
+        self.metrics.record(&CallRecord {
+            interface: self.name,
+            method,
+            started,
+            duration: start.elapsed(),
+            error,
+            bytes_sent: bytes_sent as u64,
+            bytes_received: bytes_received as u64,
+        });
+        results
+    }
+}
+
+#[async_trait]
+impl<T: BlockchainInterface> BlockchainInterface for Instrumented<T> {
+    fn set_network(&mut self, network: &Network) {
+        self.inner.set_network(network);
+    }
+
+    async fn status(&self) -> Result<(), ChainGangError> {
+        self.timed("status", 0, |_| 0, self.inner.status()).await
+    }
+
+    async fn get_balance(&self, address: &str) -> Result<Balance, ChainGangError> {
+        self.timed("get_balance", 0, |_| 0, self.inner.get_balance(address))
+            .await
+    }
+
+    async fn get_utxo(&self, address: &str) -> Result<Utxo, ChainGangError> {
+        self.timed("get_utxo", 0, |_| 0, self.inner.get_utxo(address))
+            .await
+    }
+
+    async fn broadcast_tx(&self, tx: &Tx) -> Result<String, ChainGangError> {
+        self.timed(
+            "broadcast_tx",
+            tx.size(),
+            |_| 0,
+            self.inner.broadcast_tx(tx),
+        )
+        .await
+    }
+
+    async fn get_tx(&self, txid: &str) -> Result<Tx, ChainGangError> {
+        self.timed("get_tx", 0, |tx: &Tx| tx.size(), self.inner.get_tx(txid))
+            .await
+    }
+
+    async fn get_latest_block_header(&self) -> Result<BlockHeader, ChainGangError> {
+        self.timed(
+            "get_latest_block_header",
+            0,
+            |_| BlockHeader::SIZE,
+            self.inner.get_latest_block_header(),
+        )
+        .await
+    }
+
+    async fn get_block_headers(&self) -> Result<String, ChainGangError> {
+        self.timed(
+            "get_block_headers",
+            0,
+            |headers: &String| headers.len(),
+            self.inner.get_block_headers(),
+        )
+        .await
+    }
+
+    fn batch_concurrency(&self) -> usize {
+        self.inner.batch_concurrency()
+    }
+
+    async fn get_txs(&self, txids: &[String]) -> Vec<Result<Tx, ChainGangError>> {
+        self.timed_batch("get_txs", 0, |tx: &Tx| tx.size(), self.inner.get_txs(txids))
+            .await
+    }
+
+    async fn get_utxos(&self, addresses: &[String]) -> Vec<Result<Utxo, ChainGangError>> {
+        self.timed_batch("get_utxos", 0, |_| 0, self.inner.get_utxos(addresses))
+            .await
+    }
+
+    async fn broadcast_txs(&self, txs: &[Tx]) -> Vec<Result<String, ChainGangError>> {
+        self.timed_batch(
+            "broadcast_txs",
+            txs.iter().map(|tx| tx.size()).sum(),
+            |_| 0,
+            self.inner.broadcast_txs(txs),
+        )
+        .await
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::interface::blockchain_interface::UtxoEntry;
+    use crate::interface::test_interface::TestInterface;
+    use std::pin::pin;
+    use std::sync::atomic::{AtomicUsize, Ordering};
+    use std::task::{Context, Poll, Wake, Waker};
+    use std::thread::{self, Thread};
+
+    struct ThreadWaker(Thread);
+
+    impl Wake for ThreadWaker {
+        fn wake(self: Arc<Self>) {
+            self.0.unpark();
+        }
+    }
+
+    /// Minimal executor for futures that do no real I/O
+    fn block_on<F: Future>(future: F) -> F::Output {
+        let waker = Waker::from(Arc::new(ThreadWaker(thread::current())));
+        let mut cx = Context::from_waker(&waker);
+        let mut future = pin!(future);
+        loop {
+            match future.as_mut().poll(&mut cx) {
+                Poll::Ready(output) => return output,
+                Poll::Pending => thread::park(),
+            }
+        }
+    }
+
+    #[test]
+    fn records_calls_and_errors() {
+        let metrics = Arc::new(InterfaceMetrics::new());
+        let seen = Arc::new(AtomicUsize::new(0));
+        let counter = seen.clone();
+        metrics.add_hook(Box::new(move |record| {
+            assert_eq!(record.interface, "test");
+            counter.fetch_add(1, Ordering::Relaxed);
+        }));
+
+        let test_interface = TestInterface::new();
+        let utxo = vec![UtxoEntry {
+            height: 1,
+            tx_pos: 0,
+            tx_hash: "aa".to_string(),
+            value: 10,
+        }];
+        block_on(test_interface.set_utxo("addr", &utxo));
+        let interface = Instrumented::new(test_interface, "test", metrics.clone());
+
+        assert_eq!(block_on(interface.get_utxo("addr")).unwrap(), utxo);
+        block_on(interface.get_utxo("other")).unwrap();
+        block_on(interface.status()).unwrap();
+
+        let stats = metrics.method_stats("test", "get_utxo").unwrap();
+        assert_eq!(stats.calls, 2);
+        assert!(stats.errors.is_empty());
+        assert_eq!(stats.bucket_counts.iter().sum::<u64>(), 2);
+        assert_eq!(seen.load(Ordering::Relaxed), 3);
+
+        metrics.record(&CallRecord {
+            interface: "test",
+            method: "get_tx",
+            started: SystemTime::now(),
+            duration: Duration::from_millis(30),
+            error: Some(error_class(&ChainGangError::ResponseError(
+                "404".to_string(),
+            ))),
+            bytes_sent: 0,
+            bytes_received: 0,
+        });
+        let stats = metrics.method_stats("test", "get_tx").unwrap();
+        assert_eq!(stats.errors.get("ResponseError"), Some(&1));
+        // 30ms falls in the 0.05s bucket
+        assert_eq!(stats.bucket_counts[3], 1);
+    }
+
+    #[test]
+    fn prometheus_export() {
+        let metrics = InterfaceMetrics::with_buckets(&[0.1, 1.0]);
+        metrics.record(&CallRecord {
+            interface: "woc",
+            method: "get_tx",
+            started: SystemTime::now(),
+            duration: Duration::from_millis(500),
+            error: Some(error_class(&ChainGangError::Timeout)),
+            bytes_sent: 0,
+            bytes_received: 250,
+        });
+        let text = metrics.to_prometheus("chain_gang_interface");
+        let labels = "interface=\"woc\",method=\"get_tx\"";
+        assert!(text.contains(&format!("chain_gang_interface_calls_total{{{labels}}} 1")));
+        assert!(text.contains(&format!(
+            "chain_gang_interface_errors_total{{{labels},error=\"Timeout\"}} 1"
+        )));
+        assert!(text.contains(&format!(
+            "chain_gang_interface_call_duration_seconds_bucket{{{labels},le=\"0.1\"}} 0"
+        )));
+        assert!(text.contains(&format!(
+            "chain_gang_interface_call_duration_seconds_bucket{{{labels},le=\"1\"}} 1"
+        )));
+        assert!(text.contains(&format!(
+            "chain_gang_interface_bytes_total{{{labels},direction=\"received\"}} 250"
+        )));
+    }
+}
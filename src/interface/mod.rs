@@ -1,13 +1,19 @@
 // This module provides the blockchain interface
 
 pub mod blockchain_interface;
+pub mod http_client;
+pub mod metrics;
 pub mod uaas_interface;
 pub mod woc_interface;
 
 //#[cfg(test)]
 pub mod test_interface;
 
-pub use blockchain_interface::{Balance, BlockchainInterface, Utxo, UtxoEntry};
+pub use blockchain_interface::{
+    Balance, BlockchainInterface, Utxo, UtxoEntry, DEFAULT_BATCH_CONCURRENCY,
+};
+pub use http_client::{default_client, shared_client, HttpConfig};
+pub use metrics::{CallRecord, Instrumented, InterfaceMetrics, MethodStats};
 pub use uaas_interface::{Monitor, UaaSInterface};
 pub use woc_interface::WocInterface;
 
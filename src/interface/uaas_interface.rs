@@ -6,7 +6,10 @@ use reqwest::Url;
 use serde::{Deserialize, Serialize};
 
 use crate::{
-    interface::blockchain_interface::{Balance, BlockchainInterface, Utxo},
+    interface::{
+        blockchain_interface::{Balance, BlockchainInterface, Utxo},
+        http_client::default_client,
+    },
     messages::{BlockHeader, Tx},
     network::Network,
     util::{ChainGangError, Serializable},
@@ -78,6 +81,7 @@ pub struct UaaSBroadcastTxType {
 pub struct UaaSInterface {
     url: Url,
     network_type: Network,
+    client: reqwest::Client,
 }
 
 // This represents an address or locking script monitor
@@ -108,15 +112,22 @@ impl UaaSInterface {
         Ok(UaaSInterface {
             url,
             network_type: Network::BSV_Testnet,
+            client: default_client(),
         })
     }
 
+    /// Use this client, e.g. one built from an `HttpConfig` with other timeouts
+    pub fn with_client(mut self, client: reqwest::Client) -> Self {
+        self.client = client;
+        self
+    }
+
     // Return Ok(UaaSStatusResponse) if UaaS responds...
     pub async fn get_uaas_status(&self) -> Result<UaaSStatusResponse, ChainGangError> {
         log::debug!("status");
 
         let status_url = self.url.join("/status").unwrap();
-        let response = reqwest::get(status_url.clone()).await?;
+        let response = self.client.get(status_url.clone()).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &status_url);
             return Err(ChainGangError::ResponseError(format!(
@@ -142,7 +153,7 @@ impl UaaSInterface {
         log::debug!("get_uaas_block_headers");
 
         let status_url = self.url.join("/block/latest").unwrap();
-        let response = reqwest::get(status_url.clone()).await?;
+        let response = self.client.get(status_url.clone()).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &status_url);
             return Err(ChainGangError::ResponseError(format!(
@@ -170,7 +181,7 @@ impl UaaSInterface {
         log::debug!("get_monitors");
 
         let collection_url = self.url.join("/collection").unwrap();
-        let response = reqwest::get(collection_url.clone()).await?;
+        let response = self.client.get(collection_url.clone()).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &collection_url);
             return Err(ChainGangError::ResponseError(format!(
@@ -203,8 +214,8 @@ impl UaaSInterface {
         }
 
         let add_monitor_url = self.url.join("/collection/monitor").unwrap();
-        let client = reqwest::Client::new();
-        let response = client
+        let response = self
+            .client
             .post(add_monitor_url.clone())
             .json(&monitor)
             .send()
@@ -225,9 +236,12 @@ impl UaaSInterface {
 
         let delete_url = format!("/collection/monitor?monitor_name={}", monitor_name);
         let delete_monitor_url = self.url.join(&delete_url).unwrap();
-        let client = reqwest::Client::new();
 
-        let response = client.delete(delete_monitor_url.clone()).send().await?;
+        let response = self
+            .client
+            .delete(delete_monitor_url.clone())
+            .send()
+            .await?;
 
         if response.status() != 200 {
             log::warn!("url = {}", &delete_monitor_url);
@@ -251,7 +265,7 @@ impl BlockchainInterface for UaaSInterface {
         log::debug!("status");
 
         let status_url = self.url.join("/status").unwrap();
-        let response = reqwest::get(status_url.clone()).await?;
+        let response = self.client.get(status_url.clone()).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &status_url);
             return Err(ChainGangError::ResponseError(format!(
@@ -275,7 +289,7 @@ impl BlockchainInterface for UaaSInterface {
 
         let url = self.url.join(&get_utxo_balance_url).unwrap();
 
-        let response = reqwest::get(url.clone()).await?;
+        let response = self.client.get(url.clone()).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -316,7 +330,7 @@ impl BlockchainInterface for UaaSInterface {
 
         let url = self.url.join(&get_utxo_url).unwrap();
 
-        let response = reqwest::get(url.clone()).await?;
+        let response = self.client.get(url.clone()).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -356,8 +370,8 @@ impl BlockchainInterface for UaaSInterface {
 
         let data_for_broadcast = UaaSBroadcastTxType { tx: tx.as_hexstr() };
 
-        let client = reqwest::Client::new();
-        let response = client
+        let response = self
+            .client
             .post(url.clone())
             .json(&data_for_broadcast)
             .send()
@@ -388,7 +402,7 @@ impl BlockchainInterface for UaaSInterface {
         let get_tx_url = format!("/tx/hex?hash={}", txid);
         let url = self.url.join(&get_tx_url).unwrap();
 
-        let response = reqwest::get(url.clone()).await?;
+        let response = self.client.get(url.clone()).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -428,7 +442,7 @@ impl BlockchainInterface for UaaSInterface {
 
         let url = self.url.join("/block/last/hex").unwrap();
 
-        let response = reqwest::get(url.clone()).await?;
+        let response = self.client.get(url.clone()).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -467,7 +481,7 @@ impl BlockchainInterface for UaaSInterface {
         log::debug!("get_block_headers");
 
         let status_url = self.url.join("/block/latest").unwrap();
-        let response = reqwest::get(status_url.clone()).await?;
+        let response = self.client.get(status_url.clone()).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &status_url);
             return Err(ChainGangError::ResponseError(format!(
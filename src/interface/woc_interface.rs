@@ -1,25 +1,71 @@
 use async_trait::async_trait;
+use futures::stream::{self, StreamExt};
 use reqwest::StatusCode;
+use std::collections::HashMap;
 
 use crate::util::Serializable;
-use serde::Serialize;
+use serde::{Deserialize, Serialize};
 
 use crate::{
-    interface::blockchain_interface::{Balance, BlockchainInterface, Utxo},
+    interface::{
+        blockchain_interface::{Balance, BlockchainInterface, Utxo, DEFAULT_BATCH_CONCURRENCY},
+        http_client::default_client,
+    },
     messages::{BlockHeader, Tx},
     network::Network,
     util::ChainGangError,
 };
 
+/// WhatsOnChain API root, followed by the network name
+pub const WOC_BASE_URL: &str = "https://api.whatsonchain.com/v1/bsv";
+
+/// Maximum number of txids or addresses accepted by one WoC bulk request
+pub const WOC_BULK_LIMIT: usize = 20;
+
 /// Structure for json serialisation for broadcast_tx
 #[derive(Debug, Serialize)]
 struct BroadcastTxType {
     pub txhex: String,
 }
 
+/// Request body of the bulk tx endpoint
+#[derive(Debug, Serialize)]
+struct BulkTxsRequest<'a> {
+    txids: &'a [String],
+}
+
+/// Request body of the bulk address endpoints
+#[derive(Debug, Serialize)]
+struct BulkAddressesRequest<'a> {
+    addresses: &'a [String],
+}
+
+/// Entry of the bulk tx endpoint response
+#[derive(Debug, Deserialize)]
+struct BulkTxEntry {
+    txid: String,
+    #[serde(default)]
+    hex: String,
+    #[serde(default)]
+    error: String,
+}
+
+/// Entry of the bulk unspent endpoint response
+#[derive(Debug, Deserialize)]
+struct BulkUtxoEntry {
+    address: String,
+    #[serde(default)]
+    unspent: Utxo,
+    #[serde(default)]
+    error: String,
+}
+
 #[derive(Debug, Clone)]
 pub struct WocInterface {
     network_type: Network,
+    client: reqwest::Client,
+    base_url: String,
+    batch_concurrency: usize,
 }
 
 impl Default for WocInterface {
@@ -29,12 +75,34 @@ impl Default for WocInterface {
 }
 
 impl WocInterface {
+    /// Returns an interface with its own HTTP client, shared by its clones
     pub fn new() -> Self {
         WocInterface {
             network_type: Network::BSV_Testnet,
+            client: default_client(),
+            base_url: WOC_BASE_URL.to_string(),
+            batch_concurrency: DEFAULT_BATCH_CONCURRENCY,
         }
     }
 
+    /// Use this client, e.g. one built from an `HttpConfig` with other timeouts
+    pub fn with_client(mut self, client: reqwest::Client) -> Self {
+        self.client = client;
+        self
+    }
+
+    /// Use another API root, e.g. a proxy or a test server
+    pub fn with_base_url(mut self, base_url: &str) -> Self {
+        self.base_url = base_url.trim_end_matches('/').to_string();
+        self
+    }
+
+    /// Set the number of requests the batch methods have in flight at once
+    pub fn with_batch_concurrency(mut self, batch_concurrency: usize) -> Self {
+        self.batch_concurrency = batch_concurrency.max(1);
+        self
+    }
+
     /// Return the current network as a string
     fn get_network_str(&self) -> &'static str {
         match self.network_type {
@@ -44,6 +112,53 @@ impl WocInterface {
             _ => panic!("unknown network {}", &self.network_type),
         }
     }
+
+    /// POST one chunk to a bulk endpoint and parse the JSON response
+    async fn post_bulk<B, R>(&self, path: &str, body: B) -> Result<Vec<R>, ChainGangError>
+    where
+        B: Serialize + Send,
+        R: serde::de::DeserializeOwned,
+    {
+        let network = self.get_network_str();
+        let url = format!("{}/{network}{path}", self.base_url);
+        let response = self.client.post(&url).json(&body).send().await?;
+        if response.status() != 200 {
+            log::warn!("url = {}", &url);
+            return Err(ChainGangError::ResponseError(format!(
+                "response.status() = {}",
+                response.status()
+            )));
+        };
+        let txt = response.text().await?;
+        match serde_json::from_str(&txt) {
+            Ok(data) => Ok(data),
+            Err(x) => {
+                log::warn!("txt = {}", &txt);
+                Err(ChainGangError::JSONParseError(format!(
+                    "json parse error = {}",
+                    x
+                )))
+            }
+        }
+    }
+}
+
+/// Looks up the result for each item of a bulk request, in input order
+fn collect_bulk<T: Clone>(
+    items: &[String],
+    found: &HashMap<String, Result<T, String>>,
+) -> Vec<Result<T, ChainGangError>> {
+    items
+        .iter()
+        .map(|item| match found.get(item) {
+            Some(Ok(value)) => Ok(value.clone()),
+            Some(Err(err)) => Err(ChainGangError::ResponseError(err.clone())),
+            None => Err(ChainGangError::ResponseError(format!(
+                "no result for {}",
+                item
+            ))),
+        })
+        .collect()
 }
 
 #[async_trait]
@@ -57,8 +172,8 @@ impl BlockchainInterface for WocInterface {
         log::debug!("status");
 
         let network = self.get_network_str();
-        let url = format!("https://api.whatsonchain.com/v1/bsv/{network}/woc");
-        let response = reqwest::get(&url).await?;
+        let url = format!("{}/{network}/woc", self.base_url);
+        let response = self.client.get(&url).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -84,9 +199,8 @@ impl BlockchainInterface for WocInterface {
         log::debug!("get_balance");
 
         let network = self.get_network_str();
-        let url =
-            format!("https://api.whatsonchain.com/v1/bsv/{network}/address/{address}/balance");
-        let response = reqwest::get(&url).await?;
+        let url = format!("{}/{network}/address/{address}/balance", self.base_url);
+        let response = self.client.get(&url).send().await?;
         if response.status() != 200 {
             warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -123,9 +237,8 @@ impl BlockchainInterface for WocInterface {
         log::debug!("get_utxo");
         let network = self.get_network_str();
 
-        let url =
-            format!("https://api.whatsonchain.com/v1/bsv/{network}/address/{address}/unspent");
-        let response = reqwest::get(&url).await?;
+        let url = format!("{}/{network}/address/{address}/unspent", self.base_url);
+        let response = self.client.get(&url).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -160,14 +273,17 @@ impl BlockchainInterface for WocInterface {
     async fn broadcast_tx(&self, tx: &Tx) -> Result<String, ChainGangError> {
         log::debug!("broadcast_tx");
         let network = self.get_network_str();
-        let url = format!("https://api.whatsonchain.com/v1/bsv/{network}/tx/raw");
+        let url = format!("{}/{network}/tx/raw", self.base_url);
         log::debug!("url = {}", &url);
         let data_for_broadcast = BroadcastTxType {
             txhex: tx.as_hexstr(),
         };
-        //let data = serde_json::to_string(&data_for_broadcast).unwrap();
-        let client = reqwest::Client::new();
-        let response = client.post(&url).json(&data_for_broadcast).send().await?;
+        let response = self
+            .client
+            .post(&url)
+            .json(&data_for_broadcast)
+            .send()
+            .await?;
         let status = response.status();
         // Assume a response of 200 means broadcast tx success
         match status {
@@ -191,8 +307,8 @@ impl BlockchainInterface for WocInterface {
         log::debug!("get_tx");
 
         let network = self.get_network_str();
-        let url = format!("https://api.whatsonchain.com/v1/bsv/{network}/tx/{txid}/hex");
-        let response = reqwest::get(&url).await?;
+        let url = format!("{}/{network}/tx/{txid}/hex", self.base_url);
+        let response = self.client.get(&url).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -217,9 +333,8 @@ impl BlockchainInterface for WocInterface {
     async fn get_latest_block_header(&self) -> Result<BlockHeader, ChainGangError> {
         log::debug!("get_latest_block_header");
         let network = self.get_network_str();
-        let url =
-            format!("https://api.whatsonchain.com/v1/bsv/{network}/block/headers/latest?count=1");
-        let response = reqwest::get(&url).await?;
+        let url = format!("{}/{network}/block/headers/latest?count=1", self.base_url);
+        let response = self.client.get(&url).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -244,8 +359,8 @@ impl BlockchainInterface for WocInterface {
     async fn get_block_headers(&self) -> Result<String, ChainGangError> {
         log::debug!("get_block_headers");
         let network = self.get_network_str();
-        let url = format!("https://api.whatsonchain.com/v1/bsv/{network}/block/headers");
-        let response = reqwest::get(&url).await?;
+        let url = format!("{}/{network}/block/headers", self.base_url);
+        let response = self.client.get(&url).send().await?;
         if response.status() != 200 {
             log::warn!("url = {}", &url);
             return Err(ChainGangError::ResponseError(format!(
@@ -261,4 +376,281 @@ impl BlockchainInterface for WocInterface {
             ))),
         }
     }
+
+    fn batch_concurrency(&self) -> usize {
+        self.batch_concurrency
+    }
+
+    /// Get many txs through the bulk endpoint, `WOC_BULK_LIMIT` per request
+    async fn get_txs(&self, txids: &[String]) -> Vec<Result<Tx, ChainGangError>> {
+        log::debug!("get_txs");
+        let responses: Vec<Result<Vec<BulkTxEntry>, ChainGangError>> =
+            stream::iter(txids.chunks(WOC_BULK_LIMIT))
+                .map(|chunk| self.post_bulk("/txs/hex", BulkTxsRequest { txids: chunk }))
+                .buffered(self.batch_concurrency)
+                .collect()
+                .await;
+        let mut found: HashMap<String, Result<Tx, String>> = HashMap::new();
+        for (chunk, response) in txids.chunks(WOC_BULK_LIMIT).zip(responses) {
+            match response {
+                Ok(entries) => {
+                    for entry in entries {
+                        let tx =
+                            if entry.error.is_empty() {
+                                hex::decode(&entry.hex).map_err(|e| e.to_string()).and_then(
+                                    |bytes| Tx::read(&mut &bytes[..]).map_err(|e| e.to_string()),
+                                )
+                            } else {
+                                Err(entry.error)
+                            };
+                        found.insert(entry.txid, tx);
+                    }
+                }
+                Err(err) => {
+                    for txid in chunk {
+                        found.insert(txid.clone(), Err(err.to_string()));
+                    }
+                }
+            }
+        }
+        collect_bulk(txids, &found)
+    }
+
+    /// Get the UTXO of many addresses through the bulk endpoint, `WOC_BULK_LIMIT` per request
+    async fn get_utxos(&self, addresses: &[String]) -> Vec<Result<Utxo, ChainGangError>> {
+        log::debug!("get_utxos");
+        let responses: Vec<Result<Vec<BulkUtxoEntry>, ChainGangError>> =
+            stream::iter(addresses.chunks(WOC_BULK_LIMIT))
+                .map(|chunk| {
+                    self.post_bulk(
+                        "/addresses/unspent",
+                        BulkAddressesRequest { addresses: chunk },
+                    )
+                })
+                .buffered(self.batch_concurrency)
+                .collect()
+                .await;
+        let mut found: HashMap<String, Result<Utxo, String>> = HashMap::new();
+        for (chunk, response) in addresses.chunks(WOC_BULK_LIMIT).zip(responses) {
+            match response {
+                Ok(entries) => {
+                    for entry in entries {
+                        let utxo = if entry.error.is_empty() {
+                            Ok(entry.unspent)
+                        } else {
+                            Err(entry.error)
+                        };
+                        found.insert(entry.address, utxo);
+                    }
+                }
+                Err(err) => {
+                    for address in chunk {
+                        found.insert(address.clone(), Err(err.to_string()));
+                    }
+                }
+            }
+        }
+        collect_bulk(addresses, &found)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::io::{BufRead, BufReader, Read, Write};
+    use std::net::{TcpListener, TcpStream};
+    use std::sync::atomic::{AtomicUsize, Ordering};
+    use std::sync::Arc;
+    use std::thread;
+    use std::time::Duration;
+
+    /// Counts seen by the stand-in server
+    #[derive(Default)]
+    struct ServerStats {
+        connections: AtomicUsize,
+        requests: AtomicUsize,
+        in_flight: AtomicUsize,
+        max_in_flight: AtomicUsize,
+    }
+
+    /// The tx the stand-in server knows for a txid: the txid is its lock time
+    fn test_tx(lock_time: u32) -> Tx {
+        Tx {
+            version: 1,
+            lock_time,
+            ..Tx::default()
+        }
+    }
+
+    fn respond(path: &str, body: &str) -> String {
+        match path {
+            "/test/woc" => "Whats On Chain".to_string(),
+            "/test/tx/raw" => "\"txid\"".to_string(),
+            "/test/txs/hex" => {
+                let request: serde_json::Value = serde_json::from_str(body).unwrap();
+                let entries: Vec<serde_json::Value> = request["txids"]
+                    .as_array()
+                    .unwrap()
+                    .iter()
+                    .map(|txid| {
+                        let txid = txid.as_str().unwrap();
+                        match txid.parse::<u32>() {
+                            Ok(n) => {
+                                serde_json::json!({"txid": txid, "hex": test_tx(n).as_hexstr()})
+                            }
+                            Err(_) => serde_json::json!({"txid": txid, "error": "unknown"}),
+                        }
+                    })
+                    .collect();
+                serde_json::to_string(&entries).unwrap()
+            }
+            "/test/addresses/unspent" => {
+                let request: serde_json::Value = serde_json::from_str(body).unwrap();
+                let entries: Vec<serde_json::Value> = request["addresses"]
+                    .as_array()
+                    .unwrap()
+                    .iter()
+                    .map(|address| {
+                        serde_json::json!({"address": address, "unspent": [
+                            {"height": 1, "tx_pos": 0, "tx_hash": address, "value": 5}
+                        ], "error": ""})
+                    })
+                    .collect();
+                serde_json::to_string(&entries).unwrap()
+            }
+            _ => String::new(),
+        }
+    }
+
+    /// Serves keep-alive HTTP/1.1 requests on one connection
+    fn serve(stream: TcpStream, stats: Arc<ServerStats>) {
+        let mut reader = BufReader::new(stream.try_clone().unwrap());
+        let mut writer = stream;
+        loop {
+            let mut request_line = String::new();
+            if reader.read_line(&mut request_line).unwrap_or(0) == 0 {
+                return;
+            }
+            let path = request_line.split(' ').nth(1).unwrap_or("").to_string();
+            let mut content_length = 0;
+            loop {
+                let mut header = String::new();
+                reader.read_line(&mut header).unwrap();
+                let header = header.trim_end();
+                if header.is_empty() {
+                    break;
+                }
+                if let Some((name, value)) = header.split_once(':') {
+                    if name.eq_ignore_ascii_case("content-length") {
+                        content_length = value.trim().parse().unwrap();
+                    }
+                }
+            }
+            let mut body = vec![0; content_length];
+            reader.read_exact(&mut body).unwrap();
+
+            stats.requests.fetch_add(1, Ordering::SeqCst);
+            let in_flight = stats.in_flight.fetch_add(1, Ordering::SeqCst) + 1;
+            stats.max_in_flight.fetch_max(in_flight, Ordering::SeqCst);
+            thread::sleep(Duration::from_millis(20));
+            let response = respond(&path, &String::from_utf8(body).unwrap());
+            stats.in_flight.fetch_sub(1, Ordering::SeqCst);
+
+            let status = if response.is_empty() {
+                "404 Not Found"
+            } else {
+                "200 OK"
+            };
+            let message = format!(
+                "HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n{response}",
+                response.len()
+            );
+            if writer.write_all(message.as_bytes()).is_err() {
+                return;
+            }
+        }
+    }
+
+    /// Starts a stand-in WoC server, returning its base URL
+    fn start_server() -> (String, Arc<ServerStats>) {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let url = format!("http://{}", listener.local_addr().unwrap());
+        let stats = Arc::new(ServerStats::default());
+        let server_stats = stats.clone();
+        thread::spawn(move || {
+            for stream in listener.incoming() {
+                let stream = stream.unwrap();
+                server_stats.connections.fetch_add(1, Ordering::SeqCst);
+                let stats = server_stats.clone();
+                thread::spawn(move || serve(stream, stats));
+            }
+        });
+        (url, stats)
+    }
+
+    fn test_interface(url: &str, batch_concurrency: usize) -> WocInterface {
+        WocInterface::new()
+            .with_base_url(url)
+            .with_batch_concurrency(batch_concurrency)
+    }
+
+    #[tokio::test]
+    async fn connections_are_reused() {
+        let (url, stats) = start_server();
+        let interface = test_interface(&url, 2);
+        for _ in 0..5 {
+            interface.status().await.unwrap();
+        }
+        assert_eq!(stats.requests.load(Ordering::SeqCst), 5);
+        assert_eq!(stats.connections.load(Ordering::SeqCst), 1);
+    }
+
+    #[test]
+    fn interfaces_on_separate_runtimes() {
+        // As in per-call block_on wrappers, each runtime creates its own interface
+        let (url, stats) = start_server();
+        for _ in 0..3 {
+            let runtime = tokio::runtime::Runtime::new().unwrap();
+            let interface = test_interface(&url, 2);
+            runtime.block_on(async {
+                interface.status().await.unwrap();
+                interface.status().await.unwrap();
+            });
+        }
+        assert_eq!(stats.requests.load(Ordering::SeqCst), 6);
+    }
+
+    #[tokio::test]
+    async fn get_txs_uses_bulk_requests() {
+        let (url, stats) = start_server();
+        let interface = test_interface(&url, 2);
+        let mut txids: Vec<String> = (0..45).map(|n| n.to_string()).collect();
+        txids[7] = "unknown".to_string();
+
+        let txs = interface.get_txs(&txids).await;
+        assert_eq!(txs.len(), 45);
+        assert_eq!(txs[0].as_ref().unwrap(), &test_tx(0));
+        assert_eq!(txs[44].as_ref().unwrap(), &test_tx(44));
+        assert!(txs[7].is_err());
+        // 45 txids in chunks of 20, at most two requests in flight
+        assert_eq!(stats.requests.load(Ordering::SeqCst), 3);
+        assert!(stats.max_in_flight.load(Ordering::SeqCst) <= 2);
+
+        let addresses = vec!["a1".to_string(), "a2".to_string()];
+        let utxos = interface.get_utxos(&addresses).await;
+        assert_eq!(utxos[1].as_ref().unwrap()[0].tx_hash, "a2");
+    }
+
+    #[tokio::test]
+    async fn broadcast_txs_is_bounded() {
+        let (url, stats) = start_server();
+        let interface = test_interface(&url, 3);
+        let txs: Vec<Tx> = (0..10).map(test_tx).collect();
+
+        let results = interface.broadcast_txs(&txs).await;
+        assert!(results.iter().all(|r| r.as_ref().unwrap() == "txid"));
+        assert_eq!(stats.requests.load(Ordering::SeqCst), 10);
+        assert!(stats.max_in_flight.load(Ordering::SeqCst) <= 3);
+        assert!(stats.connections.load(Ordering::SeqCst) <= 3);
+    }
 }
@@ -8,6 +8,7 @@ extern crate lazy_static;
 
 pub mod address;
 pub mod chronicle;
+pub mod mempool;
 pub mod messages;
 pub mod network;
 pub mod peer;
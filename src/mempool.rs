@@ -0,0 +1,716 @@
+//! In-memory pool of unconfirmed transactions
+//!
+//! A [`Mempool`] keeps transactions serialized, one allocation each, and indexes the outputs
+//! they spend so a double spend is found with a single lookup. Transactions spending outputs
+//! of other pooled transactions are linked to them, and each transaction tracks the fees and
+//! size of its descendants. When the pool grows past its memory budget, the transactions with
+//! the lowest fee rate, counting their descendants, are evicted together with those
+//! descendants.
+//!
+//! # Examples
+//!
+//! ```rust
+//! use chain_gang::mempool::{Mempool, MempoolConfig};
+//! use chain_gang::messages::{OutPoint, Tx, TxIn, TxOut};
+//! use chain_gang::script::Script;
+//! use chain_gang::util::Hash256;
+//!
+//! let tx = Tx {
+//!     version: 1,
+//!     inputs: vec![TxIn {
+//!         prev_output: OutPoint {
+//!             hash: Hash256([1; 32]),
+//!             index: 0,
+//!         },
+//!         ..Default::default()
+//!     }],
+//!     outputs: vec![TxOut {
+//!         satoshis: 1000,
+//!         lock_script: Script(vec![]),
+//!     }],
+//!     lock_time: 0,
+//! };
+//!
+//! let mut mempool = Mempool::new(MempoolConfig::default());
+//! mempool.insert(&tx, 500).unwrap();
+//! assert!(mempool.contains(&tx.hash()));
+//!
+//! // A second spend of the same output is rejected
+//! let mut double_spend = tx.clone();
+//! double_spend.lock_time = 1;
+//! assert!(mempool.insert(&double_spend, 1000).is_err());
+//! ```
+
+use crate::messages::{Block, OutPoint, PartialBlock, Tx};
+use crate::util::{sha256d, ChainGangError, Hash256, Serializable};
+use std::collections::{BTreeSet, HashMap, HashSet};
+use std::mem::size_of;
+
+/// Default memory budget, 300MB
+const DEFAULT_MAX_BYTES: usize = 300 * 1000 * 1000;
+
+/// Default limit on a transaction's unconfirmed ancestors
+const DEFAULT_MAX_ANCESTORS: usize = 1000;
+
+/// Estimated bytes of bookkeeping per transaction, besides its serialized bytes
+const ENTRY_OVERHEAD: usize = size_of::<Option<Entry>>()
+    + size_of::<(Hash256, u32)>()
+    + size_of::<(u64, u32)>()
+    + 4 * size_of::<usize>();
+
+/// Estimated bytes of the spent output index per input
+const INPUT_OVERHEAD: usize = size_of::<(OutPoint, u32)>() + size_of::<usize>();
+
+/// Estimated bytes of a link between a transaction and an in-pool parent, stored on both sides
+const LINK_OVERHEAD: usize = 2 * size_of::<u32>();
+
+/// Limits of a mempool
+#[derive(Debug, Clone)]
+pub struct MempoolConfig {
+    /// Estimated memory the pool may use, counting serialized transactions and their indexes
+    pub max_bytes: usize,
+    /// Most unconfirmed ancestors a transaction may have
+    pub max_ancestors: usize,
+}
+
+impl Default for MempoolConfig {
+    fn default() -> Self {
+        MempoolConfig {
+            max_bytes: DEFAULT_MAX_BYTES,
+            max_ancestors: DEFAULT_MAX_ANCESTORS,
+        }
+    }
+}
+
+/// Snapshot of a mempool's size and counters
+#[derive(Debug, Clone, Default, PartialEq, Eq)]
+pub struct MempoolStats {
+    pub count: usize,
+    /// Serialized size of the transactions
+    pub tx_bytes: usize,
+    /// Estimated memory used, which is kept under `max_bytes`
+    pub usage: usize,
+    pub max_bytes: usize,
+    /// Transactions evicted to stay under `max_bytes`
+    pub evicted: u64,
+    /// Lowest fee rate in the pool, in satoshis per 1000 bytes, counting descendants
+    pub min_fee_rate: u64,
+}
+
+/// Transactions removed from the pool by a block
+#[derive(Debug, Clone, Default, PartialEq, Eq)]
+pub struct BlockRemoval {
+    /// Pooled transactions the block confirmed
+    pub confirmed: Vec<Hash256>,
+    /// Transactions spending the same outputs as the block, removed with their descendants
+    pub conflicted: Vec<Hash256>,
+}
+
+struct Entry {
+    txid: Hash256,
+    raw: Box<[u8]>,
+    fee: i64,
+    /// In-pool transactions this one spends from
+    parents: Vec<u32>,
+    /// In-pool transactions spending from this one
+    children: Vec<u32>,
+    /// Fee and size of this transaction and all its in-pool descendants
+    desc_fee: i64,
+    desc_size: usize,
+    /// Estimated memory used, counted in the pool's usage
+    usage: usize,
+}
+
+impl Entry {
+    /// Eviction score, the better of the transaction's own fee rate and its package's
+    fn score(&self) -> u64 {
+        fee_rate(self.fee, self.raw.len()).max(fee_rate(self.desc_fee, self.desc_size))
+    }
+
+    fn tx(&self) -> Tx {
+        // The bytes were serialized from a valid Tx
+        Tx::read(&mut &self.raw[..]).unwrap()
+    }
+}
+
+/// Fee rate in satoshis per 1000 bytes
+fn fee_rate(fee: i64, size: usize) -> u64 {
+    (fee.max(0) as u128 * 1000 / size.max(1) as u128).min(u64::MAX as u128) as u64
+}
+
+fn txids(entries: Vec<Entry>) -> Vec<Hash256> {
+    entries.into_iter().map(|entry| entry.txid).collect()
+}
+
+/// Unconfirmed transactions indexed by txid, spent output and fee rate
+///
+/// Fees are supplied by the caller, who knows the values of the outputs being spent.
+pub struct Mempool {
+    config: MempoolConfig,
+    /// Entries by slot, with freed slots reused
+    entries: Vec<Option<Entry>>,
+    free: Vec<u32>,
+    ids: HashMap<Hash256, u32>,
+    spent: HashMap<OutPoint, u32>,
+    /// Slots ordered by eviction score, lowest first
+    by_score: BTreeSet<(u64, u32)>,
+    usage: usize,
+    tx_bytes: usize,
+    evicted: u64,
+}
+
+impl Mempool {
+    /// Creates an empty mempool
+    pub fn new(config: MempoolConfig) -> Mempool {
+        Mempool {
+            config,
+            entries: Vec::new(),
+            free: Vec::new(),
+            ids: HashMap::new(),
+            spent: HashMap::new(),
+            by_score: BTreeSet::new(),
+            usage: 0,
+            tx_bytes: 0,
+            evicted: 0,
+        }
+    }
+
+    fn entry(&self, id: u32) -> &Entry {
+        self.entries[id as usize].as_ref().unwrap()
+    }
+
+    /// Updates an entry, keeping the score index in step
+    fn update(&mut self, id: u32, f: impl FnOnce(&mut Entry)) {
+        let entry = self.entries[id as usize].as_mut().unwrap();
+        self.by_score.remove(&(entry.score(), id));
+        f(entry);
+        self.by_score.insert((entry.score(), id));
+    }
+
+    /// Collects the slots reachable from `start` through `next`, excluding `start` itself
+    fn reachable(&self, start: u32, next: impl Fn(&Entry) -> &[u32]) -> HashSet<u32> {
+        let mut found = HashSet::new();
+        let mut stack: Vec<u32> = next(self.entry(start)).to_vec();
+        while let Some(id) = stack.pop() {
+            if found.insert(id) {
+                stack.extend_from_slice(next(self.entry(id)));
+            }
+        }
+        found
+    }
+
+    /// Adds a transaction paying `fee`, returning the txids evicted to make room
+    ///
+    /// Fails if the transaction is already pooled, spends an output a pooled transaction
+    /// spends, has too many unconfirmed ancestors, or pays too little to enter a full pool.
+    /// A transaction that would be evicted itself to make room, or lose an ancestor, is
+    /// rejected and the pool is left as it was.
+    pub fn insert(&mut self, tx: &Tx, fee: i64) -> Result<Vec<Hash256>, ChainGangError> {
+        if tx.coinbase() {
+            let msg = "Coinbase transactions can not be pooled".to_string();
+            return Err(ChainGangError::BadData(msg));
+        }
+        let mut raw = Vec::new();
+        tx.write(&mut raw)?;
+        let txid = sha256d(&raw);
+        if self.ids.contains_key(&txid) {
+            return Err(ChainGangError::BadData(format!("Already pooled: {txid:?}")));
+        }
+        let mut outpoints = HashSet::with_capacity(tx.inputs.len());
+        for input in tx.inputs.iter() {
+            if self.spent.contains_key(&input.prev_output) || !outpoints.insert(&input.prev_output)
+            {
+                let msg = format!("Double spend of {:?}", input.prev_output);
+                return Err(ChainGangError::BadData(msg));
+            }
+        }
+
+        let mut parents: Vec<u32> = tx
+            .inputs
+            .iter()
+            .filter_map(|input| self.ids.get(&input.prev_output.hash).copied())
+            .collect();
+        parents.sort_unstable();
+        parents.dedup();
+        let mut ancestors: HashSet<u32> = parents.iter().copied().collect();
+        for &parent in parents.iter() {
+            ancestors.extend(self.reachable(parent, |entry| &entry.parents[..]));
+        }
+        if ancestors.len() > self.config.max_ancestors {
+            let msg = format!("Too many unconfirmed ancestors: {}", ancestors.len());
+            return Err(ChainGangError::BadData(msg));
+        }
+
+        let size = raw.len();
+        let usage = ENTRY_OVERHEAD
+            + size
+            + tx.inputs.len() * INPUT_OVERHEAD
+            + parents.len() * LINK_OVERHEAD;
+        if self.usage + usage > self.config.max_bytes {
+            let min_score = self.by_score.first().map(|(score, _)| *score);
+            if usage > self.config.max_bytes || min_score >= Some(fee_rate(fee, size)) {
+                return Err(ChainGangError::BadData("Mempool full".to_string()));
+            }
+        }
+
+        let id = match self.free.pop() {
+            Some(id) => id,
+            None => {
+                self.entries.push(None);
+                (self.entries.len() - 1) as u32
+            }
+        };
+        for &ancestor in ancestors.iter() {
+            self.update(ancestor, |entry| {
+                entry.desc_fee += fee;
+                entry.desc_size += size;
+            });
+        }
+        for &parent in parents.iter() {
+            self.entries[parent as usize]
+                .as_mut()
+                .unwrap()
+                .children
+                .push(id);
+        }
+        for input in tx.inputs.iter() {
+            self.spent.insert(input.prev_output.clone(), id);
+        }
+        let entry = Entry {
+            txid,
+            raw: raw.into_boxed_slice(),
+            fee,
+            parents,
+            children: Vec::new(),
+            desc_fee: fee,
+            desc_size: size,
+            usage,
+        };
+        self.by_score.insert((entry.score(), id));
+        self.entries[id as usize] = Some(entry);
+        self.ids.insert(txid, id);
+        self.usage += usage;
+        self.tx_bytes += size;
+
+        let evicted = self.trim();
+        if self.ids.contains_key(&txid) {
+            self.evicted += evicted.len() as u64;
+            return Ok(txids(evicted));
+        }
+        // Put back the others, parents first. They fit, since the pool held them before.
+        for entry in evicted.iter().rev().filter(|entry| entry.txid != txid) {
+            if let Err(e) = self.insert(&entry.tx(), entry.fee) {
+                warn!("Failed to restore {:?} to the mempool: {e}", entry.txid);
+            }
+        }
+        Err(ChainGangError::BadData("Mempool full".to_string()))
+    }
+
+    /// Evicts the lowest scoring transactions and their descendants until under budget
+    ///
+    /// Each transaction follows its descendants in the entries returned.
+    fn trim(&mut self) -> Vec<Entry> {
+        let mut evicted = Vec::new();
+        while self.usage > self.config.max_bytes {
+            let Some(&(_, id)) = self.by_score.first() else {
+                break;
+            };
+            evicted.extend(self.remove_tree(id));
+        }
+        evicted
+    }
+
+    /// Removes a transaction and its descendants, children before parents
+    fn remove_tree(&mut self, id: u32) -> Vec<Entry> {
+        // Depth first post-order, so each transaction follows all its descendants
+        let mut order = Vec::new();
+        let mut visited = HashSet::new();
+        let mut stack = vec![(id, false)];
+        while let Some((id, expanded)) = stack.pop() {
+            if expanded {
+                order.push(id);
+            } else if visited.insert(id) {
+                stack.push((id, true));
+                for &child in self.entry(id).children.iter() {
+                    stack.push((child, false));
+                }
+            }
+        }
+        order.into_iter().map(|id| self.remove_one(id)).collect()
+    }
+
+    /// Removes one transaction, leaving any children in the pool
+    fn remove_one(&mut self, id: u32) -> Entry {
+        let (fee, size) = {
+            let entry = self.entry(id);
+            (entry.fee, entry.raw.len())
+        };
+        for ancestor in self.reachable(id, |entry| &entry.parents[..]) {
+            self.update(ancestor, |entry| {
+                entry.desc_fee -= fee;
+                entry.desc_size -= size;
+            });
+        }
+        let entry = self.entries[id as usize].take().unwrap();
+        self.by_score.remove(&(entry.score(), id));
+        for &parent in entry.parents.iter() {
+            let parent = self.entries[parent as usize].as_mut().unwrap();
+            parent.children.retain(|&child| child != id);
+        }
+        for &child in entry.children.iter() {
+            let child = self.entries[child as usize].as_mut().unwrap();
+            child.parents.retain(|&parent| parent != id);
+        }
+        for input in entry.tx().inputs {
+            if self.spent.get(&input.prev_output) == Some(&id) {
+                self.spent.remove(&input.prev_output);
+            }
+        }
+        self.ids.remove(&entry.txid);
+        self.usage -= entry.usage;
+        self.tx_bytes -= entry.raw.len();
+        self.free.push(id);
+        entry
+    }
+
+    /// Removes a transaction and its descendants, returning their txids
+    pub fn remove(&mut self, txid: &Hash256) -> Vec<Hash256> {
+        match self.ids.get(txid) {
+            Some(&id) => txids(self.remove_tree(id)),
+            None => Vec::new(),
+        }
+    }
+
+    /// Removes the transactions a block confirms and those that conflict with it
+    pub fn remove_for_block(&mut self, block: &Block) -> BlockRemoval {
+        self.remove_confirmed(&block.txns)
+    }
+
+    /// Removes confirmed transactions, given in block order, and those that conflict with them
+    pub fn remove_confirmed(&mut self, txs: &[Tx]) -> BlockRemoval {
+        let mut removal = BlockRemoval::default();
+        for tx in txs.iter() {
+            let txid = tx.hash();
+            if let Some(&id) = self.ids.get(&txid) {
+                self.remove_one(id);
+                removal.confirmed.push(txid);
+                continue;
+            }
+            for input in tx.inputs.iter() {
+                if let Some(&id) = self.spent.get(&input.prev_output) {
+                    removal.conflicted.extend(txids(self.remove_tree(id)));
+                }
+            }
+        }
+        removal
+    }
+
+    pub fn contains(&self, txid: &Hash256) -> bool {
+        self.ids.contains_key(txid)
+    }
+
+    /// Decodes a pooled transaction
+    pub fn get(&self, txid: &Hash256) -> Option<Tx> {
+        self.ids.get(txid).map(|&id| self.entry(id).tx())
+    }
+
+    /// Serialized bytes of a pooled transaction
+    pub fn get_raw(&self, txid: &Hash256) -> Option<&[u8]> {
+        self.ids.get(txid).map(|&id| &self.entry(id).raw[..])
+    }
+
+    /// Fee paid by a pooled transaction
+    pub fn fee(&self, txid: &Hash256) -> Option<i64> {
+        self.ids.get(txid).map(|&id| self.entry(id).fee)
+    }
+
+    /// The pooled transaction spending an output, if any
+    pub fn spender(&self, outpoint: &OutPoint) -> Option<Hash256> {
+        self.spent.get(outpoint).map(|&id| self.entry(id).txid)
+    }
+
+    /// Pooled transactions spending any of the outputs `tx` spends
+    pub fn conflicts(&self, tx: &Tx) -> Vec<Hash256> {
+        let mut conflicts: Vec<Hash256> = tx
+            .inputs
+            .iter()
+            .filter_map(|input| self.spender(&input.prev_output))
+            .collect();
+        conflicts.sort();
+        conflicts.dedup();
+        conflicts
+    }
+
+    /// Unconfirmed transactions that `txid` spends from, directly or indirectly
+    pub fn ancestors(&self, txid: &Hash256) -> Vec<Hash256> {
+        self.related(txid, |entry| &entry.parents[..])
+    }
+
+    /// Pooled transactions spending from `txid`, directly or indirectly
+    pub fn descendants(&self, txid: &Hash256) -> Vec<Hash256> {
+        self.related(txid, |entry| &entry.children[..])
+    }
+
+    fn related(&self, txid: &Hash256, next: impl Fn(&Entry) -> &[u32]) -> Vec<Hash256> {
+        let Some(&id) = self.ids.get(txid) else {
+            return Vec::new();
+        };
+        let mut related: Vec<Hash256> = self
+            .reachable(id, next)
+            .into_iter()
+            .map(|id| self.entry(id).txid)
+            .collect();
+        related.sort();
+        related
+    }
+
+    /// Txids of the pooled transactions
+    pub fn txids(&self) -> impl Iterator<Item = &Hash256> {
+        self.ids.keys()
+    }
+
+    pub fn len(&self) -> usize {
+        self.ids.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.ids.is_empty()
+    }
+
+    /// Fills a compact block from the pool, returning how many transactions were placed
+    pub fn fill_compact_block(&self, block: &mut PartialBlock) -> usize {
+        block.fill_with(self.ids.keys(), |txid| self.get(txid))
+    }
+
+    pub fn stats(&self) -> MempoolStats {
+        MempoolStats {
+            count: self.ids.len(),
+            tx_bytes: self.tx_bytes,
+            usage: self.usage,
+            max_bytes: self.config.max_bytes,
+            evicted: self.evicted,
+            min_fee_rate: self
+                .by_score
+                .first()
+                .map(|(score, _)| *score)
+                .unwrap_or_default(),
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::messages::{BlockHeader, Cmpctblock, Payload, TxIn, TxOut};
+    use crate::script::Script;
+
+    /// Transaction spending `prev` outputs with `outputs` new outputs
+    fn tx(prev: &[(Hash256, u32)], outputs: usize) -> Tx {
+        Tx {
+            version: 1,
+            inputs: prev
+                .iter()
+                .map(|&(hash, index)| TxIn {
+                    prev_output: OutPoint { hash, index },
+                    unlock_script: Script(vec![1; 100]),
+                    sequence: 0xffffffff,
+                })
+                .collect(),
+            outputs: (0..outputs)
+                .map(|i| TxOut {
+                    satoshis: 1000 + i as i64,
+                    lock_script: Script(vec![2; 25]),
+                })
+                .collect(),
+            lock_time: 0,
+        }
+    }
+
+    /// Transaction spending a confirmed output numbered `n`
+    fn confirmed(n: u32) -> Tx {
+        tx(&[(Hash256([9; 32]), n)], 2)
+    }
+
+    #[test]
+    fn insert_and_conflicts() {
+        let mut mempool = Mempool::new(MempoolConfig::default());
+        let a = confirmed(0);
+        assert!(mempool.insert(&a, 100).unwrap().is_empty());
+        assert!(mempool.insert(&a, 100).is_err());
+        assert_eq!(mempool.len(), 1);
+        assert!(mempool.get(&a.hash()).unwrap() == a);
+        assert_eq!(mempool.fee(&a.hash()), Some(100));
+        assert_eq!(mempool.get_raw(&a.hash()).unwrap().len(), a.size());
+
+        // Spending the same output again is a double spend
+        let mut b = confirmed(0);
+        b.lock_time = 5;
+        assert_eq!(mempool.conflicts(&b), vec![a.hash()]);
+        assert!(mempool.insert(&b, 1000).is_err());
+        assert_eq!(mempool.spender(&b.inputs[0].prev_output), Some(a.hash()));
+
+        // So is spending one output twice in a tx
+        let c = tx(&[(Hash256([8; 32]), 0), (Hash256([8; 32]), 0)], 1);
+        assert!(mempool.insert(&c, 1000).is_err());
+        assert!(mempool.spender(&c.inputs[0].prev_output).is_none());
+
+        let mut coinbase = confirmed(1);
+        coinbase.inputs[0].prev_output = OutPoint {
+            hash: crate::messages::COINBASE_OUTPOINT_HASH,
+            index: crate::messages::COINBASE_OUTPOINT_INDEX,
+        };
+        assert!(mempool.insert(&coinbase, 0).is_err());
+    }
+
+    #[test]
+    fn chains() {
+        let mut mempool = Mempool::new(MempoolConfig::default());
+        let a = confirmed(0);
+        let b = tx(&[(a.hash(), 0)], 1);
+        let c = tx(&[(a.hash(), 1), (b.hash(), 0)], 1);
+        let d = confirmed(1);
+        for (tx, fee) in [(&a, 10), (&b, 20), (&c, 30), (&d, 40)] {
+            mempool.insert(tx, fee).unwrap();
+        }
+        let mut ab = vec![a.hash(), b.hash()];
+        ab.sort();
+        let mut bc = vec![b.hash(), c.hash()];
+        bc.sort();
+        assert_eq!(mempool.ancestors(&c.hash()), ab);
+        assert_eq!(mempool.descendants(&a.hash()), bc);
+        assert!(mempool.descendants(&d.hash()).is_empty());
+
+        let entry = mempool.entry(mempool.ids[&a.hash()]);
+        assert_eq!(entry.desc_fee, 60);
+        assert_eq!(entry.desc_size, a.size() + b.size() + c.size());
+
+        // Removing b takes c with it and updates a's package
+        let mut removed = mempool.remove(&b.hash());
+        removed.sort();
+        assert_eq!(removed, bc);
+        let entry = mempool.entry(mempool.ids[&a.hash()]);
+        assert_eq!((entry.desc_fee, entry.desc_size), (10, a.size()));
+        assert!(entry.children.is_empty());
+        assert!(mempool.spender(&c.inputs[0].prev_output).is_none());
+        assert_eq!(mempool.len(), 2);
+
+        // Too many ancestors
+        let config = MempoolConfig {
+            max_ancestors: 1,
+            ..Default::default()
+        };
+        let mut mempool = Mempool::new(config);
+        mempool.insert(&a, 10).unwrap();
+        mempool.insert(&b, 10).unwrap();
+        assert!(mempool.insert(&c, 10).is_err());
+    }
+
+    #[test]
+    fn block_removal() {
+        let mut mempool = Mempool::new(MempoolConfig::default());
+        let a = confirmed(0);
+        let b = tx(&[(a.hash(), 0)], 1);
+        let c = confirmed(1);
+        let c_child = tx(&[(c.hash(), 0)], 1);
+        for tx in [&a, &b, &c, &c_child] {
+            mempool.insert(tx, 100).unwrap();
+        }
+
+        // The block confirms a and double spends c's input
+        let mut c_conflict = confirmed(1);
+        c_conflict.lock_time = 1;
+        let removal = mempool.remove_confirmed(&[a.clone(), c_conflict]);
+        assert_eq!(removal.confirmed, vec![a.hash()]);
+        assert_eq!(removal.conflicted, vec![c_child.hash(), c.hash()]);
+        assert_eq!(mempool.len(), 1);
+        assert!(mempool.contains(&b.hash()));
+        assert!(mempool.ancestors(&b.hash()).is_empty());
+
+        let stats = mempool.stats();
+        assert_eq!(stats.tx_bytes, b.size());
+        let removal = mempool.remove_confirmed(&[b]);
+        assert_eq!(removal.confirmed.len(), 1);
+        assert_eq!(mempool.stats().usage, 0);
+        assert!(mempool.spent.is_empty() && mempool.by_score.is_empty());
+    }
+
+    #[test]
+    fn eviction() {
+        let per_tx = {
+            let mut mempool = Mempool::new(MempoolConfig::default());
+            mempool.insert(&confirmed(0), 0).unwrap();
+            mempool.stats().usage
+        };
+        let config = MempoolConfig {
+            max_bytes: per_tx * 10,
+            ..Default::default()
+        };
+        let mut mempool = Mempool::new(config);
+        for n in 0..10 {
+            assert!(mempool
+                .insert(&confirmed(n), 100 + n as i64)
+                .unwrap()
+                .is_empty());
+        }
+
+        // Paying less than the cheapest pooled tx is rejected once full
+        assert!(mempool.insert(&confirmed(10), 50).is_err());
+        let evicted = mempool.insert(&confirmed(11), 500).unwrap();
+        assert_eq!(evicted, vec![confirmed(0).hash()]);
+        assert_eq!(mempool.stats().evicted, 1);
+        assert!(mempool.stats().usage <= per_tx * 10);
+
+        // A low fee parent with a high fee child is kept for the child's sake
+        let parent = confirmed(1);
+        let child = tx(&[(parent.hash(), 0)], 1);
+        let evicted = mempool.insert(&child, 100_000).unwrap();
+        assert!(!evicted.contains(&parent.hash()));
+        assert!(mempool.contains(&parent.hash()) && mempool.contains(&child.hash()));
+        assert!(mempool.stats().usage <= per_tx * 10);
+    }
+
+    #[test]
+    fn rejects_tx_evicted_to_make_room() {
+        let per_tx = {
+            let mut mempool = Mempool::new(MempoolConfig::default());
+            mempool.insert(&confirmed(0), 0).unwrap();
+            mempool.stats().usage
+        };
+        let config = MempoolConfig {
+            max_bytes: per_tx * 10,
+            ..Default::default()
+        };
+        let mut mempool = Mempool::new(config);
+        for n in 0..10 {
+            mempool.insert(&confirmed(n), 100 + n as i64).unwrap();
+        }
+        let before = mempool.stats();
+
+        // Outbids the cheapest tx, but needs room of several and is next in line itself
+        let big = tx(&[(Hash256([99; 32]), 0)], 20);
+        let fee = 201 * big.size() as i64 / (2 * confirmed(0).size() as i64);
+        assert!(mempool.insert(&big, fee).is_err());
+        assert!(!mempool.contains(&big.hash()));
+        assert!((0..10).all(|n| mempool.contains(&confirmed(n).hash())));
+        assert_eq!(mempool.stats(), before);
+    }
+
+    #[test]
+    fn compact_block() {
+        let txs: Vec<Tx> = (0..20).map(confirmed).collect();
+        let mut mempool = Mempool::new(MempoolConfig::default());
+        for tx in txs.iter().skip(1).take(15) {
+            mempool.insert(tx, 100).unwrap();
+        }
+        let mut block = Block {
+            header: BlockHeader::default(),
+            txns: txs,
+        };
+        block.header.merkle_root = block.merkle_root();
+
+        let cmpctblock = Cmpctblock::from_block(&block, 3, &[]);
+        let mut partial = PartialBlock::new(&cmpctblock).unwrap();
+        assert_eq!(mempool.fill_compact_block(&mut partial), 15);
+        assert_eq!(partial.missing(), vec![16, 17, 18, 19]);
+    }
+}
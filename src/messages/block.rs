@@ -111,7 +111,7 @@ impl Block {
     }
 
     /// Calculates the merkle root from the transactions
-    fn merkle_root(&self) -> Hash256 {
+    pub(crate) fn merkle_root(&self) -> Hash256 {
         let mut row = VecDeque::new();
         for tx in self.txns.iter() {
             row.push_back(tx.hash());
@@ -0,0 +1,543 @@
+//! Block messages received straight to disk
+//!
+//! Block payloads are exempt from [`MAX_PAYLOAD_SIZE`](crate::messages::MAX_PAYLOAD_SIZE) and may
+//! be gigabytes. Reading one with [`Message::read`](crate::messages::Message::read) holds the
+//! payload in memory and then every parsed transaction on top of it. A [`BlockDownload`] instead
+//! writes the payload to a file in fixed size chunks, hashing it for the checksum as it goes, and
+//! produces a [`BlockFile`] that parses the header up front and the transactions lazily, one at a
+//! time, so memory use does not grow with the block.
+
+use crate::messages::{commands, Block, BlockHeader, MessageHeader, Tx};
+use crate::util::{var_int, ChainGangError, Hash256, Serializable};
+use sha2::{Digest, Sha256};
+use std::fs::{self, File};
+use std::io::{self, BufReader, BufWriter, Read, Seek, SeekFrom, Write};
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicBool, AtomicU64, Ordering};
+
+/// Payload bytes read and written at a time
+const CHUNK_SIZE: usize = 64 * 1024;
+
+/// Smallest possible serialized transaction, used to bound the transaction count
+const MIN_TX_SIZE: u64 = 10;
+
+/// Distinguishes the files of downloads started by this process
+static NEXT_DOWNLOAD: AtomicU64 = AtomicU64::new(0);
+
+/// Where and when to receive block messages to disk
+#[derive(Debug, Clone, PartialEq, Eq)]
+pub struct BlockSpool {
+    /// Directory the block files are written in
+    pub dir: PathBuf,
+    /// Blocks with smaller payloads are read into memory as usual
+    pub min_size: u32,
+}
+
+impl BlockSpool {
+    /// Spools blocks of 32MB and up into `dir`
+    pub fn new(dir: impl Into<PathBuf>) -> BlockSpool {
+        BlockSpool {
+            dir: dir.into(),
+            min_size: 32 * 1024 * 1024,
+        }
+    }
+
+    /// Starts a download if the message is a block large enough to spool
+    pub fn start(&self, header: &MessageHeader) -> Result<Option<BlockDownload>, ChainGangError> {
+        if header.command != commands::BLOCK || header.payload_size < self.min_size {
+            return Ok(None);
+        }
+        let name = format!(
+            "block-{}-{}.part",
+            std::process::id(),
+            NEXT_DOWNLOAD.fetch_add(1, Ordering::Relaxed)
+        );
+        Ok(Some(BlockDownload::create(header, self.dir.join(name))?))
+    }
+}
+
+/// Block payload being received into a file
+///
+/// The file is removed if the download is dropped before it is finished.
+pub struct BlockDownload {
+    header: MessageHeader,
+    path: PathBuf,
+    file: Option<BufWriter<File>>,
+    hasher: Sha256,
+    received: u64,
+    /// Chunk buffer for `read_from`
+    buf: Vec<u8>,
+    /// Set once the file is handed to a `BlockFile`
+    done: bool,
+}
+
+impl BlockDownload {
+    /// Creates the file for the payload of a message whose header has been read
+    pub fn create(header: &MessageHeader, path: PathBuf) -> Result<BlockDownload, ChainGangError> {
+        let file = BufWriter::with_capacity(CHUNK_SIZE, File::create(&path)?);
+        Ok(BlockDownload {
+            header: header.clone(),
+            path,
+            file: Some(file),
+            hasher: Sha256::new(),
+            received: 0,
+            buf: Vec::new(),
+            done: false,
+        })
+    }
+
+    /// Writes the next payload bytes from `data`, returning how many were used
+    ///
+    /// Bytes past the end of the payload are left for the next message.
+    pub fn write(&mut self, data: &[u8]) -> Result<usize, ChainGangError> {
+        let used = data.len().min(self.remaining() as usize);
+        let data = &data[..used];
+        self.hasher.update(data);
+        self.file.as_mut().unwrap().write_all(data)?;
+        self.received += used as u64;
+        Ok(used)
+    }
+
+    /// Reads the rest of the payload from `reader`
+    ///
+    /// A timeout is returned as an error after saving what was read, so the call may be repeated
+    /// to continue the download.
+    pub fn read_from(&mut self, reader: &mut dyn Read) -> Result<(), ChainGangError> {
+        self.buf.resize(CHUNK_SIZE, 0);
+        while !self.is_complete() {
+            let want = CHUNK_SIZE.min(self.remaining() as usize);
+            let read = match reader.read(&mut self.buf[..want]) {
+                Ok(0) => return Err(io::Error::from(io::ErrorKind::UnexpectedEof).into()),
+                Ok(read) => read,
+                Err(e) if e.kind() == io::ErrorKind::Interrupted => continue,
+                Err(e) => return Err(e.into()),
+            };
+            let buf = std::mem::take(&mut self.buf);
+            let result = self.write(&buf[..read]);
+            self.buf = buf;
+            result?;
+        }
+        Ok(())
+    }
+
+    /// Payload bytes received so far
+    pub fn received(&self) -> u64 {
+        self.received
+    }
+
+    /// Payload bytes still to be received
+    pub fn remaining(&self) -> u64 {
+        self.header.payload_size as u64 - self.received
+    }
+
+    pub fn is_complete(&self) -> bool {
+        self.remaining() == 0
+    }
+
+    /// Verifies the checksum of the complete payload and opens the block
+    ///
+    /// The returned block removes its file when dropped unless it is persisted.
+    pub fn finish(mut self) -> Result<BlockFile, ChainGangError> {
+        if !self.is_complete() {
+            let msg = format!("{} payload bytes missing", self.remaining());
+            return Err(ChainGangError::IllegalState(msg));
+        }
+        let mut file = self.file.take().unwrap();
+        file.flush()?;
+        drop(file);
+        let hasher = std::mem::take(&mut self.hasher);
+        self.header
+            .check_checksum(&Sha256::digest(hasher.finalize()))?;
+        let block = BlockFile::open(&self.path)?;
+        block.temporary.store(true, Ordering::Relaxed);
+        self.done = true;
+        Ok(block)
+    }
+}
+
+impl Drop for BlockDownload {
+    fn drop(&mut self) {
+        if !self.done {
+            // Close the file before removing it
+            self.file.take();
+            if let Err(e) = fs::remove_file(&self.path) {
+                warn!("Failed to remove block download {:?}: {e}", self.path);
+            }
+        }
+    }
+}
+
+/// Block stored in a file, with its transactions parsed on demand
+pub struct BlockFile {
+    path: PathBuf,
+    header: BlockHeader,
+    tx_count: u64,
+    /// Offset of the first transaction
+    txs_offset: u64,
+    size: u64,
+    /// Whether the file is removed when the block is dropped
+    temporary: AtomicBool,
+}
+
+impl BlockFile {
+    /// Opens a serialized block, reading its header and transaction count
+    pub fn open(path: &Path) -> Result<BlockFile, ChainGangError> {
+        let mut reader = BufReader::new(File::open(path)?);
+        let size = reader.get_ref().metadata()?.len();
+        let header = BlockHeader::read(&mut reader)?;
+        let tx_count = var_int::read(&mut reader)?;
+        if tx_count == 0 || tx_count > size / MIN_TX_SIZE {
+            let msg = format!("Bad tx count: {tx_count}");
+            return Err(ChainGangError::BadData(msg));
+        }
+        Ok(BlockFile {
+            path: path.to_path_buf(),
+            header,
+            tx_count,
+            txs_offset: (BlockHeader::SIZE + var_int::size(tx_count)) as u64,
+            size,
+            temporary: AtomicBool::new(false),
+        })
+    }
+
+    pub fn header(&self) -> &BlockHeader {
+        &self.header
+    }
+
+    pub fn hash(&self) -> Hash256 {
+        self.header.hash()
+    }
+
+    pub fn tx_count(&self) -> u64 {
+        self.tx_count
+    }
+
+    /// Size of the serialized block in bytes
+    pub fn size(&self) -> u64 {
+        self.size
+    }
+
+    pub fn path(&self) -> &Path {
+        &self.path
+    }
+
+    /// Keeps the file after the block is dropped
+    pub fn persist(&self) {
+        self.temporary.store(false, Ordering::Relaxed);
+    }
+
+    /// Iterates over the transactions, reading each from the file as it is needed
+    pub fn txs(&self) -> Result<BlockFileTxs, ChainGangError> {
+        let mut file = File::open(&self.path)?;
+        file.seek(SeekFrom::Start(self.txs_offset))?;
+        Ok(BlockFileTxs {
+            reader: BufReader::with_capacity(CHUNK_SIZE, file),
+            remaining: self.tx_count,
+        })
+    }
+
+    /// Calculates the merkle root, keeping one hash per level of the tree in memory
+    pub fn merkle_root(&self) -> Result<Hash256, ChainGangError> {
+        let mut txs = self.txs()?;
+        let mut merkle = MerkleStream::default();
+        while txs.remaining > 0 {
+            txs.remaining -= 1;
+            merkle.push(read_tx(&mut txs.reader)?.0);
+        }
+        Ok(merkle.root())
+    }
+
+    /// Reads the whole block into memory
+    pub fn to_block(&self) -> Result<Block, ChainGangError> {
+        Ok(Block {
+            header: self.header.clone(),
+            txns: self.txs()?.collect::<Result<_, _>>()?,
+        })
+    }
+}
+
+impl Drop for BlockFile {
+    fn drop(&mut self) {
+        if self.temporary.load(Ordering::Relaxed) {
+            if let Err(e) = fs::remove_file(&self.path) {
+                warn!("Failed to remove block file {:?}: {e}", self.path);
+            }
+        }
+    }
+}
+
+impl std::fmt::Debug for BlockFile {
+    fn fmt(&self, f: &mut std::fmt::Formatter) -> std::fmt::Result {
+        f.debug_struct("BlockFile")
+            .field("path", &self.path)
+            .field("header", &self.header)
+            .field("tx_count", &self.tx_count)
+            .field("size", &self.size)
+            .finish()
+    }
+}
+
+/// Transactions of a [`BlockFile`], parsed one at a time
+pub struct BlockFileTxs {
+    reader: BufReader<File>,
+    remaining: u64,
+}
+
+impl Iterator for BlockFileTxs {
+    type Item = Result<Tx, ChainGangError>;
+
+    fn next(&mut self) -> Option<Self::Item> {
+        if self.remaining == 0 {
+            return None;
+        }
+        self.remaining -= 1;
+        let tx = Tx::read(&mut self.reader);
+        if tx.is_err() {
+            self.remaining = 0;
+        }
+        Some(tx)
+    }
+
+    fn size_hint(&self) -> (usize, Option<usize>) {
+        (0, Some(self.remaining as usize))
+    }
+}
+
+/// Reader that hashes the bytes passing through it
+struct HashingReader<'a> {
+    reader: &'a mut dyn Read,
+    hasher: Sha256,
+}
+
+impl Read for HashingReader<'_> {
+    fn read(&mut self, buf: &mut [u8]) -> io::Result<usize> {
+        let read = self.reader.read(buf)?;
+        self.hasher.update(&buf[..read]);
+        Ok(read)
+    }
+}
+
+/// Reads a transaction and its txid, hashing the bytes as read instead of serializing again
+fn read_tx(reader: &mut dyn Read) -> Result<(Hash256, Tx), ChainGangError> {
+    let mut hashing = HashingReader {
+        reader,
+        hasher: Sha256::new(),
+    };
+    let tx = Tx::read(&mut hashing)?;
+    Ok((finish_sha256d(hashing.hasher), tx))
+}
+
+/// Merkle root calculation over a stream of txids
+///
+/// Holds the root of each complete subtree so far, at most one per level, and duplicates the
+/// last hash of odd rows at the end like [`Block::merkle_root`] does.
+#[derive(Default)]
+struct MerkleStream {
+    inner: Vec<Hash256>,
+    count: u64,
+}
+
+/// Completes a double SHA256 of the data given to `hasher`
+fn finish_sha256d(hasher: Sha256) -> Hash256 {
+    let mut hash = Hash256::default();
+    hash.0.clone_from_slice(&Sha256::digest(hasher.finalize()));
+    hash
+}
+
+fn hash_pair(left: &Hash256, right: &Hash256) -> Hash256 {
+    let mut hasher = Sha256::new();
+    hasher.update(left.0);
+    hasher.update(right.0);
+    finish_sha256d(hasher)
+}
+
+impl MerkleStream {
+    fn push(&mut self, mut hash: Hash256) {
+        self.count += 1;
+        let mut level = 0;
+        while self.count & (1 << level) == 0 {
+            hash = hash_pair(&self.inner[level], &hash);
+            level += 1;
+        }
+        if level == self.inner.len() {
+            self.inner.push(hash);
+        } else {
+            self.inner[level] = hash;
+        }
+    }
+
+    fn root(mut self) -> Hash256 {
+        if self.count == 0 {
+            return Hash256::default();
+        }
+        let mut level = self.count.trailing_zeros() as usize;
+        let mut hash = self.inner[level];
+        while self.count != 1 << level {
+            // An unpaired subtree is paired with itself and carried up
+            hash = hash_pair(&hash, &hash);
+            self.count += 1 << level;
+            level += 1;
+            while self.count & (1 << level) == 0 {
+                hash = hash_pair(&self.inner[level], &hash);
+                level += 1;
+            }
+        }
+        hash
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::messages::{Message, OutPoint, TxIn, TxOut};
+    use crate::network::Network;
+    use crate::script::Script;
+    use std::io::Cursor;
+
+    fn block(tx_count: usize) -> Block {
+        let txns = (0..tx_count)
+            .map(|i| Tx {
+                version: 1,
+                inputs: vec![TxIn {
+                    prev_output: OutPoint {
+                        hash: Hash256([i as u8; 32]),
+                        index: i as u32,
+                    },
+                    unlock_script: Script(vec![5; 40]),
+                    sequence: 0,
+                }],
+                outputs: vec![TxOut {
+                    satoshis: i as i64,
+                    lock_script: Script(vec![6; 25]),
+                }],
+                lock_time: 0,
+            })
+            .collect();
+        let mut block = Block {
+            header: BlockHeader::default(),
+            txns,
+        };
+        block.header.merkle_root = block.merkle_root();
+        block
+    }
+
+    fn spool() -> BlockSpool {
+        let dir = std::env::temp_dir().join(format!("block-file-{}", std::process::id()));
+        fs::create_dir_all(&dir).unwrap();
+        BlockSpool { dir, min_size: 0 }
+    }
+
+    /// Serializes a block message and returns its header and payload
+    fn message(block: &Block) -> (MessageHeader, Vec<u8>) {
+        let mut bytes = Vec::new();
+        Message::Block(block.clone())
+            .write(&mut bytes, Network::BSV_Mainnet.magic())
+            .unwrap();
+        let header = MessageHeader::read(&mut Cursor::new(&bytes)).unwrap();
+        (header, bytes[MessageHeader::SIZE..].to_vec())
+    }
+
+    #[test]
+    fn streaming_merkle_root() {
+        for tx_count in 1..=17 {
+            let block = block(tx_count);
+            let mut merkle = MerkleStream::default();
+            for tx in block.txns.iter() {
+                merkle.push(tx.hash());
+            }
+            assert_eq!(merkle.root(), block.merkle_root(), "{tx_count}");
+        }
+    }
+
+    #[test]
+    fn download_in_pieces() {
+        let block = block(11);
+        let (header, payload) = message(&block);
+        let spool = spool();
+        let mut download = spool.start(&header).unwrap().unwrap();
+        let mut offset = 0;
+        for size in [1, 80, 300, 7].iter().cycle() {
+            if download.is_complete() {
+                break;
+            }
+            let end = (offset + size).min(payload.len());
+            offset += download.write(&payload[offset..end]).unwrap();
+        }
+        assert_eq!(download.write(b"next message").unwrap(), 0);
+        assert_eq!(download.received(), payload.len() as u64);
+
+        let file = download.finish().unwrap();
+        let path = file.path().to_path_buf();
+        assert_eq!(file.hash(), block.header.hash());
+        assert_eq!(file.tx_count(), 11);
+        assert_eq!(file.size(), payload.len() as u64);
+        assert_eq!(file.merkle_root().unwrap(), block.header.merkle_root);
+        let txs: Vec<Tx> = file.txs().unwrap().map(Result::unwrap).collect();
+        assert_eq!(txs, block.txns);
+        assert_eq!(file.to_block().unwrap(), block);
+
+        // Temporary files go with the block unless persisted
+        drop(file);
+        assert!(!path.exists());
+        let mut download = spool.start(&header).unwrap().unwrap();
+        download.read_from(&mut Cursor::new(&payload)).unwrap();
+        let file = download.finish().unwrap();
+        file.persist();
+        let path = file.path().to_path_buf();
+        drop(file);
+        assert_eq!(BlockFile::open(&path).unwrap().to_block().unwrap(), block);
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn resumes_after_timeout() {
+        let block = block(3);
+        let (header, payload) = message(&block);
+        let mut download = spool().start(&header).unwrap().unwrap();
+
+        let mut first = Cursor::new(&payload[..50]);
+        let e = download.read_from(&mut first).unwrap_err();
+        assert!(matches!(e, ChainGangError::IoError(_)));
+        assert_eq!(download.received(), 50);
+        let path = download.path.clone();
+        assert!(download.finish().is_err());
+        assert!(!path.exists());
+
+        let mut download = spool().start(&header).unwrap().unwrap();
+        download.write(&payload[..50]).unwrap();
+        download
+            .read_from(&mut Cursor::new(&payload[50..]))
+            .unwrap();
+        assert_eq!(download.finish().unwrap().to_block().unwrap(), block);
+    }
+
+    #[test]
+    fn bad_checksum_removes_file() {
+        let (mut header, payload) = message(&block(2));
+        header.checksum = [0; 4];
+        let mut download = spool().start(&header).unwrap().unwrap();
+        let path = download.path.clone();
+        download.write(&payload).unwrap();
+        assert!(download.finish().is_err());
+        assert!(!path.exists());
+    }
+
+    #[test]
+    fn small_and_other_messages_are_not_spooled() {
+        let (header, _) = message(&block(1));
+        let spool = BlockSpool {
+            min_size: header.payload_size + 1,
+            ..spool()
+        };
+        assert!(spool.start(&header).unwrap().is_none());
+        let mut ping = header.clone();
+        ping.command = commands::PING;
+        assert!(BlockSpool {
+            min_size: 0,
+            ..spool
+        }
+        .start(&ping)
+        .unwrap()
+        .is_none());
+    }
+}
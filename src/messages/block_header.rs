@@ -1,5 +1,6 @@
 use crate::util::{sha256d, ChainGangError, Hash256, Serializable};
 use byteorder::{LittleEndian, ReadBytesExt, WriteBytesExt};
+use num_bigint::BigUint;
 use std::cmp::min;
 use std::io;
 use std::io::{Read, Write};
@@ -69,7 +70,7 @@ impl BlockHeader {
     }
 
     /// Calculates the target difficulty hash
-    fn difficulty_target(&self) -> Result<Hash256, ChainGangError> {
+    pub fn difficulty_target(&self) -> Result<Hash256, ChainGangError> {
         let exp = (self.bits >> 24) as usize;
         if !(3..=32).contains(&exp) {
             let msg = format!("Difficulty exponent out of range: {:?}", self.bits);
@@ -81,6 +82,12 @@ impl BlockHeader {
         difficulty[exp - 3] = (self.bits & 0xff) as u8;
         Ok(Hash256(difficulty))
     }
+
+    /// Calculates the expected number of hashes to mine a header with these bits
+    pub fn work(&self) -> Result<BigUint, ChainGangError> {
+        let target = BigUint::from_bytes_le(&self.difficulty_target()?.0);
+        Ok((BigUint::from(1_u32) << 256) / (target + 1_u32))
+    }
 }
 
 impl Serializable<BlockHeader> for BlockHeader {
@@ -199,4 +206,23 @@ mod tests {
         h.nonce = 0;
         assert!(h.validate(&h.hash(), &headers).is_err());
     }
+
+    #[test]
+    fn work() {
+        let genesis = BlockHeader {
+            bits: 0x1d00ffff,
+            ..Default::default()
+        };
+        assert_eq!(genesis.work().unwrap(), BigUint::from(0x100010001_u64));
+        let harder = BlockHeader {
+            bits: 0x1c7fff80,
+            ..Default::default()
+        };
+        assert_eq!(harder.work().unwrap(), BigUint::from(0x200020002_u64));
+        let bad = BlockHeader {
+            bits: 0x01003456,
+            ..Default::default()
+        };
+        assert!(bad.work().is_err());
+    }
 }
@@ -1,8 +1,10 @@
 use std::io;
 use std::io::{Read, Write};
 
-use crate::messages::{BlockHeader, Payload, Tx, MAX_SATOSHIS};
-use crate::util::{var_int, ChainGangError, Serializable};
+use crate::messages::getblocktxn::{decode_indexes, encode_indexes};
+use crate::messages::{Block, BlockHeader, Payload, Tx, MAX_SATOSHIS};
+use crate::util::sha256::sha256;
+use crate::util::{siphash24, var_int, ChainGangError, Hash256, Serializable};
 use byteorder::{LittleEndian, ReadBytesExt, WriteBytesExt};
 
 type ShortTXID = Vec<u8>;
@@ -11,7 +13,7 @@ pub const SHORT_TX_ID_LEN: usize = 6;
 
 #[derive(Debug, Default, PartialEq, Eq, Hash, Clone)]
 pub struct PrefilledTransaction {
-    ///  The index into the block at which this transaction is
+    ///  The index into the block at which this transaction is, differentially encoded
     pub index: u64,
     ///  The transaction which is in the block at index index.
     pub tx: Tx,
@@ -92,6 +94,60 @@ pub struct Cmpctblock {
 }
 
 impl Cmpctblock {
+    /// Creates a compact block that sends the coinbase and the transactions at `prefill` in full
+    ///
+    /// `prefill` must be in increasing order.
+    pub fn from_block(block: &Block, nonce: u64, prefill: &[usize]) -> Cmpctblock {
+        let mut prefilled: Vec<usize> = Vec::with_capacity(prefill.len() + 1);
+        if !block.txns.is_empty() {
+            prefilled.push(0);
+        }
+        prefilled.extend(prefill.iter().filter(|&&i| i > 0 && i < block.txns.len()));
+        prefilled.dedup();
+
+        let mut cmpctblock = Cmpctblock {
+            header: block.header.clone(),
+            nonce,
+            ..Default::default()
+        };
+        let keys = cmpctblock.short_id_keys();
+        let mut next = prefilled.iter().peekable();
+        for (i, tx) in block.txns.iter().enumerate() {
+            if next.next_if(|&&index| index == i).is_none() {
+                let id = short_id(keys, &tx.hash());
+                cmpctblock
+                    .shortids
+                    .push(id.to_le_bytes()[..SHORT_TX_ID_LEN].to_vec());
+            }
+        }
+        cmpctblock.prefilledtxn = encode_indexes(&prefilled)
+            .into_iter()
+            .zip(prefilled.iter())
+            .map(|(index, &i)| PrefilledTransaction {
+                index,
+                tx: block.txns[i].clone(),
+            })
+            .collect();
+        cmpctblock
+    }
+
+    /// SipHash keys for the block's short transaction IDs
+    pub fn short_id_keys(&self) -> (u64, u64) {
+        let mut data = Vec::with_capacity(BlockHeader::SIZE + 8);
+        self.header.write(&mut data).unwrap();
+        data.extend_from_slice(&self.nonce.to_le_bytes());
+        let hash = sha256(&data);
+        (
+            u64::from_le_bytes(hash[0..8].try_into().unwrap()),
+            u64::from_le_bytes(hash[8..16].try_into().unwrap()),
+        )
+    }
+
+    /// Decodes the prefilled transaction indexes into positions in the block
+    pub fn prefilled_indexes(&self) -> Result<Vec<usize>, ChainGangError> {
+        decode_indexes(self.prefilledtxn.iter().map(|prefilled| prefilled.index))
+    }
+
     /// Checks if the message is valid
     pub fn validate(&self) -> Result<(), ChainGangError> {
         // Check header is valid - needs blockhash and previous headers
@@ -103,6 +159,19 @@ impl Cmpctblock {
     }
 }
 
+/// Computes the 6 byte short ID of a transaction, returned in the low bits
+pub fn short_id(keys: (u64, u64), txid: &Hash256) -> u64 {
+    siphash24(keys.0, keys.1, &txid.0) & 0xffff_ffff_ffff
+}
+
+/// Reads a short ID from its little endian bytes
+pub(crate) fn short_id_from_bytes(bytes: &[u8]) -> u64 {
+    let mut buf = [0u8; 8];
+    let len = bytes.len().min(SHORT_TX_ID_LEN);
+    buf[..len].copy_from_slice(&bytes[..len]);
+    u64::from_le_bytes(buf)
+}
+
 impl Serializable<Cmpctblock> for Cmpctblock {
     fn read(reader: &mut dyn Read) -> Result<Cmpctblock, ChainGangError> {
         let mut ret = Cmpctblock {
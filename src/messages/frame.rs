@@ -0,0 +1,377 @@
+//! Framed message reading with pooled buffers and borrowed views
+//!
+//! [`Message::read`] decodes every payload into owned structs. A [`FrameReader`] instead reads
+//! each message into a pooled buffer, verifying the checksum as the bytes arrive, and returns a
+//! [`Frame`]. Frames decode to a [`Message`] on demand, and the hot relay messages can be
+//! inspected in place through [`InvView`] and [`TxView`] without allocating.
+//!
+//! Peers do not use frames, since their observers receive owned messages. Their read paths
+//! share the decoder table and buffer pool through [`Message::read_partial`] and
+//! [`Message::decode`].
+
+use crate::messages::{
+    commands, Inv, InvVect, Message, MessageHeader, Tx, MAX_INV_ENTRIES, MAX_PAYLOAD_SIZE,
+};
+use crate::util::{
+    sha256d, var_int, BufferPool, ChainGangError, Hash256, PooledBuffer, Serializable,
+};
+use byteorder::{ByteOrder, LittleEndian};
+use std::fmt;
+use std::io::{self, Read};
+use std::sync::Arc;
+
+/// Message header and its checksummed payload
+pub struct Frame {
+    pub header: MessageHeader,
+    payload: PooledBuffer,
+}
+
+impl Frame {
+    /// Payload bytes
+    pub fn payload(&self) -> &[u8] {
+        &self.payload
+    }
+
+    /// Decodes the payload into an owned message
+    pub fn message(&self) -> Result<Message, ChainGangError> {
+        Message::decode(&self.header, &self.payload)
+    }
+
+    /// Views an inv payload in place
+    pub fn inv(&self) -> Result<InvView<'_>, ChainGangError> {
+        self.expect(commands::INV)?;
+        InvView::parse(&self.payload)
+    }
+
+    /// Views a getdata payload in place
+    pub fn getdata(&self) -> Result<InvView<'_>, ChainGangError> {
+        self.expect(commands::GETDATA)?;
+        InvView::parse(&self.payload)
+    }
+
+    /// Views a tx payload in place
+    pub fn tx(&self) -> Result<TxView<'_>, ChainGangError> {
+        self.expect(commands::TX)?;
+        TxView::parse(&self.payload)
+    }
+
+    fn expect(&self, command: [u8; 12]) -> Result<(), ChainGangError> {
+        if self.header.command != command {
+            let msg = format!("Unexpected command: {:?}", self.header);
+            return Err(ChainGangError::BadData(msg));
+        }
+        Ok(())
+    }
+}
+
+impl fmt::Debug for Frame {
+    fn fmt(&self, f: &mut fmt::Formatter) -> fmt::Result {
+        f.debug_struct("Frame")
+            .field("header", &self.header)
+            .finish()
+    }
+}
+
+/// Reads messages as frames into buffers taken from a pool
+pub struct FrameReader<R: Read> {
+    reader: R,
+    magic: [u8; 4],
+    pool: Arc<BufferPool>,
+}
+
+impl<R: Read> FrameReader<R> {
+    /// Creates a reader that uses the shared buffer pool
+    pub fn new(reader: R, magic: [u8; 4]) -> FrameReader<R> {
+        FrameReader::with_pool(reader, magic, BufferPool::shared())
+    }
+
+    /// Creates a reader that takes its buffers from `pool`
+    pub fn with_pool(reader: R, magic: [u8; 4], pool: Arc<BufferPool>) -> FrameReader<R> {
+        FrameReader {
+            reader,
+            magic,
+            pool,
+        }
+    }
+
+    /// Reads the next message, verifying its header and checksum
+    ///
+    /// The payload buffer returns to the pool when the frame is dropped.
+    pub fn read_frame(&mut self) -> Result<Frame, ChainGangError> {
+        let header = MessageHeader::read(&mut self.reader)?;
+        header.validate(self.magic, MAX_PAYLOAD_SIZE)?;
+        let mut payload = self.pool.get();
+        header.read_payload_into(&mut self.reader, &mut payload)?;
+        Ok(Frame { header, payload })
+    }
+
+    /// Reads and decodes the next message
+    pub fn read_message(&mut self) -> Result<Message, ChainGangError> {
+        self.read_frame()?.message()
+    }
+
+    pub fn get_ref(&self) -> &R {
+        &self.reader
+    }
+
+    pub fn get_mut(&mut self) -> &mut R {
+        &mut self.reader
+    }
+
+    pub fn into_inner(self) -> R {
+        self.reader
+    }
+}
+
+/// Borrowed view of an inv, getdata or notfound payload
+#[derive(Clone, Copy)]
+pub struct InvView<'a> {
+    objects: &'a [u8],
+}
+
+impl<'a> InvView<'a> {
+    /// Checks the payload's length and count without copying it
+    pub fn parse(payload: &'a [u8]) -> Result<InvView<'a>, ChainGangError> {
+        let mut data = payload;
+        let num_objects = var_int::read(&mut data)? as usize;
+        if num_objects > MAX_INV_ENTRIES {
+            let msg = format!("Num objects exceeded maximum: {num_objects}");
+            return Err(ChainGangError::BadData(msg));
+        }
+        let objects = take(&mut data, num_objects * InvVect::SIZE)?;
+        Ok(InvView { objects })
+    }
+
+    /// Number of inventory vectors
+    pub fn len(&self) -> usize {
+        self.objects.len() / InvVect::SIZE
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.objects.is_empty()
+    }
+
+    /// Returns the inventory vector at `index`
+    pub fn get(&self, index: usize) -> Option<InvVect> {
+        let start = index.checked_mul(InvVect::SIZE)?;
+        let bytes = self.objects.get(start..start + InvVect::SIZE)?;
+        let mut hash = Hash256::default();
+        hash.0.copy_from_slice(&bytes[4..]);
+        Some(InvVect {
+            obj_type: LittleEndian::read_u32(&bytes[..4]),
+            hash,
+        })
+    }
+
+    /// Iterates over the inventory vectors
+    pub fn iter(&self) -> impl Iterator<Item = InvVect> + 'a {
+        let view = *self;
+        (0..view.len()).filter_map(move |i| view.get(i))
+    }
+
+    /// Copies the view into an owned Inv
+    pub fn to_inv(&self) -> Inv {
+        Inv {
+            objects: self.iter().collect(),
+        }
+    }
+}
+
+impl fmt::Debug for InvView<'_> {
+    fn fmt(&self, f: &mut fmt::Formatter) -> fmt::Result {
+        f.debug_struct("InvView").field("len", &self.len()).finish()
+    }
+}
+
+/// Borrowed view of a serialized transaction
+///
+/// Parsing walks the inputs and outputs to find the end of the tx but copies nothing.
+#[derive(Clone, Copy)]
+pub struct TxView<'a> {
+    bytes: &'a [u8],
+    pub version: u32,
+    pub input_count: usize,
+    pub output_count: usize,
+    pub lock_time: u32,
+}
+
+impl<'a> TxView<'a> {
+    /// Finds the transaction at the start of `payload`
+    pub fn parse(payload: &'a [u8]) -> Result<TxView<'a>, ChainGangError> {
+        let mut data = payload;
+        let version = LittleEndian::read_u32(take(&mut data, 4)?);
+        let input_count = var_int::read(&mut data)? as usize;
+        for _ in 0..input_count {
+            // Outpoint, unlock script, sequence
+            take(&mut data, 36)?;
+            let script_len = var_int::read(&mut data)? as usize;
+            take(&mut data, script_len)?;
+            take(&mut data, 4)?;
+        }
+        let output_count = var_int::read(&mut data)? as usize;
+        for _ in 0..output_count {
+            // Satoshis, lock script
+            take(&mut data, 8)?;
+            let script_len = var_int::read(&mut data)? as usize;
+            take(&mut data, script_len)?;
+        }
+        let lock_time = LittleEndian::read_u32(take(&mut data, 4)?);
+        Ok(TxView {
+            bytes: &payload[..payload.len() - data.len()],
+            version,
+            input_count,
+            output_count,
+            lock_time,
+        })
+    }
+
+    /// Serialized transaction
+    pub fn bytes(&self) -> &'a [u8] {
+        self.bytes
+    }
+
+    /// Hash of the transaction, computed from its bytes
+    pub fn hash(&self) -> Hash256 {
+        sha256d(self.bytes)
+    }
+
+    /// Decodes the view into an owned Tx
+    pub fn to_tx(&self) -> Result<Tx, ChainGangError> {
+        Tx::read(&mut &self.bytes[..])
+    }
+}
+
+impl fmt::Debug for TxView<'_> {
+    fn fmt(&self, f: &mut fmt::Formatter) -> fmt::Result {
+        f.debug_struct("TxView")
+            .field("hash", &self.hash())
+            .field("size", &self.bytes.len())
+            .field("input_count", &self.input_count)
+            .field("output_count", &self.output_count)
+            .finish()
+    }
+}
+
+/// Splits `n` bytes off the front of `data`
+fn take<'a>(data: &mut &'a [u8], n: usize) -> Result<&'a [u8], ChainGangError> {
+    if data.len() < n {
+        return Err(ChainGangError::IoError(io::ErrorKind::UnexpectedEof.into()));
+    }
+    let (head, tail) = data.split_at(n);
+    *data = tail;
+    Ok(head)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::messages::{OutPoint, TxIn, TxOut, INV_VECT_BLOCK, INV_VECT_TX};
+    use crate::script::Script;
+    use std::io::Cursor;
+
+    const MAGIC: [u8; 4] = [7, 8, 9, 0];
+
+    fn tx() -> Tx {
+        Tx {
+            version: 1,
+            inputs: vec![TxIn {
+                prev_output: OutPoint {
+                    hash: Hash256([6; 32]),
+                    index: 8,
+                },
+                unlock_script: Script(vec![255; 254]),
+                sequence: 100,
+            }],
+            outputs: vec![TxOut {
+                satoshis: 600,
+                lock_script: Script(vec![1, 2, 3]),
+            }],
+            lock_time: 1000,
+        }
+    }
+
+    fn inv() -> Inv {
+        Inv {
+            objects: vec![
+                InvVect {
+                    obj_type: INV_VECT_TX,
+                    hash: Hash256([8; 32]),
+                },
+                InvVect {
+                    obj_type: INV_VECT_BLOCK,
+                    hash: Hash256([9; 32]),
+                },
+            ],
+        }
+    }
+
+    #[test]
+    fn read_frames() {
+        let messages = vec![
+            Message::Inv(inv()),
+            Message::GetData(inv()),
+            Message::Tx(tx()),
+            Message::Verack,
+        ];
+        let mut v = Vec::new();
+        for message in &messages {
+            message.write(&mut v, MAGIC).unwrap();
+        }
+
+        let pool = BufferPool::new(4, 1024);
+        let mut reader = FrameReader::with_pool(Cursor::new(&v), MAGIC, pool.clone());
+
+        let frame = reader.read_frame().unwrap();
+        let view = frame.inv().unwrap();
+        assert_eq!(view.len(), 2);
+        assert_eq!(view.get(1).unwrap(), inv().objects[1]);
+        assert!(view.get(2).is_none());
+        assert!(view.to_inv() == inv());
+        assert!(frame.tx().is_err());
+        assert!(frame.message().unwrap() == messages[0]);
+        drop(frame);
+        assert_eq!(pool.available(), 1);
+
+        let frame = reader.read_frame().unwrap();
+        assert_eq!(frame.getdata().unwrap().iter().count(), 2);
+
+        let frame = reader.read_frame().unwrap();
+        let view = frame.tx().unwrap();
+        assert_eq!(view.hash(), tx().hash());
+        assert_eq!(view.input_count, 1);
+        assert_eq!(view.output_count, 1);
+        assert_eq!(view.lock_time, 1000);
+        assert!(view.to_tx().unwrap() == tx());
+
+        assert!(reader.read_message().unwrap() == Message::Verack);
+        assert!(reader.read_frame().is_err());
+    }
+
+    #[test]
+    fn bad_checksum() {
+        let mut v = Vec::new();
+        Message::Tx(tx()).write(&mut v, MAGIC).unwrap();
+        let last = v.len() - 1;
+        v[last] ^= 1;
+        assert!(FrameReader::new(Cursor::new(&v), MAGIC)
+            .read_frame()
+            .is_err());
+        assert!(FrameReader::new(Cursor::new(&v), [0; 4])
+            .read_frame()
+            .is_err());
+    }
+
+    #[test]
+    fn truncated_views() {
+        let mut v = Vec::new();
+        inv().write(&mut v).unwrap();
+        assert!(InvView::parse(&v[..v.len() - 1]).is_err());
+
+        let mut v = Vec::new();
+        tx().write(&mut v).unwrap();
+        assert!(TxView::parse(&v[..v.len() - 1]).is_err());
+        // Trailing bytes are not part of the tx
+        v.push(0);
+        assert_eq!(TxView::parse(&v).unwrap().bytes().len(), v.len() - 1);
+    }
+}
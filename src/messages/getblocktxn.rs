@@ -12,10 +12,55 @@ use crate::util::{var_int, ChainGangError, Hash256, Serializable};
 pub struct Getblocktxn {
     /// Hash of the block
     pub blockhash: Hash256,
-    //  The indexes of the transactions being requested in the block
+    /// The indexes of the transactions being requested in the block, differentially encoded
     pub indexes: Vec<u64>,
 }
 
+impl Getblocktxn {
+    /// Requests the transactions at `indexes` in the block, which must be in increasing order
+    pub fn new(blockhash: Hash256, indexes: &[usize]) -> Getblocktxn {
+        Getblocktxn {
+            blockhash,
+            indexes: encode_indexes(indexes),
+        }
+    }
+
+    /// Decodes the requested indexes into positions in the block
+    pub fn absolute_indexes(&self) -> Result<Vec<usize>, ChainGangError> {
+        decode_indexes(self.indexes.iter().copied())
+    }
+}
+
+/// Encodes increasing block indexes as BIP-152 differences from the previous index plus one
+pub(crate) fn encode_indexes(indexes: &[usize]) -> Vec<u64> {
+    let mut next = 0;
+    indexes
+        .iter()
+        .map(|&index| {
+            let diff = index - next;
+            next = index + 1;
+            diff as u64
+        })
+        .collect()
+}
+
+/// Decodes BIP-152 differentially encoded indexes
+pub(crate) fn decode_indexes(
+    diffs: impl Iterator<Item = u64>,
+) -> Result<Vec<usize>, ChainGangError> {
+    let mut next: u64 = 0;
+    diffs
+        .map(|diff| {
+            let index = next
+                .checked_add(diff)
+                .filter(|index| *index < u32::MAX as u64)
+                .ok_or_else(|| ChainGangError::BadData("Index overflow".to_string()))?;
+            next = index + 1;
+            Ok(index as usize)
+        })
+        .collect()
+}
+
 impl Serializable<Getblocktxn> for Getblocktxn {
     fn read(reader: &mut dyn Read) -> Result<Getblocktxn, ChainGangError> {
         let mut ret = Getblocktxn {
@@ -72,4 +117,17 @@ mod tests {
         assert!(v.len() == m.size());
         assert!(Getblocktxn::read(&mut Cursor::new(&v)).unwrap() == m);
     }
+
+    #[test]
+    fn differential_indexes() {
+        let m = Getblocktxn::new(Hash256([1; 32]), &[0, 1, 5, 6, 100]);
+        assert_eq!(m.indexes, vec![0, 0, 3, 0, 93]);
+        assert_eq!(m.absolute_indexes().unwrap(), vec![0, 1, 5, 6, 100]);
+
+        let m = Getblocktxn {
+            blockhash: Hash256([1; 32]),
+            indexes: vec![1, u64::MAX],
+        };
+        assert!(m.absolute_indexes().is_err());
+    }
 }
@@ -21,12 +21,12 @@ use crate::messages::Createstrm;
 use crate::messages::Getblocktxn;
 use crate::messages::Streamack;
 
-use crate::util::{ChainGangError, Serializable};
+use crate::util::{BufferPool, ChainGangError, Serializable};
 use sha2::{Digest, Sha256};
 
 use std::fmt;
 use std::io;
-use std::io::{Cursor, Read, Write};
+use std::io::{Read, Write};
 
 /// Checksum to use when there is an empty payload
 pub const NO_CHECKSUM: [u8; 4] = [0x5d, 0xf6, 0xe0, 0xe2];
@@ -184,6 +184,16 @@ impl Message {
     pub fn read(reader: &mut dyn Read, magic: [u8; 4]) -> Result<Self, ChainGangError> {
         let header = MessageHeader::read(reader)?;
         header.validate(magic, MAX_PAYLOAD_SIZE)?;
+        Message::read_payload(reader, header)
+    }
+
+    /// Reads the message whose header has been read and validated
+    ///
+    /// Like read(), a timeout while reading the payload returns a Partial message.
+    pub fn read_payload(
+        reader: &mut dyn Read,
+        header: MessageHeader,
+    ) -> Result<Self, ChainGangError> {
         match Message::read_partial(reader, &header) {
             Ok(msg) => Ok(msg),
             Err(e) => {
@@ -206,244 +216,32 @@ impl Message {
         reader: &mut dyn Read,
         header: &MessageHeader,
     ) -> Result<Self, ChainGangError> {
-        // Addr
-        if header.command == commands::ADDR {
-            let payload = header.payload(reader)?;
-            let addr = Addr::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Addr(addr));
-        }
-
-        // AddrV2
-        if header.command == commands::ADDRV2 {
-            let payload = header.payload(reader)?;
-            let addr = AddrV2::read(&mut Cursor::new(payload))?;
-            return Ok(Message::AddrV2(addr));
-        }
-
-        // Block
-        if header.command == commands::BLOCK {
-            let payload = header.payload(reader)?;
-            let block = Block::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Block(block));
-        }
-
-        // Feefilter
-        if header.command == commands::FEEFILTER {
-            let payload = header.payload(reader)?;
-            let feefilter = FeeFilter::read(&mut Cursor::new(payload))?;
-            return Ok(Message::FeeFilter(feefilter));
-        }
-
-        // FilterAdd
-        if header.command == commands::FILTERADD {
-            let payload = header.payload(reader)?;
-            let filter_add = FilterAdd::read(&mut Cursor::new(payload))?;
-            filter_add.validate()?;
-            return Ok(Message::FilterAdd(filter_add));
-        }
-
-        // FilterClear
-        if header.command == commands::FILTERCLEAR {
-            if header.payload_size != 0 {
-                return Err(ChainGangError::BadData("Bad payload".to_string()));
-            }
-            return Ok(Message::FilterClear);
-        }
-
-        // FilterLoad
-        if header.command == commands::FILTERLOAD {
-            let payload = header.payload(reader)?;
-            let filter_load = FilterLoad::read(&mut Cursor::new(payload))?;
-            filter_load.validate()?;
-            return Ok(Message::FilterLoad(filter_load));
-        }
-
-        // Getaddr
-        if header.command == commands::GETADDR {
-            if header.payload_size != 0 {
-                return Err(ChainGangError::BadData("Bad payload".to_string()));
-            }
-            return Ok(Message::GetAddr);
-        }
-
-        // Getblocks
-        if header.command == commands::GETBLOCKS {
-            let payload = header.payload(reader)?;
-            let block_locator = BlockLocator::read(&mut Cursor::new(payload))?;
-            return Ok(Message::GetBlocks(block_locator));
-        }
-
-        // Getdata
-        if header.command == commands::GETDATA {
-            let payload = header.payload(reader)?;
-            let inv = Inv::read(&mut Cursor::new(payload))?;
-            return Ok(Message::GetData(inv));
-        }
-
-        // Getheaders
-        if header.command == commands::GETHEADERS {
-            let payload = header.payload(reader)?;
-            let block_locator = BlockLocator::read(&mut Cursor::new(payload))?;
-            return Ok(Message::GetHeaders(block_locator));
-        }
-
-        // Headers
-        if header.command == commands::HEADERS {
-            let payload = header.payload(reader)?;
-            let headers = Headers::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Headers(headers));
-        }
-
-        // Inv
-        if header.command == commands::INV {
-            let payload = header.payload(reader)?;
-            let inv = Inv::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Inv(inv));
-        }
-
-        // Mempool
-        if header.command == commands::MEMPOOL {
-            if header.payload_size != 0 {
-                return Err(ChainGangError::BadData("Bad payload".to_string()));
-            }
-            return Ok(Message::Mempool);
-        }
-
-        // MerkleBlock
-        if header.command == commands::MERKLEBLOCK {
-            let payload = header.payload(reader)?;
-            let merkle_block = MerkleBlock::read(&mut Cursor::new(payload))?;
-            return Ok(Message::MerkleBlock(merkle_block));
-        }
-
-        // Notfound
-        if header.command == commands::NOTFOUND {
-            let payload = header.payload(reader)?;
-            let inv = Inv::read(&mut Cursor::new(payload))?;
-            return Ok(Message::NotFound(inv));
-        }
-
-        // Ping
-        if header.command == commands::PING {
-            let payload = header.payload(reader)?;
-            let ping = Ping::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Ping(ping));
-        }
-
-        // Pong
-        if header.command == commands::PONG {
-            let payload = header.payload(reader)?;
-            let pong = Ping::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Pong(pong));
-        }
-
-        // Reject
-        if header.command == commands::REJECT {
-            let payload = header.payload(reader)?;
-            let reject = Reject::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Reject(reject));
-        }
-
-        // Sendcmpct
-        if header.command == commands::SENDCMPCT {
-            let payload = header.payload(reader)?;
-            let sendcmpct = SendCmpct::read(&mut Cursor::new(payload))?;
-            return Ok(Message::SendCmpct(sendcmpct));
-        }
-
-        // Sendheaders
-        if header.command == commands::SENDHEADERS {
-            if header.payload_size != 0 {
-                return Err(ChainGangError::BadData("Bad payload".to_string()));
+        if let Some(decoder) = decoder(&header.command) {
+            if decoder.empty {
+                if header.payload_size != 0 {
+                    return Err(ChainGangError::BadData("Bad payload".to_string()));
+                }
+                return (decoder.decode)(&[]);
             }
-            return Ok(Message::SendHeaders);
-        }
-
-        // Tx
-        if header.command == commands::TX {
-            let payload = header.payload(reader)?;
-            let tx = Tx::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Tx(tx));
-        }
-
-        // Version
-        if header.command == commands::VERSION {
-            let payload = header.payload(reader)?;
-            let version = Version::read(&mut Cursor::new(payload))?;
-            version.validate()?;
-            return Ok(Message::Version(version));
         }
+        let mut payload = BufferPool::shared().get();
+        header.read_payload_into(reader, &mut payload)?;
+        Message::decode(header, &payload)
+    }
 
-        // Verack
-        if header.command == commands::VERACK {
-            if header.payload_size != 0 {
-                return Err(ChainGangError::BadData("Bad payload".to_string()));
+    /// Decodes a message from a payload whose checksum has already been verified
+    pub fn decode(header: &MessageHeader, payload: &[u8]) -> Result<Self, ChainGangError> {
+        match decoder(&header.command) {
+            Some(decoder) if decoder.empty && !payload.is_empty() => {
+                Err(ChainGangError::BadData("Bad payload".to_string()))
             }
-            return Ok(Message::Verack);
-        }
-        // New messages
-        if header.command == commands::PROTOCONF {
-            let payload = header.payload(reader)?;
-            let protoconf = Protoconf::read(&mut Cursor::new(payload))?;
-            protoconf.validate()?;
-            return Ok(Message::Protoconf(protoconf));
-        }
-
-        if header.command == commands::AUTHCH {
-            let payload = header.payload(reader)?;
-            let authch = Authch::read(&mut Cursor::new(payload))?;
-            authch.validate()?;
-            return Ok(Message::Authch(authch));
-        }
-
-        if header.command == commands::CREATESTRM {
-            let payload = header.payload(reader)?;
-            let createstrm = Createstrm::read(&mut Cursor::new(payload))?;
-            createstrm.validate()?;
-            return Ok(Message::Createstrm(createstrm));
-        }
-
-        if header.command == commands::STREAMACK {
-            let payload = header.payload(reader)?;
-            let streamack = Streamack::read(&mut Cursor::new(payload))?;
-            streamack.validate()?;
-            return Ok(Message::Streamack(streamack));
-        }
-
-        if header.command == commands::CMPCTBLOCK {
-            let payload = header.payload(reader)?;
-            let cmpctblock = Cmpctblock::read(&mut Cursor::new(payload))?;
-            cmpctblock.validate()?;
-            return Ok(Message::Cmpctblock(cmpctblock));
-        }
-
-        if header.command == commands::GETBLOCKTXN {
-            let payload = header.payload(reader)?;
-            let getblocktxn = Getblocktxn::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Getblocktxn(getblocktxn));
-        }
-
-        if header.command == commands::BLOCKTXN {
-            let payload = header.payload(reader)?;
-            let blocktxn = Blocktxn::read(&mut Cursor::new(payload))?;
-            return Ok(Message::Blocktxn(blocktxn));
-        }
-
-        //SendAddrV2(SendAddrV2),
-        if header.command == commands::SENDADDRV2 {
-            if header.payload_size != 0 {
-                return Err(ChainGangError::BadData("Bad payload".to_string()));
+            Some(decoder) => (decoder.decode)(payload),
+            None => {
+                let command = String::from_utf8(header.command.to_vec())
+                    .unwrap_or_else(|_| "Unknown".to_string());
+                Ok(Message::Other(command))
             }
-            return Ok(Message::SendAddrV2);
-        }
-
-        // Unknown message
-        if header.payload_size > 0 {
-            header.payload(reader)?;
         }
-        let command =
-            String::from_utf8(header.command.to_vec()).unwrap_or_else(|_| "Unknown".to_string());
-        Ok(Message::Other(command))
     }
 
     /// Writes a Bitcoin P2P message with its payload to bytes
@@ -544,6 +342,131 @@ impl fmt::Debug for Message {
     }
 }
 
+/// Decodes the payload of one command
+struct Decoder {
+    command: [u8; 12],
+    /// The command has no payload
+    empty: bool,
+    decode: fn(&[u8]) -> Result<Message, ChainGangError>,
+}
+
+const fn decoder_for(
+    command: [u8; 12],
+    decode: fn(&[u8]) -> Result<Message, ChainGangError>,
+) -> Decoder {
+    Decoder {
+        command,
+        empty: false,
+        decode,
+    }
+}
+
+const fn empty_decoder(
+    command: [u8; 12],
+    decode: fn(&[u8]) -> Result<Message, ChainGangError>,
+) -> Decoder {
+    Decoder {
+        command,
+        empty: true,
+        decode,
+    }
+}
+
+/// Decoders of the known commands, sorted by command for binary search
+static DECODERS: [Decoder; 32] = {
+    use self::commands::*;
+    [
+        decoder_for(ADDR, |mut p| Ok(Message::Addr(Addr::read(&mut p)?))),
+        decoder_for(ADDRV2, |mut p| Ok(Message::AddrV2(AddrV2::read(&mut p)?))),
+        decoder_for(AUTHCH, |mut p| {
+            let authch = Authch::read(&mut p)?;
+            authch.validate()?;
+            Ok(Message::Authch(authch))
+        }),
+        decoder_for(BLOCK, |mut p| Ok(Message::Block(Block::read(&mut p)?))),
+        decoder_for(BLOCKTXN, |mut p| {
+            Ok(Message::Blocktxn(Blocktxn::read(&mut p)?))
+        }),
+        decoder_for(CMPCTBLOCK, |mut p| {
+            let cmpctblock = Cmpctblock::read(&mut p)?;
+            cmpctblock.validate()?;
+            Ok(Message::Cmpctblock(cmpctblock))
+        }),
+        decoder_for(CREATESTRM, |mut p| {
+            let createstrm = Createstrm::read(&mut p)?;
+            createstrm.validate()?;
+            Ok(Message::Createstrm(createstrm))
+        }),
+        decoder_for(FEEFILTER, |mut p| {
+            Ok(Message::FeeFilter(FeeFilter::read(&mut p)?))
+        }),
+        decoder_for(FILTERADD, |mut p| {
+            let filter_add = FilterAdd::read(&mut p)?;
+            filter_add.validate()?;
+            Ok(Message::FilterAdd(filter_add))
+        }),
+        empty_decoder(FILTERCLEAR, |_| Ok(Message::FilterClear)),
+        decoder_for(FILTERLOAD, |mut p| {
+            let filter_load = FilterLoad::read(&mut p)?;
+            filter_load.validate()?;
+            Ok(Message::FilterLoad(filter_load))
+        }),
+        empty_decoder(GETADDR, |_| Ok(Message::GetAddr)),
+        decoder_for(GETBLOCKS, |mut p| {
+            Ok(Message::GetBlocks(BlockLocator::read(&mut p)?))
+        }),
+        decoder_for(GETBLOCKTXN, |mut p| {
+            Ok(Message::Getblocktxn(Getblocktxn::read(&mut p)?))
+        }),
+        decoder_for(GETDATA, |mut p| Ok(Message::GetData(Inv::read(&mut p)?))),
+        decoder_for(GETHEADERS, |mut p| {
+            Ok(Message::GetHeaders(BlockLocator::read(&mut p)?))
+        }),
+        decoder_for(HEADERS, |mut p| {
+            Ok(Message::Headers(Headers::read(&mut p)?))
+        }),
+        decoder_for(INV, |mut p| Ok(Message::Inv(Inv::read(&mut p)?))),
+        empty_decoder(MEMPOOL, |_| Ok(Message::Mempool)),
+        decoder_for(MERKLEBLOCK, |mut p| {
+            Ok(Message::MerkleBlock(MerkleBlock::read(&mut p)?))
+        }),
+        decoder_for(NOTFOUND, |mut p| Ok(Message::NotFound(Inv::read(&mut p)?))),
+        decoder_for(PING, |mut p| Ok(Message::Ping(Ping::read(&mut p)?))),
+        decoder_for(PONG, |mut p| Ok(Message::Pong(Ping::read(&mut p)?))),
+        decoder_for(PROTOCONF, |mut p| {
+            let protoconf = Protoconf::read(&mut p)?;
+            protoconf.validate()?;
+            Ok(Message::Protoconf(protoconf))
+        }),
+        decoder_for(REJECT, |mut p| Ok(Message::Reject(Reject::read(&mut p)?))),
+        empty_decoder(SENDADDRV2, |_| Ok(Message::SendAddrV2)),
+        decoder_for(SENDCMPCT, |mut p| {
+            Ok(Message::SendCmpct(SendCmpct::read(&mut p)?))
+        }),
+        empty_decoder(SENDHEADERS, |_| Ok(Message::SendHeaders)),
+        decoder_for(STREAMACK, |mut p| {
+            let streamack = Streamack::read(&mut p)?;
+            streamack.validate()?;
+            Ok(Message::Streamack(streamack))
+        }),
+        decoder_for(TX, |mut p| Ok(Message::Tx(Tx::read(&mut p)?))),
+        empty_decoder(VERACK, |_| Ok(Message::Verack)),
+        decoder_for(VERSION, |mut p| {
+            let version = Version::read(&mut p)?;
+            version.validate()?;
+            Ok(Message::Version(version))
+        }),
+    ]
+};
+
+/// Looks up the decoder of a command
+fn decoder(command: &[u8; 12]) -> Option<&'static Decoder> {
+    DECODERS
+        .binary_search_by(|decoder| decoder.command.cmp(command))
+        .ok()
+        .map(|i| &DECODERS[i])
+}
+
 fn write_without_payload(
     writer: &mut dyn Write,
     command: [u8; 12],
@@ -982,4 +905,32 @@ mod tests {
             assert!(false);
         }
     }
+
+    #[test]
+    fn decoders_sorted() {
+        assert!(DECODERS
+            .windows(2)
+            .all(|pair| pair[0].command < pair[1].command));
+        assert!(decoder(&commands::INV).is_some());
+        assert!(decoder(&commands::ALERT).is_none());
+    }
+
+    #[test]
+    fn decode() {
+        let header = MessageHeader {
+            command: commands::VERACK,
+            ..Default::default()
+        };
+        assert!(Message::decode(&header, &[]).unwrap() == Message::Verack);
+        assert!(Message::decode(&header, &[1]).is_err());
+
+        let ping = Ping { nonce: 99 };
+        let mut payload = Vec::new();
+        ping.write(&mut payload).unwrap();
+        let header = MessageHeader {
+            command: commands::PING,
+            ..Default::default()
+        };
+        assert!(Message::decode(&header, &payload).unwrap() == Message::Ping(ping));
+    }
 }
@@ -54,20 +54,39 @@ impl MessageHeader {
 
     /// Reads the payload and verifies its checksum
     pub fn payload(&self, reader: &mut dyn Read) -> Result<Vec<u8>, ChainGangError> {
-        let mut p: Vec<u8> = vec![0; self.payload_size as usize];
-        reader.read_exact(p.as_mut())?;
+        let mut p = Vec::new();
+        self.read_payload_into(reader, &mut p)?;
+        Ok(p)
+    }
 
-        // Double hash of payload
-        let hash = Sha256::digest(&p);
-        let hash = Sha256::digest(hash);
+    /// Reads the payload into `buf`, replacing its contents, and verifies its checksum
+    ///
+    /// The payload is read with a single `read_exact` so that an `AtomicReader` either
+    /// returns all of it or buffers what arrived for the next attempt.
+    pub fn read_payload_into(
+        &self,
+        reader: &mut dyn Read,
+        buf: &mut Vec<u8>,
+    ) -> Result<(), ChainGangError> {
+        buf.clear();
+        buf.resize(self.payload_size as usize, 0);
+        reader.read_exact(buf)?;
+        self.verify_checksum(buf)
+    }
+
+    /// Verifies the checksum of a payload that has already been read
+    pub fn verify_checksum(&self, payload: &[u8]) -> Result<(), ChainGangError> {
+        self.check_checksum(&Sha256::digest(Sha256::digest(payload)))
+    }
 
+    pub(crate) fn check_checksum(&self, hash: &[u8]) -> Result<(), ChainGangError> {
         let h = hash;
         let j = &self.checksum;
         if h[0] != j[0] || h[1] != j[1] || h[2] != j[2] || h[3] != j[3] {
             let msg = format!("Bad checksum: {:?} != {:?}", &h[..4], j);
             return Err(ChainGangError::BadData(msg));
         }
-        Ok(p)
+        Ok(())
     }
 }
 
@@ -191,4 +210,23 @@ mod tests {
         let p2 = [0xf2, 0xf3, 0xf4, 0xf0, 0xf1, 0xf2, 0xf5, 0xf7, 0xf9];
         assert!(header.payload(&mut Cursor::new(&p2)).is_err());
     }
+
+    #[test]
+    fn read_payload_into() {
+        let p: Vec<u8> = (0..200_005).map(|i| i as u8).collect();
+        let hash = Sha256::digest(Sha256::digest(&p));
+        let header = MessageHeader {
+            magic: [0x00, 0x00, 0x00, 0x00],
+            command: *b"block\0\0\0\0\0\0\0",
+            payload_size: p.len() as u32,
+            checksum: [hash[0], hash[1], hash[2], hash[3]],
+        };
+        let mut buf = vec![1, 2, 3];
+        header
+            .read_payload_into(&mut Cursor::new(&p), &mut buf)
+            .unwrap();
+        assert!(buf == p);
+        assert!(header.verify_checksum(&p).is_ok());
+        assert!(header.verify_checksum(&p[1..]).is_err());
+    }
 }
@@ -59,6 +59,7 @@
 mod addr;
 mod authch;
 mod block;
+mod block_file;
 mod block_header;
 mod block_locator;
 mod blocktxn;
@@ -67,6 +68,7 @@ mod createstrm;
 mod fee_filter;
 mod filter_add;
 mod filter_load;
+mod frame;
 mod getblocktxn;
 mod headers;
 mod inv;
@@ -77,6 +79,7 @@ mod message_header;
 mod node_addr;
 mod node_addr_ex;
 mod out_point;
+mod partial_block;
 mod ping;
 mod protoconf;
 mod reject;
@@ -89,8 +92,9 @@ mod tx_in;
 mod tx_out;
 mod version;
 
-pub use self::addr::Addr;
+pub use self::addr::{Addr, AddrV2, Bip155, NodeAddrExV2};
 pub use self::block::Block;
+pub use self::block_file::{BlockDownload, BlockFile, BlockFileTxs, BlockSpool};
 pub use self::block_header::BlockHeader;
 pub use self::block_locator::{BlockLocator, NO_HASH_STOP};
 pub use self::fee_filter::FeeFilter;
@@ -98,6 +102,7 @@ pub use self::filter_add::{FilterAdd, MAX_FILTER_ADD_DATA_SIZE};
 pub use self::filter_load::{
     FilterLoad, BLOOM_UPDATE_ALL, BLOOM_UPDATE_NONE, BLOOM_UPDATE_P2PUBKEY_ONLY,
 };
+pub use self::frame::{Frame, FrameReader, InvView, TxView};
 pub use self::headers::{header_hash, Headers};
 pub use self::inv::{Inv, MAX_INV_ENTRIES};
 pub use self::inv_vect::{
@@ -110,6 +115,7 @@ pub use self::message_header::MessageHeader;
 pub use self::node_addr::NodeAddr;
 pub use self::node_addr_ex::NodeAddrEx;
 pub use self::out_point::{OutPoint, COINBASE_OUTPOINT_HASH, COINBASE_OUTPOINT_INDEX};
+pub use self::partial_block::{CompactBlockStats, PartialBlock};
 pub use self::ping::Ping;
 pub use self::reject::{
     Reject, REJECT_CHECKPOINT, REJECT_DUPLICATE, REJECT_DUST, REJECT_INSUFFICIENT_FEE,
@@ -126,7 +132,7 @@ pub use self::version::{
 
 pub use self::authch::Authch;
 pub use self::blocktxn::Blocktxn;
-pub use self::cmpctblock::Cmpctblock;
+pub use self::cmpctblock::{short_id, Cmpctblock, PrefilledTransaction, SHORT_TX_ID_LEN};
 pub use self::createstrm::{Createstrm, MAX_SUPPORTED_STREAM_TYPE, MIN_SUPPORTED_STREAM_TYPE};
 pub use self::getblocktxn::Getblocktxn;
 pub use self::protoconf::Protoconf;
@@ -0,0 +1,404 @@
+//! Block reconstruction from BIP-152 compact blocks
+//!
+//! A [`PartialBlock`] is built from a cmpctblock message. It takes the prefilled transactions
+//! directly and matches the short IDs against the transactions already known locally, usually
+//! the mempool. Any that are still missing are requested with the getblocktxn message it
+//! creates, and the blocktxn reply completes the block without downloading it in full.
+
+use crate::messages::cmpctblock::{short_id, short_id_from_bytes};
+use crate::messages::{Block, BlockHeader, Blocktxn, Cmpctblock, Getblocktxn, Payload, Tx};
+use crate::util::{var_int, ChainGangError, Hash256};
+use std::collections::{HashMap, HashSet};
+
+/// Where a compact block's transactions came from and the bandwidth it saved
+#[derive(Debug, Clone, Default, PartialEq, Eq)]
+pub struct CompactBlockStats {
+    /// Transactions in the block
+    pub tx_count: usize,
+    /// Transactions sent in full in the cmpctblock message
+    pub prefilled: usize,
+    /// Transactions found locally by short ID
+    pub matched: usize,
+    /// Transactions received in blocktxn replies
+    pub requested: usize,
+    /// Short IDs matched by more than one local transaction, which are requested instead
+    pub collisions: usize,
+    /// Bytes of the cmpctblock message
+    pub compact_bytes: usize,
+    /// Bytes of the blocktxn replies
+    pub blocktxn_bytes: usize,
+    /// Bytes of the transactions known so far in full block encoding
+    pub block_bytes: usize,
+}
+
+impl CompactBlockStats {
+    /// Bytes not downloaded compared to a block message, once the block is complete
+    pub fn bytes_saved(&self) -> usize {
+        self.block_bytes
+            .saturating_sub(self.compact_bytes + self.blocktxn_bytes)
+    }
+}
+
+/// A block being reconstructed from a compact block
+#[derive(Debug, Clone)]
+pub struct PartialBlock {
+    header: BlockHeader,
+    hash: Hash256,
+    keys: (u64, u64),
+    txns: Vec<Option<Tx>>,
+    /// Short IDs of the transactions not sent in full, by block index
+    short_ids: HashMap<u64, usize>,
+    /// Indexes whose short IDs matched several local transactions
+    collided: HashSet<usize>,
+    stats: CompactBlockStats,
+}
+
+impl PartialBlock {
+    /// Lays out the block from a compact block, filling in its prefilled transactions
+    pub fn new(cmpctblock: &Cmpctblock) -> Result<PartialBlock, ChainGangError> {
+        let tx_count = cmpctblock.shortids.len() + cmpctblock.prefilledtxn.len();
+        if tx_count == 0 {
+            return Err(ChainGangError::BadData("Empty compact block".to_string()));
+        }
+        let mut txns: Vec<Option<Tx>> = vec![None; tx_count];
+        let mut stats = CompactBlockStats {
+            tx_count,
+            prefilled: cmpctblock.prefilledtxn.len(),
+            compact_bytes: cmpctblock.size(),
+            block_bytes: BlockHeader::SIZE + var_int::size(tx_count as u64),
+            ..Default::default()
+        };
+        for (index, prefilled) in cmpctblock
+            .prefilled_indexes()?
+            .into_iter()
+            .zip(cmpctblock.prefilledtxn.iter())
+        {
+            if index >= tx_count {
+                let msg = format!("Prefilled index out of range: {index}");
+                return Err(ChainGangError::BadData(msg));
+            }
+            stats.block_bytes += prefilled.tx.size();
+            txns[index] = Some(prefilled.tx.clone());
+        }
+
+        let mut short_ids = HashMap::with_capacity(cmpctblock.shortids.len());
+        let empty = txns.iter().enumerate().filter(|(_, tx)| tx.is_none());
+        for ((index, _), id) in empty.zip(cmpctblock.shortids.iter()) {
+            if short_ids.insert(short_id_from_bytes(id), index).is_some() {
+                // The sender's own IDs collide, so only the full block can be trusted
+                return Err(ChainGangError::BadData("Duplicate short ID".to_string()));
+            }
+        }
+
+        Ok(PartialBlock {
+            hash: cmpctblock.header.hash(),
+            header: cmpctblock.header.clone(),
+            keys: cmpctblock.short_id_keys(),
+            txns,
+            short_ids,
+            collided: HashSet::new(),
+            stats,
+        })
+    }
+
+    /// Hash of the block
+    pub fn hash(&self) -> Hash256 {
+        self.hash
+    }
+
+    /// Fills transactions from locally known ones by txid, returning how many were placed
+    ///
+    /// May be called again with more transactions, for example from a second source.
+    pub fn fill_from<'a>(&mut self, txs: impl IntoIterator<Item = (&'a Hash256, &'a Tx)>) -> usize {
+        if self.short_ids.is_empty() {
+            return 0;
+        }
+        let filled = txs
+            .into_iter()
+            .map(|(txid, tx)| self.place(txid, || Some(tx.clone())))
+            .sum();
+        self.filled(filled)
+    }
+
+    /// Like `fill_from`, but only looks up the transactions whose short IDs are in the block
+    ///
+    /// Suits stores that keep transactions serialized, such as the mempool.
+    pub fn fill_with<'a>(
+        &mut self,
+        txids: impl IntoIterator<Item = &'a Hash256>,
+        mut lookup: impl FnMut(&Hash256) -> Option<Tx>,
+    ) -> usize {
+        if self.short_ids.is_empty() {
+            return 0;
+        }
+        let filled = txids
+            .into_iter()
+            .map(|txid| self.place(txid, || lookup(txid)))
+            .sum();
+        self.filled(filled)
+    }
+
+    /// Places a transaction if its short ID is in the block, returning the change in matches
+    fn place(&mut self, txid: &Hash256, tx: impl FnOnce() -> Option<Tx>) -> isize {
+        let Some(&index) = self.short_ids.get(&short_id(self.keys, txid)) else {
+            return 0;
+        };
+        if self.collided.contains(&index) {
+            return 0;
+        }
+        let Some(tx) = tx() else {
+            return 0;
+        };
+        match &self.txns[index] {
+            None => {
+                self.stats.block_bytes += tx.size();
+                self.txns[index] = Some(tx);
+                1
+            }
+            Some(existing) if *existing != tx => {
+                // Two local transactions share the short ID, so ask for the right one
+                self.stats.block_bytes -= existing.size();
+                self.txns[index] = None;
+                self.collided.insert(index);
+                -1
+            }
+            Some(_) => 0,
+        }
+    }
+
+    fn filled(&mut self, filled: isize) -> usize {
+        self.stats.matched = self.stats.matched.saturating_add_signed(filled);
+        self.stats.collisions = self.collided.len();
+        filled.max(0) as usize
+    }
+
+    /// Indexes of the transactions still missing
+    pub fn missing(&self) -> Vec<usize> {
+        self.txns
+            .iter()
+            .enumerate()
+            .filter(|(_, tx)| tx.is_none())
+            .map(|(index, _)| index)
+            .collect()
+    }
+
+    pub fn is_complete(&self) -> bool {
+        self.txns.iter().all(|tx| tx.is_some())
+    }
+
+    /// Creates the request for the missing transactions, or None if the block is complete
+    pub fn getblocktxn(&self) -> Option<Getblocktxn> {
+        let missing = self.missing();
+        if missing.is_empty() {
+            return None;
+        }
+        Some(Getblocktxn::new(self.hash, &missing))
+    }
+
+    /// Fills the missing transactions from a reply to `getblocktxn`
+    pub fn fill_blocktxn(&mut self, blocktxn: &Blocktxn) -> Result<(), ChainGangError> {
+        if blocktxn.blockhash != self.hash {
+            return Err(ChainGangError::BadData("Wrong block hash".to_string()));
+        }
+        let missing = self.missing();
+        if blocktxn.transactions.len() != missing.len() {
+            let msg = format!(
+                "Expected {} transactions, got {}",
+                missing.len(),
+                blocktxn.transactions.len()
+            );
+            return Err(ChainGangError::BadData(msg));
+        }
+        for (index, tx) in missing.into_iter().zip(blocktxn.transactions.iter()) {
+            self.stats.block_bytes += tx.size();
+            self.txns[index] = Some(tx.clone());
+        }
+        self.stats.requested += blocktxn.transactions.len();
+        self.stats.blocktxn_bytes += blocktxn.size();
+        Ok(())
+    }
+
+    pub fn stats(&self) -> &CompactBlockStats {
+        &self.stats
+    }
+
+    /// Returns the completed block after checking its merkle root
+    ///
+    /// A bad merkle root means a local transaction matched a short ID by chance, and the block
+    /// should be downloaded in full.
+    pub fn into_block(self) -> Result<Block, ChainGangError> {
+        if !self.is_complete() {
+            let msg = format!("{} transactions missing", self.missing().len());
+            return Err(ChainGangError::IllegalState(msg));
+        }
+        let block = Block {
+            header: self.header,
+            txns: self.txns.into_iter().flatten().collect(),
+        };
+        if block.merkle_root() != block.header.merkle_root {
+            return Err(ChainGangError::BadData("Bad merkle root".to_string()));
+        }
+        Ok(block)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::messages::{OutPoint, TxIn, TxOut, COINBASE_OUTPOINT_HASH, COINBASE_OUTPOINT_INDEX};
+    use crate::script::Script;
+
+    fn tx(n: u32) -> Tx {
+        Tx {
+            version: 1,
+            inputs: vec![TxIn {
+                prev_output: OutPoint {
+                    hash: Hash256([(n % 251) as u8; 32]),
+                    index: n,
+                },
+                unlock_script: Script(vec![5; 20]),
+                sequence: 0xffffffff,
+            }],
+            outputs: vec![TxOut {
+                satoshis: n as i64,
+                lock_script: Script(vec![6; 25]),
+            }],
+            lock_time: 0,
+        }
+    }
+
+    /// Synthetic block of `count` transactions after a coinbase
+    fn block(count: u32) -> Block {
+        let mut coinbase = tx(0);
+        coinbase.inputs[0].prev_output = OutPoint {
+            hash: COINBASE_OUTPOINT_HASH,
+            index: COINBASE_OUTPOINT_INDEX,
+        };
+        let mut block = Block {
+            header: BlockHeader {
+                version: 1,
+                timestamp: 1_700_000_000,
+                ..Default::default()
+            },
+            txns: std::iter::once(coinbase)
+                .chain((1..=count).map(tx))
+                .collect(),
+        };
+        block.header.merkle_root = block.merkle_root();
+        block
+    }
+
+    /// Mempool holding the block's transactions except `missing`, plus unrelated ones
+    fn mempool(block: &Block, missing: &[usize]) -> HashMap<Hash256, Tx> {
+        let mut mempool: HashMap<Hash256, Tx> = block
+            .txns
+            .iter()
+            .enumerate()
+            .filter(|(i, _)| !missing.contains(i))
+            .map(|(_, tx)| (tx.hash(), tx.clone()))
+            .collect();
+        for n in 10_000..10_500 {
+            let tx = tx(n);
+            mempool.insert(tx.hash(), tx);
+        }
+        mempool
+    }
+
+    /// Answers a getblocktxn from the full block, as the sending peer would
+    fn serve(block: &Block, request: &Getblocktxn) -> Blocktxn {
+        Blocktxn {
+            blockhash: request.blockhash,
+            transactions: request
+                .absolute_indexes()
+                .unwrap()
+                .into_iter()
+                .map(|i| block.txns[i].clone())
+                .collect(),
+        }
+    }
+
+    #[test]
+    fn reconstruct_from_mempool() {
+        let block = block(200);
+        let cmpctblock = Cmpctblock::from_block(&block, 42, &[]);
+        assert_eq!(cmpctblock.shortids.len(), 200);
+        assert_eq!(cmpctblock.prefilledtxn.len(), 1);
+
+        let mut partial = PartialBlock::new(&cmpctblock).unwrap();
+        assert_eq!(partial.hash(), block.header.hash());
+        assert_eq!(partial.fill_from(&mempool(&block, &[])), 200);
+        assert!(partial.getblocktxn().is_none());
+        let stats = partial.stats().clone();
+        assert_eq!(stats.matched, 200);
+        assert_eq!(stats.block_bytes, block.size());
+        assert!(stats.bytes_saved() > block.size() * 3 / 4);
+        assert!(partial.into_block().unwrap() == block);
+    }
+
+    #[test]
+    fn request_missing() {
+        let block = block(50);
+        let cmpctblock = Cmpctblock::from_block(&block, 7, &[10, 20]);
+        assert_eq!(cmpctblock.prefilled_indexes().unwrap(), vec![0, 10, 20]);
+
+        let mut partial = PartialBlock::new(&cmpctblock).unwrap();
+        assert_eq!(partial.fill_from(&mempool(&block, &[3, 10, 31, 50])), 45);
+        assert_eq!(partial.missing(), vec![3, 31, 50]);
+        assert!(partial.clone().into_block().is_err());
+
+        let request = partial.getblocktxn().unwrap();
+        assert_eq!(request.indexes, vec![3, 27, 18]);
+        let mut wrong = serve(&block, &request);
+        wrong.transactions.pop();
+        assert!(partial.fill_blocktxn(&wrong).is_err());
+        partial.fill_blocktxn(&serve(&block, &request)).unwrap();
+
+        let stats = partial.stats().clone();
+        assert_eq!(
+            (stats.prefilled, stats.matched, stats.requested),
+            (3, 45, 3)
+        );
+        assert_eq!(stats.block_bytes, block.size());
+        assert!(partial.into_block().unwrap() == block);
+    }
+
+    #[test]
+    fn collisions() {
+        let block = block(10);
+        let cmpctblock = Cmpctblock::from_block(&block, 1, &[]);
+        let mut partial = PartialBlock::new(&cmpctblock).unwrap();
+
+        // A different tx presented under a block tx's id matches the same short ID
+        let txid = block.txns[4].hash();
+        let impostor = tx(9999);
+        assert_eq!(partial.fill_from([(&txid, &block.txns[4])]), 1);
+        assert_eq!(partial.fill_from([(&txid, &impostor)]), 0);
+        assert_eq!(partial.stats().collisions, 1);
+        assert_eq!(partial.fill_from(&mempool(&block, &[])), 9);
+        assert_eq!(partial.missing(), vec![4]);
+        let request = partial.getblocktxn().unwrap();
+        partial.fill_blocktxn(&serve(&block, &request)).unwrap();
+        assert!(partial.into_block().unwrap() == block);
+
+        // A wrong tx that slips through fails the merkle root check
+        let mut partial = PartialBlock::new(&cmpctblock).unwrap();
+        let mut txs = mempool(&block, &[4]);
+        txs.insert(txid, impostor);
+        partial.fill_from(&txs);
+        assert!(partial.into_block().is_err());
+    }
+
+    #[test]
+    fn bad_compact_blocks() {
+        assert!(PartialBlock::new(&Cmpctblock::default()).is_err());
+
+        let block = block(5);
+        let mut cmpctblock = Cmpctblock::from_block(&block, 1, &[]);
+        cmpctblock.shortids[1] = cmpctblock.shortids[0].clone();
+        assert!(PartialBlock::new(&cmpctblock).is_err());
+
+        let mut cmpctblock = Cmpctblock::from_block(&block, 1, &[]);
+        cmpctblock.prefilledtxn[0].index = 6;
+        assert!(PartialBlock::new(&cmpctblock).is_err());
+    }
+}
@@ -179,6 +179,21 @@ impl Network {
         }
     }
 
+    /// Returns the bits of the easiest proof of work target a block may have
+    pub fn pow_limit(&self) -> u32 {
+        0x1d00ffff
+    }
+
+    /// Returns whether a block mined more than 20 minutes after the previous one may use the
+    /// easiest target, as on the test networks
+    pub fn min_difficulty_blocks(&self) -> bool {
+        match self {
+            Network::BSV_Mainnet | Network::BTC_Mainnet | Network::BCH_Mainnet => false,
+            Network::BSV_Testnet | Network::BTC_Testnet | Network::BCH_Testnet => true,
+            Network::BSV_STN => true,
+        }
+    }
+
     /// Returns the version byte flag for P2PKH-type addresses
     pub fn addr_pubkeyhash_flag(&self) -> u8 {
         match self {
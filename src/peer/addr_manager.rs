@@ -0,0 +1,851 @@
+//! Table of peer addresses learned from seeds and addr gossip
+//!
+//! An [`AddrManager`] keeps addresses in two tables, like Bitcoin Core's addrman. Addresses
+//! heard about go into "new" buckets and move to "tried" buckets once a connection to them
+//! succeeds. Bucket positions come from a keyed hash of the address's network group and the
+//! group of the peer that gossiped it, so one source can only fill a few buckets and a flood of
+//! addresses replaces little of what is known. Both tables have a fixed size, and addresses are
+//! stored in a compact fixed width record, so memory stays bounded however much is gossiped.
+//!
+//! The table is saved to and loaded from a compact binary file, so a restarted
+//! [`PeerPool`](crate::peer::PeerPool) can connect without waiting on DNS seeds.
+
+use crate::messages::{Bip155, NodeAddr, NodeAddrEx, NodeAddrExV2};
+use crate::util::{siphash24, ChainGangError};
+use byteorder::{LittleEndian, ReadBytesExt, WriteBytesExt};
+use rand::{random, rng, RngExt};
+use std::collections::HashMap;
+use std::fs::{self, File};
+use std::io::{self, BufReader, BufWriter, Read, Write};
+use std::net::{IpAddr, Ipv6Addr, SocketAddr};
+use std::path::Path;
+
+/// Identifies the address file format
+const FILE_MAGIC: [u8; 4] = *b"cgam";
+const FILE_VERSION: u8 = 1;
+
+/// Marks an empty bucket slot
+const EMPTY: u32 = u32::MAX;
+
+/// Buckets of the new table one source group can place addresses in
+const NEW_BUCKETS_PER_SOURCE: u64 = 64;
+
+/// Buckets of the tried table one address group can be placed in
+const TRIED_BUCKETS_PER_GROUP: u64 = 8;
+
+/// Gossiped timestamps further ahead than this are not believed
+const MAX_FUTURE_SECS: u32 = 10 * 60;
+
+/// Addresses not heard about for this long are dropped when their slot is wanted
+const HORIZON_SECS: u32 = 30 * 24 * 60 * 60;
+
+/// Settings of an address manager
+#[derive(Debug, Clone, PartialEq, Eq)]
+pub struct AddrManagerConfig {
+    pub new_buckets: u32,
+    pub tried_buckets: u32,
+    /// Addresses per bucket
+    pub bucket_size: u32,
+    /// Ban score at which an address is banned
+    pub ban_threshold: u32,
+    /// How long a banned address is excluded, in seconds
+    pub ban_secs: u32,
+}
+
+impl Default for AddrManagerConfig {
+    /// Room for 256K new and 64K tried addresses
+    fn default() -> Self {
+        AddrManagerConfig {
+            new_buckets: 4096,
+            tried_buckets: 1024,
+            bucket_size: 64,
+            ban_threshold: 100,
+            ban_secs: 24 * 60 * 60,
+        }
+    }
+}
+
+/// Known address and its connection history
+#[derive(Debug, Clone, PartialEq, Eq)]
+struct AddrInfo {
+    ip: Ipv6Addr,
+    port: u16,
+    services: u64,
+    /// Last time the address was reported active, in seconds since the unix epoch
+    last_seen: u32,
+    last_try: u32,
+    last_success: u32,
+    /// Failed attempts since the last success
+    attempts: u16,
+    ban_score: u16,
+    banned_until: u32,
+    tried: bool,
+    /// Index into the new or tried table
+    slot: u32,
+    /// Position in the list of the table's addresses
+    list_pos: u32,
+}
+
+impl AddrInfo {
+    fn socket_addr(&self) -> SocketAddr {
+        let ip = match self.ip.to_ipv4_mapped() {
+            Some(ipv4) => IpAddr::V4(ipv4),
+            None => IpAddr::V6(self.ip),
+        };
+        SocketAddr::new(ip, self.port)
+    }
+
+    /// Whether the address is not worth keeping when its slot is wanted
+    fn is_terrible(&self, now: u32) -> bool {
+        if self.last_try != 0 && now.saturating_sub(self.last_try) < 60 {
+            return false;
+        }
+        self.last_seen > now + MAX_FUTURE_SECS
+            || now.saturating_sub(self.last_seen) > HORIZON_SECS
+            || (self.last_success == 0 && self.attempts >= 3)
+            || (now.saturating_sub(self.last_success) > 7 * 24 * 60 * 60 && self.attempts >= 10)
+    }
+
+    /// Relative chance of being selected, lower after recent or repeated failures
+    fn chance(&self, now: u32) -> f64 {
+        let mut chance = 1.0;
+        if now.saturating_sub(self.last_try) < 10 * 60 {
+            chance *= 0.01;
+        }
+        chance * 0.66f64.powi(self.attempts.min(8) as i32)
+    }
+
+    fn write(&self, writer: &mut dyn Write) -> io::Result<()> {
+        writer.write_all(&self.ip.octets())?;
+        writer.write_u16::<LittleEndian>(self.port)?;
+        writer.write_u64::<LittleEndian>(self.services)?;
+        writer.write_u32::<LittleEndian>(self.last_seen)?;
+        writer.write_u32::<LittleEndian>(self.last_try)?;
+        writer.write_u32::<LittleEndian>(self.last_success)?;
+        writer.write_u16::<LittleEndian>(self.attempts)?;
+        writer.write_u16::<LittleEndian>(self.ban_score)?;
+        writer.write_u32::<LittleEndian>(self.banned_until)?;
+        writer.write_u8(self.tried as u8)?;
+        writer.write_u32::<LittleEndian>(self.slot)
+    }
+
+    fn read(reader: &mut dyn Read) -> Result<AddrInfo, ChainGangError> {
+        let mut ip = [0; 16];
+        reader.read_exact(&mut ip)?;
+        Ok(AddrInfo {
+            ip: Ipv6Addr::from(ip),
+            port: reader.read_u16::<LittleEndian>()?,
+            services: reader.read_u64::<LittleEndian>()?,
+            last_seen: reader.read_u32::<LittleEndian>()?,
+            last_try: reader.read_u32::<LittleEndian>()?,
+            last_success: reader.read_u32::<LittleEndian>()?,
+            attempts: reader.read_u16::<LittleEndian>()?,
+            ban_score: reader.read_u16::<LittleEndian>()?,
+            banned_until: reader.read_u32::<LittleEndian>()?,
+            tried: reader.read_u8()? != 0,
+            slot: reader.read_u32::<LittleEndian>()?,
+            list_pos: 0,
+        })
+    }
+}
+
+/// Address as stored in the index, IPv4 as IPv4-mapped IPv6
+type AddrKey = (Ipv6Addr, u16);
+
+fn key_of(addr: &SocketAddr) -> AddrKey {
+    let ip = match addr.ip() {
+        IpAddr::V4(ipv4) => ipv4.to_ipv6_mapped(),
+        IpAddr::V6(ipv6) => ipv6,
+    };
+    (ip, addr.port())
+}
+
+/// Network group of an address, the /16 for IPv4 and the /32 for IPv6
+fn group(ip: &Ipv6Addr) -> [u8; 5] {
+    let octets = ip.octets();
+    match ip.to_ipv4_mapped() {
+        Some(ipv4) => {
+            let [a, b, _, _] = ipv4.octets();
+            [4, a, b, 0, 0]
+        }
+        None => [6, octets[0], octets[1], octets[2], octets[3]],
+    }
+}
+
+/// Whether an address can be connected to over the public internet
+fn is_routable(ip: &Ipv6Addr) -> bool {
+    match ip.to_ipv4_mapped() {
+        Some(ipv4) => {
+            !(ipv4.is_unspecified()
+                || ipv4.is_loopback()
+                || ipv4.is_private()
+                || ipv4.is_link_local()
+                || ipv4.is_broadcast()
+                || ipv4.is_documentation())
+        }
+        None => !(ip.is_unspecified() || ip.is_loopback() || ip.is_multicast()),
+    }
+}
+
+/// Bucketed table of known peer addresses
+///
+/// Times are seconds since the unix epoch, passed in by the caller.
+pub struct AddrManager {
+    config: AddrManagerConfig,
+    /// Secret key for bucket placement, so peers can not predict it
+    key: (u64, u64),
+    /// Accept addresses that are not publicly routable, for tests and private networks
+    allow_local: bool,
+    entries: Vec<Option<AddrInfo>>,
+    free: Vec<u32>,
+    index: HashMap<AddrKey, u32>,
+    new_table: Vec<u32>,
+    tried_table: Vec<u32>,
+    /// Entries in each table, for uniform random selection
+    new_list: Vec<u32>,
+    tried_list: Vec<u32>,
+}
+
+impl AddrManager {
+    /// Creates an empty address manager with a random key
+    pub fn new(config: AddrManagerConfig) -> AddrManager {
+        let new_slots = (config.new_buckets * config.bucket_size) as usize;
+        let tried_slots = (config.tried_buckets * config.bucket_size) as usize;
+        AddrManager {
+            config,
+            key: (random(), random()),
+            allow_local: false,
+            entries: Vec::new(),
+            free: Vec::new(),
+            index: HashMap::new(),
+            new_table: vec![EMPTY; new_slots],
+            tried_table: vec![EMPTY; tried_slots],
+            new_list: Vec::new(),
+            tried_list: Vec::new(),
+        }
+    }
+
+    /// Accepts loopback and private addresses as well as public ones
+    pub fn allow_local(&mut self, allow: bool) {
+        self.allow_local = allow;
+    }
+
+    fn hash(&self, data: &[u8]) -> u64 {
+        siphash24(self.key.0, self.key.1, data)
+    }
+
+    /// Slot in the new table for an address gossiped by `source`
+    ///
+    /// The addresses one source group gossips can only reach a few of the buckets.
+    fn new_slot(&self, ip: &Ipv6Addr, port: u16, source: &Ipv6Addr) -> u32 {
+        let source_group = group(source);
+        let source_bucket =
+            self.hash(&[&[b'S'][..], &group(ip), &source_group].concat()) % NEW_BUCKETS_PER_SOURCE;
+        let bucket = self
+            .hash(&[&[b'N'][..], &source_group, &source_bucket.to_le_bytes()].concat())
+            % self.config.new_buckets as u64;
+        self.slot(bucket, b'n', ip, port)
+    }
+
+    /// Slot in the tried table for an address
+    fn tried_slot(&self, ip: &Ipv6Addr, port: u16) -> u32 {
+        let addr_bucket = self.hash(&[&[b'A'][..], &ip.octets(), &port.to_le_bytes()].concat())
+            % TRIED_BUCKETS_PER_GROUP;
+        let bucket = self.hash(&[&[b'T'][..], &group(ip), &addr_bucket.to_le_bytes()].concat())
+            % self.config.tried_buckets as u64;
+        self.slot(bucket, b't', ip, port)
+    }
+
+    fn slot(&self, bucket: u64, table: u8, ip: &Ipv6Addr, port: u16) -> u32 {
+        let data = [
+            &[table][..],
+            &bucket.to_le_bytes(),
+            &ip.octets(),
+            &port.to_le_bytes(),
+        ]
+        .concat();
+        let position = self.hash(&data) % self.config.bucket_size as u64;
+        (bucket * self.config.bucket_size as u64 + position) as u32
+    }
+
+    fn entry(&self, id: u32) -> &AddrInfo {
+        self.entries[id as usize].as_ref().unwrap()
+    }
+
+    fn entry_mut(&mut self, id: u32) -> &mut AddrInfo {
+        self.entries[id as usize].as_mut().unwrap()
+    }
+
+    /// Puts an entry in a table slot, which must be empty
+    fn place(&mut self, id: u32, tried: bool, slot: u32) {
+        let (table, list) = match tried {
+            true => (&mut self.tried_table, &mut self.tried_list),
+            false => (&mut self.new_table, &mut self.new_list),
+        };
+        table[slot as usize] = id;
+        list.push(id);
+        let list_pos = (list.len() - 1) as u32;
+        let entry = self.entry_mut(id);
+        entry.tried = tried;
+        entry.slot = slot;
+        entry.list_pos = list_pos;
+    }
+
+    /// Takes an entry out of its table slot, leaving it stored
+    fn unplace(&mut self, id: u32) {
+        let (tried, slot, list_pos) = {
+            let entry = self.entry(id);
+            (entry.tried, entry.slot, entry.list_pos)
+        };
+        let (table, list) = match tried {
+            true => (&mut self.tried_table, &mut self.tried_list),
+            false => (&mut self.new_table, &mut self.new_list),
+        };
+        table[slot as usize] = EMPTY;
+        list.swap_remove(list_pos as usize);
+        if let Some(&moved) = list.get(list_pos as usize) {
+            self.entry_mut(moved).list_pos = list_pos;
+        }
+    }
+
+    /// Removes an entry entirely
+    fn delete(&mut self, id: u32) {
+        self.unplace(id);
+        let entry = self.entries[id as usize].take().unwrap();
+        self.index.remove(&(entry.ip, entry.port));
+        self.free.push(id);
+    }
+
+    fn store(&mut self, entry: AddrInfo) -> u32 {
+        let key = (entry.ip, entry.port);
+        let id = match self.free.pop() {
+            Some(id) => {
+                self.entries[id as usize] = Some(entry);
+                id
+            }
+            None => {
+                self.entries.push(Some(entry));
+                (self.entries.len() - 1) as u32
+            }
+        };
+        self.index.insert(key, id);
+        id
+    }
+
+    /// Adds addresses from an addr message sent by `source`, returning how many were new
+    pub fn add(&mut self, addrs: &[NodeAddrEx], source: IpAddr, now: u32) -> usize {
+        addrs
+            .iter()
+            .filter(|addr| {
+                let ip = addr.addr.ip;
+                let socket_addr = SocketAddr::new(IpAddr::V6(ip), addr.addr.port);
+                let socket_addr = match ip.to_ipv4_mapped() {
+                    Some(ipv4) => SocketAddr::new(IpAddr::V4(ipv4), addr.addr.port),
+                    None => socket_addr,
+                };
+                self.add_addr(
+                    socket_addr,
+                    addr.addr.services,
+                    addr.last_connected_time,
+                    source,
+                    now,
+                )
+            })
+            .count()
+    }
+
+    /// Adds the IPv4 and IPv6 addresses from an addrv2 message sent by `source`
+    ///
+    /// Tor, I2P and CJDNS addresses are skipped, since peers can not connect to them.
+    pub fn add_v2(&mut self, addrs: &[NodeAddrExV2], source: IpAddr, now: u32) -> usize {
+        addrs
+            .iter()
+            .filter(|addr| {
+                let ip = match &addr.bip_address {
+                    Bip155::IPV4(ip) => IpAddr::V4(*ip),
+                    Bip155::IPV6(ip) => IpAddr::V6(*ip),
+                    _ => return false,
+                };
+                self.add_addr(
+                    SocketAddr::new(ip, addr.port),
+                    addr.services,
+                    addr.last_connected_time,
+                    source,
+                    now,
+                )
+            })
+            .count()
+    }
+
+    /// Adds or refreshes one address, returning true if it was new
+    ///
+    /// A new address whose slot is held by a good address is dropped.
+    pub fn add_addr(
+        &mut self,
+        addr: SocketAddr,
+        services: u64,
+        timestamp: u32,
+        source: IpAddr,
+        now: u32,
+    ) -> bool {
+        let (ip, port) = key_of(&addr);
+        if port == 0 || (!self.allow_local && !is_routable(&ip)) {
+            return false;
+        }
+        // Missing and future timestamps are replaced with one a few days old
+        let timestamp = match timestamp == 0 || timestamp > now + MAX_FUTURE_SECS {
+            true => now.saturating_sub(5 * 24 * 60 * 60),
+            false => timestamp,
+        };
+        if let Some(&id) = self.index.get(&(ip, port)) {
+            let entry = self.entry_mut(id);
+            entry.services |= services;
+            entry.last_seen = entry.last_seen.max(timestamp);
+            return false;
+        }
+
+        let source = key_of(&SocketAddr::new(source, 0)).0;
+        let slot = self.new_slot(&ip, port, &source);
+        let occupant = self.new_table[slot as usize];
+        if occupant != EMPTY {
+            if !self.entry(occupant).is_terrible(now) {
+                return false;
+            }
+            self.delete(occupant);
+        }
+        let id = self.store(AddrInfo {
+            ip,
+            port,
+            services,
+            last_seen: timestamp,
+            last_try: 0,
+            last_success: 0,
+            attempts: 0,
+            ban_score: 0,
+            banned_until: 0,
+            tried: false,
+            slot,
+            list_pos: 0,
+        });
+        self.place(id, false, slot);
+        true
+    }
+
+    /// Records a connection attempt
+    pub fn attempt(&mut self, addr: &SocketAddr, now: u32) {
+        if let Some(&id) = self.index.get(&key_of(addr)) {
+            let entry = self.entry_mut(id);
+            entry.last_try = now;
+            entry.attempts = entry.attempts.saturating_add(1);
+        }
+    }
+
+    /// Records a successful connection, moving the address to the tried table
+    ///
+    /// An address already in the tried slot moves back to the new table if its slot there is
+    /// free, and is dropped otherwise.
+    pub fn good(&mut self, addr: &SocketAddr, now: u32) {
+        let Some(&id) = self.index.get(&key_of(addr)) else {
+            return;
+        };
+        let entry = self.entry_mut(id);
+        entry.last_success = now;
+        entry.last_try = now;
+        entry.last_seen = now;
+        entry.attempts = 0;
+        if entry.tried {
+            return;
+        }
+        let (ip, port) = (entry.ip, entry.port);
+        self.unplace(id);
+        let slot = self.tried_slot(&ip, port);
+        let occupant = self.tried_table[slot as usize];
+        if occupant != EMPTY {
+            self.unplace(occupant);
+            let evicted = self.entry(occupant);
+            // Placed as if gossiped by itself, since the original source is not kept
+            let new_slot = self.new_slot(&evicted.ip, evicted.port, &evicted.ip);
+            match self.new_table[new_slot as usize] {
+                EMPTY => self.place(occupant, false, new_slot),
+                _ => {
+                    let evicted = self.entries[occupant as usize].take().unwrap();
+                    self.index.remove(&(evicted.ip, evicted.port));
+                    self.free.push(occupant);
+                }
+            }
+        }
+        self.place(id, true, slot);
+    }
+
+    /// Adds to an address's ban score, returning true if it is now banned
+    pub fn misbehaving(&mut self, addr: &SocketAddr, score: u32, now: u32) -> bool {
+        let (threshold, ban_secs) = (self.config.ban_threshold, self.config.ban_secs);
+        let Some(&id) = self.index.get(&key_of(addr)) else {
+            return false;
+        };
+        let entry = self.entry_mut(id);
+        let total = (entry.ban_score as u32).saturating_add(score);
+        entry.ban_score = total.min(u16::MAX as u32) as u16;
+        if total >= threshold {
+            entry.banned_until = now.saturating_add(ban_secs);
+            entry.ban_score = 0;
+        }
+        entry.banned_until > now
+    }
+
+    pub fn is_banned(&self, addr: &SocketAddr, now: u32) -> bool {
+        self.index
+            .get(&key_of(addr))
+            .is_some_and(|&id| self.entry(id).banned_until > now)
+    }
+
+    /// Picks an address to connect to at random, favoring ones that have not failed recently
+    ///
+    /// Tried and new addresses are equally likely when both tables have entries. Banned
+    /// addresses and those `exclude` returns true for are skipped.
+    pub fn select(&self, now: u32, exclude: impl Fn(&SocketAddr) -> bool) -> Option<SocketAddr> {
+        if self.new_list.is_empty() && self.tried_list.is_empty() {
+            return None;
+        }
+        let mut rng = rng();
+        let mut factor = 1.0;
+        for _ in 0..1000 {
+            let list = match (self.tried_list.is_empty(), self.new_list.is_empty()) {
+                (true, _) => &self.new_list,
+                (_, true) => &self.tried_list,
+                _ if rng.random_bool(0.5) => &self.tried_list,
+                _ => &self.new_list,
+            };
+            let entry = self.entry(list[rng.random_range(0..list.len())]);
+            let addr = entry.socket_addr();
+            if entry.banned_until > now || exclude(&addr) {
+                continue;
+            }
+            if rng.random::<f64>() < factor * entry.chance(now) {
+                return Some(addr);
+            }
+            // Raise the odds each round so a table of failing addresses still returns one
+            factor *= 1.2;
+        }
+        None
+    }
+
+    /// Picks up to `max` random addresses heard about recently, for answering getaddr
+    pub fn sample(&self, max: usize, now: u32) -> Vec<NodeAddrEx> {
+        let ids: Vec<u32> = self
+            .new_list
+            .iter()
+            .chain(self.tried_list.iter())
+            .copied()
+            .collect();
+        let mut rng = rng();
+        let mut sample = Vec::with_capacity(max.min(ids.len()));
+        let mut ids = ids;
+        while sample.len() < max && !ids.is_empty() {
+            let id = ids.swap_remove(rng.random_range(0..ids.len()));
+            let entry = self.entry(id);
+            if entry.is_terrible(now) || entry.banned_until > now {
+                continue;
+            }
+            sample.push(NodeAddrEx {
+                last_connected_time: entry.last_seen,
+                addr: NodeAddr {
+                    services: entry.services,
+                    ip: entry.ip,
+                    port: entry.port,
+                },
+            });
+        }
+        sample
+    }
+
+    /// Number of addresses known
+    pub fn len(&self) -> usize {
+        self.index.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.index.is_empty()
+    }
+
+    /// Number of addresses that have been connected to
+    pub fn tried_count(&self) -> usize {
+        self.tried_list.len()
+    }
+
+    pub fn contains(&self, addr: &SocketAddr) -> bool {
+        self.index.contains_key(&key_of(addr))
+    }
+
+    /// Writes the table in the compact file format
+    pub fn write(&self, writer: &mut dyn Write) -> io::Result<()> {
+        writer.write_all(&FILE_MAGIC)?;
+        writer.write_u8(FILE_VERSION)?;
+        writer.write_u64::<LittleEndian>(self.key.0)?;
+        writer.write_u64::<LittleEndian>(self.key.1)?;
+        writer.write_u32::<LittleEndian>(self.config.new_buckets)?;
+        writer.write_u32::<LittleEndian>(self.config.tried_buckets)?;
+        writer.write_u32::<LittleEndian>(self.config.bucket_size)?;
+        writer.write_u32::<LittleEndian>(self.index.len() as u32)?;
+        for entry in self.entries.iter().flatten() {
+            entry.write(writer)?;
+        }
+        Ok(())
+    }
+
+    /// Reads a table written by `write`, keeping its key and bucket layout
+    ///
+    /// If `config` has a different layout, addresses are placed again in the new table.
+    pub fn read(
+        reader: &mut dyn Read,
+        config: AddrManagerConfig,
+    ) -> Result<AddrManager, ChainGangError> {
+        let mut magic = [0; 4];
+        reader.read_exact(&mut magic)?;
+        if magic != FILE_MAGIC || reader.read_u8()? != FILE_VERSION {
+            return Err(ChainGangError::BadData("Not an address file".to_string()));
+        }
+        let key = (
+            reader.read_u64::<LittleEndian>()?,
+            reader.read_u64::<LittleEndian>()?,
+        );
+        let layout = (
+            reader.read_u32::<LittleEndian>()?,
+            reader.read_u32::<LittleEndian>()?,
+            reader.read_u32::<LittleEndian>()?,
+        );
+        let same_layout = layout == (config.new_buckets, config.tried_buckets, config.bucket_size);
+        let count = reader.read_u32::<LittleEndian>()?;
+
+        let mut manager = AddrManager::new(config);
+        manager.key = key;
+        manager.allow_local = true;
+        for _ in 0..count {
+            let mut entry = AddrInfo::read(reader)?;
+            let key = (entry.ip, entry.port);
+            if manager.index.contains_key(&key) {
+                continue;
+            }
+            let (table, slot) = match same_layout {
+                true => (entry.tried, entry.slot),
+                false => (false, manager.new_slot(&entry.ip, entry.port, &entry.ip)),
+            };
+            let slots = match table {
+                true => &manager.tried_table,
+                false => &manager.new_table,
+            };
+            if slots.get(slot as usize) != Some(&EMPTY) {
+                continue;
+            }
+            entry.tried = table;
+            entry.slot = slot;
+            let id = manager.store(entry);
+            manager.place(id, table, slot);
+        }
+        manager.allow_local = false;
+        Ok(manager)
+    }
+
+    /// Saves the table to a file, replacing it atomically
+    pub fn save_file(&self, path: &Path) -> Result<(), ChainGangError> {
+        let tmp = path.with_extension("tmp");
+        {
+            let mut writer = BufWriter::new(File::create(&tmp)?);
+            self.write(&mut writer)?;
+            writer.flush()?;
+        }
+        fs::rename(&tmp, path)?;
+        Ok(())
+    }
+
+    /// Loads a table saved with `save_file`
+    pub fn load_file(
+        path: &Path,
+        config: AddrManagerConfig,
+    ) -> Result<AddrManager, ChainGangError> {
+        AddrManager::read(&mut BufReader::new(File::open(path)?), config)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::io::Cursor;
+    use std::net::Ipv4Addr;
+
+    const NOW: u32 = 1_700_000_000;
+
+    fn addr(a: u8, b: u8, c: u8, d: u8) -> SocketAddr {
+        SocketAddr::new(IpAddr::V4(Ipv4Addr::new(a, b, c, d)), 8333)
+    }
+
+    fn source(n: u8) -> IpAddr {
+        IpAddr::V4(Ipv4Addr::new(50, n, 0, 1))
+    }
+
+    fn small() -> AddrManagerConfig {
+        AddrManagerConfig {
+            new_buckets: 64,
+            tried_buckets: 16,
+            bucket_size: 16,
+            ..Default::default()
+        }
+    }
+
+    #[test]
+    fn add_and_dedup() {
+        let mut manager = AddrManager::new(AddrManagerConfig::default());
+        let gossip = NodeAddrEx {
+            last_connected_time: NOW - 100,
+            addr: NodeAddr::new(addr(1, 2, 3, 4).ip(), 8333),
+        };
+        assert_eq!(
+            manager.add(&[gossip.clone(), gossip.clone()], source(1), NOW),
+            1
+        );
+        assert_eq!(manager.add(&[gossip], source(2), NOW), 0);
+        assert_eq!(manager.len(), 1);
+        assert!(manager.contains(&addr(1, 2, 3, 4)));
+
+        // Unroutable addresses are ignored unless allowed
+        assert!(!manager.add_addr(addr(127, 0, 0, 1), 1, NOW, source(1), NOW));
+        assert!(!manager.add_addr(addr(10, 0, 0, 1), 1, NOW, source(1), NOW));
+        manager.allow_local(true);
+        assert!(manager.add_addr(addr(127, 0, 0, 1), 1, NOW, source(1), NOW));
+
+        // Only IP addresses are taken from addrv2
+        let v2 = vec![
+            NodeAddrExV2 {
+                last_connected_time: NOW,
+                services: 1,
+                bip_address: Bip155::IPV6("2001:db9::1".parse().unwrap()),
+                port: 8333,
+            },
+            NodeAddrExV2 {
+                last_connected_time: NOW,
+                services: 1,
+                bip_address: Bip155::TORV3(Default::default()),
+                port: 8333,
+            },
+        ];
+        assert_eq!(manager.add_v2(&v2, source(1), NOW), 1);
+        assert_eq!(manager.len(), 3);
+    }
+
+    #[test]
+    fn tried_and_select() {
+        let mut manager = AddrManager::new(AddrManagerConfig::default());
+        assert!(manager.select(NOW, |_| false).is_none());
+        for i in 0..100 {
+            manager.add_addr(addr(20, i, 1, 1), 1, NOW, source(i), NOW);
+        }
+        assert_eq!(manager.len(), 100);
+        let good = addr(20, 7, 1, 1);
+        manager.attempt(&good, NOW);
+        manager.good(&good, NOW);
+        assert_eq!(manager.tried_count(), 1);
+        assert_eq!(manager.len(), 100);
+
+        // Half the selections come from the single tried address
+        let picks: Vec<SocketAddr> = (0..400)
+            .filter_map(|_| manager.select(NOW + 3600, |_| false))
+            .collect();
+        assert_eq!(picks.len(), 400);
+        let tried = picks.iter().filter(|&&pick| pick == good).count();
+        assert!(tried > 120 && tried < 280, "{tried}");
+        assert!(manager.select(NOW, |addr| addr.ip().is_ipv4()).is_none());
+
+        let sample = manager.sample(30, NOW);
+        assert_eq!(sample.len(), 30);
+    }
+
+    #[test]
+    fn bans() {
+        let mut manager = AddrManager::new(AddrManagerConfig::default());
+        let bad = addr(30, 1, 1, 1);
+        manager.add_addr(bad, 1, NOW, source(1), NOW);
+        assert!(!manager.misbehaving(&bad, 60, NOW));
+        assert!(manager.misbehaving(&bad, 60, NOW));
+        assert!(manager.is_banned(&bad, NOW + 100));
+        assert!(manager.select(NOW, |_| false).is_none());
+        assert!(!manager.is_banned(&bad, NOW + 24 * 60 * 60));
+    }
+
+    #[test]
+    fn bounded_by_buckets() {
+        let mut manager = AddrManager::new(AddrManagerConfig {
+            new_buckets: 1024,
+            bucket_size: 4,
+            ..small()
+        });
+        // One source floods many addresses but can only reach its own buckets
+        for i in 0..20_000u32 {
+            let [_, a, b, c] = i.to_be_bytes();
+            manager.add_addr(addr(40 + a, b, c, 1), 1, NOW, source(1), NOW);
+        }
+        let flooded = manager.len();
+        assert!(flooded <= NEW_BUCKETS_PER_SOURCE as usize * 4, "{flooded}");
+
+        // Other sources still find room
+        let mut added = 0;
+        for i in 0..200u8 {
+            added +=
+                manager.add_addr(addr(90, i, 1, 1), 1, NOW, source(100 + i % 50), NOW) as usize;
+        }
+        assert!(added > 150, "{added}");
+        assert_eq!(manager.len(), flooded + added);
+        assert_eq!(manager.len(), manager.new_list.len());
+    }
+
+    #[test]
+    fn terrible_entries_are_replaced() {
+        let mut manager = AddrManager::new(AddrManagerConfig {
+            new_buckets: 1,
+            bucket_size: 1,
+            ..small()
+        });
+        let old = addr(60, 1, 1, 1);
+        assert!(manager.add_addr(old, 1, NOW - HORIZON_SECS - 1, source(1), NOW));
+        let fresh = addr(61, 1, 1, 1);
+        assert!(manager.add_addr(fresh, 1, NOW, source(1), NOW));
+        assert!(!manager.contains(&old));
+        assert!(!manager.add_addr(addr(62, 1, 1, 1), 1, NOW, source(1), NOW));
+        assert!(manager.contains(&fresh));
+    }
+
+    #[test]
+    fn save_and_load() {
+        let mut manager = AddrManager::new(small());
+        for i in 0..200u8 {
+            manager.add_addr(addr(70, i, 1, 1), i as u64, NOW, source(i), NOW);
+        }
+        let good = manager.select(NOW, |_| false).unwrap();
+        manager.good(&good, NOW);
+        let mut v = Vec::new();
+        manager.write(&mut v).unwrap();
+        assert_eq!(v.len(), 37 + manager.len() * 51);
+
+        let loaded = AddrManager::read(&mut Cursor::new(&v), small()).unwrap();
+        assert_eq!(loaded.len(), manager.len());
+        assert_eq!(loaded.tried_count(), 1);
+        for entry in manager.entries.iter().flatten() {
+            let id = loaded.index[&(entry.ip, entry.port)];
+            assert_eq!(loaded.entry(id).slot, entry.slot);
+            assert_eq!(loaded.entry(id).services, entry.services);
+        }
+        assert_eq!(loaded.select(NOW, |addr| *addr != good), Some(good));
+
+        // A different layout places everything again
+        let relaid = AddrManager::read(&mut Cursor::new(&v), AddrManagerConfig::default()).unwrap();
+        assert!(relaid.len() > manager.len() * 9 / 10);
+        assert_eq!(relaid.tried_count(), 0);
+
+        let path = std::env::temp_dir().join(format!("addrs-{}.dat", std::process::id()));
+        manager.save_file(&path).unwrap();
+        let loaded = AddrManager::load_file(&path, small()).unwrap();
+        assert_eq!(loaded.len(), manager.len());
+        fs::remove_file(&path).unwrap();
+
+        assert!(AddrManager::read(&mut Cursor::new(&v[1..]), small()).is_err());
+    }
+}
@@ -78,14 +78,55 @@
 //! peer.disconnected_event().subscribe(&event_handler);
 //! peer.messages().subscribe(&event_handler);
 //! ```
+//!
+//! Drive many peers from a few event loop threads:
+//!
+//! ```no_run, rust
+//! use chain_gang::messages::{Version, NODE_BITCOIN_CASH, PROTOCOL_VERSION};
+//! use chain_gang::network::Network;
+//! use chain_gang::peer::{PeerRuntime, SVPeerFilter};
+//! use chain_gang::util::rx::Observable;
+//! use chain_gang::util::secs_since;
+//! use std::time::UNIX_EPOCH;
+//!
+//! let runtime = PeerRuntime::new(4).unwrap();
+//! let peers: Vec<_> = Network::BSV_Mainnet
+//!     .seed_iter()
+//!     .map(|(ip, port)| {
+//!         let version = Version {
+//!             version: PROTOCOL_VERSION,
+//!             services: NODE_BITCOIN_CASH,
+//!             timestamp: secs_since(UNIX_EPOCH) as i64,
+//!             user_agent: "chain-gang".to_string(),
+//!             ..Default::default()
+//!         };
+//!         runtime.connect(ip, port, Network::BSV_Mainnet, version, SVPeerFilter::new(0))
+//!     })
+//!     .collect();
+//!
+//! for peer in &peers {
+//!     peer.connected_event().poll();
+//! }
+//! ```
 
 pub(crate) mod atomic_reader;
+mod addr_manager;
+mod pool;
+mod runtime;
+mod send_queue;
+mod sync;
 
 // Disabled this warning as would probably break too much other code to fix it
 //warn: module has the same name as its containing module
 #[allow(clippy::module_inception)]
 mod peer;
 
+pub use self::addr_manager::{AddrManager, AddrManagerConfig};
 pub use self::peer::{
-    Peer, PeerConnected, PeerDisconnected, PeerFilter, PeerMessage, PeerNodeFilter, SVPeerFilter,
+    Peer, PeerBlockFile, PeerConnected, PeerDisconnected, PeerFilter, PeerMessage, PeerNodeFilter,
+    SVPeerFilter,
 };
+pub use self::pool::{PeerPool, PeerPoolConfig, PoolPeerStats, PoolStats};
+pub use self::runtime::PeerRuntime;
+pub use self::send_queue::{SendPolicy, SendQueueConfig, SendQueueStats};
+pub use self::sync::{BlockSync, BlockSyncConfig, SyncStats, SyncedBlock};
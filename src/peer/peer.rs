@@ -1,13 +1,17 @@
-use crate::messages::{Message, MessageHeader, Ping, Version, NODE_BITCOIN_CASH, NODE_NETWORK};
+use crate::messages::{
+    BlockDownload, BlockFile, BlockSpool, Message, MessageHeader, Ping, Version, MAX_PAYLOAD_SIZE,
+    NODE_BITCOIN_CASH, NODE_NETWORK,
+};
 use crate::network::Network;
 use crate::peer::atomic_reader::AtomicReader;
+use crate::peer::runtime::RuntimeLink;
+use crate::peer::send_queue::{SendQueue, SendQueueConfig, SendQueueStats, WriteBatch};
 use crate::util::rx::{Observable, Observer, Single, Subject};
-use crate::util::{secs_since, ChainGangError};
+use crate::util::{secs_since, BufferPool, ChainGangError};
 use snowflake::ProcessUniqueId;
 use std::fmt;
 use std::hash::{Hash, Hasher};
 use std::io;
-use std::io::Write;
 use std::net::{IpAddr, Shutdown, SocketAddr, TcpStream};
 use std::sync::atomic::{AtomicBool, Ordering};
 use std::sync::{Arc, Mutex, Weak};
@@ -35,6 +39,19 @@ fn duration_from_env_secs(env_var: &str, default: Duration) -> Duration {
         .unwrap_or(default)
 }
 
+/// Time to wait for the initial TCP connection
+pub(crate) fn connect_timeout() -> Duration {
+    duration_from_env_secs("CHAIN_GANG_CONNECT_TIMEOUT_SECS", CONNECT_TIMEOUT)
+}
+
+/// Time to wait for each handshake message
+pub(crate) fn handshake_read_timeout() -> Duration {
+    duration_from_env_secs(
+        "CHAIN_GANG_HANDSHAKE_READ_TIMEOUT_SECS",
+        HANDSHAKE_READ_TIMEOUT,
+    )
+}
+
 /// Event emitted when a connection is established with the peer
 #[derive(Clone, Debug)]
 pub struct PeerConnected {
@@ -54,6 +71,13 @@ pub struct PeerMessage {
     pub message: Message,
 }
 
+/// Event emitted when the peer receives a block that was spooled to disk
+#[derive(Clone, Debug)]
+pub struct PeerBlockFile {
+    pub peer: Arc<Peer>,
+    pub block: Arc<BlockFile>,
+}
+
 /// Filters peers based on their version information before connecting
 pub trait PeerFilter: Send + Sync {
     fn connectable(&self, _: &Version) -> bool;
@@ -109,7 +133,8 @@ impl PeerFilter for PeerNodeFilter {
 ///
 /// It will setup a connection, respond to pings, and store basic properties about the connection,
 /// but any real logic to process messages will be handled outside. Network messages received will
-/// be published to an observable on the peer's receiver thread. Messages may be sent via send()
+/// be published to an observable on the peer's receiver thread, or on its worker thread for peers
+/// connected through a [`PeerRuntime`](crate::peer::PeerRuntime). Messages may be sent via send()
 /// from any thread. Once shutdown, the Peer may no longer be used.
 pub struct Peer {
     /// Unique id for this connection
@@ -124,8 +149,13 @@ pub struct Peer {
     pub(crate) connected_event: Single<PeerConnected>,
     pub(crate) disconnected_event: Single<PeerDisconnected>,
     pub(crate) messages: Subject<PeerMessage>,
+    pub(crate) block_files: Subject<PeerBlockFile>,
 
     tcp_writer: Mutex<Option<TcpStream>>,
+    /// Serialized messages waiting for the writer
+    send_queue: SendQueue,
+    /// Set for peers driven by a PeerRuntime instead of their own thread
+    link: Mutex<Option<RuntimeLink>>,
 
     connected: AtomicBool,
     time_delta: Mutex<i64>,
@@ -133,6 +163,7 @@ pub struct Peer {
     sendheaders: AtomicBool,
     sendcmpct: AtomicBool,
     version: Mutex<Option<Version>>,
+    block_spool: Mutex<Option<BlockSpool>>,
 
     /// Weak reference to self so we can pass ourselves in emitted events. This is a
     /// bit ugly, but we hopefully can able to remove it once arbitrary self types goes in.
@@ -147,6 +178,37 @@ impl Peer {
         network: Network,
         version: Version,
         filter: Arc<dyn PeerFilter>,
+    ) -> Arc<Peer> {
+        Peer::connect_with_send_queue(
+            ip,
+            port,
+            network,
+            version,
+            filter,
+            SendQueueConfig::default(),
+        )
+    }
+
+    /// Creates a new peer with the given send queue limits and begins connecting
+    pub fn connect_with_send_queue(
+        ip: IpAddr,
+        port: u16,
+        network: Network,
+        version: Version,
+        filter: Arc<dyn PeerFilter>,
+        send_queue: SendQueueConfig,
+    ) -> Arc<Peer> {
+        let peer = Peer::new(ip, port, network, send_queue);
+        Peer::connect_internal(&peer, version, filter);
+        peer
+    }
+
+    /// Creates a peer that is not connected yet
+    pub(crate) fn new(
+        ip: IpAddr,
+        port: u16,
+        network: Network,
+        send_queue: SendQueueConfig,
     ) -> Arc<Peer> {
         let peer = Arc::new(Peer {
             id: ProcessUniqueId::new(),
@@ -156,60 +218,85 @@ impl Peer {
             connected_event: Single::new(),
             disconnected_event: Single::new(),
             messages: Subject::new(),
+            block_files: Subject::new(),
             tcp_writer: Mutex::new(None),
+            send_queue: SendQueue::new(send_queue),
+            link: Mutex::new(None),
             connected: AtomicBool::new(false),
             time_delta: Mutex::new(0),
             minfee: Mutex::new(0),
             sendheaders: AtomicBool::new(false),
             sendcmpct: AtomicBool::new(false),
             version: Mutex::new(None),
+            block_spool: Mutex::new(None),
             weak_self: Mutex::new(None),
         });
 
         *peer.weak_self.lock().unwrap() = Some(Arc::downgrade(&peer));
-
-        Peer::connect_internal(&peer, version, filter);
-
         peer
     }
 
+    /// Hands the peer's I/O to a runtime worker
+    pub(crate) fn set_link(&self, link: RuntimeLink) {
+        *self.link.lock().unwrap() = Some(link);
+    }
+
     /// Sends a message to the peer
+    ///
+    /// The message is queued for the peer's writer. When the queue is full the send queue's
+    /// policy either rejects the message or waits for space.
     pub fn send(&self, message: &Message) -> Result<(), ChainGangError> {
         if !self.connected.load(Ordering::Relaxed) {
             return Err(ChainGangError::IllegalState("Not connected".to_string()));
         }
 
-        let mut io_error: Option<io::Error> = None;
-        {
-            let mut tcp_writer = self.tcp_writer.lock().unwrap();
-            let mut tcp_writer = match tcp_writer.as_mut() {
-                Some(tcp_writer) => tcp_writer,
-                None => return Err(ChainGangError::IllegalState("No tcp stream".to_string())),
-            };
-
-            debug!("{self:?} Write {message:#?}");
-
-            if let Err(e) = message.write(&mut tcp_writer, self.network.magic()) {
-                io_error = Some(e);
-            } else if let Err(e) = tcp_writer.flush() {
-                io_error = Some(e);
+        debug!("{self:?} Queue {message:#?}");
+        let mut buf = BufferPool::shared().get();
+        message.write(&mut *buf, self.network.magic())?;
+        let depth = self.send_queue.push(buf)?;
+        if depth == 1 {
+            if let Some(link) = &*self.link.lock().unwrap() {
+                link.flush();
             }
         }
+        Ok(())
+    }
 
-        match io_error {
-            Some(e) => {
-                self.disconnect();
-                Err(ChainGangError::IoError(e))
-            }
-            None => Ok(()),
-        }
+    /// Returns the depth and counters of the send queue
+    pub fn send_queue_stats(&self) -> SendQueueStats {
+        self.send_queue.stats()
+    }
+
+    /// Queue of messages waiting to be written, shared with the runtime worker
+    pub(crate) fn send_queue(&self) -> &SendQueue {
+        &self.send_queue
     }
 
     /// Disconects and disables the peer
+    ///
+    /// Messages already queued are written first, waiting up to the send queue's
+    /// `close_timeout`.
     pub fn disconnect(&self) {
         self.connected.swap(false, Ordering::Relaxed);
 
         info!("{self:?} Disconnecting");
+        self.send_queue.finish();
+
+        // A runtime worker writes what is left before closing the socket itself
+        let runtime = match &*self.link.lock().unwrap() {
+            Some(link) => {
+                link.close();
+                true
+            }
+            None => false,
+        };
+        if !runtime {
+            let timeout = self.send_queue.config().close_timeout;
+            if !self.send_queue.wait_flushed(timeout) {
+                warn!("{self:?} Dropping messages not written within {timeout:?}");
+            }
+            self.send_queue.close();
+        }
 
         let mut tcp_stream = self.tcp_writer.lock().unwrap();
         if let Some(tcp_stream) = tcp_stream.as_mut() {
@@ -223,6 +310,16 @@ impl Peer {
         }
     }
 
+    /// Marks a runtime peer disconnected after its worker closed the connection
+    pub(crate) fn closed(&self) {
+        self.connected.store(false, Ordering::Relaxed);
+        self.send_queue.close();
+        info!("{self:?} Disconnected");
+        if let Some(peer) = self.strong_self() {
+            self.disconnected_event.next(&PeerDisconnected { peer });
+        }
+    }
+
     /// Returns a Single that emits a message when connected
     pub fn connected_event(&self) -> &impl Observable<PeerConnected> {
         &self.connected_event
@@ -238,6 +335,40 @@ impl Peer {
         &self.messages
     }
 
+    /// Returns an Observable that emits blocks received to disk
+    ///
+    /// Blocks are only received to disk once a spool is set with `set_block_spool`. They are
+    /// not emitted as messages.
+    pub fn block_files(&self) -> &impl Observable<PeerBlockFile> {
+        &self.block_files
+    }
+
+    /// Sets where large blocks are received to disk, or None to read them into memory
+    pub fn set_block_spool(&self, spool: Option<BlockSpool>) {
+        *self.block_spool.lock().unwrap() = spool;
+    }
+
+    /// Starts receiving a message to disk if it is a block the spool takes
+    pub(crate) fn start_download(
+        &self,
+        header: &MessageHeader,
+    ) -> Result<Option<BlockDownload>, ChainGangError> {
+        match &*self.block_spool.lock().unwrap() {
+            Some(spool) => spool.start(header),
+            None => Ok(None),
+        }
+    }
+
+    /// Finishes a block received to disk and emits it
+    pub(crate) fn received_block(&self, download: BlockDownload) -> Result<(), ChainGangError> {
+        let block = Arc::new(download.finish()?);
+        debug!("{self:?} Read {block:?}");
+        if let Some(peer) = self.strong_self() {
+            self.block_files.next(&PeerBlockFile { peer, block });
+        }
+        Ok(())
+    }
+
     /// Returns whether the peer is connected
     pub fn connected(&self) -> bool {
         self.connected.load(Ordering::Relaxed)
@@ -286,23 +417,44 @@ impl Peer {
                 }
             };
 
+            if let Err(e) = Peer::start_writer(&tpeer, &tcp_reader) {
+                error!("{tpeer:?} Failed to start writer: {e:?}");
+                tpeer.disconnect();
+                return;
+            }
+
             // The peer is considered connected and may be written to now
-            info!("{:?} Connected to {:?}:{}", tpeer, tpeer.ip, tpeer.port);
-            tpeer.connected.store(true, Ordering::Relaxed);
-            tpeer.connected_event.next(&PeerConnected {
-                peer: tpeer.clone(),
-            });
+            tpeer.set_connected();
 
             let mut partial: Option<MessageHeader> = None;
+            let mut download: Option<BlockDownload> = None;
             let magic = tpeer.network.magic();
 
             // Message reads over TCP must be all-or-nothing.
             let mut tcp_reader = AtomicReader::new(&mut tcp_reader);
 
             loop {
-                let message = match &partial {
-                    Some(header) => Message::read_partial(&mut tcp_reader, header),
-                    None => Message::read(&mut tcp_reader, magic),
+                // None once a block being received to disk is complete
+                let message = if let Some(active) = &mut download {
+                    active.read_from(&mut tcp_reader).map(|()| None)
+                } else if let Some(header) = &partial {
+                    Message::read_partial(&mut tcp_reader, header).map(Some)
+                } else {
+                    let started = MessageHeader::read(&mut tcp_reader).and_then(|header| {
+                        header.validate(magic, MAX_PAYLOAD_SIZE)?;
+                        let download = tpeer.start_download(&header)?;
+                        Ok((header, download))
+                    });
+                    match started {
+                        Ok((_, Some(started))) => {
+                            download = Some(started);
+                            continue;
+                        }
+                        Ok((header, None)) => {
+                            Message::read_payload(&mut tcp_reader, header).map(Some)
+                        }
+                        Err(e) => Err(e),
+                    }
                 };
 
                 // Always check the connected flag right after the blocking read so we exit right away,
@@ -312,7 +464,14 @@ impl Peer {
                 }
 
                 match message {
-                    Ok(message) => {
+                    Ok(None) => {
+                        if let Err(e) = tpeer.received_block(download.take().unwrap()) {
+                            error!("{tpeer:?} Error receiving block {e:?}");
+                            tpeer.disconnect();
+                            return;
+                        }
+                    }
+                    Ok(Some(message)) => {
                         if let Message::Partial(header) = message {
                             partial = Some(header);
                         } else {
@@ -351,6 +510,32 @@ impl Peer {
         });
     }
 
+    /// Starts the thread that writes queued messages, coalescing them into vectored writes
+    fn start_writer(peer: &Arc<Peer>, tcp_stream: &TcpStream) -> Result<(), ChainGangError> {
+        let mut tcp_writer = tcp_stream.try_clone()?;
+        let wpeer = peer.clone();
+        thread::spawn(move || {
+            let mut batch = WriteBatch::default();
+            while wpeer.send_queue.wait_drain(&mut batch) {
+                while !batch.is_empty() {
+                    match batch.write_to(&mut tcp_writer) {
+                        Ok((bytes, messages)) => wpeer.send_queue.wrote(bytes, messages),
+                        Err(e) if e.kind() == io::ErrorKind::Interrupted => {}
+                        Err(e) => {
+                            wpeer.send_queue.close();
+                            if wpeer.connected() {
+                                error!("{wpeer:?} Error writing messages {e:?}");
+                                wpeer.disconnect();
+                            }
+                            return;
+                        }
+                    }
+                }
+            }
+        });
+        Ok(())
+    }
+
     fn handshake(
         self: &Peer,
         version: Version,
@@ -358,15 +543,9 @@ impl Peer {
     ) -> Result<TcpStream, ChainGangError> {
         // Connect over TCP
         let tcp_addr = SocketAddr::new(self.ip, self.port);
-        let connect_timeout =
-            duration_from_env_secs("CHAIN_GANG_CONNECT_TIMEOUT_SECS", CONNECT_TIMEOUT);
-        let handshake_read_timeout = duration_from_env_secs(
-            "CHAIN_GANG_HANDSHAKE_READ_TIMEOUT_SECS",
-            HANDSHAKE_READ_TIMEOUT,
-        );
-        let mut tcp_stream = TcpStream::connect_timeout(&tcp_addr, connect_timeout)?;
+        let mut tcp_stream = TcpStream::connect_timeout(&tcp_addr, connect_timeout())?;
         tcp_stream.set_nodelay(true)?; // Disable buffering
-        tcp_stream.set_read_timeout(Some(handshake_read_timeout))?;
+        tcp_stream.set_read_timeout(Some(handshake_read_timeout()))?;
         tcp_stream.set_nonblocking(false)?;
 
         // Write our version
@@ -382,16 +561,7 @@ impl Peer {
             Message::Version(version) => version,
             _ => return Err(ChainGangError::BadData("Unexpected command".to_string())),
         };
-
-        if !filter.connectable(&their_version) {
-            return Err(ChainGangError::IllegalState(
-                "Peer filtered out".to_string(),
-            ));
-        }
-
-        let now = secs_since(UNIX_EPOCH) as i64;
-        *self.time_delta.lock().unwrap() = now - their_version.timestamp;
-        *self.version.lock().unwrap() = Some(their_version);
+        self.accept_version(their_version, filter.as_ref())?;
 
         // Read their verack
         let their_verack = Message::read(&mut tcp_stream, magic)?;
@@ -407,15 +577,20 @@ impl Peer {
 
         // Write a ping message because this seems to help with connection weirdness
         // https://bitcoin.stackexchange.com/questions/49487/getaddr-not-returning-connected-node-addresses
-        let ping = Message::Ping(Ping {
-            nonce: secs_since(UNIX_EPOCH) as u64,
-        });
+        let ping = Peer::handshake_ping();
         debug!("{self:?} Write {ping:#?}");
         ping.write(&mut tcp_stream, magic)?;
 
         // After handshake, clone TCP stream and save the write version
         *self.tcp_writer.lock().unwrap() = Some(tcp_stream.try_clone()?);
 
+        // A disconnect during the handshake had no stream to shut down
+        if self.send_queue.is_closed() {
+            return Err(ChainGangError::IllegalState(
+                "Disconnected while connecting".to_string(),
+            ));
+        }
+
         // We don't need a timeout for the read. The peer will shutdown just fine.
         // The read timeout doesn't work reliably across platforms anyway.
         tcp_stream.set_read_timeout(None)?;
@@ -423,7 +598,40 @@ impl Peer {
         Ok(tcp_stream)
     }
 
-    fn handle_message(&self, message: &Message) -> Result<(), ChainGangError> {
+    /// Checks their version message against the filter and records it
+    pub(crate) fn accept_version(
+        &self,
+        their_version: Version,
+        filter: &dyn PeerFilter,
+    ) -> Result<(), ChainGangError> {
+        if !filter.connectable(&their_version) {
+            return Err(ChainGangError::IllegalState(
+                "Peer filtered out".to_string(),
+            ));
+        }
+
+        let now = secs_since(UNIX_EPOCH) as i64;
+        *self.time_delta.lock().unwrap() = now - their_version.timestamp;
+        *self.version.lock().unwrap() = Some(their_version);
+        Ok(())
+    }
+
+    /// Ping sent at the end of the handshake
+    pub(crate) fn handshake_ping() -> Message {
+        Message::Ping(Ping {
+            nonce: secs_since(UNIX_EPOCH) as u64,
+        })
+    }
+
+    /// Marks the handshake complete, after which the peer may be written to
+    pub(crate) fn set_connected(self: &Arc<Peer>) {
+        info!("{:?} Connected to {:?}:{}", self, self.ip, self.port);
+        self.connected.store(true, Ordering::Relaxed);
+        self.connected_event
+            .next(&PeerConnected { peer: self.clone() });
+    }
+
+    pub(crate) fn handle_message(&self, message: &Message) -> Result<(), ChainGangError> {
         // A subset of messages are handled directly by the peer
         match message {
             Message::FeeFilter(feefilter) => {
@@ -478,3 +686,82 @@ impl Drop for Peer {
         self.disconnect();
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::messages::{BlockHeader, Headers, PROTOCOL_VERSION};
+    use std::net::TcpListener;
+    use std::sync::mpsc;
+
+    const NETWORK: Network = Network::BSV_Testnet;
+
+    struct Collector(Mutex<mpsc::Sender<Message>>);
+
+    impl Observer<PeerMessage> for Collector {
+        fn next(&self, event: &PeerMessage) {
+            let _ = self.0.lock().unwrap().send(event.message.clone());
+        }
+    }
+
+    #[test]
+    fn reads_payload_split_across_writes() {
+        let headers = Message::Headers(Headers {
+            headers: vec![BlockHeader::default(); 2000],
+        });
+        let mut bytes = Vec::new();
+        headers.write(&mut bytes, NETWORK.magic()).unwrap();
+        assert!(bytes.len() > 64 * 1024);
+
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let addr = listener.local_addr().unwrap();
+        thread::spawn(move || -> Result<(), ChainGangError> {
+            let (mut stream, _) = listener.accept()?;
+            let magic = NETWORK.magic();
+            let version = Version {
+                version: PROTOCOL_VERSION,
+                services: NODE_BITCOIN_CASH,
+                user_agent: "/Bitcoin SV:1.0.0/".to_string(),
+                ..Default::default()
+            };
+            Message::read(&mut stream, magic)?;
+            Message::Version(version).write(&mut stream, magic)?;
+            Message::Verack.write(&mut stream, magic)?;
+            // Let the peer finish the handshake before the payload arrives in short writes
+            thread::sleep(Duration::from_millis(100));
+            for chunk in bytes.chunks(20_000) {
+                io::Write::write_all(&mut stream, chunk)?;
+                io::Write::flush(&mut stream)?;
+                thread::sleep(Duration::from_millis(20));
+            }
+            while Message::read(&mut stream, magic).is_ok() {}
+            Ok(())
+        });
+
+        let (tx, rx) = mpsc::channel();
+        let collector = Arc::new(Collector(Mutex::new(tx)));
+        let version = Version {
+            version: PROTOCOL_VERSION,
+            services: NODE_BITCOIN_CASH,
+            ..Default::default()
+        };
+        let peer = Peer::connect(
+            addr.ip(),
+            addr.port(),
+            NETWORK,
+            version,
+            Arc::new(PeerNodeFilter::default()),
+        );
+        peer.messages().subscribe(&collector);
+
+        let received = loop {
+            match rx.recv_timeout(Duration::from_secs(10)).unwrap() {
+                Message::Headers(received) => break received,
+                _ => continue,
+            }
+        };
+        assert_eq!(received.headers.len(), 2000);
+        assert!(peer.connected());
+        peer.disconnect();
+    }
+}
@@ -0,0 +1,1008 @@
+//! Pool that keeps a target number of healthy peers connected
+//!
+//! A [`PeerPool`] resolves the network's DNS seeds in parallel and caches the addresses, connects
+//! until it has the target number of peers, and pings each peer to measure its round trip time.
+//! Peers that stop answering pings, answer too slowly or are penalized past the ban score are
+//! disconnected, and addresses that fail are retried with exponential backoff. Requests can be
+//! routed to the best peers, ranked by ban score and round trip time.
+//!
+//! With an [`AddrManager`], the pool asks connected peers for addresses, learns those they
+//! gossip, and draws candidates from it before falling back to the DNS seeds.
+
+use crate::messages::{Message, Ping, Version};
+use crate::network::Network;
+use crate::peer::{
+    AddrManager, Peer, PeerConnected, PeerDisconnected, PeerFilter, PeerMessage, PeerRuntime,
+};
+use crate::util::rx::{Observable, Observer};
+use crate::util::{secs_since, ChainGangError};
+use dns_lookup::lookup_host;
+use rand::seq::SliceRandom;
+use rand::{random, rng};
+use std::collections::HashMap;
+use std::fmt::Write as _;
+use std::net::{IpAddr, SocketAddr};
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex};
+use std::thread::{self, JoinHandle};
+use std::time::{Duration, Instant, UNIX_EPOCH};
+
+/// Weight of the newest sample in the round trip time average
+const RTT_WEIGHT: f64 = 0.25;
+
+/// Settings of a peer pool
+#[derive(Clone)]
+pub struct PeerPoolConfig {
+    pub network: Network,
+    /// Number of connected peers to maintain
+    pub target_peers: usize,
+    /// Version sent to peers; the timestamp is refreshed for each connection
+    pub version: Version,
+    pub filter: Arc<dyn PeerFilter>,
+    /// DNS seeds to resolve, by default the network's seeds
+    pub seeds: Vec<String>,
+    /// Addresses to use in addition to the seeds
+    pub addresses: Vec<SocketAddr>,
+    /// How long resolved seed addresses are reused before resolving again
+    pub seed_refresh: Duration,
+    /// Minimum time between lookups when the seeds gave no unused addresses
+    pub seed_retry: Duration,
+    pub ping_interval: Duration,
+    /// Peers that do not answer a ping within this time are evicted
+    pub ping_timeout: Duration,
+    /// Peers whose average round trip time exceeds this are evicted
+    pub max_rtt: Duration,
+    /// Peers that do not finish connecting within this time are dropped
+    pub connect_timeout: Duration,
+    /// Peers penalized to this score are evicted
+    pub max_ban_score: u32,
+    /// Delay before retrying an address after its first failure, doubled for each further failure
+    pub min_backoff: Duration,
+    pub max_backoff: Duration,
+    /// How often the pool checks its peers
+    pub tick: Duration,
+    /// Runtime to connect peers through, instead of a thread per peer
+    pub runtime: Option<Arc<PeerRuntime>>,
+    /// Table of gossiped addresses to learn from and connect to
+    pub addr_manager: Option<Arc<Mutex<AddrManager>>>,
+}
+
+impl PeerPoolConfig {
+    /// Creates a config with default limits for the network
+    pub fn new(network: Network, version: Version, filter: Arc<dyn PeerFilter>) -> PeerPoolConfig {
+        PeerPoolConfig {
+            network,
+            target_peers: 8,
+            version,
+            filter,
+            seeds: network.seeds(),
+            addresses: Vec::new(),
+            seed_refresh: Duration::from_secs(30 * 60),
+            seed_retry: Duration::from_secs(60),
+            ping_interval: Duration::from_secs(30),
+            ping_timeout: Duration::from_secs(20),
+            max_rtt: Duration::from_secs(5),
+            connect_timeout: Duration::from_secs(15),
+            max_ban_score: 100,
+            min_backoff: Duration::from_secs(1),
+            max_backoff: Duration::from_secs(10 * 60),
+            tick: Duration::from_secs(1),
+            runtime: None,
+            addr_manager: None,
+        }
+    }
+}
+
+/// Health of one pooled peer
+#[derive(Debug, Clone, PartialEq)]
+pub struct PoolPeerStats {
+    pub addr: SocketAddr,
+    pub connected: bool,
+    /// Average ping round trip time
+    pub rtt: Option<Duration>,
+    pub messages: u64,
+    /// Messages received per second since connecting
+    pub messages_per_sec: f64,
+    pub ban_score: u32,
+    pub uptime: Duration,
+}
+
+/// Snapshot of a pool's state and counters
+#[derive(Debug, Clone, Default, PartialEq)]
+pub struct PoolStats {
+    pub target: usize,
+    pub connected: usize,
+    pub connecting: usize,
+    /// Addresses known from the seeds, config and address manager
+    pub known_addresses: usize,
+    /// Addresses waiting to be retried
+    pub backing_off: usize,
+    pub connects: u64,
+    /// Connections that failed or dropped
+    pub failures: u64,
+    /// Peers disconnected for being slow, unresponsive or misbehaving
+    pub evictions: u64,
+    pub peers: Vec<PoolPeerStats>,
+}
+
+impl PoolStats {
+    /// Formats the stats in the Prometheus text exposition format
+    pub fn to_prometheus(&self, prefix: &str) -> String {
+        let mut out = String::new();
+        // Writing to a String can not fail
+        for (name, kind, help, value) in [
+            (
+                "target_peers",
+                "gauge",
+                "Peers the pool maintains.",
+                self.target as f64,
+            ),
+            (
+                "connected_peers",
+                "gauge",
+                "Connected peers.",
+                self.connected as f64,
+            ),
+            (
+                "connecting_peers",
+                "gauge",
+                "Peers connecting.",
+                self.connecting as f64,
+            ),
+            (
+                "known_addresses",
+                "gauge",
+                "Known peer addresses.",
+                self.known_addresses as f64,
+            ),
+            (
+                "backing_off",
+                "gauge",
+                "Addresses waiting to be retried.",
+                self.backing_off as f64,
+            ),
+            (
+                "connects_total",
+                "counter",
+                "Connection attempts.",
+                self.connects as f64,
+            ),
+            (
+                "failures_total",
+                "counter",
+                "Connections that failed or dropped.",
+                self.failures as f64,
+            ),
+            (
+                "evictions_total",
+                "counter",
+                "Peers evicted for poor health.",
+                self.evictions as f64,
+            ),
+        ] {
+            let _ = writeln!(out, "# HELP {prefix}_{name} {help}");
+            let _ = writeln!(out, "# TYPE {prefix}_{name} {kind}");
+            let _ = writeln!(out, "{prefix}_{name} {value}");
+        }
+        let _ = writeln!(
+            out,
+            "# HELP {prefix}_peer_rtt_seconds Average ping round trip time."
+        );
+        let _ = writeln!(out, "# TYPE {prefix}_peer_rtt_seconds gauge");
+        for peer in self.peers.iter() {
+            if let Some(rtt) = peer.rtt {
+                let _ = writeln!(
+                    out,
+                    "{prefix}_peer_rtt_seconds{{peer=\"{}\"}} {}",
+                    peer.addr,
+                    rtt.as_secs_f64()
+                );
+            }
+        }
+        let _ = writeln!(
+            out,
+            "# HELP {prefix}_peer_messages_total Messages received."
+        );
+        let _ = writeln!(out, "# TYPE {prefix}_peer_messages_total counter");
+        for peer in self.peers.iter() {
+            let _ = writeln!(
+                out,
+                "{prefix}_peer_messages_total{{peer=\"{}\"}} {}",
+                peer.addr, peer.messages
+            );
+        }
+        out
+    }
+}
+
+/// A peer the pool connected and what it has measured about it
+struct PoolPeer {
+    peer: Arc<Peer>,
+    started: Instant,
+    connected_at: Option<Instant>,
+    /// The peer disconnected or failed to connect
+    closed: bool,
+    rtt: Option<Duration>,
+    /// Nonce and send time of the unanswered ping
+    ping: Option<(u64, Instant)>,
+    last_ping: Option<Instant>,
+    messages: u64,
+    ban_score: u32,
+}
+
+impl PoolPeer {
+    fn stats(&self, addr: SocketAddr, now: Instant) -> PoolPeerStats {
+        let uptime = self
+            .connected_at
+            .map(|connected_at| now - connected_at)
+            .unwrap_or_default();
+        PoolPeerStats {
+            addr,
+            connected: self.connected_at.is_some() && !self.closed,
+            rtt: self.rtt,
+            messages: self.messages,
+            messages_per_sec: match uptime.as_secs_f64() {
+                secs if secs > 0.0 => self.messages as f64 / secs,
+                _ => 0.0,
+            },
+            ban_score: self.ban_score,
+            uptime,
+        }
+    }
+
+    /// Sort key for routing, best first
+    fn rank(&self) -> (u32, Duration) {
+        (self.ban_score, self.rtt.unwrap_or(Duration::MAX))
+    }
+}
+
+/// Retry state of an address that failed
+struct Backoff {
+    failures: u32,
+    retry_at: Instant,
+}
+
+#[derive(Default)]
+struct PoolState {
+    peers: HashMap<SocketAddr, PoolPeer>,
+    backoff: HashMap<SocketAddr, Backoff>,
+    seeds: Vec<SocketAddr>,
+    seeds_resolved: Option<Instant>,
+    connects: u64,
+    failures: u64,
+    evictions: u64,
+}
+
+struct PoolInner {
+    config: PeerPoolConfig,
+    state: Mutex<PoolState>,
+    stopped: AtomicBool,
+}
+
+fn addr_of(peer: &Peer) -> SocketAddr {
+    SocketAddr::new(peer.ip, peer.port)
+}
+
+fn unix_now() -> u32 {
+    secs_since(UNIX_EPOCH) as u32
+}
+
+impl PoolInner {
+    /// Runs the pool's checks and connects peers until stopped
+    fn run(self: Arc<Self>) {
+        while !self.stopped.load(Ordering::Relaxed) {
+            self.maintain();
+            thread::sleep(self.config.tick);
+        }
+    }
+
+    fn maintain(self: &Arc<Self>) {
+        let now = Instant::now();
+        let mut evict = Vec::new();
+        let mut abandon = Vec::new();
+        let mut pings = Vec::new();
+        let live = {
+            let mut state = self.state.lock().unwrap();
+            let state = &mut *state;
+            let mut closed = Vec::new();
+            for (addr, pooled) in state.peers.iter_mut() {
+                if pooled.closed {
+                    closed.push(*addr);
+                    continue;
+                }
+                if pooled.connected_at.is_none()
+                    && now - pooled.started > self.config.connect_timeout
+                {
+                    // Disconnected too, so a handshake that finishes late is not left running
+                    info!("{:?} Timed out connecting", pooled.peer);
+                    abandon.push(pooled.peer.clone());
+                    closed.push(*addr);
+                    continue;
+                }
+                if pooled.connected_at.is_none() {
+                    continue;
+                }
+                let reason = if pooled.ban_score >= self.config.max_ban_score {
+                    Some("misbehaving")
+                } else if pooled
+                    .ping
+                    .is_some_and(|(_, sent)| now - sent > self.config.ping_timeout)
+                {
+                    Some("ping timeout")
+                } else if pooled.rtt.is_some_and(|rtt| rtt > self.config.max_rtt) {
+                    Some("slow")
+                } else {
+                    None
+                };
+                if let Some(reason) = reason {
+                    info!("{:?} Evicting from pool: {reason}", pooled.peer);
+                    evict.push(pooled.peer.clone());
+                    closed.push(*addr);
+                } else if pooled.ping.is_none()
+                    && pooled
+                        .last_ping
+                        .is_none_or(|last| now - last >= self.config.ping_interval)
+                {
+                    let nonce = random::<u64>();
+                    pooled.ping = Some((nonce, now));
+                    pooled.last_ping = Some(now);
+                    pings.push((pooled.peer.clone(), nonce));
+                }
+            }
+            state.evictions += evict.len() as u64;
+            for addr in closed {
+                if let Some(pooled) = state.peers.remove(&addr) {
+                    self.retry_later(state, addr, &pooled, now);
+                }
+            }
+            state.peers.len()
+        };
+
+        // Peers are called without the lock, since they emit events back into the pool
+        for peer in evict.into_iter().chain(abandon) {
+            peer.disconnect();
+        }
+        for (peer, nonce) in pings {
+            if let Err(e) = peer.send(&Message::Ping(Ping { nonce })) {
+                warn!("{peer:?} Failed to send ping: {e:?}");
+            }
+        }
+
+        if live < self.config.target_peers {
+            self.connect(self.config.target_peers - live, now);
+        }
+    }
+
+    /// Schedules the next attempt at an address whose peer was removed
+    fn retry_later(
+        &self,
+        state: &mut PoolState,
+        addr: SocketAddr,
+        pooled: &PoolPeer,
+        now: Instant,
+    ) {
+        let failures = match (pooled.connected_at, state.backoff.get(&addr)) {
+            // A peer that was connected starts its backoff again
+            (Some(_), _) => 1,
+            (None, Some(backoff)) => backoff.failures + 1,
+            (None, None) => 1,
+        };
+        state.failures += 1;
+        let delay = self
+            .config
+            .min_backoff
+            .saturating_mul(1 << (failures - 1).min(16))
+            .min(self.config.max_backoff);
+        state.backoff.insert(
+            addr,
+            Backoff {
+                failures,
+                retry_at: now + delay,
+            },
+        );
+    }
+
+    /// Connects up to `count` new peers
+    fn connect(self: &Arc<Self>, count: usize, now: Instant) {
+        self.refresh_seeds(now);
+        let candidates: Vec<SocketAddr> = {
+            let state = self.state.lock().unwrap();
+            let available = |addr: &SocketAddr| {
+                !state.peers.contains_key(addr)
+                    && state
+                        .backoff
+                        .get(addr)
+                        .is_none_or(|backoff| backoff.retry_at <= now)
+            };
+            let mut candidates: Vec<SocketAddr> = self
+                .config
+                .addresses
+                .iter()
+                .filter(|addr| available(addr))
+                .copied()
+                .take(count)
+                .collect();
+            // The address manager is only locked inside the state lock, never the other way round
+            if let Some(addr_manager) = &self.config.addr_manager {
+                let addr_manager = addr_manager.lock().unwrap();
+                let unix_now = unix_now();
+                while candidates.len() < count {
+                    let selected = addr_manager.select(unix_now, |addr| {
+                        !available(addr) || candidates.contains(addr)
+                    });
+                    match selected {
+                        Some(addr) => candidates.push(addr),
+                        None => break,
+                    }
+                }
+            }
+            let mut seeds = state.seeds.clone();
+            seeds.shuffle(&mut rng());
+            for addr in seeds {
+                if candidates.len() == count {
+                    break;
+                }
+                if available(&addr) && !candidates.contains(&addr) {
+                    candidates.push(addr);
+                }
+            }
+            candidates
+        };
+        if let Some(addr_manager) = &self.config.addr_manager {
+            let mut addr_manager = addr_manager.lock().unwrap();
+            for addr in &candidates {
+                addr_manager.attempt(addr, unix_now());
+            }
+        }
+
+        for addr in candidates {
+            let mut version = self.config.version.clone();
+            version.timestamp = secs_since(UNIX_EPOCH) as i64;
+            let (ip, port, network, filter) = (
+                addr.ip(),
+                addr.port(),
+                self.config.network,
+                self.config.filter.clone(),
+            );
+            let peer = match &self.config.runtime {
+                Some(runtime) => runtime.connect(ip, port, network, version, filter),
+                None => Peer::connect(ip, port, network, version, filter),
+            };
+            {
+                let mut state = self.state.lock().unwrap();
+                state.connects += 1;
+                state.peers.insert(
+                    addr,
+                    PoolPeer {
+                        peer: peer.clone(),
+                        started: now,
+                        connected_at: None,
+                        closed: false,
+                        rtt: None,
+                        ping: None,
+                        last_ping: None,
+                        messages: 0,
+                        ban_score: 0,
+                    },
+                );
+            }
+            // Subscribed after the peer is recorded, and without the lock, since events that
+            // already happened are replayed straight away
+            peer.messages().subscribe(self);
+            peer.connected_event().subscribe(self);
+            peer.disconnected_event().subscribe(self);
+        }
+    }
+
+    /// Resolves the DNS seeds in parallel when the cached addresses are stale or used up
+    ///
+    /// Used up addresses, including an empty or failed lookup, are resolved again at most once
+    /// every `seed_retry`.
+    fn refresh_seeds(&self, now: Instant) {
+        let stale = {
+            let state = self.state.lock().unwrap();
+            match state.seeds_resolved {
+                None => true,
+                Some(resolved) => {
+                    let age = now.saturating_duration_since(resolved);
+                    age > self.config.seed_refresh
+                        || (age >= self.config.seed_retry
+                            && state
+                                .seeds
+                                .iter()
+                                .all(|addr| state.peers.contains_key(addr)))
+                }
+            }
+        };
+        if !stale || self.config.seeds.is_empty() {
+            return;
+        }
+        let port = self.config.network.port();
+        let mut seeds: Vec<SocketAddr> = thread::scope(|scope| {
+            let lookups: Vec<_> = self
+                .config
+                .seeds
+                .iter()
+                .map(|seed| {
+                    scope.spawn(move || {
+                        let ips = lookup_host(seed).map(|ips| ips.collect::<Vec<IpAddr>>());
+                        (seed, ips)
+                    })
+                })
+                .collect();
+            lookups
+                .into_iter()
+                .filter_map(|lookup| lookup.join().ok())
+                .flat_map(|(seed, result)| match result {
+                    Ok(ips) => ips,
+                    Err(e) => {
+                        error!("Failed to look up DNS {seed:?}: {e}");
+                        Vec::new()
+                    }
+                })
+                .map(|ip| SocketAddr::new(ip, port))
+                .collect()
+        });
+        seeds.sort();
+        seeds.dedup();
+        info!("Resolved {} addresses from DNS seeds", seeds.len());
+        let mut state = self.state.lock().unwrap();
+        state.seeds = seeds;
+        state.seeds_resolved = Some(now);
+    }
+}
+
+impl Observer<PeerMessage> for PoolInner {
+    fn next(&self, event: &PeerMessage) {
+        if let Some(addr_manager) = &self.config.addr_manager {
+            let source = event.peer.ip;
+            match &event.message {
+                Message::Addr(addr) => {
+                    let added = addr_manager
+                        .lock()
+                        .unwrap()
+                        .add(&addr.addrs, source, unix_now());
+                    debug!("{:?} Learned {added} new addresses", event.peer);
+                }
+                Message::AddrV2(addr) => {
+                    let added =
+                        addr_manager
+                            .lock()
+                            .unwrap()
+                            .add_v2(&addr.addrs, source, unix_now());
+                    debug!("{:?} Learned {added} new addresses", event.peer);
+                }
+                _ => {}
+            }
+        }
+        let mut state = self.state.lock().unwrap();
+        let Some(pooled) = state.peers.get_mut(&addr_of(&event.peer)) else {
+            return;
+        };
+        pooled.messages += 1;
+        if let Message::Pong(pong) = &event.message {
+            if let Some((nonce, sent)) = pooled.ping {
+                if pong.nonce == nonce {
+                    let sample = sent.elapsed();
+                    pooled.rtt = Some(match pooled.rtt {
+                        Some(rtt) => rtt.mul_f64(1.0 - RTT_WEIGHT) + sample.mul_f64(RTT_WEIGHT),
+                        None => sample,
+                    });
+                    pooled.ping = None;
+                }
+            }
+        }
+    }
+}
+
+impl Observer<PeerConnected> for PoolInner {
+    fn next(&self, event: &PeerConnected) {
+        let addr = addr_of(&event.peer);
+        {
+            let mut state = self.state.lock().unwrap();
+            let Some(pooled) = state
+                .peers
+                .get_mut(&addr)
+                .filter(|pooled| pooled.peer.id == event.peer.id)
+            else {
+                return;
+            };
+            pooled.connected_at = Some(Instant::now());
+            state.backoff.remove(&addr);
+        }
+        if let Some(addr_manager) = &self.config.addr_manager {
+            addr_manager.lock().unwrap().good(&addr, unix_now());
+            if let Err(e) = event.peer.send(&Message::GetAddr) {
+                warn!("{:?} Failed to send getaddr: {e:?}", event.peer);
+            }
+        }
+    }
+}
+
+impl Observer<PeerDisconnected> for PoolInner {
+    fn next(&self, event: &PeerDisconnected) {
+        let mut state = self.state.lock().unwrap();
+        // A peer the pool already dropped may still report, after a new one took its address
+        if let Some(pooled) = state
+            .peers
+            .get_mut(&addr_of(&event.peer))
+            .filter(|pooled| pooled.peer.id == event.peer.id)
+        {
+            pooled.closed = true;
+        }
+    }
+}
+
+/// Maintains a target number of healthy peer connections
+///
+/// Dropping the pool stops it and disconnects its peers.
+pub struct PeerPool {
+    inner: Arc<PoolInner>,
+    thread: Option<JoinHandle<()>>,
+}
+
+impl PeerPool {
+    /// Starts a pool that connects peers in the background
+    pub fn start(config: PeerPoolConfig) -> PeerPool {
+        let inner = Arc::new(PoolInner {
+            config,
+            state: Mutex::new(PoolState::default()),
+            stopped: AtomicBool::new(false),
+        });
+        let runner = inner.clone();
+        let thread = thread::spawn(move || runner.run());
+        PeerPool {
+            inner,
+            thread: Some(thread),
+        }
+    }
+
+    /// Connected peers, best first
+    pub fn peers(&self) -> Vec<Arc<Peer>> {
+        let state = self.inner.state.lock().unwrap();
+        let mut peers: Vec<&PoolPeer> = state
+            .peers
+            .values()
+            .filter(|pooled| pooled.connected_at.is_some() && !pooled.closed)
+            .collect();
+        peers.sort_by_key(|pooled| pooled.rank());
+        peers.iter().map(|pooled| pooled.peer.clone()).collect()
+    }
+
+    /// Up to `n` of the best connected peers
+    pub fn best_peers(&self, n: usize) -> Vec<Arc<Peer>> {
+        let mut peers = self.peers();
+        peers.truncate(n);
+        peers
+    }
+
+    /// The best connected peer, if any
+    pub fn best_peer(&self) -> Option<Arc<Peer>> {
+        self.peers().into_iter().next()
+    }
+
+    /// Sends a message to up to `n` of the best peers, returning how many accepted it
+    pub fn send_to_best(&self, message: &Message, n: usize) -> Result<usize, ChainGangError> {
+        let sent = self
+            .best_peers(n)
+            .iter()
+            .filter(|peer| peer.send(message).is_ok())
+            .count();
+        match sent {
+            0 => Err(ChainGangError::IllegalState(
+                "No connected peers".to_string(),
+            )),
+            sent => Ok(sent),
+        }
+    }
+
+    /// Sends a message to every connected peer, returning how many accepted it
+    pub fn broadcast(&self, message: &Message) -> usize {
+        self.peers()
+            .iter()
+            .filter(|peer| peer.send(message).is_ok())
+            .count()
+    }
+
+    /// Adds to a peer's ban score; peers reaching the config's `max_ban_score` are evicted
+    ///
+    /// The score is also recorded in the address manager, which bans the address for a while.
+    pub fn penalize(&self, peer: &Peer, score: u32) {
+        let addr = addr_of(peer);
+        {
+            let mut state = self.inner.state.lock().unwrap();
+            if let Some(pooled) = state.peers.get_mut(&addr) {
+                pooled.ban_score = pooled.ban_score.saturating_add(score);
+            }
+        }
+        if let Some(addr_manager) = &self.inner.config.addr_manager {
+            addr_manager
+                .lock()
+                .unwrap()
+                .misbehaving(&addr, score, unix_now());
+        }
+    }
+
+    /// Returns the pool's state and counters
+    pub fn stats(&self) -> PoolStats {
+        let now = Instant::now();
+        let state = self.inner.state.lock().unwrap();
+        let mut peers: Vec<PoolPeerStats> = state
+            .peers
+            .iter()
+            .map(|(addr, pooled)| pooled.stats(*addr, now))
+            .collect();
+        peers.sort_by_key(|peer| peer.addr);
+        let connected = peers.iter().filter(|peer| peer.connected).count();
+        let mut known = state.seeds.clone();
+        known.extend(self.inner.config.addresses.iter().copied());
+        known.sort();
+        known.dedup();
+        let gossiped = match &self.inner.config.addr_manager {
+            Some(addr_manager) => addr_manager.lock().unwrap().len(),
+            None => 0,
+        };
+        PoolStats {
+            target: self.inner.config.target_peers,
+            connected,
+            connecting: peers.len() - connected,
+            known_addresses: known.len() + gossiped,
+            backing_off: state
+                .backoff
+                .values()
+                .filter(|backoff| backoff.retry_at > now)
+                .count(),
+            connects: state.connects,
+            failures: state.failures,
+            evictions: state.evictions,
+            peers,
+        }
+    }
+
+    /// Stops maintaining peers and disconnects them
+    pub fn stop(&mut self) {
+        self.inner.stopped.store(true, Ordering::Relaxed);
+        if let Some(thread) = self.thread.take() {
+            let _ = thread.join();
+        }
+        let peers: Vec<Arc<Peer>> = {
+            let mut state = self.inner.state.lock().unwrap();
+            state.peers.drain().map(|(_, pooled)| pooled.peer).collect()
+        };
+        for peer in peers {
+            peer.disconnect();
+        }
+    }
+}
+
+impl Drop for PeerPool {
+    fn drop(&mut self) {
+        self.stop();
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::messages::{Addr, NodeAddr, NodeAddrEx, NODE_BITCOIN_CASH, PROTOCOL_VERSION};
+    use crate::peer::AddrManagerConfig;
+    use crate::peer::PeerNodeFilter;
+    use std::net::{TcpListener, TcpStream};
+    use std::sync::mpsc;
+
+    const NETWORK: Network = Network::BSV_Testnet;
+
+    fn version() -> Version {
+        Version {
+            version: PROTOCOL_VERSION,
+            services: NODE_BITCOIN_CASH,
+            user_agent: "/Bitcoin SV:1.0.0/".to_string(),
+            ..Default::default()
+        }
+    }
+
+    /// Stand-in node that completes the handshake and answers pings after `delay`
+    fn node(delay: Duration) -> SocketAddr {
+        gossiping_node(delay, Vec::new())
+    }
+
+    /// Stand-in node that also answers getaddr with `gossip`
+    fn gossiping_node(delay: Duration, gossip: Vec<SocketAddr>) -> SocketAddr {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let addr = listener.local_addr().unwrap();
+        thread::spawn(move || {
+            for stream in listener.incoming() {
+                let mut stream: TcpStream = stream.unwrap();
+                let gossip = gossip.clone();
+                thread::spawn(move || -> Result<(), ChainGangError> {
+                    let magic = NETWORK.magic();
+                    Message::read(&mut stream, magic)?;
+                    Message::Version(version()).write(&mut stream, magic)?;
+                    Message::Verack.write(&mut stream, magic)?;
+                    loop {
+                        match Message::read(&mut stream, magic)? {
+                            Message::Ping(ping) => {
+                                thread::sleep(delay);
+                                Message::Pong(ping).write(&mut stream, magic)?;
+                            }
+                            Message::GetAddr => {
+                                let addrs = gossip
+                                    .iter()
+                                    .map(|addr| NodeAddrEx {
+                                        last_connected_time: unix_now(),
+                                        addr: NodeAddr::new(addr.ip(), addr.port()),
+                                    })
+                                    .collect();
+                                Message::Addr(Addr { addrs }).write(&mut stream, magic)?;
+                            }
+                            _ => {}
+                        }
+                    }
+                });
+            }
+        });
+        addr
+    }
+
+    /// Stand-in node that completes the handshake after `delay`, then reports when it is closed
+    fn late_node(delay: Duration, closed: mpsc::Sender<()>) -> SocketAddr {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let addr = listener.local_addr().unwrap();
+        thread::spawn(move || -> Result<(), ChainGangError> {
+            let mut stream = listener.incoming().next().unwrap()?;
+            let magic = NETWORK.magic();
+            Message::read(&mut stream, magic)?;
+            thread::sleep(delay);
+            Message::Version(version()).write(&mut stream, magic)?;
+            Message::Verack.write(&mut stream, magic)?;
+            while Message::read(&mut stream, magic).is_ok() {}
+            let _ = closed.send(());
+            Ok(())
+        });
+        addr
+    }
+
+    fn config(addresses: Vec<SocketAddr>) -> PeerPoolConfig {
+        let mut config =
+            PeerPoolConfig::new(NETWORK, version(), Arc::new(PeerNodeFilter::default()));
+        config.seeds = Vec::new();
+        config.addresses = addresses;
+        config.target_peers = 2;
+        config.tick = Duration::from_millis(20);
+        config.ping_interval = Duration::from_millis(50);
+        config.min_backoff = Duration::from_millis(50);
+        config
+    }
+
+    fn wait_for(pool: &PeerPool, mut done: impl FnMut(&PoolStats) -> bool) -> PoolStats {
+        let deadline = Instant::now() + Duration::from_secs(10);
+        loop {
+            let stats = pool.stats();
+            if done(&stats) {
+                return stats;
+            }
+            assert!(Instant::now() < deadline, "timed out: {stats:?}");
+            thread::sleep(Duration::from_millis(10));
+        }
+    }
+
+    #[test]
+    fn maintains_target_and_ranks_peers() {
+        let fast = node(Duration::ZERO);
+        let slow = node(Duration::from_millis(100));
+        let pool = PeerPool::start(config(vec![slow, fast]));
+        let stats = wait_for(&pool, |stats| {
+            stats.connected == 2 && stats.peers.iter().all(|peer| peer.rtt.is_some())
+        });
+        assert_eq!(stats.connects, 2);
+        assert!(stats
+            .to_prometheus("pool")
+            .contains("pool_connected_peers 2"));
+
+        let best = pool.best_peer().unwrap();
+        assert_eq!(addr_of(&best), fast);
+        assert_eq!(
+            pool.send_to_best(&Message::Ping(Ping { nonce: 1 }), 1)
+                .unwrap(),
+            1
+        );
+        assert_eq!(pool.broadcast(&Message::Ping(Ping { nonce: 2 })), 2);
+
+        // A penalized peer ranks last, then is evicted and replaced by a retry
+        pool.penalize(&best, 10);
+        assert_eq!(addr_of(&pool.best_peer().unwrap()), slow);
+        pool.penalize(&best, 1000);
+        wait_for(&pool, |stats| stats.evictions == 1);
+        wait_for(&pool, |stats| stats.connected == 2 && stats.connects == 3);
+    }
+
+    #[test]
+    fn evicts_slow_peers_and_backs_off() {
+        let slow = node(Duration::from_millis(100));
+        let mut config = config(vec![slow]);
+        config.max_rtt = Duration::from_millis(20);
+        config.min_backoff = Duration::from_secs(60);
+        let pool = PeerPool::start(config);
+        let stats = wait_for(&pool, |stats| stats.evictions == 1);
+        assert_eq!(stats.backing_off, 1);
+        thread::sleep(Duration::from_millis(100));
+        assert_eq!(pool.stats().connects, 1);
+        assert!(pool.best_peer().is_none());
+        assert!(pool.send_to_best(&Message::Verack, 1).is_err());
+    }
+
+    #[test]
+    fn disconnects_peers_that_time_out_connecting() {
+        let (sender, closed) = mpsc::channel();
+        let late = late_node(Duration::from_millis(300), sender);
+        let mut config = config(vec![late]);
+        config.connect_timeout = Duration::from_millis(100);
+        config.min_backoff = Duration::from_secs(60);
+        let pool = PeerPool::start(config);
+        wait_for(&pool, |stats| stats.failures == 1);
+        // The handshake completes after the pool gave up, and the connection is closed
+        closed.recv_timeout(Duration::from_secs(5)).unwrap();
+        let stats = pool.stats();
+        assert_eq!(stats.connected, 0);
+        assert_eq!(stats.connects, 1);
+    }
+
+    #[test]
+    fn unreachable_addresses_back_off() {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let closed = listener.local_addr().unwrap();
+        drop(listener);
+        let pool = PeerPool::start(config(vec![closed]));
+        let stats = wait_for(&pool, |stats| stats.failures >= 2);
+        assert_eq!(stats.connected, 0);
+        // 50ms then 100ms between attempts
+        assert!(stats.connects <= 3);
+    }
+
+    #[test]
+    fn learns_addresses_from_gossip() {
+        let gossiped = node(Duration::ZERO);
+        let known = gossiping_node(Duration::ZERO, vec![gossiped]);
+        let mut addr_manager = AddrManager::new(AddrManagerConfig::default());
+        addr_manager.allow_local(true);
+        addr_manager.add_addr(known, 0, unix_now(), known.ip(), unix_now());
+        let addr_manager = Arc::new(Mutex::new(addr_manager));
+
+        let mut config = config(Vec::new());
+        config.addr_manager = Some(addr_manager.clone());
+        let pool = PeerPool::start(config);
+        let stats = wait_for(&pool, |stats| stats.connected == 2);
+        assert_eq!(stats.known_addresses, 2);
+        wait_for(&pool, |_| addr_manager.lock().unwrap().tried_count() == 2);
+
+        pool.penalize(&pool.best_peer().unwrap(), 1000);
+        wait_for(&pool, |stats| stats.evictions == 1);
+        let addr_manager = addr_manager.lock().unwrap();
+        assert!(
+            addr_manager.is_banned(&known, unix_now())
+                || addr_manager.is_banned(&gossiped, unix_now())
+        );
+    }
+
+    #[test]
+    fn empty_seed_lookups_are_not_repeated_every_tick() {
+        let mut config = config(Vec::new());
+        // Names under .invalid never resolve
+        config.seeds = vec!["seed.invalid".to_string()];
+        let retry = config.seed_retry;
+        let inner = PoolInner {
+            config,
+            state: Mutex::new(PoolState::default()),
+            stopped: AtomicBool::new(false),
+        };
+        let start = Instant::now();
+        inner.refresh_seeds(start);
+        assert_eq!(inner.state.lock().unwrap().seeds_resolved, Some(start));
+        // Later ticks reuse the empty result until the retry interval has passed
+        inner.refresh_seeds(start + Duration::from_secs(1));
+        assert_eq!(inner.state.lock().unwrap().seeds_resolved, Some(start));
+        let later = start + retry;
+        inner.refresh_seeds(later);
+        assert_eq!(inner.state.lock().unwrap().seeds_resolved, Some(later));
+    }
+}
@@ -0,0 +1,921 @@
+//! Event loop runtime that multiplexes many peers on a small pool of worker threads
+//!
+//! [`Peer::connect`] spawns a thread per peer that blocks reading its socket. A [`PeerRuntime`]
+//! instead registers non-blocking sockets with one [`mio::Poll`] per worker thread, so thousands
+//! of peers share a fixed number of threads. Peers connected through a runtime are ordinary
+//! [`Peer`]s: they emit the same `connected_event`, `messages` and `disconnected_event`, and
+//! `send` queues the message for the worker to write when the socket is ready.
+//!
+//! Observers of runtime peers are called on the worker thread, so a slow observer delays every
+//! peer on that worker.
+
+use crate::messages::{BlockDownload, Message, MessageHeader, Version, MAX_PAYLOAD_SIZE};
+use crate::network::Network;
+use crate::peer::peer::{connect_timeout, handshake_read_timeout};
+use crate::peer::send_queue::{SendPolicy, SendQueueConfig, WriteBatch};
+use crate::peer::{Peer, PeerFilter, PeerMessage};
+use crate::util::{BufferPool, ChainGangError, Serializable};
+use mio::net::TcpStream;
+use mio::{Events, Interest, Poll, Token, Waker};
+use std::collections::HashMap;
+use std::io::{self, Read};
+use std::net::{IpAddr, Shutdown, SocketAddr};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::{Arc, Mutex};
+use std::thread::{self, JoinHandle};
+use std::time::{Duration, Instant};
+
+/// Token of each worker's waker
+const WAKE_TOKEN: Token = Token(usize::MAX);
+
+/// How often workers check handshake deadlines
+const TICK: Duration = Duration::from_millis(100);
+
+/// Size of the buffer sockets are read into
+const READ_CHUNK: usize = 64 * 1024;
+
+/// Work handed to a worker thread
+enum Command {
+    Register(Box<Connection>),
+    /// Outbound data was queued for the connection
+    Flush(Token),
+    Close(Token),
+    Shutdown,
+}
+
+/// State shared between a worker thread and the peers it drives
+struct WorkerShared {
+    waker: Waker,
+    commands: Mutex<Vec<Command>>,
+    next_token: AtomicUsize,
+    peers: AtomicUsize,
+}
+
+impl WorkerShared {
+    fn command(&self, command: Command) {
+        self.commands.lock().unwrap().push(command);
+        if let Err(e) = self.waker.wake() {
+            error!("Failed to wake peer runtime worker: {e:?}");
+        }
+    }
+}
+
+/// A runtime peer's handle to its worker, used by `Peer::send` and `Peer::disconnect`
+pub(crate) struct RuntimeLink {
+    worker: Arc<WorkerShared>,
+    token: Token,
+}
+
+impl RuntimeLink {
+    /// Wakes the worker to write the peer's send queue
+    pub(crate) fn flush(&self) {
+        self.worker.command(Command::Flush(self.token));
+    }
+
+    /// Asks the worker to write the peer's send queue and close the connection
+    pub(crate) fn close(&self) {
+        self.worker.command(Command::Close(self.token));
+    }
+}
+
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+enum State {
+    Connecting,
+    AwaitVersion,
+    AwaitVerack,
+    Connected,
+}
+
+/// Message or block parsed from the received bytes
+enum Inbound {
+    Message(Message),
+    Block(BlockDownload),
+}
+
+/// A peer's socket and protocol state, owned by its worker
+struct Connection {
+    peer: Arc<Peer>,
+    token: Token,
+    stream: TcpStream,
+    state: State,
+    version: Option<Version>,
+    filter: Arc<dyn PeerFilter>,
+    /// Deadline for the current handshake step
+    deadline: Option<Instant>,
+    /// Received bytes not yet parsed into messages
+    inbound: Vec<u8>,
+    /// Block being received to disk
+    download: Option<BlockDownload>,
+    /// Messages being written, refilled from the peer's send queue
+    pending: WriteBatch,
+    /// Set once the peer disconnects. Only writing continues, until `deadline`.
+    closing: bool,
+}
+
+impl Connection {
+    fn magic(&self) -> [u8; 4] {
+        self.peer.network.magic()
+    }
+
+    /// Handles a readiness event
+    fn ready(&mut self, read_buf: &mut [u8]) -> Result<(), ChainGangError> {
+        if self.closing {
+            return self.flush();
+        }
+        if self.state == State::Connecting {
+            if let Some(e) = self.stream.take_error()? {
+                return Err(ChainGangError::IoError(e));
+            }
+            match self.stream.peer_addr() {
+                Ok(_) => self.on_connected()?,
+                Err(e) if e.kind() == io::ErrorKind::NotConnected => return Ok(()),
+                Err(e) => return Err(ChainGangError::IoError(e)),
+            }
+        }
+        let open = self.read(read_buf)?;
+        // Messages that arrived before the peer closed the connection are still handled
+        for inbound in self.frames()? {
+            match inbound {
+                Inbound::Message(message) => self.on_message(message)?,
+                Inbound::Block(download) => self.peer.received_block(download)?,
+            }
+        }
+        if !open {
+            return Err(ChainGangError::IoError(io::Error::new(
+                io::ErrorKind::UnexpectedEof,
+                "Connection closed by peer",
+            )));
+        }
+        self.flush()?;
+        Ok(())
+    }
+
+    fn on_connected(&mut self) -> Result<(), ChainGangError> {
+        self.stream.set_nodelay(true)?;
+        if let Some(version) = self.version.take() {
+            let our_version = Message::Version(version);
+            debug!("{:?} Write {our_version:#?}", self.peer);
+            self.queue(&our_version)?;
+        }
+        self.state = State::AwaitVersion;
+        self.deadline = Some(Instant::now() + handshake_read_timeout());
+        Ok(())
+    }
+
+    /// Adds a handshake message to the messages being written
+    fn queue(&mut self, message: &Message) -> Result<(), ChainGangError> {
+        let mut buf = BufferPool::shared().get();
+        message.write(&mut *buf, self.magic())?;
+        self.pending.push(buf);
+        Ok(())
+    }
+
+    /// Reads until the socket would block, returning false if the peer closed the connection
+    fn read(&mut self, read_buf: &mut [u8]) -> Result<bool, ChainGangError> {
+        loop {
+            match self.stream.read(read_buf) {
+                Ok(0) => return Ok(false),
+                Ok(n) => {
+                    self.inbound.extend_from_slice(&read_buf[..n]);
+                    self.spool()?;
+                }
+                Err(e) if e.kind() == io::ErrorKind::WouldBlock => return Ok(true),
+                Err(e) if e.kind() == io::ErrorKind::Interrupted => continue,
+                Err(e) => return Err(ChainGangError::IoError(e)),
+            }
+        }
+    }
+
+    /// Moves received bytes into the block being received to disk, if any
+    fn spool(&mut self) -> Result<(), ChainGangError> {
+        if let Some(download) = &mut self.download {
+            let used = download.write(&self.inbound)?;
+            self.inbound.drain(..used);
+        }
+        Ok(())
+    }
+
+    /// Parses the complete messages and blocks received so far
+    fn frames(&mut self) -> Result<Vec<Inbound>, ChainGangError> {
+        let magic = self.magic();
+        let mut messages = Vec::new();
+        let mut start = 0;
+        loop {
+            if let Some(download) = &mut self.download {
+                start += download.write(&self.inbound[start..])?;
+                if !download.is_complete() {
+                    break;
+                }
+                messages.push(Inbound::Block(self.download.take().unwrap()));
+                continue;
+            }
+            if self.inbound.len() - start < MessageHeader::SIZE {
+                break;
+            }
+            let header = MessageHeader::read(&mut &self.inbound[start..])?;
+            header.validate(magic, MAX_PAYLOAD_SIZE)?;
+            if self.state == State::Connected {
+                if let Some(download) = self.peer.start_download(&header)? {
+                    self.download = Some(download);
+                    start += MessageHeader::SIZE;
+                    continue;
+                }
+            }
+            let end = start + MessageHeader::SIZE + header.payload_size as usize;
+            if self.inbound.len() < end {
+                self.inbound.reserve(end - self.inbound.len());
+                break;
+            }
+            let payload = &self.inbound[start + MessageHeader::SIZE..end];
+            header.verify_checksum(payload)?;
+            messages.push(Inbound::Message(Message::decode(&header, payload)?));
+            start = end;
+        }
+        self.inbound.drain(..start);
+        Ok(messages)
+    }
+
+    fn on_message(&mut self, message: Message) -> Result<(), ChainGangError> {
+        debug!("{:?} Read {message:#?}", self.peer);
+        match (self.state, message) {
+            (State::AwaitVersion, Message::Version(their_version)) => {
+                self.peer
+                    .accept_version(their_version, self.filter.as_ref())?;
+                self.state = State::AwaitVerack;
+                self.deadline = Some(Instant::now() + handshake_read_timeout());
+            }
+            (State::AwaitVerack, Message::Verack) => {
+                self.queue(&Message::Verack)?;
+                self.queue(&Peer::handshake_ping())?;
+                self.state = State::Connected;
+                self.deadline = None;
+                self.peer.set_connected();
+            }
+            (State::Connected, message) => {
+                self.peer.handle_message(&message)?;
+                self.peer.messages.next(&PeerMessage {
+                    peer: self.peer.clone(),
+                    message,
+                });
+            }
+            _ => return Err(ChainGangError::BadData("Unexpected command".to_string())),
+        }
+        Ok(())
+    }
+
+    /// Writes queued messages until done or the socket would block
+    fn flush(&mut self) -> Result<(), ChainGangError> {
+        if self.state == State::Connecting {
+            return Ok(());
+        }
+        loop {
+            if self.pending.is_empty() {
+                self.peer.send_queue().drain(&mut self.pending);
+                if self.pending.is_empty() {
+                    return Ok(());
+                }
+            }
+            match self.pending.write_to(&mut self.stream) {
+                Ok((bytes, messages)) => self.peer.send_queue().wrote(bytes, messages),
+                Err(e) if e.kind() == io::ErrorKind::WouldBlock => return Ok(()),
+                Err(e) if e.kind() == io::ErrorKind::Interrupted => continue,
+                Err(e) => return Err(ChainGangError::IoError(e)),
+            }
+        }
+    }
+
+    /// Stops reading and writes what is left, returning true once nothing is left to write
+    fn close(&mut self) -> bool {
+        if self.state != State::Connected {
+            return true;
+        }
+        self.closing = true;
+        self.deadline = Some(Instant::now() + self.peer.send_queue().config().close_timeout);
+        match self.flush() {
+            Ok(()) => self.pending.is_empty(),
+            Err(_) => true,
+        }
+    }
+}
+
+/// One event loop thread and the connections it drives
+struct Worker {
+    poll: Poll,
+    shared: Arc<WorkerShared>,
+    connections: HashMap<Token, Connection>,
+}
+
+impl Worker {
+    fn run(mut self) {
+        let mut events = Events::with_capacity(1024);
+        let mut read_buf = vec![0; READ_CHUNK];
+        let mut next_tick = Instant::now() + TICK;
+        loop {
+            if let Err(e) = self.poll.poll(&mut events, Some(TICK)) {
+                if e.kind() == io::ErrorKind::Interrupted {
+                    continue;
+                }
+                error!("Peer runtime poll failed: {e:?}");
+                self.close_all();
+                return;
+            }
+
+            for event in events.iter() {
+                let token = event.token();
+                if token == WAKE_TOKEN {
+                    continue;
+                }
+                let result = match self.connections.get_mut(&token) {
+                    Some(connection) => connection
+                        .ready(&mut read_buf)
+                        .map(|()| connection.closing && connection.pending.is_empty()),
+                    None => continue,
+                };
+                match result {
+                    Ok(true) => self.finish(token),
+                    Ok(false) => {}
+                    Err(e) => self.fail(token, e),
+                }
+            }
+
+            let commands = std::mem::take(&mut *self.shared.commands.lock().unwrap());
+            for command in commands {
+                match command {
+                    Command::Register(connection) => self.register(*connection),
+                    Command::Flush(token) => {
+                        let result = match self.connections.get_mut(&token) {
+                            Some(connection) => connection.flush(),
+                            None => continue,
+                        };
+                        if let Err(e) = result {
+                            self.fail(token, e);
+                        }
+                    }
+                    Command::Close(token) => self.close(token),
+                    Command::Shutdown => {
+                        self.close_all();
+                        return;
+                    }
+                }
+            }
+
+            let now = Instant::now();
+            if now >= next_tick {
+                next_tick = now + TICK;
+                let expired: Vec<Token> = self
+                    .connections
+                    .iter()
+                    .filter(|(_, c)| c.deadline.is_some_and(|deadline| now >= deadline))
+                    .map(|(token, _)| *token)
+                    .collect();
+                for token in expired {
+                    if self.connections[&token].closing {
+                        warn!(
+                            "{:?} Dropping messages not written in time",
+                            self.connections[&token].peer
+                        );
+                        self.finish(token);
+                    } else {
+                        self.fail(token, ChainGangError::Timeout);
+                    }
+                }
+            }
+        }
+    }
+
+    fn register(&mut self, mut connection: Connection) {
+        let token = connection.token;
+        if let Err(e) = self.poll.registry().register(
+            &mut connection.stream,
+            token,
+            Interest::READABLE | Interest::WRITABLE,
+        ) {
+            error!("{:?} Failed to register: {e:?}", connection.peer);
+            self.shared.peers.fetch_sub(1, Ordering::Relaxed);
+            connection.peer.closed();
+            return;
+        }
+        self.connections.insert(token, connection);
+    }
+
+    /// Removes the connection, returning it if it was present
+    fn remove(&mut self, token: Token) -> Option<Connection> {
+        let mut connection = self.connections.remove(&token)?;
+        self.shared.peers.fetch_sub(1, Ordering::Relaxed);
+        if let Err(e) = self.poll.registry().deregister(&mut connection.stream) {
+            warn!("{:?} Failed to deregister: {e:?}", connection.peer);
+        }
+        let _ = connection.stream.shutdown(Shutdown::Both);
+        Some(connection)
+    }
+
+    /// Closes a connection after an error
+    fn fail(&mut self, token: Token, e: ChainGangError) {
+        if let Some(connection) = self.remove(token) {
+            match connection.state {
+                State::Connected => error!("{:?} Error reading message {e:?}", connection.peer),
+                _ => error!("Failed to complete handshake: {e:?}"),
+            }
+            connection.peer.closed();
+        }
+    }
+
+    /// Closes a connection at the peer's request once its queued messages are written
+    fn close(&mut self, token: Token) {
+        let flushed = match self.connections.get_mut(&token) {
+            Some(connection) => connection.close(),
+            None => return,
+        };
+        if flushed {
+            self.finish(token);
+        }
+    }
+
+    /// Closes a connection without writing anything more
+    fn finish(&mut self, token: Token) {
+        if let Some(connection) = self.remove(token) {
+            connection.peer.closed();
+        }
+    }
+
+    fn close_all(&mut self) {
+        let tokens: Vec<Token> = self.connections.keys().copied().collect();
+        for token in tokens {
+            self.finish(token);
+        }
+    }
+}
+
+/// Drives many peers from a fixed pool of event loop threads
+///
+/// Dropping the runtime disconnects its peers and stops the workers.
+pub struct PeerRuntime {
+    workers: Vec<Arc<WorkerShared>>,
+    threads: Vec<JoinHandle<()>>,
+    send_queue: SendQueueConfig,
+}
+
+impl PeerRuntime {
+    /// Starts a runtime with `workers` event loop threads
+    pub fn new(workers: usize) -> Result<PeerRuntime, ChainGangError> {
+        let mut runtime = PeerRuntime {
+            workers: Vec::new(),
+            threads: Vec::new(),
+            send_queue: SendQueueConfig::default(),
+        };
+        for i in 0..workers.max(1) {
+            let poll = Poll::new()?;
+            let waker = Waker::new(poll.registry(), WAKE_TOKEN)?;
+            let shared = Arc::new(WorkerShared {
+                waker,
+                commands: Mutex::new(Vec::new()),
+                next_token: AtomicUsize::new(0),
+                peers: AtomicUsize::new(0),
+            });
+            let worker = Worker {
+                poll,
+                shared: shared.clone(),
+                connections: HashMap::new(),
+            };
+            let thread = thread::Builder::new()
+                .name(format!("peer-runtime-{i}"))
+                .spawn(move || worker.run())?;
+            runtime.workers.push(shared);
+            runtime.threads.push(thread);
+        }
+        Ok(runtime)
+    }
+
+    /// Sets the send queue limits of peers connected after this
+    ///
+    /// Runtime peers always use `SendPolicy::Drop`, since a sender blocking on the worker thread
+    /// would stall the worker that empties the queue.
+    pub fn with_send_queue(mut self, send_queue: SendQueueConfig) -> PeerRuntime {
+        self.send_queue = send_queue;
+        self
+    }
+
+    /// Creates a new peer driven by this runtime and begins connecting
+    ///
+    /// The peer goes to the worker with the fewest peers.
+    pub fn connect(
+        &self,
+        ip: IpAddr,
+        port: u16,
+        network: Network,
+        version: Version,
+        filter: Arc<dyn PeerFilter>,
+    ) -> Arc<Peer> {
+        let send_queue = SendQueueConfig {
+            policy: SendPolicy::Drop,
+            ..self.send_queue.clone()
+        };
+        let peer = Peer::new(ip, port, network, send_queue);
+        info!("{:?} Connecting to {:?}:{}", peer, peer.ip, peer.port);
+
+        let worker = self
+            .workers
+            .iter()
+            .min_by_key(|worker| worker.peers.load(Ordering::Relaxed))
+            .expect("runtime has workers")
+            .clone();
+        let stream = match TcpStream::connect(SocketAddr::new(ip, port)) {
+            Ok(stream) => stream,
+            Err(e) => {
+                error!("Failed to complete handshake: {e:?}");
+                peer.closed();
+                return peer;
+            }
+        };
+
+        let token = Token(worker.next_token.fetch_add(1, Ordering::Relaxed));
+        peer.set_link(RuntimeLink {
+            worker: worker.clone(),
+            token,
+        });
+        worker.peers.fetch_add(1, Ordering::Relaxed);
+        worker.command(Command::Register(Box::new(Connection {
+            peer: peer.clone(),
+            token,
+            stream,
+            state: State::Connecting,
+            version: Some(version),
+            filter,
+            deadline: Some(Instant::now() + connect_timeout()),
+            inbound: Vec::new(),
+            download: None,
+            pending: WriteBatch::default(),
+            closing: false,
+        })));
+        peer
+    }
+
+    /// Number of worker threads
+    pub fn worker_count(&self) -> usize {
+        self.workers.len()
+    }
+
+    /// Number of peers connecting or connected
+    pub fn peer_count(&self) -> usize {
+        self.workers
+            .iter()
+            .map(|worker| worker.peers.load(Ordering::Relaxed))
+            .sum()
+    }
+
+    /// Disconnects every peer and stops the workers
+    pub fn shutdown(&mut self) {
+        if self.threads.is_empty() {
+            return;
+        }
+        for worker in &self.workers {
+            worker.command(Command::Shutdown);
+        }
+        for thread in self.threads.drain(..) {
+            let _ = thread.join();
+        }
+    }
+}
+
+impl Drop for PeerRuntime {
+    fn drop(&mut self) {
+        self.shutdown();
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::messages::{
+        Block, BlockFile, BlockHeader, BlockSpool, Ping, Tx, TxIn, NODE_BITCOIN_CASH,
+        PROTOCOL_VERSION,
+    };
+    use crate::peer::{PeerBlockFile, PeerNodeFilter};
+    use crate::util::rx::{Observable, Observer};
+    use crate::util::secs_since;
+    use std::net::TcpListener;
+    use std::sync::mpsc;
+    use std::time::UNIX_EPOCH;
+
+    const NETWORK: Network = Network::BSV_Testnet;
+
+    fn version(user_agent: &str) -> Version {
+        Version {
+            version: PROTOCOL_VERSION,
+            services: NODE_BITCOIN_CASH,
+            timestamp: secs_since(UNIX_EPOCH) as i64,
+            user_agent: user_agent.to_string(),
+            ..Default::default()
+        }
+    }
+
+    /// Stand-in node that completes the handshake and answers pings, a thread per connection
+    fn node(user_agent: &'static str) -> u16 {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let port = listener.local_addr().unwrap().port();
+        thread::spawn(move || {
+            for stream in listener.incoming() {
+                let mut stream = stream.unwrap();
+                thread::spawn(move || -> Result<(), ChainGangError> {
+                    let magic = NETWORK.magic();
+                    Message::read(&mut stream, magic)?;
+                    Message::Version(version(user_agent)).write(&mut stream, magic)?;
+                    Message::Verack.write(&mut stream, magic)?;
+                    loop {
+                        if let Message::Ping(ping) = Message::read(&mut stream, magic)? {
+                            Message::Pong(ping).write(&mut stream, magic)?;
+                        }
+                    }
+                });
+            }
+        });
+        port
+    }
+
+    /// Stand-in node that closes the connection straight after answering a ping with nonce 9
+    fn closing_node() -> u16 {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let port = listener.local_addr().unwrap().port();
+        thread::spawn(move || {
+            for stream in listener.incoming() {
+                let mut stream = stream.unwrap();
+                thread::spawn(move || -> Result<(), ChainGangError> {
+                    let magic = NETWORK.magic();
+                    Message::read(&mut stream, magic)?;
+                    Message::Version(version("/Bitcoin SV:1.0.0/")).write(&mut stream, magic)?;
+                    Message::Verack.write(&mut stream, magic)?;
+                    loop {
+                        if let Message::Ping(ping) = Message::read(&mut stream, magic)? {
+                            Message::Pong(ping.clone()).write(&mut stream, magic)?;
+                            if ping.nonce == 9 {
+                                return Ok(());
+                            }
+                        }
+                    }
+                });
+            }
+        });
+        port
+    }
+
+    /// Stand-in node that passes on the nonce of every ping it receives
+    fn ping_node(nonces: mpsc::Sender<u64>) -> u16 {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let port = listener.local_addr().unwrap().port();
+        thread::spawn(move || -> Result<(), ChainGangError> {
+            let mut stream = listener.incoming().next().unwrap()?;
+            let magic = NETWORK.magic();
+            Message::read(&mut stream, magic)?;
+            Message::Version(version("/Bitcoin SV:1.0.0/")).write(&mut stream, magic)?;
+            Message::Verack.write(&mut stream, magic)?;
+            loop {
+                if let Message::Ping(ping) = Message::read(&mut stream, magic)? {
+                    let _ = nonces.send(ping.nonce);
+                }
+            }
+        });
+        port
+    }
+
+    /// Stand-in node that sends `block` before answering a ping with nonce 7
+    fn block_node(block: Block) -> u16 {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let port = listener.local_addr().unwrap().port();
+        thread::spawn(move || {
+            for stream in listener.incoming() {
+                let mut stream = stream.unwrap();
+                let block = block.clone();
+                thread::spawn(move || -> Result<(), ChainGangError> {
+                    let magic = NETWORK.magic();
+                    Message::read(&mut stream, magic)?;
+                    Message::Version(version("/Bitcoin SV:1.0.0/")).write(&mut stream, magic)?;
+                    Message::Verack.write(&mut stream, magic)?;
+                    loop {
+                        if let Message::Ping(ping) = Message::read(&mut stream, magic)? {
+                            if ping.nonce == 7 {
+                                Message::Block(block.clone()).write(&mut stream, magic)?;
+                            }
+                            Message::Pong(ping).write(&mut stream, magic)?;
+                        }
+                    }
+                });
+            }
+        });
+        port
+    }
+
+    fn localhost() -> IpAddr {
+        "127.0.0.1".parse().unwrap()
+    }
+
+    #[derive(Default)]
+    struct Blocks {
+        blocks: Mutex<Vec<Arc<BlockFile>>>,
+        /// Pong nonces, to check the order of messages and blocks
+        pongs: Mutex<Vec<(u64, usize)>>,
+    }
+
+    impl Observer<PeerBlockFile> for Blocks {
+        fn next(&self, event: &PeerBlockFile) {
+            self.blocks.lock().unwrap().push(event.block.clone());
+        }
+    }
+
+    impl Observer<PeerMessage> for Blocks {
+        fn next(&self, event: &PeerMessage) {
+            if let Message::Pong(pong) = &event.message {
+                let blocks = self.blocks.lock().unwrap().len();
+                self.pongs.lock().unwrap().push((pong.nonce, blocks));
+            }
+        }
+    }
+
+    #[derive(Default)]
+    struct Pongs {
+        nonces: Mutex<Vec<u64>>,
+    }
+
+    impl Observer<PeerMessage> for Pongs {
+        fn next(&self, event: &PeerMessage) {
+            if let Message::Pong(pong) = &event.message {
+                self.nonces.lock().unwrap().push(pong.nonce);
+            }
+        }
+    }
+
+    #[test]
+    fn connect_many() {
+        let port = node("/Bitcoin SV:1.0.0/");
+        let runtime = PeerRuntime::new(2).unwrap();
+        let filter = Arc::new(PeerNodeFilter::default());
+        let peers: Vec<Arc<Peer>> = (0..8)
+            .map(|_| runtime.connect(localhost(), port, NETWORK, version("test"), filter.clone()))
+            .collect();
+        for peer in &peers {
+            peer.connected_event()
+                .poll_timeout(Duration::from_secs(5))
+                .unwrap();
+        }
+        assert_eq!(runtime.worker_count(), 2);
+        assert_eq!(runtime.peer_count(), 8);
+
+        let pongs = Arc::new(Pongs::default());
+        for (i, peer) in peers.iter().enumerate() {
+            peer.messages().subscribe(&pongs);
+            let ping = Message::Ping(Ping {
+                nonce: 100 + i as u64,
+            });
+            peer.send(&ping).unwrap();
+        }
+        let deadline = Instant::now() + Duration::from_secs(5);
+        while pongs
+            .nonces
+            .lock()
+            .unwrap()
+            .iter()
+            .filter(|n| **n >= 100)
+            .count()
+            < 8
+        {
+            assert!(Instant::now() < deadline, "pongs not received");
+            thread::sleep(Duration::from_millis(10));
+        }
+
+        let stats = peers[1].send_queue_stats();
+        // Version, verack, the handshake ping and ours
+        assert_eq!(stats.sent_messages, 4);
+        assert_eq!(stats.depth, 0);
+
+        peers[0].disconnect();
+        peers[0]
+            .disconnected_event()
+            .poll_timeout(Duration::from_secs(5))
+            .unwrap();
+        assert!(!peers[0].connected());
+        assert!(peers[0].send(&Message::Verack).is_err());
+        assert_eq!(runtime.peer_count(), 7);
+    }
+
+    #[test]
+    fn handles_messages_received_before_close() {
+        let port = closing_node();
+        let runtime = PeerRuntime::new(1).unwrap();
+        let filter = Arc::new(PeerNodeFilter::default());
+        let peer = runtime.connect(localhost(), port, NETWORK, version("test"), filter);
+        peer.connected_event()
+            .poll_timeout(Duration::from_secs(5))
+            .unwrap();
+        let pongs = Arc::new(Pongs::default());
+        peer.messages().subscribe(&pongs);
+        peer.send(&Message::Ping(Ping { nonce: 9 })).unwrap();
+        peer.disconnected_event()
+            .poll_timeout(Duration::from_secs(5))
+            .unwrap();
+        assert!(pongs.nonces.lock().unwrap().contains(&9));
+    }
+
+    #[test]
+    fn writes_queued_messages_before_disconnecting() {
+        let (sender, nonces) = mpsc::channel();
+        let port = ping_node(sender);
+        let runtime = PeerRuntime::new(1).unwrap();
+        let filter = Arc::new(PeerNodeFilter::default());
+        let peer = runtime.connect(localhost(), port, NETWORK, version("test"), filter);
+        peer.connected_event()
+            .poll_timeout(Duration::from_secs(5))
+            .unwrap();
+        for nonce in 100..200 {
+            peer.send(&Message::Ping(Ping { nonce })).unwrap();
+        }
+        peer.disconnect();
+        let received: Vec<u64> = nonces.iter().filter(|nonce| *nonce < 200).collect();
+        assert_eq!(received, (100..200).collect::<Vec<u64>>());
+    }
+
+    #[test]
+    fn filtered_out() {
+        let port = node("/Other:1.0.0/");
+        let runtime = PeerRuntime::new(1).unwrap();
+        let filter = Arc::new(PeerNodeFilter {
+            user_agent: Some("Bitcoin SV".to_string()),
+            ..Default::default()
+        });
+        let peer = runtime.connect(localhost(), port, NETWORK, version("test"), filter);
+        peer.disconnected_event()
+            .poll_timeout(Duration::from_secs(5))
+            .unwrap();
+        assert!(!peer.connected());
+        assert_eq!(runtime.peer_count(), 0);
+    }
+
+    #[test]
+    fn shutdown_disconnects() {
+        let port = node("/Bitcoin SV:1.0.0/");
+        let mut runtime = PeerRuntime::new(1).unwrap();
+        let filter = Arc::new(PeerNodeFilter::default());
+        let peer = runtime.connect(localhost(), port, NETWORK, version("test"), filter);
+        peer.connected_event()
+            .poll_timeout(Duration::from_secs(5))
+            .unwrap();
+        runtime.shutdown();
+        peer.disconnected_event()
+            .poll_timeout(Duration::from_secs(1))
+            .unwrap();
+        assert_eq!(runtime.peer_count(), 0);
+    }
+
+    #[test]
+    fn spools_large_blocks() {
+        let tx = Tx {
+            version: 1,
+            inputs: vec![TxIn::default()],
+            outputs: Vec::new(),
+            lock_time: 0,
+        };
+        let mut block = Block {
+            header: BlockHeader::default(),
+            txns: vec![tx; 2000],
+        };
+        block.header.nonce = 9;
+        let port = block_node(block.clone());
+        let dir = std::env::temp_dir().join(format!("spool-{}", std::process::id()));
+        std::fs::create_dir_all(&dir).unwrap();
+        let spool = BlockSpool {
+            dir,
+            min_size: 1000,
+        };
+
+        let runtime = PeerRuntime::new(1).unwrap();
+        let filter = Arc::new(PeerNodeFilter::default());
+        let peers = [
+            runtime.connect(localhost(), port, NETWORK, version("test"), filter.clone()),
+            Peer::connect(localhost(), port, NETWORK, version("test"), filter),
+        ];
+        for peer in &peers {
+            peer.connected_event()
+                .poll_timeout(Duration::from_secs(5))
+                .unwrap();
+            peer.set_block_spool(Some(spool.clone()));
+            let blocks = Arc::new(Blocks::default());
+            peer.block_files().subscribe(&blocks);
+            peer.messages().subscribe(&blocks);
+            peer.send(&Message::Ping(Ping { nonce: 7 })).unwrap();
+            let deadline = Instant::now() + Duration::from_secs(5);
+            while !blocks.pongs.lock().unwrap().iter().any(|pong| pong.0 == 7) {
+                assert!(Instant::now() < deadline, "pong not received");
+                thread::sleep(Duration::from_millis(10));
+            }
+
+            // The block is emitted before the pong that followed it, and not as a message
+            assert!(blocks.pongs.lock().unwrap().contains(&(7, 1)));
+            let file = blocks.blocks.lock().unwrap().pop().unwrap();
+            assert_eq!(file.hash(), block.header.hash());
+            assert_eq!(file.tx_count(), 2000);
+            assert_eq!(file.to_block().unwrap(), block);
+            let path = file.path().to_path_buf();
+            drop(file);
+            assert!(!path.exists());
+            peer.disconnect();
+        }
+    }
+}
@@ -0,0 +1,456 @@
+//! Bounded queue of serialized messages waiting to be written to a peer
+//!
+//! `Peer::send` serializes a message into a pooled buffer and pushes it here instead of writing
+//! to the socket, so senders never wait on a slow peer's TCP window unless they ask to. A writer
+//! drains everything queued at once and hands it to the socket in vectored writes, turning a
+//! burst of small inv or tx messages into a few syscalls.
+
+use crate::util::{ChainGangError, PooledBuffer};
+use std::collections::VecDeque;
+use std::io::{self, IoSlice, Write};
+use std::sync::{Condvar, Mutex};
+use std::time::{Duration, Instant};
+
+/// Most buffers handed to one vectored write, below the usual IOV_MAX of 1024
+const MAX_IO_SLICES: usize = 512;
+
+/// What `Peer::send` does when the send queue is full
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum SendPolicy {
+    /// Reject the message with an error, leaving the queue as it is
+    Drop,
+    /// Wait up to `block_timeout` for space, then fail with `ChainGangError::Timeout`
+    Block,
+}
+
+/// Limits of a peer's send queue
+#[derive(Debug, Clone)]
+pub struct SendQueueConfig {
+    /// Most messages queued at once
+    pub max_messages: usize,
+    /// Most bytes queued at once. A single larger message is accepted when the queue is empty.
+    pub max_bytes: usize,
+    pub policy: SendPolicy,
+    /// How long `SendPolicy::Block` waits for space
+    pub block_timeout: Duration,
+    /// How long disconnecting waits for queued messages to be written
+    pub close_timeout: Duration,
+}
+
+impl Default for SendQueueConfig {
+    fn default() -> Self {
+        SendQueueConfig {
+            max_messages: 10_000,
+            max_bytes: 64 * 1024 * 1024,
+            policy: SendPolicy::Block,
+            block_timeout: Duration::from_secs(10),
+            close_timeout: Duration::from_secs(5),
+        }
+    }
+}
+
+/// Snapshot of a send queue's depth and counters
+#[derive(Debug, Clone, Default, PartialEq, Eq)]
+pub struct SendQueueStats {
+    /// Messages queued and not yet taken by the writer
+    pub depth: usize,
+    /// Bytes queued and not yet taken by the writer
+    pub bytes: usize,
+    /// Largest depth seen
+    pub max_depth: usize,
+    /// Messages completely written to the socket
+    pub sent_messages: u64,
+    pub sent_bytes: u64,
+    /// Write calls made, each covering one or more messages
+    pub writes: u64,
+    /// Messages rejected because the queue was full
+    pub dropped: u64,
+}
+
+struct QueueState {
+    messages: VecDeque<PooledBuffer>,
+    /// Messages queued or taken by the writer and not yet completely written
+    unsent: usize,
+    /// Set by `finish`. No more messages are accepted but those queued are still written.
+    finishing: bool,
+    closed: bool,
+    stats: SendQueueStats,
+}
+
+/// A peer's bounded queue of serialized messages
+pub(crate) struct SendQueue {
+    config: SendQueueConfig,
+    state: Mutex<QueueState>,
+    not_empty: Condvar,
+    not_full: Condvar,
+    flushed: Condvar,
+}
+
+impl SendQueue {
+    pub(crate) fn new(config: SendQueueConfig) -> SendQueue {
+        SendQueue {
+            config,
+            state: Mutex::new(QueueState {
+                messages: VecDeque::new(),
+                unsent: 0,
+                finishing: false,
+                closed: false,
+                stats: SendQueueStats::default(),
+            }),
+            not_empty: Condvar::new(),
+            not_full: Condvar::new(),
+            flushed: Condvar::new(),
+        }
+    }
+
+    pub(crate) fn config(&self) -> &SendQueueConfig {
+        &self.config
+    }
+
+    fn accepting(state: &QueueState) -> bool {
+        !state.closed && !state.finishing
+    }
+
+    fn has_room(&self, state: &QueueState, size: usize) -> bool {
+        state.messages.is_empty()
+            || (state.stats.depth < self.config.max_messages
+                && state.stats.bytes + size <= self.config.max_bytes)
+    }
+
+    /// Queues a serialized message, returning the depth after it was added
+    pub(crate) fn push(&self, message: PooledBuffer) -> Result<usize, ChainGangError> {
+        let size = message.len();
+        let mut state = self.state.lock().unwrap();
+        if Self::accepting(&state) && !self.has_room(&state, size) {
+            match self.config.policy {
+                SendPolicy::Drop => {
+                    state.stats.dropped += 1;
+                    return Err(ChainGangError::IllegalState("Send queue full".to_string()));
+                }
+                SendPolicy::Block => {
+                    let deadline = Instant::now() + self.config.block_timeout;
+                    while Self::accepting(&state) && !self.has_room(&state, size) {
+                        let now = Instant::now();
+                        if now >= deadline {
+                            state.stats.dropped += 1;
+                            return Err(ChainGangError::Timeout);
+                        }
+                        state = self.not_full.wait_timeout(state, deadline - now).unwrap().0;
+                    }
+                }
+            }
+        }
+        if !Self::accepting(&state) {
+            return Err(ChainGangError::IllegalState("Not connected".to_string()));
+        }
+        state.messages.push_back(message);
+        state.unsent += 1;
+        state.stats.depth += 1;
+        state.stats.bytes += size;
+        state.stats.max_depth = state.stats.max_depth.max(state.stats.depth);
+        let depth = state.stats.depth;
+        drop(state);
+        self.not_empty.notify_one();
+        Ok(depth)
+    }
+
+    fn take_into(&self, state: &mut QueueState, batch: &mut WriteBatch) {
+        batch.buffers.extend(state.messages.drain(..));
+        state.stats.depth = 0;
+        state.stats.bytes = 0;
+        self.not_full.notify_all();
+    }
+
+    /// Moves everything queued into `batch` without waiting
+    pub(crate) fn drain(&self, batch: &mut WriteBatch) {
+        let mut state = self.state.lock().unwrap();
+        if !state.messages.is_empty() {
+            self.take_into(&mut state, batch);
+        }
+    }
+
+    /// Waits for messages and moves them into `batch`, returning false once closed, or once
+    /// finished and empty
+    pub(crate) fn wait_drain(&self, batch: &mut WriteBatch) -> bool {
+        let mut state = self.state.lock().unwrap();
+        while state.messages.is_empty() && Self::accepting(&state) {
+            state = self.not_empty.wait(state).unwrap();
+        }
+        if state.closed || state.messages.is_empty() {
+            return false;
+        }
+        self.take_into(&mut state, batch);
+        true
+    }
+
+    /// Records a write of `bytes` that completed `messages`
+    pub(crate) fn wrote(&self, bytes: usize, messages: usize) {
+        let mut state = self.state.lock().unwrap();
+        state.stats.writes += 1;
+        state.stats.sent_bytes += bytes as u64;
+        state.stats.sent_messages += messages as u64;
+        state.unsent = state.unsent.saturating_sub(messages);
+        if state.unsent == 0 {
+            self.flushed.notify_all();
+        }
+    }
+
+    /// Stops accepting messages while letting the writer send those already queued
+    pub(crate) fn finish(&self) {
+        self.state.lock().unwrap().finishing = true;
+        self.not_empty.notify_all();
+        self.not_full.notify_all();
+    }
+
+    /// Waits up to `timeout` for every queued message to be written, returning whether they were
+    pub(crate) fn wait_flushed(&self, timeout: Duration) -> bool {
+        let deadline = Instant::now() + timeout;
+        let mut state = self.state.lock().unwrap();
+        while state.unsent > 0 && !state.closed {
+            let now = Instant::now();
+            if now >= deadline {
+                return false;
+            }
+            state = self.flushed.wait_timeout(state, deadline - now).unwrap().0;
+        }
+        state.unsent == 0
+    }
+
+    /// Discards queued messages, fails waiting senders and stops the writer
+    pub(crate) fn close(&self) {
+        let mut state = self.state.lock().unwrap();
+        state.closed = true;
+        state.messages.clear();
+        state.unsent = 0;
+        state.stats.depth = 0;
+        state.stats.bytes = 0;
+        drop(state);
+        self.not_empty.notify_all();
+        self.not_full.notify_all();
+        self.flushed.notify_all();
+    }
+
+    pub(crate) fn is_closed(&self) -> bool {
+        self.state.lock().unwrap().closed
+    }
+
+    pub(crate) fn stats(&self) -> SendQueueStats {
+        self.state.lock().unwrap().stats.clone()
+    }
+}
+
+/// Messages taken from the queue by a writer, and how much of the first has been written
+#[derive(Default)]
+pub(crate) struct WriteBatch {
+    buffers: VecDeque<PooledBuffer>,
+    written: usize,
+}
+
+impl WriteBatch {
+    pub(crate) fn is_empty(&self) -> bool {
+        self.buffers.is_empty()
+    }
+
+    /// Adds a message behind those already in the batch
+    pub(crate) fn push(&mut self, message: PooledBuffer) {
+        self.buffers.push_back(message);
+    }
+
+    /// Makes one vectored write, returning the bytes written and the messages it completed
+    pub(crate) fn write_to(&mut self, writer: &mut impl Write) -> io::Result<(usize, usize)> {
+        let slices: Vec<IoSlice> = self
+            .buffers
+            .iter()
+            .take(MAX_IO_SLICES)
+            .enumerate()
+            .map(|(i, buf)| match i {
+                0 => IoSlice::new(&buf[self.written..]),
+                _ => IoSlice::new(buf),
+            })
+            .collect();
+        let n = writer.write_vectored(&slices)?;
+        if n == 0 && !slices.iter().all(|slice| slice.is_empty()) {
+            return Err(io::ErrorKind::WriteZero.into());
+        }
+
+        let mut remaining = n;
+        let mut completed = 0;
+        while let Some(front) = self.buffers.front() {
+            let left = front.len() - self.written;
+            if remaining < left {
+                self.written += remaining;
+                break;
+            }
+            remaining -= left;
+            self.buffers.pop_front();
+            self.written = 0;
+            completed += 1;
+        }
+        Ok((n, completed))
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::util::BufferPool;
+    use std::sync::Arc;
+    use std::thread;
+
+    fn message(bytes: &[u8]) -> PooledBuffer {
+        let mut buf = BufferPool::shared().get();
+        buf.extend_from_slice(bytes);
+        buf
+    }
+
+    fn new_queue(max_messages: usize, policy: SendPolicy) -> SendQueue {
+        SendQueue::new(SendQueueConfig {
+            max_messages,
+            max_bytes: 100,
+            policy,
+            block_timeout: Duration::from_millis(50),
+            close_timeout: Duration::from_millis(50),
+        })
+    }
+
+    /// Writer that accepts at most `limit` bytes per call
+    struct Trickle {
+        data: Vec<u8>,
+        limit: usize,
+        calls: usize,
+    }
+
+    impl Write for Trickle {
+        fn write(&mut self, buf: &[u8]) -> io::Result<usize> {
+            self.write_vectored(&[IoSlice::new(buf)])
+        }
+
+        fn write_vectored(&mut self, bufs: &[IoSlice]) -> io::Result<usize> {
+            self.calls += 1;
+            let mut n = 0;
+            for buf in bufs {
+                let take = buf.len().min(self.limit - n);
+                self.data.extend_from_slice(&buf[..take]);
+                n += take;
+            }
+            Ok(n)
+        }
+
+        fn flush(&mut self) -> io::Result<()> {
+            Ok(())
+        }
+    }
+
+    #[test]
+    fn coalesce() {
+        let queue = new_queue(10, SendPolicy::Drop);
+        assert_eq!(queue.push(message(b"abc")).unwrap(), 1);
+        assert_eq!(queue.push(message(b"de")).unwrap(), 2);
+        assert_eq!(queue.push(message(b"fghi")).unwrap(), 3);
+        assert_eq!(queue.stats().bytes, 9);
+
+        let mut batch = WriteBatch::default();
+        queue.drain(&mut batch);
+        assert_eq!(queue.stats().depth, 0);
+
+        let mut writer = Trickle {
+            data: Vec::new(),
+            limit: 100,
+            calls: 0,
+        };
+        assert_eq!(batch.write_to(&mut writer).unwrap(), (9, 3));
+        assert_eq!(writer.calls, 1);
+        assert_eq!(writer.data, b"abcdefghi");
+        assert!(batch.is_empty());
+    }
+
+    #[test]
+    fn partial_writes() {
+        let mut batch = WriteBatch::default();
+        batch.push(message(b"abc"));
+        batch.push(message(b"defg"));
+        let mut writer = Trickle {
+            data: Vec::new(),
+            limit: 2,
+            calls: 0,
+        };
+        let mut completed = 0;
+        while !batch.is_empty() {
+            completed += batch.write_to(&mut writer).unwrap().1;
+        }
+        assert_eq!(writer.data, b"abcdefg");
+        assert_eq!(writer.calls, 4);
+        assert_eq!(completed, 2);
+    }
+
+    #[test]
+    fn drop_policy() {
+        let queue = new_queue(2, SendPolicy::Drop);
+        queue.push(message(b"a")).unwrap();
+        queue.push(message(b"b")).unwrap();
+        assert!(queue.push(message(b"c")).is_err());
+        assert_eq!(queue.stats().dropped, 1);
+        assert_eq!(queue.stats().max_depth, 2);
+
+        // Bytes are bounded too, but one large message fits an empty queue
+        let queue = new_queue(10, SendPolicy::Drop);
+        queue.push(message(&[0; 150])).unwrap();
+        assert!(queue.push(message(b"a")).is_err());
+    }
+
+    #[test]
+    fn block_policy() {
+        let queue = Arc::new(new_queue(1, SendPolicy::Block));
+        queue.push(message(b"a")).unwrap();
+        let start = Instant::now();
+        assert!(queue.push(message(b"b")).is_err());
+        assert!(start.elapsed() >= Duration::from_millis(50));
+
+        let writer = {
+            let queue = queue.clone();
+            thread::spawn(move || {
+                thread::sleep(Duration::from_millis(10));
+                let mut batch = WriteBatch::default();
+                queue.wait_drain(&mut batch)
+            })
+        };
+        queue.push(message(b"c")).unwrap();
+        assert!(writer.join().unwrap());
+
+        queue.close();
+        assert!(queue.push(message(b"d")).is_err());
+        assert!(!queue.wait_drain(&mut WriteBatch::default()));
+    }
+
+    #[test]
+    fn finish_writes_queued_messages() {
+        let queue = Arc::new(new_queue(10, SendPolicy::Drop));
+        queue.push(message(b"abc")).unwrap();
+        queue.push(message(b"de")).unwrap();
+        queue.finish();
+        assert!(queue.push(message(b"f")).is_err());
+        assert!(!queue.wait_flushed(Duration::from_millis(10)));
+
+        let writer = {
+            let queue = queue.clone();
+            thread::spawn(move || {
+                let mut writer = Trickle {
+                    data: Vec::new(),
+                    limit: 2,
+                    calls: 0,
+                };
+                let mut batch = WriteBatch::default();
+                while queue.wait_drain(&mut batch) {
+                    while !batch.is_empty() {
+                        let (bytes, messages) = batch.write_to(&mut writer).unwrap();
+                        queue.wrote(bytes, messages);
+                    }
+                }
+                writer.data
+            })
+        };
+        assert!(queue.wait_flushed(Duration::from_secs(5)));
+        assert_eq!(writer.join().unwrap(), b"abcde");
+        assert_eq!(queue.stats().sent_messages, 2);
+    }
+}
@@ -0,0 +1,1129 @@
+//! Headers-first block download across several peers
+//!
+//! A [`BlockSync`] catches up from a known block. It asks one peer at a time for headers and
+//! checks that they link, meet their proof of work target, stay within the network's proof of
+//! work limit and do not ease off faster than difficulty adjustment allows. Once the headers
+//! carry enough work it requests the blocks for them from every peer it has been given. Requests are limited to a moving window
+//! past the next block to deliver and to a number in flight per peer. Requests that are not
+//! answered in time are sent to another peer, and peers that keep stalling are no longer used.
+//! Blocks are checked against their merkle root and handed to a consumer in height order.
+
+use crate::messages::{
+    Block, BlockFile, BlockHeader, BlockLocator, Inv, InvVect, Message, INV_VECT_BLOCK,
+    NO_HASH_STOP, PROTOCOL_VERSION,
+};
+use crate::network::Network;
+use crate::peer::{Peer, PeerBlockFile, PeerDisconnected, PeerMessage};
+use crate::util::rx::{Observable, Observer};
+use crate::util::{ChainGangError, Hash256};
+use num_bigint::BigUint;
+use snowflake::ProcessUniqueId;
+use std::collections::{BTreeMap, HashMap, HashSet, VecDeque};
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex};
+use std::thread::{self, JoinHandle};
+use std::time::{Duration, Instant};
+
+/// Headers in a full getheaders response, after which more are requested
+const MAX_HEADERS: usize = 2000;
+
+/// Previous headers a new header's timestamp is checked against
+const TIMESTAMP_HEADERS: usize = 11;
+
+/// Most a target may grow from one header to the next, as with Bitcoin's four-fold limit per
+/// retarget. Adjustment every block, as on BSV and BCH, moves it far less.
+const MAX_EASING: u32 = 4;
+
+/// Seconds after the previous block after which a test network block may use the easiest target
+const MIN_DIFFICULTY_DELAY: u32 = 20 * 60;
+
+/// Settings of a block sync
+#[derive(Debug, Clone)]
+pub struct BlockSyncConfig {
+    /// Last block the consumer already has
+    pub start_hash: Hash256,
+    pub start_height: u32,
+    /// Blocks past the next one to deliver that may be requested or held
+    pub window: usize,
+    /// Block requests outstanding per peer
+    pub max_in_flight: usize,
+    /// Header requests not answered within this time are sent to another peer
+    pub headers_timeout: Duration,
+    /// Block requests not answered within this time are sent to another peer
+    pub block_timeout: Duration,
+    /// Peers that let requests time out this many times are no longer used. Requests that time
+    /// out together count once.
+    pub max_stalls: u32,
+    /// Whether headers must meet the proof of work target in their bits, and the checks on bits
+    /// below
+    pub check_pow: bool,
+    /// Bits of the easiest target a header may have
+    pub pow_limit: u32,
+    /// Whether a header more than 20 minutes after the previous one may use `pow_limit`
+    pub min_difficulty_blocks: bool,
+    /// Work the headers after the start block must add up to before blocks are requested. A
+    /// peer whose whole chain has less is dropped and its headers are discarded.
+    pub min_chain_work: BigUint,
+    /// How often timeouts are checked
+    pub tick: Duration,
+}
+
+impl BlockSyncConfig {
+    /// Creates a config that syncs the network from its genesis block
+    pub fn new(network: Network) -> BlockSyncConfig {
+        BlockSyncConfig {
+            start_hash: network.genesis_hash(),
+            start_height: 0,
+            window: 1024,
+            max_in_flight: 16,
+            headers_timeout: Duration::from_secs(30),
+            block_timeout: Duration::from_secs(60),
+            max_stalls: 3,
+            check_pow: true,
+            pow_limit: network.pow_limit(),
+            min_difficulty_blocks: network.min_difficulty_blocks(),
+            min_chain_work: BigUint::default(),
+            tick: Duration::from_secs(1),
+        }
+    }
+}
+
+/// Block handed to the consumer, held in memory or in a file when the peer spooled it
+#[derive(Debug, Clone)]
+pub enum SyncedBlock {
+    Block(Block),
+    File(Arc<BlockFile>),
+}
+
+impl SyncedBlock {
+    pub fn header(&self) -> &BlockHeader {
+        match self {
+            SyncedBlock::Block(block) => &block.header,
+            SyncedBlock::File(file) => file.header(),
+        }
+    }
+
+    pub fn hash(&self) -> Hash256 {
+        self.header().hash()
+    }
+
+    /// Whether the transactions match the header's merkle root
+    fn merkle_root_valid(&self) -> bool {
+        match self {
+            SyncedBlock::Block(block) => block.merkle_root() == block.header.merkle_root,
+            SyncedBlock::File(file) => file
+                .merkle_root()
+                .is_ok_and(|root| root == file.header().merkle_root),
+        }
+    }
+}
+
+/// Progress and counters of a block sync
+#[derive(Debug, Clone, Default, PartialEq, Eq)]
+pub struct SyncStats {
+    /// Height of the last header
+    pub header_height: u32,
+    /// Height of the last block delivered
+    pub block_height: u32,
+    /// Whether the last header request returned the peer's tip
+    pub headers_synced: bool,
+    /// Work of the headers after the start block
+    pub chain_work: BigUint,
+    pub peers: usize,
+    pub in_flight: usize,
+    /// Blocks received and waiting for earlier ones
+    pub buffered: usize,
+    pub requested: u64,
+    /// Requests that timed out and were sent again
+    pub stalls: u64,
+    /// Invalid headers and blocks received
+    pub invalid: u64,
+}
+
+struct SyncPeer {
+    peer: Arc<Peer>,
+    in_flight: usize,
+    stalls: u32,
+}
+
+struct SyncState {
+    start_hash: Hash256,
+    start_height: u32,
+    /// Hashes of the headers after the start block, in height order
+    hashes: Vec<Hash256>,
+    heights: HashMap<Hash256, u32>,
+    /// Last headers, for checking timestamps and bits
+    recent: VecDeque<BlockHeader>,
+    /// Work of the headers after the start block
+    chain_work: BigUint,
+    headers_synced: bool,
+    /// Peer asked for headers and when
+    header_request: Option<(ProcessUniqueId, Instant)>,
+    /// Height of the next block to deliver
+    next_height: u32,
+    received: BTreeMap<u32, SyncedBlock>,
+    /// Requested heights, by the peer asked and when
+    in_flight: HashMap<u32, (ProcessUniqueId, Instant)>,
+    /// Heights whose request timed out, by the peer that did not answer
+    timed_out: HashMap<u32, ProcessUniqueId>,
+    peers: HashMap<ProcessUniqueId, SyncPeer>,
+    requested: u64,
+    stalls: u64,
+    invalid: u64,
+}
+
+impl SyncState {
+    fn new(start_hash: Hash256, start_height: u32) -> SyncState {
+        SyncState {
+            start_hash,
+            start_height,
+            hashes: Vec::new(),
+            heights: HashMap::new(),
+            recent: VecDeque::new(),
+            chain_work: BigUint::default(),
+            headers_synced: false,
+            header_request: None,
+            next_height: start_height + 1,
+            received: BTreeMap::new(),
+            in_flight: HashMap::new(),
+            timed_out: HashMap::new(),
+            peers: HashMap::new(),
+            requested: 0,
+            stalls: 0,
+            invalid: 0,
+        }
+    }
+
+    fn header_height(&self) -> u32 {
+        self.start_height + self.hashes.len() as u32
+    }
+
+    fn hash_at(&self, height: u32) -> Hash256 {
+        match height.checked_sub(self.start_height + 1) {
+            Some(i) => self.hashes[i as usize],
+            None => self.start_hash,
+        }
+    }
+
+    /// Hashes from the tip back to the start block, spaced further apart further back
+    fn locator(&self) -> Vec<Hash256> {
+        let mut locator = Vec::new();
+        let mut height = self.header_height();
+        let mut step = 1;
+        loop {
+            locator.push(self.hash_at(height));
+            if height == self.start_height {
+                return locator;
+            }
+            if locator.len() >= 10 {
+                step *= 2;
+            }
+            height = height.saturating_sub(step).max(self.start_height);
+        }
+    }
+
+    /// Appends headers that extend the tip, returning how many were new
+    ///
+    /// Headers already known are skipped. Headers that do not connect to the tip are ignored.
+    fn add_headers(
+        &mut self,
+        headers: &[BlockHeader],
+        config: &BlockSyncConfig,
+    ) -> Result<usize, String> {
+        let mut added = 0;
+        for header in headers {
+            let hash = header.hash();
+            if hash == self.start_hash || self.heights.contains_key(&hash) {
+                continue;
+            }
+            let tip = self.hash_at(self.header_height());
+            if header.prev_hash != tip {
+                if added == 0 {
+                    debug!("Headers do not connect to tip {tip:?}");
+                    return Ok(0);
+                }
+                return Err(format!(
+                    "Header {hash:?} does not follow the previous header"
+                ));
+            }
+            if config.check_pow {
+                let recent: Vec<BlockHeader> = self.recent.iter().cloned().collect();
+                header
+                    .validate(&hash, &recent)
+                    .and_then(|()| check_bits(header, self.recent.back(), config))
+                    .map_err(|e| format!("Header {hash:?}: {e}"))?;
+            }
+            // Bits that give no target were rejected above unless proof of work is not checked
+            self.chain_work += header.work().unwrap_or_default();
+            self.hashes.push(hash);
+            self.heights.insert(hash, self.header_height());
+            if self.recent.len() == TIMESTAMP_HEADERS {
+                self.recent.pop_front();
+            }
+            self.recent.push_back(header.clone());
+            added += 1;
+        }
+        Ok(added)
+    }
+
+    /// Forgets the headers, which is only safe before any blocks are requested
+    fn discard_headers(&mut self) {
+        self.hashes.clear();
+        self.heights.clear();
+        self.recent.clear();
+        self.chain_work = BigUint::default();
+        self.headers_synced = false;
+    }
+
+    /// Forgets the request for a height
+    fn release(&mut self, height: u32) {
+        if let Some((id, _)) = self.in_flight.remove(&height) {
+            if let Some(peer) = self.peers.get_mut(&id) {
+                peer.in_flight -= 1;
+            }
+        }
+    }
+
+    /// Stops using a peer, freeing its requests to go to others
+    fn remove_peer(&mut self, id: ProcessUniqueId) {
+        if self.peers.remove(&id).is_none() {
+            return;
+        }
+        self.in_flight.retain(|_, (peer, _)| *peer != id);
+        if self.header_request.is_some_and(|(peer, _)| peer == id) {
+            self.header_request = None;
+        }
+    }
+
+    /// Asks a peer for the headers after the tip if none are on the way
+    fn request_headers(&mut self, now: Instant) -> Option<(Arc<Peer>, Message)> {
+        if self.headers_synced || self.header_request.is_some() {
+            return None;
+        }
+        let peer = self
+            .peers
+            .values()
+            .filter(|peer| peer.peer.connected())
+            .min_by_key(|peer| (peer.stalls, peer.in_flight))?
+            .peer
+            .clone();
+        self.header_request = Some((peer.id, now));
+        let locator = BlockLocator {
+            version: PROTOCOL_VERSION,
+            block_locator_hashes: self.locator(),
+            hash_stop: NO_HASH_STOP,
+        };
+        Some((peer, Message::GetHeaders(locator)))
+    }
+
+    /// Requests the blocks in the window that are not received or on the way
+    ///
+    /// Each block goes to the peer with the fewest requests outstanding, other than one that
+    /// just let the same request time out.
+    fn schedule(
+        &mut self,
+        window: usize,
+        max_in_flight: usize,
+        now: Instant,
+    ) -> Vec<(Arc<Peer>, Message)> {
+        let end = (self.next_height as u64 + window as u64).min(self.header_height() as u64 + 1);
+        let mut batches: HashMap<ProcessUniqueId, Vec<InvVect>> = HashMap::new();
+        for height in self.next_height..end as u32 {
+            if self.received.contains_key(&height) || self.in_flight.contains_key(&height) {
+                continue;
+            }
+            let timed_out = self.timed_out.get(&height).copied();
+            let Some(peer) = self
+                .peers
+                .values_mut()
+                .filter(|peer| peer.in_flight < max_in_flight && peer.peer.connected())
+                .min_by_key(|peer| (Some(peer.peer.id) == timed_out, peer.in_flight))
+            else {
+                break;
+            };
+            self.timed_out.remove(&height);
+            peer.in_flight += 1;
+            let id = peer.peer.id;
+            self.in_flight.insert(height, (id, now));
+            self.requested += 1;
+            batches.entry(id).or_default().push(InvVect {
+                obj_type: INV_VECT_BLOCK,
+                hash: self.hash_at(height),
+            });
+        }
+        batches
+            .into_iter()
+            .map(|(id, objects)| {
+                let peer = self.peers[&id].peer.clone();
+                (peer, Message::GetData(Inv { objects }))
+            })
+            .collect()
+    }
+
+    /// Takes the blocks that are next in height order
+    fn take_ready(&mut self) -> Vec<(u32, SyncedBlock)> {
+        let mut ready = Vec::new();
+        while let Some(block) = self.received.remove(&self.next_height) {
+            ready.push((self.next_height, block));
+            self.next_height += 1;
+        }
+        ready
+    }
+}
+
+/// Target of `bits` as a number
+fn target_of(bits: u32) -> Result<BigUint, ChainGangError> {
+    let header = BlockHeader {
+        bits,
+        ..Default::default()
+    };
+    Ok(BigUint::from_bytes_le(&header.difficulty_target()?.0))
+}
+
+/// Checks a header's bits against the proof of work limit and the previous header's bits
+///
+/// Difficulty adjustment is not recomputed. Instead the target may not be easier than the limit
+/// or grow faster than `MAX_EASING`, except for the easiest target after a long gap on test
+/// networks. Headers whose target drops are only harder to fake.
+fn check_bits(
+    header: &BlockHeader,
+    prev: Option<&BlockHeader>,
+    config: &BlockSyncConfig,
+) -> Result<(), ChainGangError> {
+    let target = target_of(header.bits)?;
+    if target > target_of(config.pow_limit)? {
+        let msg = format!("Target of bits {:#x} is easier than the limit", header.bits);
+        return Err(ChainGangError::BadData(msg));
+    }
+    let Some(prev) = prev else {
+        return Ok(());
+    };
+    let min_difficulty = config.min_difficulty_blocks
+        && header.bits == config.pow_limit
+        && header.timestamp > prev.timestamp.saturating_add(MIN_DIFFICULTY_DELAY);
+    if !min_difficulty && target > target_of(prev.bits)? * MAX_EASING {
+        let msg = format!(
+            "Bits {:#x} ease off too fast from {:#x}",
+            header.bits, prev.bits
+        );
+        return Err(ChainGangError::BadData(msg));
+    }
+    Ok(())
+}
+
+/// Consumer of synced blocks, called with each block's height in order
+type Consumer = Box<dyn FnMut(u32, SyncedBlock) + Send>;
+
+struct SyncInner {
+    config: BlockSyncConfig,
+    state: Mutex<SyncState>,
+    /// Held while handing blocks over, so they reach the consumer in order. Taken before the
+    /// state lock when both are needed.
+    consumer: Mutex<Consumer>,
+    stopped: AtomicBool,
+}
+
+impl SyncInner {
+    fn run(self: Arc<Self>) {
+        while !self.stopped.load(Ordering::Relaxed) {
+            self.tick();
+            thread::sleep(self.config.tick);
+        }
+    }
+
+    /// Re-requests what timed out and drops peers that keep stalling
+    fn tick(&self) {
+        let now = Instant::now();
+        let requests = {
+            let mut state = self.state.lock().unwrap();
+            let state = &mut *state;
+            let closed: Vec<ProcessUniqueId> = state
+                .peers
+                .values()
+                .filter(|peer| !peer.peer.connected())
+                .map(|peer| peer.peer.id)
+                .collect();
+            for id in closed {
+                state.remove_peer(id);
+            }
+
+            // Peers that let requests time out, each counted as one stall however many were late
+            let mut late = HashSet::new();
+            if let Some((id, sent)) = state.header_request {
+                if now - sent > self.config.headers_timeout {
+                    warn!("Header request timed out");
+                    state.header_request = None;
+                    state.stalls += 1;
+                    late.insert(id);
+                }
+            }
+            let expired: Vec<u32> = state
+                .in_flight
+                .iter()
+                .filter(|(_, (_, sent))| now - *sent > self.config.block_timeout)
+                .map(|(height, _)| *height)
+                .collect();
+            for height in expired {
+                let id = state.in_flight[&height].0;
+                state.release(height);
+                state.timed_out.insert(height, id);
+                state.stalls += 1;
+                late.insert(id);
+            }
+            for id in late {
+                if let Some(peer) = state.peers.get_mut(&id) {
+                    peer.stalls += 1;
+                }
+            }
+            let stalled: Vec<ProcessUniqueId> = state
+                .peers
+                .values()
+                .filter(|peer| peer.stalls >= self.config.max_stalls)
+                .map(|peer| peer.peer.id)
+                .collect();
+            for id in stalled {
+                info!("[Peer {id}] Stalled, no longer syncing from it");
+                state.remove_peer(id);
+            }
+            self.requests(state, now)
+        };
+        send(requests);
+    }
+
+    /// Header and block requests that can be made now
+    ///
+    /// Blocks are only requested once the headers carry `min_chain_work`.
+    fn requests(&self, state: &mut SyncState, now: Instant) -> Vec<(Arc<Peer>, Message)> {
+        let mut requests = Vec::new();
+        if state.chain_work >= self.config.min_chain_work {
+            requests = state.schedule(self.config.window, self.config.max_in_flight, now);
+        }
+        requests.extend(state.request_headers(now));
+        requests
+    }
+
+    fn on_headers(&self, peer: &Arc<Peer>, headers: &[BlockHeader]) {
+        let now = Instant::now();
+        let result = {
+            let mut state = self.state.lock().unwrap();
+            if !state.peers.contains_key(&peer.id) {
+                return;
+            }
+            let requested = state.header_request.is_some_and(|(id, _)| id == peer.id);
+            match state.add_headers(headers, &self.config) {
+                Ok(added) => {
+                    if requested {
+                        state.header_request = None;
+                        // A full response means the peer has more
+                        state.headers_synced = added == 0 || headers.len() < MAX_HEADERS;
+                    }
+                    if requested
+                        && state.headers_synced
+                        && state.chain_work < self.config.min_chain_work
+                    {
+                        // The peer's whole chain has too little work, so no blocks were requested
+                        let e = format!("Chain has too little work: {}", state.chain_work);
+                        state.discard_headers();
+                        state.invalid += 1;
+                        state.remove_peer(peer.id);
+                        Err(e)
+                    } else {
+                        debug!("{peer:?} Added {added} headers");
+                        Ok(self.requests(&mut state, now))
+                    }
+                }
+                Err(e) => {
+                    state.invalid += 1;
+                    state.remove_peer(peer.id);
+                    Err(e)
+                }
+            }
+        };
+        match result {
+            Ok(requests) => send(requests),
+            Err(e) => {
+                warn!("{peer:?} Sent bad headers: {e}");
+                peer.disconnect();
+            }
+        }
+    }
+
+    fn on_block(&self, peer: &Arc<Peer>, block: SyncedBlock) {
+        let hash = block.hash();
+        let wanted = |state: &SyncState| {
+            state.peers.contains_key(&peer.id)
+                && state.heights.get(&hash).is_some_and(|&height| {
+                    height >= state.next_height
+                        && (height - state.next_height) < self.config.window as u32
+                        && !state.received.contains_key(&height)
+                })
+        };
+        if !wanted(&*self.state.lock().unwrap()) {
+            return;
+        }
+        // Checked without the lock, since blocks in files are read to check
+        let valid = block.merkle_root_valid();
+
+        let now = Instant::now();
+        let requests = {
+            let mut state = self.state.lock().unwrap();
+            if !wanted(&*state) {
+                return;
+            }
+            if !valid {
+                state.invalid += 1;
+                state.remove_peer(peer.id);
+                None
+            } else {
+                let height = state.heights[&hash];
+                state.release(height);
+                state.timed_out.remove(&height);
+                state.received.insert(height, block);
+                Some(self.requests(&mut state, now))
+            }
+        };
+        match requests {
+            Some(requests) => {
+                send(requests);
+                self.deliver();
+            }
+            None => {
+                warn!("{peer:?} Sent block {hash:?} with a bad merkle root");
+                peer.disconnect();
+            }
+        }
+    }
+
+    /// Hands the blocks that are next in order to the consumer
+    fn deliver(&self) {
+        let mut consumer = self.consumer.lock().unwrap();
+        loop {
+            let ready = self.state.lock().unwrap().take_ready();
+            if ready.is_empty() {
+                return;
+            }
+            for (height, block) in ready {
+                (*consumer)(height, block);
+            }
+        }
+    }
+}
+
+/// Sends requests, without holding any lock since peers may emit events back
+fn send(requests: Vec<(Arc<Peer>, Message)>) {
+    for (peer, message) in requests {
+        if let Err(e) = peer.send(&message) {
+            warn!("{peer:?} Failed to send request: {e:?}");
+        }
+    }
+}
+
+impl Observer<PeerMessage> for SyncInner {
+    fn next(&self, event: &PeerMessage) {
+        match &event.message {
+            Message::Headers(headers) => self.on_headers(&event.peer, &headers.headers),
+            Message::Block(block) => self.on_block(&event.peer, SyncedBlock::Block(block.clone())),
+            Message::Inv(inv) if inv.objects.iter().any(|o| o.obj_type == INV_VECT_BLOCK) => {
+                // A new block was announced, so there are headers to fetch
+                let requests = {
+                    let mut state = self.state.lock().unwrap();
+                    if !state.peers.contains_key(&event.peer.id) {
+                        return;
+                    }
+                    state.headers_synced = false;
+                    state.request_headers(Instant::now())
+                };
+                send(requests.into_iter().collect());
+            }
+            _ => {}
+        }
+    }
+}
+
+impl Observer<PeerBlockFile> for SyncInner {
+    fn next(&self, event: &PeerBlockFile) {
+        self.on_block(&event.peer, SyncedBlock::File(event.block.clone()));
+    }
+}
+
+impl Observer<PeerDisconnected> for SyncInner {
+    fn next(&self, event: &PeerDisconnected) {
+        self.state.lock().unwrap().remove_peer(event.peer.id);
+    }
+}
+
+/// Downloads headers, then blocks from several peers, delivering blocks in order
+///
+/// Dropping the sync stops it. Peers are not disconnected, except for those that send invalid
+/// headers or blocks.
+pub struct BlockSync {
+    inner: Arc<SyncInner>,
+    thread: Option<JoinHandle<()>>,
+}
+
+impl BlockSync {
+    /// Starts syncing, calling `consumer` with each block after the start block in height order
+    ///
+    /// The consumer is called on the thread of the peer that completed the run of blocks, so a
+    /// slow consumer holds up that peer.
+    pub fn start(
+        config: BlockSyncConfig,
+        consumer: impl FnMut(u32, SyncedBlock) + Send + 'static,
+    ) -> BlockSync {
+        let state = SyncState::new(config.start_hash, config.start_height);
+        let inner = Arc::new(SyncInner {
+            config,
+            state: Mutex::new(state),
+            consumer: Mutex::new(Box::new(consumer)),
+            stopped: AtomicBool::new(false),
+        });
+        let runner = inner.clone();
+        let thread = thread::spawn(move || runner.run());
+        BlockSync {
+            inner,
+            thread: Some(thread),
+        }
+    }
+
+    /// Adds a connected peer to download from
+    pub fn add_peer(&self, peer: &Arc<Peer>) {
+        let requests = {
+            let mut state = self.inner.state.lock().unwrap();
+            if state.peers.contains_key(&peer.id) {
+                return;
+            }
+            state.peers.insert(
+                peer.id,
+                SyncPeer {
+                    peer: peer.clone(),
+                    in_flight: 0,
+                    stalls: 0,
+                },
+            );
+            self.inner.requests(&mut state, Instant::now())
+        };
+        // Subscribed without the lock, since a disconnect that already happened is replayed
+        peer.messages().subscribe(&self.inner);
+        peer.block_files().subscribe(&self.inner);
+        peer.disconnected_event().subscribe(&self.inner);
+        send(requests);
+    }
+
+    /// Stops downloading from a peer, sending its requests to others
+    pub fn remove_peer(&self, peer: &Peer) {
+        self.inner.state.lock().unwrap().remove_peer(peer.id);
+    }
+
+    /// Returns the progress and counters of the sync
+    pub fn stats(&self) -> SyncStats {
+        let state = self.inner.state.lock().unwrap();
+        SyncStats {
+            header_height: state.header_height(),
+            block_height: state.next_height - 1,
+            headers_synced: state.headers_synced,
+            chain_work: state.chain_work.clone(),
+            peers: state.peers.len(),
+            in_flight: state.in_flight.len(),
+            buffered: state.received.len(),
+            requested: state.requested,
+            stalls: state.stalls,
+            invalid: state.invalid,
+        }
+    }
+
+    /// Whether every known header's block has been delivered and the headers are up to date
+    pub fn is_synced(&self) -> bool {
+        let stats = self.stats();
+        stats.headers_synced && stats.block_height == stats.header_height
+    }
+
+    /// Stops requesting headers and blocks
+    pub fn stop(&mut self) {
+        self.inner.stopped.store(true, Ordering::Relaxed);
+        if let Some(thread) = self.thread.take() {
+            let _ = thread.join();
+        }
+        let mut state = self.inner.state.lock().unwrap();
+        state.peers.clear();
+        state.in_flight.clear();
+        state.timed_out.clear();
+        state.header_request = None;
+    }
+}
+
+impl Drop for BlockSync {
+    fn drop(&mut self) {
+        self.stop();
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::messages::{Headers, OutPoint, Tx, TxIn, TxOut, Version, NODE_BITCOIN_CASH};
+    use crate::peer::PeerNodeFilter;
+    use crate::script::Script;
+    use std::net::{IpAddr, TcpListener};
+    use std::sync::atomic::AtomicUsize;
+
+    const NETWORK: Network = Network::BSV_Testnet;
+
+    /// Easiest target, met by about half of all hashes
+    const EASY_BITS: u32 = 0x207fffff;
+
+    /// Target 256 times harder than `EASY_BITS`
+    const HARDER_BITS: u32 = 0x1f7fffff;
+
+    fn version() -> Version {
+        Version {
+            version: PROTOCOL_VERSION,
+            services: NODE_BITCOIN_CASH,
+            user_agent: "/Bitcoin SV:1.0.0/".to_string(),
+            ..Default::default()
+        }
+    }
+
+    /// Finds a nonce that meets the header's target
+    fn mine(mut header: BlockHeader) -> BlockHeader {
+        while header.validate(&header.hash(), &[]).is_err() {
+            header.nonce += 1;
+        }
+        header
+    }
+
+    /// Chain of mined blocks with one transaction each, starting from a block at height 0
+    fn chain(len: usize) -> Arc<Vec<Block>> {
+        let mut blocks: Vec<Block> = Vec::with_capacity(len);
+        for height in 0..len {
+            let tx = Tx {
+                version: 1,
+                inputs: vec![TxIn {
+                    prev_output: OutPoint::default(),
+                    unlock_script: Script((height as u32).to_le_bytes().to_vec()),
+                    sequence: 0xffffffff,
+                }],
+                outputs: vec![TxOut {
+                    satoshis: 50,
+                    lock_script: Script(vec![0x51]),
+                }],
+                lock_time: 0,
+            };
+            let mut block = Block {
+                header: BlockHeader {
+                    version: 1,
+                    prev_hash: blocks.last().map(|b| b.header.hash()).unwrap_or_default(),
+                    merkle_root: Hash256::default(),
+                    timestamp: 1_600_000_000 + height as u32 * 600,
+                    bits: EASY_BITS,
+                    nonce: 0,
+                },
+                txns: vec![tx],
+            };
+            block.header.merkle_root = block.merkle_root();
+            block.header = mine(block.header.clone());
+            blocks.push(block);
+        }
+        Arc::new(blocks)
+    }
+
+    #[derive(Clone, Copy, PartialEq, Eq)]
+    enum Serve {
+        Blocks,
+        /// Answers getdata with nothing
+        Nothing,
+        /// Answers getdata with blocks whose transactions do not match the header
+        Corrupt,
+    }
+
+    /// Stand-in node serving headers and blocks from `chain`, counting the blocks sent
+    fn node(chain: Arc<Vec<Block>>, serve: Serve, sent: Arc<AtomicUsize>) -> u16 {
+        let listener = TcpListener::bind("127.0.0.1:0").unwrap();
+        let port = listener.local_addr().unwrap().port();
+        let index: Arc<HashMap<Hash256, usize>> = Arc::new(
+            chain
+                .iter()
+                .enumerate()
+                .map(|(i, block)| (block.header.hash(), i))
+                .collect(),
+        );
+        thread::spawn(move || {
+            for stream in listener.incoming() {
+                let mut stream = stream.unwrap();
+                let (chain, index, sent) = (chain.clone(), index.clone(), sent.clone());
+                thread::spawn(move || -> Result<(), ChainGangError> {
+                    let magic = NETWORK.magic();
+                    Message::read(&mut stream, magic)?;
+                    Message::Version(version()).write(&mut stream, magic)?;
+                    Message::Verack.write(&mut stream, magic)?;
+                    loop {
+                        match Message::read(&mut stream, magic)? {
+                            Message::Ping(ping) => Message::Pong(ping).write(&mut stream, magic)?,
+                            Message::GetHeaders(locator) => {
+                                let start = locator
+                                    .block_locator_hashes
+                                    .iter()
+                                    .find_map(|hash| index.get(hash))
+                                    .map_or(0, |i| i + 1);
+                                let end = chain.len().min(start + MAX_HEADERS);
+                                let headers = chain[start..end]
+                                    .iter()
+                                    .map(|block| block.header.clone())
+                                    .collect();
+                                Message::Headers(Headers { headers }).write(&mut stream, magic)?;
+                            }
+                            Message::GetData(inv) if serve != Serve::Nothing => {
+                                for object in inv.objects {
+                                    let mut block = chain[index[&object.hash]].clone();
+                                    if serve == Serve::Corrupt {
+                                        block.txns[0].lock_time = 1;
+                                    }
+                                    Message::Block(block).write(&mut stream, magic)?;
+                                    sent.fetch_add(1, Ordering::Relaxed);
+                                }
+                            }
+                            _ => {}
+                        }
+                    }
+                });
+            }
+        });
+        port
+    }
+
+    fn connect(port: u16) -> Arc<Peer> {
+        let ip: IpAddr = "127.0.0.1".parse().unwrap();
+        let peer = Peer::connect(
+            ip,
+            port,
+            NETWORK,
+            version(),
+            Arc::new(PeerNodeFilter::default()),
+        );
+        peer.connected_event()
+            .poll_timeout(Duration::from_secs(5))
+            .unwrap();
+        peer
+    }
+
+    fn config(chain: &[Block]) -> BlockSyncConfig {
+        let mut config = BlockSyncConfig::new(NETWORK);
+        config.start_hash = chain[0].header.hash();
+        config.pow_limit = EASY_BITS;
+        config.window = 64;
+        config.max_in_flight = 8;
+        config.tick = Duration::from_millis(20);
+        config
+    }
+
+    /// Starts a sync that records the heights and hashes delivered
+    fn start(config: BlockSyncConfig) -> (BlockSync, Arc<Mutex<Vec<(u32, Hash256)>>>) {
+        let delivered = Arc::new(Mutex::new(Vec::new()));
+        let record = delivered.clone();
+        let sync = BlockSync::start(config, move |height, block| {
+            record.lock().unwrap().push((height, block.hash()));
+        });
+        (sync, delivered)
+    }
+
+    fn wait_for(sync: &BlockSync, done: impl Fn(&SyncStats) -> bool) -> SyncStats {
+        let deadline = Instant::now() + Duration::from_secs(20);
+        loop {
+            let stats = sync.stats();
+            if done(&stats) {
+                return stats;
+            }
+            assert!(Instant::now() < deadline, "timed out: {stats:?}");
+            thread::sleep(Duration::from_millis(10));
+        }
+    }
+
+    fn wait_synced(sync: &BlockSync) -> SyncStats {
+        wait_for(sync, |stats| {
+            stats.headers_synced && stats.block_height == stats.header_height
+        })
+    }
+
+    fn assert_in_order(chain: &[Block], delivered: &[(u32, Hash256)]) {
+        assert_eq!(delivered.len(), chain.len() - 1);
+        for (i, (height, hash)) in delivered.iter().enumerate() {
+            assert_eq!(*height as usize, i + 1);
+            assert_eq!(*hash, chain[i + 1].header.hash());
+        }
+    }
+
+    #[test]
+    fn locator() {
+        let mut state = SyncState::new(Hash256([1; 32]), 100);
+        state.hashes = (0..50u8).map(|i| Hash256([i + 2; 32])).collect();
+        let locator = state.locator();
+        assert_eq!(locator[0], state.hash_at(150));
+        assert_eq!(locator[9], state.hash_at(141));
+        assert_eq!(locator[10], state.hash_at(139));
+        assert_eq!(*locator.last().unwrap(), Hash256([1; 32]));
+        assert!(locator.len() < 20);
+
+        state.hashes.clear();
+        assert_eq!(state.locator(), vec![Hash256([1; 32])]);
+    }
+
+    #[test]
+    fn bad_headers() {
+        let chain = chain(5);
+        let config = config(&chain);
+        let (sync, _) = start(config.clone());
+        let mut state = sync.inner.state.lock().unwrap();
+        let headers: Vec<BlockHeader> = chain[1..].iter().map(|b| b.header.clone()).collect();
+        assert_eq!(state.add_headers(&headers[..2], &config), Ok(2));
+        // Known headers are skipped and ones that do not connect are ignored
+        assert_eq!(state.add_headers(&headers, &config), Ok(2));
+        assert_eq!(state.add_headers(&headers[..1], &config), Ok(0));
+        assert_eq!(state.header_height(), 4);
+        let work: BigUint = headers.iter().map(|h| h.work().unwrap()).sum();
+        assert_eq!(state.chain_work, work);
+
+        let mut unmined = chain[4].header.clone();
+        unmined.prev_hash = chain[4].header.hash();
+        unmined.bits = 0x1d00ffff;
+        assert!(state.add_headers(&[unmined.clone()], &config).is_err());
+        let unchecked = BlockSyncConfig {
+            check_pow: false,
+            ..config
+        };
+        assert_eq!(state.add_headers(&[unmined], &unchecked), Ok(1));
+    }
+
+    #[test]
+    fn bits_within_limits() {
+        let chain = chain(2);
+        let mut config = config(&chain);
+        let mut state = SyncState::new(chain[0].header.hash(), 0);
+        let harder = mine(BlockHeader {
+            prev_hash: chain[1].header.hash(),
+            timestamp: chain[1].header.timestamp + 600,
+            bits: HARDER_BITS,
+            ..Default::default()
+        });
+        let headers = [chain[1].header.clone(), harder.clone()];
+        assert_eq!(state.add_headers(&headers, &config), Ok(2));
+
+        // Easing straight back to the easiest target is too fast
+        let easy = mine(BlockHeader {
+            prev_hash: harder.hash(),
+            timestamp: harder.timestamp + 600,
+            bits: EASY_BITS,
+            ..Default::default()
+        });
+        assert!(state.add_headers(&[easy.clone()], &config).is_err());
+        // Except on a test network, long after the previous block
+        let late = mine(BlockHeader {
+            timestamp: harder.timestamp + MIN_DIFFICULTY_DELAY + 1,
+            ..easy.clone()
+        });
+        config.min_difficulty_blocks = false;
+        assert!(state.add_headers(&[late.clone()], &config).is_err());
+        config.min_difficulty_blocks = true;
+        assert_eq!(state.add_headers(&[late], &config), Ok(1));
+
+        // Headers at the easiest target are cheap to fake, and above the network's limit
+        config.pow_limit = NETWORK.pow_limit();
+        let mut state = SyncState::new(chain[0].header.hash(), 0);
+        assert!(state.add_headers(&headers[..1], &config).is_err());
+    }
+
+    #[test]
+    fn drops_chains_with_too_little_work() {
+        let chain = chain(20);
+        let mut config = config(&chain);
+        // Each header at the easiest target adds about two hashes of work
+        config.min_chain_work = BigUint::from(1000_u32);
+        let (sync, delivered) = start(config);
+        let sent = Arc::new(AtomicUsize::new(0));
+        let peer = connect(node(chain.clone(), Serve::Blocks, sent.clone()));
+        sync.add_peer(&peer);
+        let stats = wait_for(&sync, |stats| stats.invalid == 1);
+        assert_eq!(stats.peers, 0);
+        assert_eq!(stats.header_height, 0);
+        assert_eq!(stats.chain_work, BigUint::default());
+        assert_eq!(stats.requested, 0);
+        assert_eq!(sent.load(Ordering::Relaxed), 0);
+        assert!(delivered.lock().unwrap().is_empty());
+    }
+
+    #[test]
+    fn syncs_in_order_across_peers() {
+        // More than one full headers response
+        let chain = chain(MAX_HEADERS + 150);
+        let sent: Vec<Arc<AtomicUsize>> = (0..3).map(|_| Arc::default()).collect();
+        let (sync, delivered) = start(config(&chain));
+        for sent in sent.iter() {
+            let peer = connect(node(chain.clone(), Serve::Blocks, sent.clone()));
+            sync.add_peer(&peer);
+        }
+        let stats = wait_synced(&sync);
+        assert_eq!(stats.header_height as usize, chain.len() - 1);
+        assert_eq!(stats.in_flight, 0);
+        assert_eq!(stats.buffered, 0);
+        assert_eq!(stats.invalid, 0);
+        assert_in_order(&chain, &delivered.lock().unwrap());
+
+        let sent: Vec<usize> = sent.iter().map(|n| n.load(Ordering::Relaxed)).collect();
+        assert_eq!(sent.iter().sum::<usize>(), chain.len() - 1);
+        assert!(sent.iter().filter(|&&n| n > 0).count() >= 2, "{sent:?}");
+    }
+
+    #[test]
+    fn re_requests_from_stalled_and_invalid_peers() {
+        let chain = chain(300);
+        let mut config = config(&chain);
+        config.block_timeout = Duration::from_millis(200);
+        let (sync, delivered) = start(config);
+        let mut peers = Vec::new();
+        for serve in [Serve::Nothing, Serve::Corrupt, Serve::Blocks] {
+            let peer = connect(node(chain.clone(), serve, Arc::default()));
+            sync.add_peer(&peer);
+            peers.push(peer);
+        }
+        let stats = wait_synced(&sync);
+        assert!(stats.stalls > 0);
+        assert!(stats.invalid > 0);
+        assert_eq!(stats.peers, 1);
+        assert!(!peers[1].connected());
+        assert!(peers[0].connected());
+        assert_in_order(&chain, &delivered.lock().unwrap());
+    }
+
+    #[test]
+    fn stalls_once_per_tick_and_re_requests_elsewhere() {
+        let chain = chain(20);
+        let mut config = config(&chain);
+        config.block_timeout = Duration::from_millis(300);
+        let (sync, delivered) = start(config);
+        let slow = connect(node(chain.clone(), Serve::Nothing, Arc::default()));
+        sync.add_peer(&slow);
+        wait_for(&sync, |stats| stats.in_flight == 8);
+        let sent = Arc::new(AtomicUsize::new(0));
+        sync.add_peer(&connect(node(chain.clone(), Serve::Blocks, sent.clone())));
+
+        // The slow peer's eight requests time out in one tick and all go to the other peer
+        let stats = wait_synced(&sync);
+        assert_eq!(stats.stalls, 8);
+        assert_eq!(stats.peers, 2);
+        assert_eq!(sync.inner.state.lock().unwrap().peers[&slow.id].stalls, 1);
+        assert_eq!(sent.load(Ordering::Relaxed), chain.len() - 1);
+        assert_in_order(&chain, &delivered.lock().unwrap());
+    }
+
+    #[test]
+    fn starts_from_a_known_block() {
+        let chain = chain(40);
+        let mut config = config(&chain);
+        config.start_hash = chain[10].header.hash();
+        config.start_height = 10;
+        let (sync, delivered) = start(config);
+        sync.add_peer(&connect(node(chain.clone(), Serve::Blocks, Arc::default())));
+        let stats = wait_synced(&sync);
+        assert_eq!(stats.header_height, 39);
+        assert_eq!(stats.requested, 29);
+        assert_in_order(&chain[10..], &delivered.lock().unwrap());
+    }
+}
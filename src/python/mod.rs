@@ -2,6 +2,7 @@ use pyo3::Bound;
 use pyo3::{prelude::*, types::PyBytes};
 
 mod op_code_names;
+mod py_mempool;
 mod py_script;
 mod py_stack;
 mod py_tx;
@@ -12,6 +13,7 @@ use crate::{
     messages::Tx,
     network::Network,
     python::{
+        py_mempool::PyMempool,
         py_script::PyScript,
         py_stack::{decode_num_stack, PyStack},
         py_tx::{PyTx, PyTxIn, PyTxOut},
@@ -21,8 +23,8 @@ use crate::{
             PyHdWatchWallet,
         },
         py_wallet::{
-            address_to_public_key_hash, bytes_to_wif, generate_wif, p2pkh_pyscript, wif_to_bytes,
-            PyWallet,
+            address_to_public_key_hash, bytes_to_wif, generate_wif, p2pkh_pyscript, py_sign_many,
+            str_to_network, wif_to_bytes, PyWallet,
         },
     },
     script::{
@@ -32,8 +34,8 @@ use crate::{
     transaction::sighash::{sig_hash_preimage, sig_hash_preimage_checksig_index, SigHashCache},
     util::{hash160, sha256d, ChainGangError, Hash256},
     wallet::{
-        create_sighash, create_sighash_checksig_index, public_key_to_address, MAIN_PRIVATE_KEY,
-        TEST_PRIVATE_KEY,
+        addresses_to_public_key_hashes, create_sighash, create_sighash_checksig_index,
+        public_key_hashes_to_addresses, public_key_to_address, MAIN_PRIVATE_KEY, TEST_PRIVATE_KEY,
     },
 };
 
@@ -144,6 +146,65 @@ pub fn py_address_to_public_key_hash(py: Python, address: &str) -> PyResult<Py<P
     Ok(PyBytes::new(py, &result).into())
 }
 
+/// Converts many addresses to packed 20-byte public key hashes in one call.
+///
+/// `addresses` is a list of strings or a bytes buffer with one address per line.
+/// Returns `(packed_hashes, errors)`; rows that fail to decode are zero filled in
+/// `packed_hashes` and listed in `errors` as `(row, message)`.
+#[pyfunction(name = "addresses_to_public_key_hashes")]
+pub fn py_addresses_to_public_key_hashes(
+    py: Python,
+    addresses: &Bound<'_, PyAny>,
+) -> PyResult<(Py<PyAny>, Vec<(usize, String)>)> {
+    let addresses: Vec<String> = match addresses.cast::<PyBytes>() {
+        Ok(buffer) => String::from_utf8_lossy(buffer.as_bytes())
+            .lines()
+            .map(|line| line.trim().to_string())
+            .collect(),
+        Err(_) => addresses.extract()?,
+    };
+
+    let (packed, errors) = py.detach(|| {
+        let mut packed = Vec::with_capacity(addresses.len() * 20);
+        let mut errors = Vec::new();
+        for (row, result) in addresses_to_public_key_hashes(&addresses).into_iter().enumerate() {
+            match result {
+                Ok(hash) => packed.extend_from_slice(&hash),
+                Err(e) => {
+                    packed.extend_from_slice(&[0; 20]);
+                    errors.push((row, e.to_string()));
+                }
+            }
+        }
+        (packed, errors)
+    });
+    Ok((PyBytes::new(py, &packed).into(), errors))
+}
+
+/// Converts packed 20-byte public key hashes to P2PKH addresses for `network`.
+#[pyfunction(name = "public_key_hashes_to_addresses")]
+pub fn py_public_key_hashes_to_addresses(
+    py: Python,
+    public_key_hashes: &[u8],
+    network: &str,
+) -> PyResult<Vec<String>> {
+    if public_key_hashes.len() % 20 != 0 {
+        let msg = format!(
+            "Packed public key hashes length {} is not a multiple of 20",
+            public_key_hashes.len()
+        );
+        return Err(ChainGangError::BadData(msg).into());
+    }
+    let network_type = str_to_network(network).ok_or_else(|| {
+        ChainGangError::BadData(format!("Unknown network: {}", network))
+    })?;
+    let hashes: Vec<[u8; 20]> = public_key_hashes
+        .chunks_exact(20)
+        .map(|hash| hash.try_into().expect("chunks are 20 bytes"))
+        .collect();
+    Ok(py.detach(|| public_key_hashes_to_addresses(&hashes, network_type))?)
+}
+
 #[pyfunction(name = "public_key_to_address")]
 pub fn py_public_key_to_address(public_key: &[u8], network: &str) -> PyResult<String> {
     // network conversion
@@ -459,6 +520,8 @@ fn chain_gang(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(py_hash256d, m)?)?;
     m.add_function(wrap_pyfunction!(py_address_to_public_key_hash, m)?)?;
     m.add_function(wrap_pyfunction!(py_public_key_to_address, m)?)?;
+    m.add_function(wrap_pyfunction!(py_addresses_to_public_key_hashes, m)?)?;
+    m.add_function(wrap_pyfunction!(py_public_key_hashes_to_addresses, m)?)?;
     m.add_function(wrap_pyfunction!(py_sig_hash_preimage, m)?)?;
     m.add_function(wrap_pyfunction!(py_sig_hash_preimage_checksig_index, m)?)?;
     m.add_function(wrap_pyfunction!(py_sig_hash, m)?)?;
@@ -466,6 +529,7 @@ fn chain_gang(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(py_wif_to_bytes, m)?)?;
     m.add_function(wrap_pyfunction!(py_bytes_to_wif, m)?)?;
     m.add_function(wrap_pyfunction!(py_generate_wif_from_pw_nonce, m)?)?;
+    m.add_function(wrap_pyfunction!(py_sign_many, m)?)?;
     m.add_function(wrap_pyfunction!(decode_num_stack, m)?)?;
     m.add_function(wrap_pyfunction!(py_script_eval_pystack, m)?)?;
     m.add_function(wrap_pyfunction!(py_script_eval_two_phase_pystack, m)?)?;
@@ -489,5 +553,7 @@ fn chain_gang(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<PyHdWatchWallet>()?;
     // stack class
     m.add_class::<PyStack>()?;
+    // Mempool class
+    m.add_class::<PyMempool>()?;
     Ok(())
 }
@@ -4,12 +4,14 @@ use crate::{
     util::ChainGangError,
     wallet::{
         bip32_path, bip44_path, derive_extended_key, load_wordlist, mnemonic_to_seed, watch_bip32_path,
-        watch_bip44_path, Wordlist, BSV_COIN_TYPE, ExtendedKey, HdWallet, HdWatchWallet,
+        watch_bip44_path, Wordlist, BSV_COIN_TYPE, DerivationCache, ExtendedKey, HdWallet,
+        HdWatchWallet, DEFAULT_DERIVATION_CACHE_SIZE,
     },
 };
 
 use pyo3::prelude::*;
-use pyo3::types::PyType;
+use pyo3::types::{PyBytes, PyType};
+use std::collections::HashMap;
 
 #[pyclass(name = "HdWallet")]
 pub struct PyHdWallet {
@@ -88,6 +90,30 @@ impl PyHdWallet {
       .encode())
   }
 
+  fn derive_xprv_indices(&self, indices: Vec<u32>) -> PyResult<String> {
+    Ok(self.inner.derive_indices(&indices)?.encode())
+  }
+
+  fn derive_xpub_indices(&self, indices: Vec<u32>) -> PyResult<String> {
+    Ok(self
+      .inner
+      .derive_indices(&indices)?
+      .extended_public_key()?
+      .encode())
+  }
+
+  #[pyo3(signature = (capacity=DEFAULT_DERIVATION_CACHE_SIZE, zeroize=false))]
+  fn set_derivation_cache(&mut self, capacity: usize, zeroize: bool) {
+    self.inner = self
+      .inner
+      .clone()
+      .with_cache(DerivationCache::with_zeroize(capacity, zeroize));
+  }
+
+  fn derivation_cache_stats(&self) -> HashMap<&'static str, u64> {
+    cache_stats(self.inner.cache())
+  }
+
   fn scan_external_addresses(
     &self,
     account: u32,
@@ -98,6 +124,28 @@ impl PyHdWallet {
       .inner
       .scan_external_addresses(account, gap_limit, |addr| call_is_used(is_used, addr))?)
   }
+
+  /// Gap-limit scans the receive and change chains of each account concurrently.
+  ///
+  /// `are_used` receives a list of up to `window` addresses and returns a list of bools.
+  /// Returns one `(external, internal)` tuple of used addresses per account.
+  #[pyo3(signature = (accounts, gap_limit, are_used, window=None))]
+  fn scan_accounts(
+    &self,
+    py: Python<'_>,
+    accounts: Vec<u32>,
+    gap_limit: u32,
+    are_used: Py<PyAny>,
+    window: Option<u32>,
+  ) -> PyResult<Vec<(Vec<String>, Vec<String>)>> {
+    let window = scan_window(gap_limit, window);
+    let scans = py.detach(|| {
+      self
+        .inner
+        .scan_accounts(&accounts, gap_limit, window, |addrs| call_are_used(&are_used, addrs))
+    })?;
+    Ok(scans.into_iter().map(|scan| (scan.external, scan.internal)).collect())
+  }
 }
 
 #[pyclass(name = "HdWatchWallet")]
@@ -134,6 +182,63 @@ impl PyHdWatchWallet {
     Ok(self.inner.derive_path(path)?.encode())
   }
 
+  fn derive_xpub_indices(&self, indices: Vec<u32>) -> PyResult<String> {
+    Ok(self.inner.derive_indices(&indices)?.encode())
+  }
+
+  /// P2PKH addresses for chain indices `start..start + count`, derived in parallel without the GIL.
+  fn addresses_range(
+    &self,
+    py: Python<'_>,
+    external: bool,
+    start: u32,
+    count: u32,
+  ) -> PyResult<Vec<String>> {
+    Ok(py.detach(|| self.inner.addresses_range(external, start, count))?)
+  }
+
+  /// Packed 25-byte P2PKH locking scripts for chain indices `start..start + count`.
+  fn locking_scripts_range(
+    &self,
+    py: Python<'_>,
+    external: bool,
+    start: u32,
+    count: u32,
+  ) -> PyResult<Py<PyAny>> {
+    let packed = py.detach(|| -> Result<Vec<u8>, ChainGangError> {
+      let scripts = self.inner.locking_scripts_range(external, start, count)?;
+      Ok(scripts.iter().flat_map(|script| script.0.iter().copied()).collect())
+    })?;
+    Ok(PyBytes::new(py, &packed).into())
+  }
+
+  /// Packed 20-byte public key hashes for chain indices `start..start + count`.
+  fn pubkey_hashes_range(
+    &self,
+    py: Python<'_>,
+    external: bool,
+    start: u32,
+    count: u32,
+  ) -> PyResult<Py<PyAny>> {
+    let packed = py.detach(|| -> Result<Vec<u8>, ChainGangError> {
+      let hashes = self.inner.pubkey_hashes_range(external, start, count)?;
+      Ok(hashes.concat())
+    })?;
+    Ok(PyBytes::new(py, &packed).into())
+  }
+
+  #[pyo3(signature = (capacity=DEFAULT_DERIVATION_CACHE_SIZE, zeroize=false))]
+  fn set_derivation_cache(&mut self, capacity: usize, zeroize: bool) {
+    self.inner = self
+      .inner
+      .clone()
+      .with_cache(DerivationCache::with_zeroize(capacity, zeroize));
+  }
+
+  fn derivation_cache_stats(&self) -> HashMap<&'static str, u64> {
+    cache_stats(self.inner.cache())
+  }
+
   fn scan_addresses(
     &self,
     external: bool,
@@ -144,6 +249,51 @@ impl PyHdWatchWallet {
       .inner
       .scan_addresses(external, gap_limit, |addr| call_is_used(is_used, addr))?)
   }
+
+  /// Gap-limit scan asking `are_used` about `window` addresses (default `gap_limit`) per call.
+  #[pyo3(signature = (external, gap_limit, are_used, window=None))]
+  fn scan_addresses_batched(
+    &self,
+    py: Python<'_>,
+    external: bool,
+    gap_limit: u32,
+    are_used: Py<PyAny>,
+    window: Option<u32>,
+  ) -> PyResult<Vec<String>> {
+    let window = scan_window(gap_limit, window);
+    Ok(py.detach(|| {
+      self
+        .inner
+        .scan_addresses_batched(external, gap_limit, window, |addrs| call_are_used(&are_used, addrs))
+    })?)
+  }
+
+  /// Scans the receive and change chains concurrently, returning `(external, internal)`.
+  #[pyo3(signature = (gap_limit, are_used, window=None))]
+  fn scan_chains(
+    &self,
+    py: Python<'_>,
+    gap_limit: u32,
+    are_used: Py<PyAny>,
+    window: Option<u32>,
+  ) -> PyResult<(Vec<String>, Vec<String>)> {
+    let window = scan_window(gap_limit, window);
+    let scan = py.detach(|| {
+      self
+        .inner
+        .scan_chains(gap_limit, window, |addrs| call_are_used(&are_used, addrs))
+    })?;
+    Ok((scan.external, scan.internal))
+  }
+}
+
+fn cache_stats(cache: &DerivationCache) -> HashMap<&'static str, u64> {
+  HashMap::from([
+    ("size", cache.len() as u64),
+    ("capacity", cache.capacity() as u64),
+    ("hits", cache.hits()),
+    ("misses", cache.misses()),
+  ])
 }
 
 fn call_is_used(is_used: &Bound<'_, PyAny>, addr: &str) -> bool {
@@ -153,6 +303,21 @@ fn call_is_used(is_used: &Bound<'_, PyAny>, addr: &str) -> bool {
     .unwrap_or(false)
 }
 
+/// Calls a batch usage callback, reacquiring the GIL from a scanning thread.
+fn call_are_used(are_used: &Py<PyAny>, addrs: &[String]) -> Result<Vec<bool>, ChainGangError> {
+  Python::attach(|py| {
+    are_used
+      .bind(py)
+      .call1((addrs.to_vec(),))
+      .and_then(|v| v.extract::<Vec<bool>>())
+      .map_err(|e| ChainGangError::BadData(format!("are_used callback failed: {}", e)))
+  })
+}
+
+fn scan_window(gap_limit: u32, window: Option<u32>) -> u32 {
+  window.unwrap_or(gap_limit.max(1))
+}
+
 fn parse_network(network: &str) -> PyResult<Network> {
   str_to_network(network).ok_or_else(|| {
     ChainGangError::BadArgument(format!("Unknown network {}", network)).into()
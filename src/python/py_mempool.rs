@@ -0,0 +1,105 @@
+use crate::{
+    mempool::{Mempool, MempoolConfig},
+    python::py_tx::{tx_as_pytx, PyTx},
+    util::Hash256,
+};
+use pyo3::prelude::*;
+use std::collections::HashMap;
+
+fn encode_all(txids: Vec<Hash256>) -> Vec<String> {
+    txids.iter().map(|txid| txid.encode()).collect()
+}
+
+/// Mempool - unconfirmed transactions indexed by txid, spent output and fee rate
+///
+/// Txids are hex strings, as returned by `Tx.id()`.
+#[pyclass(name = "Mempool")]
+pub struct PyMempool {
+    inner: Mempool,
+}
+
+#[pymethods]
+impl PyMempool {
+    #[new]
+    #[pyo3(signature = (max_bytes=None, max_ancestors=None))]
+    fn new(max_bytes: Option<usize>, max_ancestors: Option<usize>) -> Self {
+        let default = MempoolConfig::default();
+        let config = MempoolConfig {
+            max_bytes: max_bytes.unwrap_or(default.max_bytes),
+            max_ancestors: max_ancestors.unwrap_or(default.max_ancestors),
+        };
+        PyMempool {
+            inner: Mempool::new(config),
+        }
+    }
+
+    /// Adds a transaction paying `fee` satoshis, returning the txids evicted to make room
+    fn add(&mut self, tx: &PyTx, fee: i64) -> PyResult<Vec<String>> {
+        Ok(encode_all(self.inner.insert(&tx.as_tx(), fee)?))
+    }
+
+    /// Removes a transaction and its descendants, returning their txids
+    fn remove(&mut self, txid: &str) -> PyResult<Vec<String>> {
+        Ok(encode_all(self.inner.remove(&Hash256::decode(txid)?)))
+    }
+
+    /// Removes the transactions in a block, given in block order, and those conflicting with them
+    ///
+    /// Returns the confirmed txids and the conflicting txids removed.
+    fn remove_for_block(&mut self, txs: Vec<PyTx>) -> (Vec<String>, Vec<String>) {
+        let txs: Vec<_> = txs.iter().map(|tx| tx.as_tx()).collect();
+        let removal = self.inner.remove_confirmed(&txs);
+        (
+            encode_all(removal.confirmed),
+            encode_all(removal.conflicted),
+        )
+    }
+
+    fn get(&self, txid: &str) -> PyResult<Option<PyTx>> {
+        Ok(self
+            .inner
+            .get(&Hash256::decode(txid)?)
+            .map(|tx| tx_as_pytx(&tx)))
+    }
+
+    fn fee(&self, txid: &str) -> PyResult<Option<i64>> {
+        Ok(self.inner.fee(&Hash256::decode(txid)?))
+    }
+
+    /// Pooled txids spending any of the outputs `tx` spends
+    fn conflicts(&self, tx: &PyTx) -> Vec<String> {
+        encode_all(self.inner.conflicts(&tx.as_tx()))
+    }
+
+    fn ancestors(&self, txid: &str) -> PyResult<Vec<String>> {
+        Ok(encode_all(self.inner.ancestors(&Hash256::decode(txid)?)))
+    }
+
+    fn descendants(&self, txid: &str) -> PyResult<Vec<String>> {
+        Ok(encode_all(self.inner.descendants(&Hash256::decode(txid)?)))
+    }
+
+    fn txids(&self) -> Vec<String> {
+        self.inner.txids().map(|txid| txid.encode()).collect()
+    }
+
+    fn stats(&self) -> HashMap<&'static str, u64> {
+        let stats = self.inner.stats();
+        HashMap::from([
+            ("count", stats.count as u64),
+            ("tx_bytes", stats.tx_bytes as u64),
+            ("usage", stats.usage as u64),
+            ("max_bytes", stats.max_bytes as u64),
+            ("evicted", stats.evicted),
+            ("min_fee_rate", stats.min_fee_rate),
+        ])
+    }
+
+    fn __len__(&self) -> usize {
+        self.inner.len()
+    }
+
+    fn __contains__(&self, txid: &str) -> PyResult<bool> {
+        Ok(self.inner.contains(&Hash256::decode(txid)?))
+    }
+}
@@ -5,8 +5,11 @@ use crate::{
         op_codes::{OP_CHECKSIG, OP_DUP, OP_EQUALVERIFY, OP_HASH160},
         Script,
     },
-    transaction::sighash::{SIGHASH_ALL, SIGHASH_FORKID},
-    util::ChainGangError,
+    transaction::{
+        generate_signatures,
+        sighash::{SIGHASH_ALL, SIGHASH_FORKID},
+    },
+    util::{parallel::parallel_chunks, ChainGangError, Hash256},
     wallet::{
         base58_checksum::{decode_base58_checksum, encode_base58_checksum},
         wallet::{wif_to_network_and_private_key, Wallet, MAIN_PRIVATE_KEY, TEST_PRIVATE_KEY},
@@ -16,7 +19,7 @@ use k256::{ecdsa::SigningKey, elliptic_curve::Generate};
 use num_bigint::{BigInt, Sign};
 use pyo3::{
     prelude::*,
-    types::{PyDict, PyInt, PyType},
+    types::{PyBytes, PyDict, PyInt, PyType},
 };
 use std::ffi::CString;
 
@@ -90,8 +93,16 @@ pub fn network_and_private_key_to_wif(
     Ok(encode_base58_checksum(data.as_slice()))
 }
 
+/// Returns the payload of an address after its version byte
+///
+/// Any payload length is accepted, as before the bulk conversions were added. The bulk
+/// `addresses_to_public_key_hashes` only accepts 20-byte hashes.
 pub fn address_to_public_key_hash(address: &str) -> Result<Vec<u8>, ChainGangError> {
     let decoded = decode_base58_checksum(address)?;
+    if decoded.is_empty() {
+        let msg = format!("Address '{address}' has no version byte");
+        return Err(ChainGangError::BadData(msg));
+    }
     Ok(decoded[1..].to_vec())
 }
 
@@ -357,6 +368,64 @@ impl PyWallet {
     }
 }
 
+/// Signing key for one `sign_many` job: a wallet key, or raw private key bytes parsed off the GIL.
+enum SignManyKey {
+    Key(SigningKey),
+    Bytes(Vec<u8>),
+}
+
+/// Signs many `(wallet_or_key_bytes, sighash, sighash_flags)` items in parallel with the GIL
+/// released.
+///
+/// Returns the signatures packed into one bytes object, each preceded by its one-byte length
+/// (DER signature plus sighash flag byte, at most 73 bytes), in input order.
+#[pyfunction(name = "sign_many")]
+pub fn py_sign_many(py: Python<'_>, items: &Bound<'_, PyAny>) -> PyResult<Py<PyAny>> {
+    let mut jobs = Vec::new();
+    for item in items.try_iter()? {
+        let (key, sighash, flags): (Bound<'_, PyAny>, Vec<u8>, u8) = item?.extract()?;
+        let key = match key.cast::<PyWallet>() {
+            Ok(wallet) => SignManyKey::Key(wallet.borrow().wallet.private_key.clone()),
+            Err(_) => SignManyKey::Bytes(key.extract::<Vec<u8>>()?),
+        };
+        let sighash: [u8; 32] = sighash.try_into().map_err(|_| {
+            ChainGangError::BadData(format!("Item {}: sighash must be 32 bytes", jobs.len()))
+        })?;
+        jobs.push((key, Hash256(sighash), flags));
+    }
+
+    let packed = py.detach(|| -> Result<Vec<u8>, ChainGangError> {
+        let jobs = parallel_chunks(jobs.len(), MIN_KEY_PARSE_CHUNK, |range| {
+            let offset = range.start;
+            jobs[range]
+                .iter()
+                .enumerate()
+                .map(|(i, (key, sighash, flags))| {
+                    let key = match key {
+                        SignManyKey::Key(key) => key.clone(),
+                        SignManyKey::Bytes(bytes) => SigningKey::from_slice(bytes).map_err(|e| {
+                            ChainGangError::BadData(format!("Item {}: {}", offset + i, e))
+                        })?,
+                    };
+                    Ok((key, *sighash, *flags))
+                })
+                .collect()
+        })?;
+
+        let signatures = generate_signatures(&jobs)?;
+        let mut packed = Vec::with_capacity(signatures.len() * 73);
+        for signature in signatures {
+            packed.push(signature.len() as u8);
+            packed.extend_from_slice(&signature);
+        }
+        Ok(packed)
+    })?;
+    Ok(PyBytes::new(py, &packed).into())
+}
+
+/// Smallest number of raw private keys parsed per worker thread by `sign_many`.
+const MIN_KEY_PARSE_CHUNK: usize = 64;
+
 #[cfg(test)]
 mod tests {
     use super::*;
@@ -386,6 +455,20 @@ mod tests {
         assert!(&result.is_err());
     }
 
+    #[test]
+    fn address_to_public_key_hash_accepts_any_payload_length() {
+        let address = encode_base58_checksum(&[0x6f; 21]);
+        assert_eq!(
+            address_to_public_key_hash(&address).unwrap(),
+            vec![0x6f; 20]
+        );
+        // Longer payloads are returned whole, unlike the bulk conversion
+        let long = encode_base58_checksum(&[0x00; 33]);
+        assert_eq!(address_to_public_key_hash(&long).unwrap(), vec![0x00; 32]);
+        assert!(crate::wallet::addresses_to_public_key_hashes(&[long])[0].is_err());
+        assert!(address_to_public_key_hash(&encode_base58_checksum(&[])).is_err());
+    }
+
     #[test]
     fn wif_to_bytes_check() {
         // Valid data
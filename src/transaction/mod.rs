@@ -29,6 +29,7 @@
 //! tx.inputs[0].unlock_script = create_unlock_script(&signature, &public_key);
 //! ```
 
+use crate::util::parallel::parallel_chunks;
 use crate::util::{ChainGangError, Hash256};
 use k256::ecdsa::{
     signature::{hazmat::PrehashSigner, SignatureEncoding},
@@ -64,10 +65,37 @@ pub fn generate_signature(
     sighash_type: u8,
 ) -> Result<Vec<u8>, ChainGangError> {
     let signing_key = SigningKey::from_slice(private_key)?;
+    sign_sighash(&signing_key, sighash, sighash_type)
+}
+
+/// Signs a sighash with an already parsed key, returning the DER signature followed by the
+/// sighash type byte.
+pub fn sign_sighash(
+    signing_key: &SigningKey,
+    sighash: &Hash256,
+    sighash_type: u8,
+) -> Result<Vec<u8>, ChainGangError> {
     let signature: Signature = signing_key.sign_prehash(&sighash.0)?;
     Ok(encode_signature(signature, sighash_type))
 }
 
+/// Smallest number of signatures produced per worker thread by [`generate_signatures`].
+const MIN_SIGNING_CHUNK: usize = 16;
+
+/// Signs each `(key, sighash, sighash_type)` job across all cores.
+///
+/// Signatures are returned in job order, each encoded as by [`generate_signature`].
+pub fn generate_signatures(
+    jobs: &[(SigningKey, Hash256, u8)],
+) -> Result<Vec<Vec<u8>>, ChainGangError> {
+    parallel_chunks(jobs.len(), MIN_SIGNING_CHUNK, |range| {
+        jobs[range]
+            .iter()
+            .map(|(key, sighash, sighash_type)| sign_sighash(key, sighash, *sighash_type))
+            .collect()
+    })
+}
+
 #[cfg(test)]
 mod tests {
     use super::*;
@@ -176,6 +204,23 @@ mod tests {
         );
     }
 
+    #[test]
+    fn generate_signatures_matches_single_signing() {
+        let jobs: Vec<(SigningKey, Hash256, u8)> = (1..=40u8)
+            .map(|i| {
+                let key = SigningKey::from_slice(&[i; 32]).unwrap();
+                (key, Hash256([i.wrapping_mul(7); 32]), SIGHASH_ALL | SIGHASH_FORKID)
+            })
+            .collect();
+        let sigs = generate_signatures(&jobs).unwrap();
+        assert_eq!(sigs.len(), jobs.len());
+        for (i, sig) in sigs.iter().enumerate() {
+            let key = [i as u8 + 1; 32];
+            assert_eq!(sig, &generate_signature(&key, &jobs[i].1, jobs[i].2).unwrap());
+        }
+        assert!(generate_signatures(&[]).unwrap().is_empty());
+    }
+
     #[test]
     fn generate_signature_chronicle_uses_raw_signer_output() {
         let key = [2u8; 32];
@@ -0,0 +1,130 @@
+//! Pool of reusable byte buffers for reading messages
+//!
+//! Reading a message payload into a fresh `Vec` allocates once per message, which dominates the
+//! cost of small, frequent messages like inv and tx. Buffers taken from a [`BufferPool`] go back
+//! to it when dropped, keeping their capacity for the next message.
+
+use std::ops::{Deref, DerefMut};
+use std::sync::{Arc, Mutex, OnceLock};
+
+/// Number of buffers kept by the shared pool
+const SHARED_MAX_BUFFERS: usize = 64;
+
+/// Largest buffer the shared pool keeps (4MB); bigger ones are freed when returned
+const SHARED_MAX_CAPACITY: usize = 4 * 1024 * 1024;
+
+/// Reusable byte buffers
+#[derive(Debug)]
+pub struct BufferPool {
+    free: Mutex<Vec<Vec<u8>>>,
+    max_buffers: usize,
+    max_capacity: usize,
+}
+
+impl BufferPool {
+    /// Creates a pool that keeps up to `max_buffers` buffers of at most `max_capacity` bytes
+    pub fn new(max_buffers: usize, max_capacity: usize) -> Arc<BufferPool> {
+        Arc::new(BufferPool {
+            free: Mutex::new(Vec::new()),
+            max_buffers,
+            max_capacity,
+        })
+    }
+
+    /// Returns the process wide pool
+    pub fn shared() -> Arc<BufferPool> {
+        static SHARED: OnceLock<Arc<BufferPool>> = OnceLock::new();
+        SHARED
+            .get_or_init(|| BufferPool::new(SHARED_MAX_BUFFERS, SHARED_MAX_CAPACITY))
+            .clone()
+    }
+
+    /// Takes an empty buffer from the pool, or allocates one if none are free
+    pub fn get(self: &Arc<Self>) -> PooledBuffer {
+        let buf = self.free.lock().unwrap().pop().unwrap_or_default();
+        PooledBuffer {
+            buf,
+            pool: self.clone(),
+        }
+    }
+
+    /// Number of buffers waiting to be reused
+    pub fn available(&self) -> usize {
+        self.free.lock().unwrap().len()
+    }
+
+    fn put(&self, mut buf: Vec<u8>) {
+        if buf.capacity() == 0 || buf.capacity() > self.max_capacity {
+            return;
+        }
+        buf.clear();
+        let mut free = self.free.lock().unwrap();
+        if free.len() < self.max_buffers {
+            free.push(buf);
+        }
+    }
+}
+
+/// Buffer that returns to its pool when dropped
+pub struct PooledBuffer {
+    buf: Vec<u8>,
+    pool: Arc<BufferPool>,
+}
+
+impl Deref for PooledBuffer {
+    type Target = Vec<u8>;
+
+    fn deref(&self) -> &Vec<u8> {
+        &self.buf
+    }
+}
+
+impl DerefMut for PooledBuffer {
+    fn deref_mut(&mut self) -> &mut Vec<u8> {
+        &mut self.buf
+    }
+}
+
+impl Drop for PooledBuffer {
+    fn drop(&mut self) {
+        self.pool.put(std::mem::take(&mut self.buf));
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn reuse() {
+        let pool = BufferPool::new(2, 1024);
+        let mut a = pool.get();
+        a.extend_from_slice(&[1, 2, 3]);
+        let ptr = a.as_ptr();
+        drop(a);
+        assert_eq!(pool.available(), 1);
+
+        let b = pool.get();
+        assert!(b.is_empty());
+        assert!(b.capacity() >= 3);
+        assert_eq!(b.as_ptr(), ptr);
+        assert_eq!(pool.available(), 0);
+    }
+
+    #[test]
+    fn limits() {
+        let pool = BufferPool::new(1, 16);
+        let mut big = pool.get();
+        big.resize(17, 0);
+        drop(big);
+        assert_eq!(pool.available(), 0);
+
+        let mut a = pool.get();
+        let mut b = pool.get();
+        a.push(1);
+        b.push(2);
+        drop(a);
+        drop(b);
+        assert_eq!(pool.available(), 1);
+    }
+}
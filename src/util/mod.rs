@@ -5,6 +5,7 @@ use std::time::SystemTime;
 #[allow(dead_code)]
 mod bits;
 mod bloom_filter;
+mod buffer_pool;
 #[allow(dead_code)]
 mod future;
 #[allow(dead_code)]
@@ -12,10 +13,12 @@ mod hash160;
 mod hash256;
 #[allow(dead_code)]
 mod latch;
+pub mod parallel;
 pub mod rx;
 mod serdes;
 pub mod sha1;
 pub mod sha256;
+mod siphash;
 pub(crate) mod var_int;
 
 pub mod errors;
@@ -25,11 +28,13 @@ pub(crate) use self::bits::{lshift, rshift, Bits};
 pub use self::bloom_filter::{
     BloomFilter, BLOOM_FILTER_MAX_FILTER_SIZE, BLOOM_FILTER_MAX_HASH_FUNCS,
 };
+pub use self::buffer_pool::{BufferPool, PooledBuffer};
 pub use self::errors::ChainGangError;
 pub use self::hash160::{hash160, Hash160};
 pub use self::hash256::{sha256d, Hash256};
 #[allow(unused_imports)]
 pub use self::serdes::Serializable;
+pub use self::siphash::siphash24;
 
 /// Gets the time in seconds since a time in the past
 pub fn secs_since(time: SystemTime) -> u32 {
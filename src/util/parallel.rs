@@ -0,0 +1,138 @@
+//! Scoped data parallelism over index ranges using the standard library thread pool size.
+
+use crate::util::ChainGangError;
+use std::ops::Range;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Mutex;
+use std::thread;
+
+/// Number of worker threads to use for CPU-bound batch work.
+pub fn worker_count() -> usize {
+    thread::available_parallelism()
+        .map(|n| n.get())
+        .unwrap_or(1)
+}
+
+/// Splits `0..len` into contiguous chunks of at least `min_chunk` items, runs `f` on each chunk
+/// on its own scoped thread, and concatenates the results in order.
+///
+/// Small inputs run on the calling thread. The first error returned by any chunk is returned.
+pub fn parallel_chunks<T, F>(len: usize, min_chunk: usize, f: F) -> Result<Vec<T>, ChainGangError>
+where
+    T: Send,
+    F: Fn(Range<usize>) -> Result<Vec<T>, ChainGangError> + Sync,
+{
+    let workers = worker_count().min(len / min_chunk.max(1)).max(1);
+    if workers == 1 {
+        return f(0..len);
+    }
+
+    let chunk = len.div_ceil(workers);
+    let results: Vec<Result<Vec<T>, ChainGangError>> = thread::scope(|s| {
+        let handles: Vec<_> = (0..len)
+            .step_by(chunk)
+            .map(|begin| {
+                let f = &f;
+                s.spawn(move || f(begin..(begin + chunk).min(len)))
+            })
+            .collect();
+        handles
+            .into_iter()
+            .map(|h| h.join().expect("parallel worker panicked"))
+            .collect()
+    });
+
+    let mut out = Vec::with_capacity(len);
+    for result in results {
+        out.extend(result?);
+    }
+    Ok(out)
+}
+
+/// Runs `f` on every item using up to `max_threads` scoped threads and returns the results in
+/// input order.
+///
+/// Unlike [`parallel_chunks`], items are handed out one at a time, which suits jobs of uneven
+/// length such as network-bound scans. The first error (in input order) is returned.
+pub fn parallel_map<I, T, F>(
+    items: &[I],
+    max_threads: usize,
+    f: F,
+) -> Result<Vec<T>, ChainGangError>
+where
+    I: Sync,
+    T: Send,
+    F: Fn(&I) -> Result<T, ChainGangError> + Sync,
+{
+    let workers = max_threads.min(items.len()).max(1);
+    if workers == 1 {
+        return items.iter().map(f).collect();
+    }
+
+    let next = AtomicUsize::new(0);
+    let slots: Vec<Mutex<Option<Result<T, ChainGangError>>>> =
+        items.iter().map(|_| Mutex::new(None)).collect();
+    thread::scope(|s| {
+        for _ in 0..workers {
+            s.spawn(|| loop {
+                let i = next.fetch_add(1, Ordering::Relaxed);
+                if i >= items.len() {
+                    break;
+                }
+                *slots[i].lock().unwrap() = Some(f(&items[i]));
+            });
+        }
+    });
+
+    slots
+        .into_iter()
+        .map(|slot| slot.into_inner().unwrap().expect("parallel job not run"))
+        .collect()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn preserves_order() {
+        let out = parallel_chunks(10_000, 16, |r| Ok(r.collect::<Vec<usize>>())).unwrap();
+        assert_eq!(out, (0..10_000).collect::<Vec<usize>>());
+    }
+
+    #[test]
+    fn empty_and_small() {
+        assert!(parallel_chunks(0, 16, |r| Ok(r.collect::<Vec<usize>>()))
+            .unwrap()
+            .is_empty());
+        assert_eq!(
+            parallel_chunks(3, 16, |r| Ok(r.collect::<Vec<usize>>())).unwrap(),
+            vec![0, 1, 2]
+        );
+    }
+
+    #[test]
+    fn map_preserves_order() {
+        let items: Vec<u32> = (0..100).collect();
+        let out = parallel_map(&items, 8, |i| Ok(i * 2)).unwrap();
+        assert_eq!(out, items.iter().map(|i| i * 2).collect::<Vec<u32>>());
+        assert!(parallel_map(&items, 8, |i| if *i == 50 {
+            Err(ChainGangError::Timeout)
+        } else {
+            Ok(*i)
+        })
+        .is_err());
+    }
+
+    #[test]
+    fn propagates_errors() {
+        let result = parallel_chunks(1000, 1, |r| {
+            if r.contains(&500) {
+                Err(ChainGangError::BadData("boom".to_string()))
+            } else {
+                Ok(r.collect::<Vec<usize>>())
+            }
+        });
+        assert!(result.is_err());
+    }
+}
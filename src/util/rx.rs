@@ -1,9 +1,16 @@
 //! Lightweight reactive library
+//!
+//! Observers are normally called on the thread that emits the event. A subscriber that may be
+//! slow can instead be given its own bounded channel and consumer thread with
+//! [`Observable::subscribe_channel`], so it cannot hold up the emitter.
 
 use crate::util::future::{Future, FutureProvider};
 use crate::util::ChainGangError;
-use std::sync::{Arc, RwLock, TryLockError, Weak};
-use std::time::Duration;
+use std::collections::VecDeque;
+use std::panic::{self, AssertUnwindSafe};
+use std::sync::{Arc, Condvar, Mutex, RwLock, TryLockError, Weak};
+use std::thread;
+use std::time::{Duration, Instant};
 
 /// Observes an event of type T
 pub trait Observer<T>: Sync + Send {
@@ -32,12 +39,220 @@ pub trait Observable<T: Send + Sync + Clone + 'static> {
             Err(_future) => Err(ChainGangError::Timeout),
         }
     }
+
+    /// Adds an observer that is called on its own thread, fed through a bounded channel
+    ///
+    /// The subscription lasts until the returned handle is dropped, or until the observer panics.
+    fn subscribe_channel<S: Observer<T> + 'static>(
+        &self,
+        observer: Arc<S>,
+        config: ChannelConfig,
+    ) -> Subscription<T> {
+        let channel = Channel::spawn(observer, config);
+        let forwarder = Arc::new(Forwarder {
+            channel: channel.clone(),
+        });
+        self.subscribe(&forwarder);
+        Subscription {
+            channel,
+            _forwarder: Some(forwarder),
+        }
+    }
+}
+
+/// What a channel subscriber's queue does when an event arrives and it is full
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum OverflowPolicy {
+    /// Discard the oldest queued event to make room
+    DropOldest,
+    /// Make the emitter wait for room
+    Block,
+    /// Unsubscribe the subscriber and discard its queue
+    Disconnect,
+}
+
+/// Capacity and overflow policy of a channel subscriber
+#[derive(Debug, Clone)]
+pub struct ChannelConfig {
+    pub capacity: usize,
+    pub policy: OverflowPolicy,
+}
+
+impl Default for ChannelConfig {
+    fn default() -> Self {
+        ChannelConfig {
+            capacity: 1024,
+            policy: OverflowPolicy::DropOldest,
+        }
+    }
+}
+
+/// Snapshot of how far a channel subscriber is behind
+#[derive(Debug, Clone, Default, PartialEq, Eq)]
+pub struct SubscriberStats {
+    /// Events waiting to be observed
+    pub queued: usize,
+    /// Largest number of events waiting at once
+    pub max_queued: usize,
+    pub delivered: u64,
+    /// Events discarded by the overflow policy
+    pub dropped: u64,
+    /// How long the oldest waiting event has waited
+    pub lag: Duration,
+    /// The subscriber was unsubscribed by `OverflowPolicy::Disconnect`
+    pub disconnected: bool,
+}
+
+struct ChannelState<T> {
+    events: VecDeque<(Arc<T>, Instant)>,
+    closed: bool,
+    stats: SubscriberStats,
+}
+
+/// Bounded queue between emitters and one subscriber's consumer thread
+struct Channel<T> {
+    config: ChannelConfig,
+    state: Mutex<ChannelState<T>>,
+    not_empty: Condvar,
+    not_full: Condvar,
+}
+
+impl<T: Send + Sync + 'static> Channel<T> {
+    /// Creates a channel and starts the thread that feeds its events to `observer`
+    fn spawn<S: Observer<T> + 'static>(observer: Arc<S>, config: ChannelConfig) -> Arc<Channel<T>> {
+        let channel = Arc::new(Channel {
+            config,
+            state: Mutex::new(ChannelState {
+                events: VecDeque::new(),
+                closed: false,
+                stats: SubscriberStats::default(),
+            }),
+            not_empty: Condvar::new(),
+            not_full: Condvar::new(),
+        });
+        let consumer = channel.clone();
+        thread::spawn(move || {
+            // Close the channel however the consumer stops so blocked emitters are released
+            let result = panic::catch_unwind(AssertUnwindSafe(|| {
+                while let Some(event) = consumer.recv() {
+                    observer.next(&event);
+                }
+            }));
+            consumer.close();
+            if result.is_err() {
+                error!("Channel subscriber panicked and was unsubscribed");
+            }
+        });
+        channel
+    }
+
+    /// Queues an event, returning false if the subscriber is gone
+    fn send(&self, event: Arc<T>) -> bool {
+        let mut state = self.state.lock().unwrap();
+        while !state.closed && state.events.len() >= self.config.capacity.max(1) {
+            match self.config.policy {
+                OverflowPolicy::DropOldest => {
+                    state.events.pop_front();
+                    state.stats.dropped += 1;
+                }
+                OverflowPolicy::Block => state = self.not_full.wait(state).unwrap(),
+                OverflowPolicy::Disconnect => {
+                    state.stats.dropped += state.events.len() as u64 + 1;
+                    state.stats.disconnected = true;
+                    state.closed = true;
+                    state.events.clear();
+                    drop(state);
+                    self.not_empty.notify_all();
+                    return false;
+                }
+            }
+        }
+        if state.closed {
+            return false;
+        }
+        state.events.push_back((event, Instant::now()));
+        state.stats.max_queued = state.stats.max_queued.max(state.events.len());
+        drop(state);
+        self.not_empty.notify_one();
+        true
+    }
+
+    /// Waits for the next event, returning None once closed
+    fn recv(&self) -> Option<Arc<T>> {
+        let mut state = self.state.lock().unwrap();
+        loop {
+            if state.closed {
+                return None;
+            }
+            if let Some((event, _)) = state.events.pop_front() {
+                state.stats.delivered += 1;
+                drop(state);
+                self.not_full.notify_one();
+                return Some(event);
+            }
+            state = self.not_empty.wait(state).unwrap();
+        }
+    }
+
+    fn close(&self) {
+        let mut state = self.state.lock().unwrap();
+        state.closed = true;
+        state.events.clear();
+        drop(state);
+        self.not_empty.notify_all();
+        self.not_full.notify_all();
+    }
+
+    fn stats(&self) -> SubscriberStats {
+        let state = self.state.lock().unwrap();
+        let mut stats = state.stats.clone();
+        stats.queued = state.events.len();
+        stats.lag = state
+            .events
+            .front()
+            .map(|(_, queued_at)| queued_at.elapsed())
+            .unwrap_or_default();
+        stats
+    }
+}
+
+/// Observer that copies events into a channel, for observables without shared fan-out
+struct Forwarder<T> {
+    channel: Arc<Channel<T>>,
+}
+
+impl<T: Clone + Send + Sync + 'static> Observer<T> for Forwarder<T> {
+    fn next(&self, event: &T) {
+        self.channel.send(Arc::new(event.clone()));
+    }
+}
+
+/// Handle to a channel subscriber, which is unsubscribed when this is dropped
+pub struct Subscription<T: Send + Sync + 'static> {
+    channel: Arc<Channel<T>>,
+    _forwarder: Option<Arc<Forwarder<T>>>,
+}
+
+impl<T: Send + Sync + 'static> Subscription<T> {
+    /// Returns the subscriber's queue depth, lag and counters
+    pub fn stats(&self) -> SubscriberStats {
+        self.channel.stats()
+    }
+}
+
+impl<T: Send + Sync + 'static> Drop for Subscription<T> {
+    fn drop(&mut self) {
+        self.channel.close();
+    }
 }
 
 /// Stores the observers for a particular event
+///
+/// Channel subscribers share one copy of each event.
 pub struct Subject<T> {
     observers: RwLock<Vec<Weak<dyn Observer<T>>>>,
     pending: RwLock<Vec<Weak<dyn Observer<T>>>>,
+    channels: Mutex<Vec<Weak<Channel<T>>>>,
 }
 
 impl<T> Subject<T> {
@@ -46,6 +261,7 @@ impl<T> Subject<T> {
         Subject {
             observers: RwLock::new(Vec::new()),
             pending: RwLock::new(Vec::new()),
+            channels: Mutex::new(Vec::new()),
         }
     }
 }
@@ -56,8 +272,28 @@ impl<T> Default for Subject<T> {
     }
 }
 
-impl<T> Observer<T> for Subject<T> {
+impl<T: Clone + Send + Sync + 'static> Observer<T> for Subject<T> {
     fn next(&self, event: &T) {
+        // Snapshot the channels so a blocking channel does not hold the lock
+        let channels = self.channels.lock().unwrap().clone();
+        if !channels.is_empty() {
+            let shared = Arc::new(event.clone());
+            let mut any_closed = false;
+            for channel in channels.iter() {
+                match channel.upgrade() {
+                    Some(channel) => any_closed |= !channel.send(shared.clone()),
+                    None => any_closed = true,
+                }
+            }
+            if any_closed {
+                self.channels.lock().unwrap().retain(|channel| {
+                    channel
+                        .upgrade()
+                        .is_some_and(|channel| !channel.state.lock().unwrap().closed)
+                });
+            }
+        }
+
         let mut any_to_remove = false;
 
         {
@@ -99,6 +335,19 @@ impl<T: Send + Sync + Clone + 'static> Observable<T> for Subject<T> {
             Err(TryLockError::Poisoned(_)) => panic!("Observer lock poisoned"),
         }
     }
+
+    fn subscribe_channel<S: Observer<T> + 'static>(
+        &self,
+        observer: Arc<S>,
+        config: ChannelConfig,
+    ) -> Subscription<T> {
+        let channel = Channel::spawn(observer, config);
+        self.channels.lock().unwrap().push(Arc::downgrade(&channel));
+        Subscription {
+            channel,
+            _forwarder: None,
+        }
+    }
 }
 
 /// A subject that only emits a single value
@@ -126,7 +375,7 @@ impl<T: Sync + Send + Clone> Default for Single<T> {
     }
 }
 
-impl<T: Sync + Send + Clone> Observer<T> for Single<T> {
+impl<T: Sync + Send + Clone + 'static> Observer<T> for Single<T> {
     fn next(&self, event: &T) {
         let mut value = self.value.write().unwrap();
         if value.is_none() {
@@ -165,7 +414,7 @@ impl<T: Sync + Send + Clone> Observer<T> for Poller<T> {
 #[cfg(test)]
 mod tests {
     use super::*;
-    use std::sync::atomic::{AtomicBool, Ordering};
+    use std::sync::atomic::{AtomicBool, AtomicUsize, Ordering};
 
     #[test]
     fn publish_observe() {
@@ -238,4 +487,161 @@ mod tests {
         assert!(post_emit_observer.observed.load(Ordering::Relaxed));
         single.next(&6);
     }
+
+    /// Records events and can be held up by closing its gate
+    struct Slow {
+        gate: Mutex<()>,
+        seen: Mutex<Vec<u32>>,
+    }
+
+    impl Observer<u32> for Slow {
+        fn next(&self, event: &u32) {
+            let _gate = self.gate.lock().unwrap();
+            self.seen.lock().unwrap().push(*event);
+        }
+    }
+
+    fn slow() -> Arc<Slow> {
+        Arc::new(Slow {
+            gate: Mutex::new(()),
+            seen: Mutex::new(Vec::new()),
+        })
+    }
+
+    fn wait_for(mut done: impl FnMut() -> bool) {
+        let deadline = Instant::now() + Duration::from_secs(5);
+        while !done() {
+            assert!(Instant::now() < deadline);
+            thread::sleep(Duration::from_millis(1));
+        }
+    }
+
+    #[test]
+    fn channel_drop_oldest() {
+        let subject = Subject::<u32>::new();
+        let observer = slow();
+        let config = ChannelConfig {
+            capacity: 2,
+            policy: OverflowPolicy::DropOldest,
+        };
+        let subscription = subject.subscribe_channel(observer.clone(), config);
+        let gate = observer.gate.lock().unwrap();
+        subject.next(&1);
+        // Wait for the consumer to take 1 and block on the gate
+        wait_for(|| subscription.stats().delivered == 1);
+        for i in 2..6 {
+            subject.next(&i);
+        }
+        let stats = subscription.stats();
+        assert_eq!(stats.queued, 2);
+        assert_eq!(stats.dropped, 2);
+        drop(gate);
+        wait_for(|| observer.seen.lock().unwrap().len() == 3);
+        assert_eq!(*observer.seen.lock().unwrap(), vec![1, 4, 5]);
+        assert_eq!(subscription.stats().lag, Duration::ZERO);
+    }
+
+    #[test]
+    fn channel_disconnect() {
+        let subject = Subject::<u32>::new();
+        let observer = slow();
+        let config = ChannelConfig {
+            capacity: 1,
+            policy: OverflowPolicy::Disconnect,
+        };
+        let subscription = subject.subscribe_channel(observer.clone(), config);
+        let gate = observer.gate.lock().unwrap();
+        subject.next(&1);
+        wait_for(|| subscription.stats().delivered == 1);
+        subject.next(&2);
+        subject.next(&3);
+        assert!(subscription.stats().disconnected);
+        assert!(subject.channels.lock().unwrap().is_empty());
+        drop(gate);
+        subject.next(&4);
+        thread::sleep(Duration::from_millis(10));
+        assert_eq!(*observer.seen.lock().unwrap(), vec![1]);
+    }
+
+    #[test]
+    fn channel_block() {
+        let subject = Arc::new(Subject::<u32>::new());
+        let observer = slow();
+        let config = ChannelConfig {
+            capacity: 1,
+            policy: OverflowPolicy::Block,
+        };
+        let subscription = subject.subscribe_channel(observer.clone(), config);
+        let gate = observer.gate.lock().unwrap();
+        subject.next(&1);
+        wait_for(|| subscription.stats().delivered == 1);
+        subject.next(&2);
+        let emitter = {
+            let subject = subject.clone();
+            thread::spawn(move || subject.next(&3))
+        };
+        thread::sleep(Duration::from_millis(20));
+        assert!(!emitter.is_finished());
+        drop(gate);
+        emitter.join().unwrap();
+        wait_for(|| observer.seen.lock().unwrap().len() == 3);
+        assert_eq!(subscription.stats().dropped, 0);
+    }
+
+    #[test]
+    fn channel_closes_when_observer_panics() {
+        struct Panics;
+        impl Observer<u32> for Panics {
+            fn next(&self, _event: &u32) {
+                panic!("observer failed");
+            }
+        }
+
+        let subject = Subject::<u32>::new();
+        let config = ChannelConfig {
+            capacity: 1,
+            policy: OverflowPolicy::Block,
+        };
+        let subscription = subject.subscribe_channel(Arc::new(Panics), config);
+        subject.next(&1);
+        wait_for(|| subscription.channel.state.lock().unwrap().closed);
+        // Would wait forever on the full queue if the channel were still open
+        for i in 2..5 {
+            subject.next(&i);
+        }
+        assert!(subject.channels.lock().unwrap().is_empty());
+    }
+
+    #[test]
+    fn channel_shares_events() {
+        static CLONES: AtomicUsize = AtomicUsize::new(0);
+
+        struct Big;
+        impl Clone for Big {
+            fn clone(&self) -> Self {
+                CLONES.fetch_add(1, Ordering::Relaxed);
+                Big
+            }
+        }
+
+        struct Count(AtomicUsize);
+        impl Observer<Big> for Count {
+            fn next(&self, _event: &Big) {
+                self.0.fetch_add(1, Ordering::Relaxed);
+            }
+        }
+
+        let subject = Subject::<Big>::new();
+        let observer = Arc::new(Count(AtomicUsize::new(0)));
+        let subscriptions: Vec<Subscription<Big>> = (0..3)
+            .map(|_| subject.subscribe_channel(observer.clone(), ChannelConfig::default()))
+            .collect();
+        subject.next(&Big);
+        wait_for(|| observer.0.load(Ordering::Relaxed) == 3);
+        assert_eq!(CLONES.load(Ordering::Relaxed), 1);
+
+        drop(subscriptions);
+        subject.next(&Big);
+        assert!(subject.channels.lock().unwrap().is_empty());
+    }
 }
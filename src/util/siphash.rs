@@ -0,0 +1,71 @@
+//! SipHash-2-4, used for BIP-152 short transaction IDs
+
+/// Hashes `data` with SipHash-2-4 keyed by `k0` and `k1`
+pub fn siphash24(k0: u64, k1: u64, data: &[u8]) -> u64 {
+    let mut v = [
+        k0 ^ 0x736f6d6570736575,
+        k1 ^ 0x646f72616e646f6d,
+        k0 ^ 0x6c7967656e657261,
+        k1 ^ 0x7465646279746573,
+    ];
+
+    let mut chunks = data.chunks_exact(8);
+    for chunk in chunks.by_ref() {
+        let m = u64::from_le_bytes(chunk.try_into().unwrap());
+        v[3] ^= m;
+        round(&mut v);
+        round(&mut v);
+        v[0] ^= m;
+    }
+
+    // Last block holds the remaining bytes and the length in its top byte
+    let mut last = [0u8; 8];
+    let rest = chunks.remainder();
+    last[..rest.len()].copy_from_slice(rest);
+    let m = u64::from_le_bytes(last) | ((data.len() as u64) << 56);
+    v[3] ^= m;
+    round(&mut v);
+    round(&mut v);
+    v[0] ^= m;
+
+    v[2] ^= 0xff;
+    for _ in 0..4 {
+        round(&mut v);
+    }
+    v[0] ^ v[1] ^ v[2] ^ v[3]
+}
+
+fn round(v: &mut [u64; 4]) {
+    v[0] = v[0].wrapping_add(v[1]);
+    v[1] = v[1].rotate_left(13);
+    v[1] ^= v[0];
+    v[0] = v[0].rotate_left(32);
+    v[2] = v[2].wrapping_add(v[3]);
+    v[3] = v[3].rotate_left(16);
+    v[3] ^= v[2];
+    v[0] = v[0].wrapping_add(v[3]);
+    v[3] = v[3].rotate_left(21);
+    v[3] ^= v[0];
+    v[2] = v[2].wrapping_add(v[1]);
+    v[1] = v[1].rotate_left(17);
+    v[1] ^= v[2];
+    v[2] = v[2].rotate_left(32);
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn reference_vectors() {
+        // Vectors from the SipHash paper's reference implementation, key 00..0f, input 00..n
+        let k0 = u64::from_le_bytes([0, 1, 2, 3, 4, 5, 6, 7]);
+        let k1 = u64::from_le_bytes([8, 9, 10, 11, 12, 13, 14, 15]);
+        let data: Vec<u8> = (0..64).collect();
+        assert_eq!(siphash24(k0, k1, &data[..0]), 0x726fdb47dd0e0e31);
+        assert_eq!(siphash24(k0, k1, &data[..1]), 0x74f839c593dc67fd);
+        assert_eq!(siphash24(k0, k1, &data[..8]), 0x93f5f5799a932462);
+        assert_eq!(siphash24(k0, k1, &data[..15]), 0xa129ca6149be45e5);
+        assert_eq!(siphash24(k0, k1, &data[..63]), 0x958a324ceb064572);
+    }
+}
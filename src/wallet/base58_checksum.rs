@@ -1,44 +1,182 @@
 use crate::util::{sha256d, ChainGangError};
 
-use base58::{FromBase58, ToBase58};
+const ALPHABET: &[u8; 58] = b"123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz";
+
+const INVALID_DIGIT: u8 = 0xff;
+
+/// Base58 digit value of each ASCII character, or `INVALID_DIGIT`.
+const DIGITS: [u8; 128] = {
+    let mut map = [INVALID_DIGIT; 128];
+    let mut i = 0;
+    while i < ALPHABET.len() {
+        map[ALPHABET[i] as usize] = i as u8;
+        i += 1;
+    }
+    map
+};
+
+/// 58^5, the largest power of 58 that fits in a u32 limb.
+const BASE58_POW5: u64 = 656_356_768;
 
 // Return first 4 digits of double sha256
 pub fn short_double_sha256_checksum(data: &[u8]) -> Vec<u8> {
     sha256d(data).0[..4].to_vec()
 }
 
+/// Splits `data` into chunks of `size` items, with any short remainder first.
+fn chunks_short_first<T>(data: &[T], size: usize) -> impl Iterator<Item = &[T]> {
+    let (head, rest) = data.split_at(data.len() % size);
+    std::iter::once(head)
+        .filter(|head| !head.is_empty())
+        .chain(rest.chunks(size))
+}
+
+/// Encodes bytes as base58 (no checksum)
+///
+/// Works on base 58^5 limbs, four input bytes at a time, rather than one digit and one byte at
+/// a time, which keeps the quadratic inner loop about twenty times shorter.
+pub fn encode_base58(input: &[u8]) -> String {
+    let zeros = input.iter().take_while(|b| **b == 0).count();
+    let data = &input[zeros..];
+
+    // Little-endian limbs in base 58^5
+    let mut limbs: Vec<u32> = Vec::with_capacity(data.len() * 138 / 500 + 1);
+    for chunk in chunks_short_first(data, 4) {
+        let shift = 8 * chunk.len();
+        let mut carry = chunk.iter().fold(0u64, |acc, b| (acc << 8) | *b as u64);
+        for limb in limbs.iter_mut() {
+            carry += (*limb as u64) << shift;
+            *limb = (carry % BASE58_POW5) as u32;
+            carry /= BASE58_POW5;
+        }
+        while carry > 0 {
+            limbs.push((carry % BASE58_POW5) as u32);
+            carry /= BASE58_POW5;
+        }
+    }
+
+    let mut digits = Vec::with_capacity(limbs.len() * 5);
+    for limb in limbs.iter().rev() {
+        let mut value = *limb;
+        let mut chunk = [0u8; 5];
+        for digit in chunk.iter_mut().rev() {
+            *digit = (value % 58) as u8;
+            value /= 58;
+        }
+        digits.extend_from_slice(&chunk);
+    }
+    let leading = digits.iter().take_while(|d| **d == 0).count();
+
+    let mut out = Vec::with_capacity(zeros + digits.len() - leading);
+    out.resize(zeros, b'1');
+    out.extend(digits[leading..].iter().map(|d| ALPHABET[*d as usize]));
+    // Only ASCII alphabet characters were written
+    String::from_utf8(out).expect("base58 output is ASCII")
+}
+
+/// Decodes a base58 string (no checksum)
+pub fn decode_base58(input: &str) -> Result<Vec<u8>, ChainGangError> {
+    let chars = input.as_bytes();
+    let ones = chars.iter().take_while(|c| **c == b'1').count();
+    let data = &chars[ones..];
+
+    // Little-endian limbs in base 2^32
+    let mut limbs: Vec<u32> = Vec::with_capacity(data.len() * 733 / 4000 + 1);
+    let mut position = ones;
+    for chunk in chunks_short_first(data, 5) {
+        let mut value = 0u64;
+        let mut multiplier = 1u64;
+        for c in chunk {
+            let digit = match DIGITS.get(*c as usize) {
+                Some(digit) if *digit != INVALID_DIGIT => *digit,
+                _ => {
+                    let msg = format!("Invalid base58 character at position {}", position);
+                    return Err(ChainGangError::Base58Error(msg));
+                }
+            };
+            value = value * 58 + digit as u64;
+            multiplier *= 58;
+            position += 1;
+        }
+
+        let mut carry = value;
+        for limb in limbs.iter_mut() {
+            carry += *limb as u64 * multiplier;
+            *limb = carry as u32;
+            carry >>= 32;
+        }
+        while carry > 0 {
+            limbs.push(carry as u32);
+            carry >>= 32;
+        }
+    }
+
+    let mut out = Vec::with_capacity(ones + limbs.len() * 4);
+    out.resize(ones, 0);
+    let mut started = false;
+    for limb in limbs.iter().rev() {
+        for b in limb.to_be_bytes() {
+            if started || b != 0 {
+                started = true;
+                out.push(b);
+            }
+        }
+    }
+    Ok(out)
+}
+
 /// Given the string return the checked base58 value
 pub fn decode_base58_checksum(input: &str) -> Result<Vec<u8>, ChainGangError> {
-    let decoded: Vec<u8> = input
-        .from_base58()
-        .map_err(|e| ChainGangError::Base58Error(format!("{e:?}")))?;
-    // Return all but the last 4
-    let shortened: Vec<u8> = decoded.as_slice()[..decoded.len() - 4].to_vec();
-    // Return last 4
-    let decoded_checksum: Vec<u8> = decoded.as_slice()[decoded.len() - 4..].to_vec();
-    let hash_checksum: Vec<u8> = short_double_sha256_checksum(&shortened);
-    if hash_checksum != decoded_checksum {
+    let decoded = decode_base58(input)?;
+    if decoded.len() < 4 {
+        let msg = format!("Base58 data '{input}' is too short to hold a checksum");
+        return Err(ChainGangError::BadData(msg));
+    }
+    let (shortened, decoded_checksum) = decoded.split_at(decoded.len() - 4);
+    let hash_checksum = sha256d(shortened);
+    if &hash_checksum.0[..4] != decoded_checksum {
         let err_msg = format!(
-            "Decoded checksum {decoded_checksum:x?} derived from '{input}' is not equal to hash checksum {hash_checksum:x?}."
+            "Decoded checksum {decoded_checksum:x?} derived from '{input}' is not equal to hash checksum {:x?}.",
+            &hash_checksum.0[..4]
         );
         Err(ChainGangError::BadData(err_msg))
     } else {
-        Ok(shortened)
+        Ok(shortened.to_vec())
     }
 }
 
+/// Decodes base58check data whose payload must be exactly `N` bytes
+///
+/// Strings too long to hold `N + 4` bytes are rejected before decoding.
+pub fn decode_base58_checksum_fixed<const N: usize>(
+    input: &str,
+) -> Result<[u8; N], ChainGangError> {
+    // Each byte needs at most log(256) / log(58) < 1.37 characters
+    if input.len() > (N + 4) * 137 / 100 + 1 {
+        let msg = format!("Base58 data is too long for a {N} byte payload");
+        return Err(ChainGangError::BadData(msg));
+    }
+    let decoded = decode_base58_checksum(input)?;
+    decoded.try_into().map_err(|v: Vec<u8>| {
+        let msg = format!("Expected a {N} byte payload, decoded {} bytes", v.len());
+        ChainGangError::BadData(msg)
+    })
+}
+
 /// Return base58 with checksum
 /// Used to turn public key into an address
 pub fn encode_base58_checksum(input: &[u8]) -> String {
-    let hash = short_double_sha256_checksum(input);
-    let mut data: Vec<u8> = input.to_vec();
-    data.extend(hash);
-    data.to_base58()
+    let hash = sha256d(input);
+    let mut data: Vec<u8> = Vec::with_capacity(input.len() + 4);
+    data.extend_from_slice(input);
+    data.extend_from_slice(&hash.0[..4]);
+    encode_base58(&data)
 }
 
 #[cfg(test)]
 mod tests {
     use super::*;
+    use base58::{FromBase58, ToBase58};
     use hex;
 
     #[test]
@@ -47,4 +185,42 @@ mod tests {
         let e = hex::encode(short_double_sha256_checksum(&x));
         assert!(e == "137ad663");
     }
+
+    #[test]
+    fn base58_matches_reference_codec() {
+        let mut data = Vec::new();
+        for len in 0..100usize {
+            let encoded = encode_base58(&data);
+            assert_eq!(encoded, data.to_base58());
+            assert_eq!(decode_base58(&encoded).unwrap(), data);
+            assert_eq!(encoded.from_base58().unwrap(), data);
+            // Mix leading zeros, small and large bytes
+            data.push(match len % 7 {
+                0 => 0,
+                1 => 0xff,
+                _ => (len * 37 % 256) as u8,
+            });
+        }
+        assert_eq!(encode_base58(&[0, 0, 1]), "112");
+        assert_eq!(decode_base58("").unwrap(), Vec::<u8>::new());
+    }
+
+    #[test]
+    fn base58_rejects_invalid_characters() {
+        assert!(decode_base58("1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN0").is_err());
+        assert!(decode_base58("1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVNl").is_err());
+        assert!(decode_base58("1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVNé").is_err());
+    }
+
+    #[test]
+    fn checksum_fixed_length() {
+        let address = "1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN2";
+        let payload = decode_base58_checksum_fixed::<21>(address).unwrap();
+        assert_eq!(payload[0], 0);
+        assert_eq!(encode_base58_checksum(&payload), address);
+        assert!(decode_base58_checksum_fixed::<20>(address).is_err());
+        assert!(decode_base58_checksum_fixed::<21>(&address.repeat(2)).is_err());
+        assert!(decode_base58_checksum("1").is_err());
+        assert!(decode_base58_checksum("1BvBMSEYstWetqTFn5Au4m4GFg7xJaNVN3").is_err());
+    }
 }
@@ -0,0 +1,285 @@
+//! Bounded memoisation of intermediate BIP-32 derivation nodes.
+
+use crate::util::ChainGangError;
+use crate::wallet::extended_key::{ExtendedKey, ExtendedKeyType};
+use linked_hash_map::LinkedHashMap;
+use std::fmt;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::Mutex;
+use zeroize::Zeroize;
+
+/// Default number of intermediate nodes kept by an HD wallet derivation cache.
+pub const DEFAULT_DERIVATION_CACHE_SIZE: usize = 256;
+
+/// Cached nodes keyed by `[key type tag, child indices..]`, with a reused buffer to probe them
+struct Nodes {
+    map: LinkedHashMap<Box<[u32]>, ExtendedKey>,
+    probe: Vec<u32>,
+}
+
+/// First element of a cache key, distinguishing public and private derivations of a path
+fn key_type_tag(key_type: ExtendedKeyType) -> u32 {
+    match key_type {
+        ExtendedKeyType::Public => 0,
+        ExtendedKeyType::Private => 1,
+    }
+}
+
+/// Least-recently-used cache of intermediate [`ExtendedKey`] nodes keyed by key type and child
+/// index path.
+///
+/// Each key is the path prefixed with a key type tag, so lookups can probe with a borrowed
+/// slice of a reused buffer instead of allocating a key per probe.
+///
+/// Only the parents of a requested key are stored, so deriving millions of leaf addresses under
+/// a few account nodes keeps the cache small while every lookup skips the hardened
+/// purpose/coin/account steps. When `zeroize` is set, evicted and dropped nodes are overwritten
+/// with zeros.
+pub struct DerivationCache {
+    capacity: usize,
+    zeroize: bool,
+    nodes: Mutex<Nodes>,
+    hits: AtomicU64,
+    misses: AtomicU64,
+}
+
+impl DerivationCache {
+    /// Creates a cache holding at most `capacity` intermediate nodes.
+    pub fn new(capacity: usize) -> DerivationCache {
+        DerivationCache::with_zeroize(capacity, false)
+    }
+
+    /// Creates a cache that optionally zeroes key material when nodes are evicted or dropped.
+    pub fn with_zeroize(capacity: usize, zeroize: bool) -> DerivationCache {
+        DerivationCache {
+            capacity,
+            zeroize,
+            nodes: Mutex::new(Nodes {
+                map: LinkedHashMap::new(),
+                probe: Vec::new(),
+            }),
+            hits: AtomicU64::new(0),
+            misses: AtomicU64::new(0),
+        }
+    }
+
+    /// Maximum number of nodes held.
+    pub fn capacity(&self) -> usize {
+        self.capacity
+    }
+
+    /// Whether evicted nodes are zeroed.
+    pub fn zeroize(&self) -> bool {
+        self.zeroize
+    }
+
+    /// Number of nodes currently held.
+    pub fn len(&self) -> usize {
+        self.nodes.lock().unwrap().map.len()
+    }
+
+    /// Returns true if no nodes are held.
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    /// Number of derivations that started from a cached parent node.
+    pub fn hits(&self) -> u64 {
+        self.hits.load(Ordering::Relaxed)
+    }
+
+    /// Number of derivations that had to start from the root key.
+    pub fn misses(&self) -> u64 {
+        self.misses.load(Ordering::Relaxed)
+    }
+
+    /// Removes all cached nodes.
+    pub fn clear(&self) {
+        let mut nodes = self.nodes.lock().unwrap();
+        if self.zeroize {
+            for (_, key) in nodes.map.iter_mut() {
+                key.0.zeroize();
+            }
+        }
+        nodes.map.clear();
+    }
+
+    /// Derives `indices` from `root`, starting at the deepest cached ancestor.
+    ///
+    /// The cache is only valid for a single root key; callers own one cache per root.
+    pub fn derive(
+        &self,
+        root: &ExtendedKey,
+        key_type: ExtendedKeyType,
+        indices: &[u32],
+    ) -> Result<ExtendedKey, ChainGangError> {
+        if key_type == ExtendedKeyType::Private && root.key_type()? == ExtendedKeyType::Public {
+            let msg = "Cannot derive private key from public master";
+            return Err(ChainGangError::BadArgument(msg.to_string()));
+        }
+        if indices.is_empty() {
+            return Ok(*root);
+        }
+
+        let (mut depth, mut key) = self.deepest_ancestor(root, key_type, indices);
+
+        while depth < indices.len() {
+            key = key.derive_child(key_type, indices[depth])?;
+            depth += 1;
+            if depth < indices.len() {
+                self.insert(key_type, &indices[..depth], key);
+            }
+        }
+        Ok(key)
+    }
+
+    /// Finds the longest cached proper prefix of `indices` derived as `key_type`.
+    fn deepest_ancestor(
+        &self,
+        root: &ExtendedKey,
+        key_type: ExtendedKeyType,
+        indices: &[u32],
+    ) -> (usize, ExtendedKey) {
+        if self.capacity > 0 {
+            let mut guard = self.nodes.lock().unwrap();
+            let Nodes { map, probe } = &mut *guard;
+            probe.clear();
+            probe.push(key_type_tag(key_type));
+            probe.extend_from_slice(&indices[..indices.len() - 1]);
+            for depth in (1..indices.len()).rev() {
+                probe.truncate(depth + 1);
+                if let Some(key) = map.get_refresh(probe.as_slice()) {
+                    self.hits.fetch_add(1, Ordering::Relaxed);
+                    return (depth, *key);
+                }
+            }
+        }
+        self.misses.fetch_add(1, Ordering::Relaxed);
+        (0, *root)
+    }
+
+    fn insert(&self, key_type: ExtendedKeyType, path: &[u32], key: ExtendedKey) {
+        if self.capacity == 0 {
+            return;
+        }
+        let mut key_path = Vec::with_capacity(path.len() + 1);
+        key_path.push(key_type_tag(key_type));
+        key_path.extend_from_slice(path);
+        let mut nodes = self.nodes.lock().unwrap();
+        nodes.map.insert(key_path.into_boxed_slice(), key);
+        while nodes.map.len() > self.capacity {
+            match nodes.map.pop_front() {
+                Some((_, mut evicted)) if self.zeroize => evicted.0.zeroize(),
+                Some(_) => {}
+                None => break,
+            }
+        }
+    }
+}
+
+impl Default for DerivationCache {
+    fn default() -> Self {
+        DerivationCache::new(DEFAULT_DERIVATION_CACHE_SIZE)
+    }
+}
+
+impl fmt::Debug for DerivationCache {
+    fn fmt(&self, f: &mut fmt::Formatter) -> fmt::Result {
+        f.debug_struct("DerivationCache")
+            .field("capacity", &self.capacity)
+            .field("len", &self.len())
+            .field("zeroize", &self.zeroize)
+            .finish()
+    }
+}
+
+impl Drop for DerivationCache {
+    fn drop(&mut self) {
+        if self.zeroize {
+            self.clear();
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::network::Network;
+    use crate::wallet::extended_key::{
+        derive_extended_key, master_extended_key_from_seed, HARDENED_KEY,
+    };
+    use hex;
+
+    fn master() -> ExtendedKey {
+        master_extended_key_from_seed(
+            Network::BSV_Mainnet,
+            &hex::decode("000102030405060708090a0b0c0d0e0f").unwrap(),
+        )
+        .unwrap()
+    }
+
+    #[test]
+    fn matches_uncached_derivation() {
+        let m = master();
+        let cache = DerivationCache::new(8);
+        for i in 0..4 {
+            let path = [44 + HARDENED_KEY, 236 + HARDENED_KEY, HARDENED_KEY, 0, i];
+            let cached = cache.derive(&m, ExtendedKeyType::Private, &path).unwrap();
+            let expected = derive_extended_key(&m, &format!("m/44'/236'/0'/0/{}", i)).unwrap();
+            assert_eq!(cached, expected);
+        }
+        // Leaves are not cached, only their four ancestors
+        assert_eq!(cache.len(), 4);
+        assert_eq!(cache.misses(), 1);
+        assert_eq!(cache.hits(), 3);
+    }
+
+    #[test]
+    fn bounded_and_clear() {
+        let m = master();
+        let cache = DerivationCache::with_zeroize(2, true);
+        for account in 0..4 {
+            let path = [account + HARDENED_KEY, 0, 0];
+            cache.derive(&m, ExtendedKeyType::Private, &path).unwrap();
+        }
+        assert_eq!(cache.len(), 2);
+        cache.clear();
+        assert!(cache.is_empty());
+    }
+
+    #[test]
+    fn disabled_cache_still_derives() {
+        let m = master();
+        let cache = DerivationCache::new(0);
+        let key = cache
+            .derive(&m, ExtendedKeyType::Private, &[HARDENED_KEY, 1])
+            .unwrap();
+        assert_eq!(key, derive_extended_key(&m, "m/0'/1").unwrap());
+        assert!(cache.is_empty());
+    }
+
+    #[test]
+    fn public_then_private_derivation_of_same_path() {
+        let m = master();
+        let cache = DerivationCache::new(8);
+        let path = [0, 1, 2];
+        let public = cache.derive(&m, ExtendedKeyType::Public, &path).unwrap();
+        assert_eq!(public.key_type().unwrap(), ExtendedKeyType::Public);
+        let private = cache.derive(&m, ExtendedKeyType::Private, &path).unwrap();
+        assert_eq!(private, derive_extended_key(&m, "m/0/1/2").unwrap());
+        assert_eq!(
+            cache.derive(&m, ExtendedKeyType::Public, &path).unwrap(),
+            public
+        );
+    }
+
+    #[test]
+    fn public_root_rejects_private_derivation() {
+        let xpub = master().extended_public_key().unwrap();
+        let cache = DerivationCache::default();
+        assert!(cache.derive(&xpub, ExtendedKeyType::Private, &[0]).is_err());
+        assert!(cache
+            .derive(&xpub, ExtendedKeyType::Public, &[0, 1])
+            .is_ok());
+    }
+}
@@ -1,11 +1,12 @@
 use crate::network::Network;
-use crate::util::{hash160, sha256d, ChainGangError, Serializable};
+use crate::util::{hash160, ChainGangError, Serializable};
+use crate::wallet::base58_checksum::{decode_base58_checksum_fixed, encode_base58_checksum};
 use byteorder::{BigEndian, WriteBytesExt};
 use hmac::{Hmac, KeyInit, Mac};
 use sha2::Sha512;
 
-use base58::{FromBase58, ToBase58};
-use k256::{elliptic_curve::PublicKey, Secp256k1, SecretKey};
+use k256::elliptic_curve::group::{Curve, Group, GroupEncoding};
+use k256::{elliptic_curve::PublicKey, AffinePoint, ProjectivePoint, Secp256k1, SecretKey};
 use std::fmt;
 use std::io;
 use std::io::{Cursor, Read, Write};
@@ -428,27 +429,97 @@ impl ExtendedKey {
         )
     }
 
+    /// Derives the compressed public keys of the non-hardened children `start..start + count`.
+    ///
+    /// Equivalent to calling [`derive_public_key`](Self::derive_public_key) for each index, but
+    /// the parent point is decoded once and all child points are converted to affine form with
+    /// a single batched field inversion.
+    pub fn derive_public_keys(&self, start: u32, count: u32) -> Result<Vec<[u8; 33]>, ChainGangError> {
+        let end = start.checked_add(count).filter(|end| *end <= HARDENED_KEY);
+        if end.is_none() {
+            return Err(ChainGangError::BadArgument(
+                "i cannot be hardened".to_string(),
+            ));
+        }
+        if self.depth() == 255 {
+            let msg = "Cannot derive extended key. Depth already at max.";
+            return Err(ChainGangError::BadData(msg.to_string()));
+        }
+
+        let chain_code = &self.0[13..45];
+        let parent_bytes = self.public_key()?;
+        let parent_pk = PublicKey::<Secp256k1>::from_sec1_bytes(&parent_bytes)
+            .map_err(|_| ChainGangError::BadData("Invalid parent public key".to_string()))?;
+        let parent_point = parent_pk.to_projective();
+
+        let mut points = Vec::with_capacity(count as usize);
+        // Children that are invalid per BIP-32 take the slow path, which skips to the next index
+        let mut skipped = Vec::new();
+        for offset in 0..count {
+            let index = start + offset;
+            let mut key = HmacSha512::new_from_slice(chain_code).expect("hmac512 error");
+            key.update(&parent_bytes);
+            key.update(&index.to_be_bytes());
+            let hmac = key.finalize().into_bytes();
+
+            let child_point = if is_private_key_valid(&hmac[..32]) {
+                let offset_pk = SecretKey::from_slice(&hmac[..32])?.public_key();
+                let point = parent_point + offset_pk.to_projective();
+                if bool::from(point.is_identity()) {
+                    None
+                } else {
+                    Some(point)
+                }
+            } else {
+                None
+            };
+
+            match child_point {
+                Some(point) => points.push(point),
+                None => {
+                    skipped.push((offset as usize, self.derive_public_key(index)?.public_key()?));
+                    points.push(ProjectivePoint::GENERATOR);
+                }
+            }
+        }
+
+        let mut affine = vec![AffinePoint::IDENTITY; points.len()];
+        ProjectivePoint::batch_normalize(&points, &mut affine);
+
+        let mut keys: Vec<[u8; 33]> = affine
+            .iter()
+            .map(|point| {
+                let mut bytes = [0u8; 33];
+                bytes.copy_from_slice(point.to_bytes().as_ref());
+                bytes
+            })
+            .collect();
+        for (offset, public_key) in skipped {
+            keys[offset] = public_key;
+        }
+        Ok(keys)
+    }
+
+    /// Derives a single child using private or public derivation.
+    pub fn derive_child(
+        &self,
+        key_type: ExtendedKeyType,
+        index: u32,
+    ) -> Result<ExtendedKey, ChainGangError> {
+        match key_type {
+            ExtendedKeyType::Public => self.derive_public_key(index),
+            ExtendedKeyType::Private => self.derive_private_key(index),
+        }
+    }
+
     /// Encodes an extended key into a string
     pub fn encode(&self) -> String {
-        let checksum = sha256d(&self.0);
-        let mut v = Vec::with_capacity(82);
-        v.extend_from_slice(&self.0);
-        v.extend_from_slice(&checksum.0[..4]);
-        v.to_base58()
+        encode_base58_checksum(&self.0)
     }
 
     /// Decodes an extended key from a string
     pub fn decode(s: &str) -> Result<ExtendedKey, ChainGangError> {
-        let v = s
-            .from_base58()
-            .map_err(|e| ChainGangError::Base58Error(format!("{e:?}")))?;
-        let checksum = sha256d(&v[..78]);
-        if checksum.0[..4] != v[78..] {
-            return Err(ChainGangError::BadArgument("Invalid checksum".to_string()));
-        }
-        let mut extended_key = ExtendedKey([0; 78]);
-        extended_key.0.clone_from_slice(&v[..78]);
-        Ok(extended_key)
+        Ok(ExtendedKey(decode_base58_checksum_fixed::<78>(s)?))
     }
 }
 
@@ -484,22 +555,26 @@ pub fn derive_extended_key(
     master: &ExtendedKey,
     path: &str,
 ) -> Result<ExtendedKey, ChainGangError> {
+    let (key_type, indices) = parse_derivation_path(path)?;
+    derive_extended_key_indices(master, key_type, &indices)
+}
+
+/// Parses a BIP-32 path (`m/...` or `M/...`) into its derivation type and child indices.
+///
+/// Hardened steps (`'`, `h` or `H` suffix) are returned with [`HARDENED_KEY`] added.
+pub fn parse_derivation_path(path: &str) -> Result<(ExtendedKeyType, Vec<u32>), ChainGangError> {
     let parts: Vec<&str> = path.split('/').collect();
-    let mut key_type = ExtendedKeyType::Public;
 
-    if parts[0] == "m" {
-        if master.key_type()? == ExtendedKeyType::Public {
-            let msg = "Cannot derive private key from public master";
-            return Err(ChainGangError::BadArgument(msg.to_string()));
-        }
-        key_type = ExtendedKeyType::Private;
-    } else if parts[0] != "M" {
+    let key_type = if parts[0] == "m" {
+        ExtendedKeyType::Private
+    } else if parts[0] == "M" {
+        ExtendedKeyType::Public
+    } else {
         let msg = "Path must start with m or M";
         return Err(ChainGangError::BadArgument(msg.to_string()));
-    }
-
-    let mut key = *master;
+    };
 
+    let mut indices = Vec::with_capacity(parts.len() - 1);
     for part in parts[1..].iter() {
         if part.is_empty() {
             let msg = "Empty part";
@@ -512,21 +587,43 @@ pub fn derive_extended_key(
                 .trim_end_matches('h')
                 .trim_end_matches('H')
                 .parse()?;
-            if index >= HARDENED_KEY {
-                let msg = "Key index is already hardened";
-                return Err(ChainGangError::BadArgument(msg.to_string()));
-            }
-            index + HARDENED_KEY
+            hardened_index(index)?
         } else {
             part.parse()?
         };
+        indices.push(index);
+    }
 
-        key = match key_type {
-            ExtendedKeyType::Public => key.derive_public_key(index)?,
-            ExtendedKeyType::Private => key.derive_private_key(index)?,
-        };
+    Ok((key_type, indices))
+}
+
+/// Returns the hardened form of a child index (`index + HARDENED_KEY`).
+pub fn hardened_index(index: u32) -> Result<u32, ChainGangError> {
+    if index >= HARDENED_KEY {
+        let msg = "Key index is already hardened";
+        return Err(ChainGangError::BadArgument(msg.to_string()));
+    }
+    Ok(index + HARDENED_KEY)
+}
+
+/// Derives a key along pre-parsed child indices, skipping path string parsing.
+///
+/// `key_type` selects private (`m/...`) or public (`M/...`) derivation; hardened indices
+/// must already include [`HARDENED_KEY`].
+pub fn derive_extended_key_indices(
+    master: &ExtendedKey,
+    key_type: ExtendedKeyType,
+    indices: &[u32],
+) -> Result<ExtendedKey, ChainGangError> {
+    if key_type == ExtendedKeyType::Private && master.key_type()? == ExtendedKeyType::Public {
+        let msg = "Cannot derive private key from public master";
+        return Err(ChainGangError::BadArgument(msg.to_string()));
     }
 
+    let mut key = *master;
+    for index in indices.iter() {
+        key = key.derive_child(key_type, *index)?;
+    }
     Ok(key)
 }
 
@@ -3,11 +3,16 @@
 use crate::network::Network;
 use crate::script::Script;
 use crate::util::ChainGangError;
+use crate::wallet::derivation_cache::DerivationCache;
 use crate::wallet::extended_key::{
-    derive_extended_key, master_extended_key_from_seed, ExtendedKey, ExtendedKeyType,
+    hardened_index, master_extended_key_from_seed, parse_derivation_path, ExtendedKey,
+    ExtendedKeyType,
 };
+use crate::util::parallel::parallel_map;
+use crate::wallet::hd_watch_wallet::{ChainScan, HdWatchWallet, DEFAULT_SCAN_CONCURRENCY};
 use crate::wallet::mnemonic::mnemonic_to_seed_validated;
 use crate::wallet::wallet::Wallet;
+use std::sync::Arc;
 
 /// BSV mainnet coin type per SLIP-44.
 pub const BSV_COIN_TYPE: u32 = 236;
@@ -25,12 +30,46 @@ pub fn bip44_path(coin_type: u32, account: u32, external: bool, index: u32) -> S
     format!("m/44'/{}'/{}'/{}/{}", coin_type, account, change, index)
 }
 
+/// Child indices for `m/{account}'/{change}/{index}`.
+pub fn bip32_indices(account: u32, change: u32, index: u32) -> Result<[u32; 3], ChainGangError> {
+    Ok([hardened_index(account)?, change, index])
+}
+
+/// Child indices for `m/44'/{coin_type}'/{account}'/{change}/{index}`.
+pub fn bip44_indices(
+    coin_type: u32,
+    account: u32,
+    external: bool,
+    index: u32,
+) -> Result<[u32; 5], ChainGangError> {
+    let change = if external { 0 } else { 1 };
+    Ok([
+        hardened_index(44)?,
+        hardened_index(coin_type)?,
+        hardened_index(account)?,
+        change,
+        index,
+    ])
+}
+
 /// HD wallet rooted at a BIP-32 master extended **private** key.
-#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+///
+/// Intermediate derivation nodes are memoised in a shared [`DerivationCache`], so clones of a
+/// wallet reuse the same cache.
+#[derive(Debug, Clone)]
 pub struct HdWallet {
     master: ExtendedKey,
+    cache: Arc<DerivationCache>,
 }
 
+impl PartialEq for HdWallet {
+    fn eq(&self, other: &HdWallet) -> bool {
+        self.master == other.master
+    }
+}
+
+impl Eq for HdWallet {}
+
 impl HdWallet {
     /// Creates an HD wallet from a master extended private key.
     pub fn from_master(master: ExtendedKey) -> Result<Self, ChainGangError> {
@@ -39,13 +78,16 @@ impl HdWallet {
                 "HdWallet requires a master extended private key".to_string(),
             ));
         }
-        Ok(HdWallet { master })
+        Ok(HdWallet {
+            master,
+            cache: Arc::new(DerivationCache::default()),
+        })
     }
 
     /// Creates an HD wallet from a BIP-32 seed.
     pub fn from_seed(network: Network, seed: &[u8]) -> Result<Self, ChainGangError> {
         let master = master_extended_key_from_seed(network, seed)?;
-        Ok(HdWallet { master })
+        Self::from_master(master)
     }
 
     /// Creates an HD wallet from a validated BIP-39 mnemonic (English word list).
@@ -69,9 +111,29 @@ impl HdWallet {
         self.master.network()
     }
 
+    /// Replaces the derivation cache (e.g. to change its size or enable zeroing).
+    ///
+    /// A capacity of `0` disables caching.
+    pub fn with_cache(mut self, cache: DerivationCache) -> Self {
+        self.cache = Arc::new(cache);
+        self
+    }
+
+    /// Derivation cache shared by this wallet and its clones.
+    pub fn cache(&self) -> &DerivationCache {
+        &self.cache
+    }
+
     /// Derives an extended key along a BIP-32 path (`m/...` or `M/...`).
     pub fn derive_path(&self, path: &str) -> Result<ExtendedKey, ChainGangError> {
-        derive_extended_key(&self.master, path)
+        let (key_type, indices) = parse_derivation_path(path)?;
+        self.cache.derive(&self.master, key_type, &indices)
+    }
+
+    /// Derives an extended private key along child indices (hardened indices include
+    /// [`HARDENED_KEY`](crate::wallet::HARDENED_KEY)), without parsing a path string.
+    pub fn derive_indices(&self, indices: &[u32]) -> Result<ExtendedKey, ChainGangError> {
+        self.cache.derive(&self.master, ExtendedKeyType::Private, indices)
     }
 
     /// Derives a signing [`Wallet`] at a private BIP-32 path.
@@ -79,10 +141,16 @@ impl HdWallet {
         Wallet::from_extended_key(&self.derive_path(path)?)
     }
 
+    /// Derives a signing [`Wallet`] at private child indices.
+    pub fn wallet_at_indices(&self, indices: &[u32]) -> Result<Wallet, ChainGangError> {
+        Wallet::from_extended_key(&self.derive_indices(indices)?)
+    }
+
     /// P2PKH address at `m/{account}'/{change}/{index}`.
     pub fn address_at(&self, account: u32, external: bool, index: u32) -> Result<String, ChainGangError> {
         let change = if external { 0 } else { 1 };
-        self.wallet_at_path(&bip32_path(account, change, index))?.get_address()
+        self.wallet_at_indices(&bip32_indices(account, change, index)?)?
+            .get_address()
     }
 
     /// Locking script at `m/{account}'/{change}/{index}`.
@@ -94,7 +162,7 @@ impl HdWallet {
     ) -> Result<Script, ChainGangError> {
         let change = if external { 0 } else { 1 };
         Ok(self
-            .wallet_at_path(&bip32_path(account, change, index))?
+            .wallet_at_indices(&bip32_indices(account, change, index)?)?
             .get_locking_script())
     }
 
@@ -106,7 +174,8 @@ impl HdWallet {
         external: bool,
         index: u32,
     ) -> Result<String, ChainGangError> {
-        self.wallet_at_path(&bip44_path(coin_type, account, external, index))?.get_address()
+        self.wallet_at_indices(&bip44_indices(coin_type, account, external, index)?)?
+            .get_address()
     }
 
     /// Scans external receive addresses for `account` until `gap_limit` consecutive unused indices.
@@ -125,6 +194,46 @@ impl HdWallet {
             is_used,
         )
     }
+
+    /// Watch-only wallet for the account node `m/account'`.
+    pub fn account_watch_wallet(&self, account: u32) -> Result<HdWatchWallet, ChainGangError> {
+        let account_key = self.derive_indices(&[hardened_index(account)?])?;
+        HdWatchWallet::from_master(account_key.extended_public_key()?)
+    }
+
+    /// Gap-limit scans the receive and change chains of every account in `accounts`.
+    ///
+    /// All chains are scanned concurrently (up to [`DEFAULT_SCAN_CONCURRENCY`] at a time), each
+    /// asking `are_used` about `window` addresses per call. Results are in `accounts` order.
+    pub fn scan_accounts<H>(
+        &self,
+        accounts: &[u32],
+        gap_limit: u32,
+        window: u32,
+        are_used: H,
+    ) -> Result<Vec<ChainScan>, ChainGangError>
+    where
+        H: Fn(&[String]) -> Result<Vec<bool>, ChainGangError> + Sync,
+    {
+        let watches = accounts
+            .iter()
+            .map(|account| self.account_watch_wallet(*account))
+            .collect::<Result<Vec<_>, _>>()?;
+        let jobs: Vec<(usize, bool)> = (0..watches.len())
+            .flat_map(|i| [(i, true), (i, false)])
+            .collect();
+
+        let mut chains = parallel_map(&jobs, DEFAULT_SCAN_CONCURRENCY, |(i, external)| {
+            watches[*i].scan_addresses_batched(*external, gap_limit, window, &are_used)
+        })?
+        .into_iter();
+
+        let mut scans = Vec::with_capacity(watches.len());
+        while let (Some(external), Some(internal)) = (chains.next(), chains.next()) {
+            scans.push(ChainScan { external, internal });
+        }
+        Ok(scans)
+    }
 }
 
 #[cfg(test)]
@@ -134,6 +243,7 @@ mod tests {
         OutPoint, Tx, TxIn, TxOut, COINBASE_OUTPOINT_HASH, COINBASE_OUTPOINT_INDEX,
     };
     use crate::transaction::sighash::{SIGHASH_ALL, SIGHASH_FORKID};
+    use crate::wallet::HARDENED_KEY;
     use hex;
 
     fn test_seed() -> Vec<u8> {
@@ -160,6 +270,66 @@ mod tests {
         assert_eq!(wallet.public_key_serialize(), key.public_key().unwrap());
     }
 
+    #[test]
+    fn indices_match_path_strings() {
+        let hd = HdWallet::from_seed(Network::BSV_Mainnet, &test_seed()).unwrap();
+        let uncached = HdWallet::from_seed(Network::BSV_Mainnet, &test_seed())
+            .unwrap()
+            .with_cache(DerivationCache::new(0));
+        for index in 0..3 {
+            let path = bip44_path(BSV_COIN_TYPE, 1, false, index);
+            let indices = bip44_indices(BSV_COIN_TYPE, 1, false, index).unwrap();
+            assert_eq!(hd.derive_indices(&indices).unwrap(), uncached.derive_path(&path).unwrap());
+            assert_eq!(
+                hd.address_at(2, true, index).unwrap(),
+                uncached.wallet_at_path(&bip32_path(2, 0, index)).unwrap().get_address().unwrap()
+            );
+        }
+        assert!(hd.cache().hits() > 0);
+        assert!(bip32_indices(HARDENED_KEY, 0, 0).is_err());
+    }
+
+    #[test]
+    fn public_then_private_path_derivation() {
+        let hd = HdWallet::from_seed(Network::BSV_Mainnet, &test_seed()).unwrap();
+        let uncached = HdWallet::from_seed(Network::BSV_Mainnet, &test_seed())
+            .unwrap()
+            .with_cache(DerivationCache::new(0));
+        hd.derive_path("M/0/1").unwrap();
+        assert_eq!(
+            hd.derive_path("m/0/1").unwrap(),
+            uncached.derive_path("m/0/1").unwrap()
+        );
+        assert_eq!(
+            hd.derive_indices(&[0, 1]).unwrap(),
+            uncached.derive_path("m/0/1").unwrap()
+        );
+    }
+
+    #[test]
+    fn scan_accounts_matches_per_account_scan() {
+        let hd = HdWallet::from_seed(Network::BSV_Mainnet, &test_seed()).unwrap();
+        let used = [
+            hd.address_at(0, true, 0).unwrap(),
+            hd.address_at(0, false, 3).unwrap(),
+            hd.address_at(2, true, 1).unwrap(),
+        ];
+        let are_used = |addrs: &[String]| -> Result<Vec<bool>, ChainGangError> {
+            Ok(addrs.iter().map(|a| used.contains(a)).collect())
+        };
+
+        let scans = hd.scan_accounts(&[0, 1, 2], 5, 2, are_used).unwrap();
+        assert_eq!(scans.len(), 3);
+        assert_eq!(scans[0].external, vec![used[0].clone()]);
+        assert_eq!(scans[0].internal, vec![used[1].clone()]);
+        assert_eq!(scans[1], ChainScan::default());
+        assert_eq!(
+            scans[2].external,
+            hd.scan_external_addresses(2, 5, |a| used.iter().any(|u| u == a))
+                .unwrap()
+        );
+    }
+
     #[test]
     fn bip44_path_derives_distinct_addresses() {
         let hd = HdWallet::from_seed(Network::BSV_Mainnet, &test_seed()).unwrap();
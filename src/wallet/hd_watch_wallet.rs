@@ -2,15 +2,29 @@
 
 use crate::network::Network;
 use crate::script::Script;
-use crate::util::ChainGangError;
-use crate::wallet::extended_key::{
-    derive_extended_key, ExtendedKey, ExtendedKeyType,
-};
-use crate::wallet::wallet::{p2pkh_script, public_key_to_address};
+use crate::util::parallel::{parallel_chunks, parallel_map};
+use crate::util::{hash160, ChainGangError};
+use crate::wallet::derivation_cache::DerivationCache;
+use crate::wallet::extended_key::{parse_derivation_path, ExtendedKey, ExtendedKeyType};
+use crate::wallet::wallet::{p2pkh_script, public_key_hash_to_address, public_key_to_address};
+use std::sync::Arc;
 
 /// Default BIP-44 gap limit for address discovery.
 pub const DEFAULT_GAP_LIMIT: u32 = 20;
 
+/// Smallest number of children derived per worker thread by the range methods.
+const MIN_RANGE_CHUNK: usize = 512;
+
+/// Maximum number of chains scanned concurrently by the batched gap-limit scanners.
+pub const DEFAULT_SCAN_CONCURRENCY: usize = 8;
+
+/// Used addresses found on the receive (external) and change (internal) chains of an account.
+#[derive(Debug, Clone, Default, PartialEq, Eq)]
+pub struct ChainScan {
+    pub external: Vec<String>,
+    pub internal: Vec<String>,
+}
+
 /// Builds a relative BIP-32 path from an account-level extended public key: `M/{change}/{index}`.
 pub fn watch_bip32_path(change: u32, index: u32) -> String {
     format!("M/{}/{}", change, index)
@@ -23,11 +37,22 @@ pub fn watch_bip44_path(external: bool, index: u32) -> String {
 }
 
 /// Watch-only HD wallet rooted at an extended **public** key (typically account-level `xpub`).
-#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+///
+/// The receive and change chain nodes are memoised in a shared [`DerivationCache`].
+#[derive(Debug, Clone)]
 pub struct HdWatchWallet {
     master: ExtendedKey,
+    cache: Arc<DerivationCache>,
 }
 
+impl PartialEq for HdWatchWallet {
+    fn eq(&self, other: &HdWatchWallet) -> bool {
+        self.master == other.master
+    }
+}
+
+impl Eq for HdWatchWallet {}
+
 impl HdWatchWallet {
     /// Creates a watch-only wallet from an encoded extended public key (`xpub` / `tpub`).
     pub fn from_xpub(xpub: &str) -> Result<Self, ChainGangError> {
@@ -41,7 +66,10 @@ impl HdWatchWallet {
                 "HdWatchWallet requires an extended public key".to_string(),
             ));
         }
-        Ok(HdWatchWallet { master })
+        Ok(HdWatchWallet {
+            master,
+            cache: Arc::new(DerivationCache::default()),
+        })
     }
 
     pub fn master(&self) -> ExtendedKey {
@@ -52,9 +80,26 @@ impl HdWatchWallet {
         self.master.network()
     }
 
+    /// Replaces the derivation cache. A capacity of `0` disables caching.
+    pub fn with_cache(mut self, cache: DerivationCache) -> Self {
+        self.cache = Arc::new(cache);
+        self
+    }
+
+    /// Derivation cache shared by this wallet and its clones.
+    pub fn cache(&self) -> &DerivationCache {
+        &self.cache
+    }
+
     /// Derives an extended public key along a BIP-32 path (`M/...`).
     pub fn derive_path(&self, path: &str) -> Result<ExtendedKey, ChainGangError> {
-        derive_extended_key(&self.master, path)
+        let (key_type, indices) = parse_derivation_path(path)?;
+        self.cache.derive(&self.master, key_type, &indices)
+    }
+
+    /// Derives an extended public key along non-hardened child indices.
+    pub fn derive_indices(&self, indices: &[u32]) -> Result<ExtendedKey, ChainGangError> {
+        self.cache.derive(&self.master, ExtendedKeyType::Public, indices)
     }
 
     /// Compressed public key bytes at `path`.
@@ -62,6 +107,12 @@ impl HdWatchWallet {
         Ok(self.derive_path(path)?.public_key()?.to_vec())
     }
 
+    /// Compressed public key at `M/{change}/{index}`.
+    pub fn public_key_at(&self, external: bool, index: u32) -> Result<[u8; 33], ChainGangError> {
+        let change = if external { 0 } else { 1 };
+        self.derive_indices(&[change, index])?.public_key()
+    }
+
     /// P2PKH address at `path`.
     pub fn address_at_path(&self, path: &str) -> Result<String, ChainGangError> {
         let pk = self.public_key_at_path(path)?;
@@ -76,13 +127,83 @@ impl HdWatchWallet {
 
     /// P2PKH address at `M/{change}/{index}` relative to an account-level `xpub`.
     pub fn address_at(&self, external: bool, index: u32) -> Result<String, ChainGangError> {
-        let change = if external { 0 } else { 1 };
-        self.address_at_path(&watch_bip32_path(change, index))
+        public_key_to_address(&self.public_key_at(external, index)?, self.network()?)
     }
 
     /// P2PKH address at a relative BIP-44 receive/change chain index.
     pub fn address_at_bip44(&self, external: bool, index: u32) -> Result<String, ChainGangError> {
-        self.address_at_path(&watch_bip44_path(external, index))
+        self.address_at(external, index)
+    }
+
+    /// Compressed public keys for chain indices `start..start + count`.
+    ///
+    /// The chain node is derived once, then the range is split across worker threads, each
+    /// normalising its child points with a single batched field inversion.
+    pub fn public_keys_range(
+        &self,
+        external: bool,
+        start: u32,
+        count: u32,
+    ) -> Result<Vec<[u8; 33]>, ChainGangError> {
+        self.map_range(external, start, count, |pk| Ok(*pk))
+    }
+
+    /// Public key hashes (hash160) for chain indices `start..start + count`.
+    pub fn pubkey_hashes_range(
+        &self,
+        external: bool,
+        start: u32,
+        count: u32,
+    ) -> Result<Vec<[u8; 20]>, ChainGangError> {
+        self.map_range(external, start, count, |pk| Ok(hash160(pk).0))
+    }
+
+    /// P2PKH locking scripts for chain indices `start..start + count`.
+    pub fn locking_scripts_range(
+        &self,
+        external: bool,
+        start: u32,
+        count: u32,
+    ) -> Result<Vec<Script>, ChainGangError> {
+        self.map_range(external, start, count, |pk| Ok(p2pkh_script(&hash160(pk).0)))
+    }
+
+    /// P2PKH addresses for chain indices `start..start + count`.
+    pub fn addresses_range(
+        &self,
+        external: bool,
+        start: u32,
+        count: u32,
+    ) -> Result<Vec<String>, ChainGangError> {
+        let network = self.network()?;
+        self.map_range(external, start, count, |pk| {
+            public_key_hash_to_address(&hash160(pk).0, network)
+        })
+    }
+
+    fn map_range<T, F>(
+        &self,
+        external: bool,
+        start: u32,
+        count: u32,
+        f: F,
+    ) -> Result<Vec<T>, ChainGangError>
+    where
+        T: Send,
+        F: Fn(&[u8; 33]) -> Result<T, ChainGangError> + Sync,
+    {
+        let change = if external { 0 } else { 1 };
+        let chain = self.derive_indices(&[change])?;
+        parallel_chunks(count as usize, MIN_RANGE_CHUNK, |range| {
+            let first = start
+                .checked_add(range.start as u32)
+                .ok_or_else(|| ChainGangError::BadArgument("Index out of range".to_string()))?;
+            chain
+                .derive_public_keys(first, range.len() as u32)?
+                .iter()
+                .map(&f)
+                .collect()
+        })
     }
 
     /// Scans external or change chain indices until `gap_limit` consecutive unused addresses.
@@ -97,6 +218,103 @@ impl HdWatchWallet {
     {
         scan_address_indices(|i| self.address_at(external, i), gap_limit, is_used)
     }
+
+    /// Gap-limit scan that derives `window` addresses at a time and asks `are_used` about the
+    /// whole window in one call.
+    ///
+    /// Returns exactly the addresses [`scan_addresses`](Self::scan_addresses) would return.
+    pub fn scan_addresses_batched<H>(
+        &self,
+        external: bool,
+        gap_limit: u32,
+        window: u32,
+        are_used: H,
+    ) -> Result<Vec<String>, ChainGangError>
+    where
+        H: Fn(&[String]) -> Result<Vec<bool>, ChainGangError>,
+    {
+        scan_address_windows(
+            |start, count| self.addresses_range(external, start, count),
+            gap_limit,
+            window,
+            are_used,
+        )
+    }
+
+    /// Scans the receive and change chains concurrently with [`scan_addresses_batched`](Self::scan_addresses_batched).
+    pub fn scan_chains<H>(
+        &self,
+        gap_limit: u32,
+        window: u32,
+        are_used: H,
+    ) -> Result<ChainScan, ChainGangError>
+    where
+        H: Fn(&[String]) -> Result<Vec<bool>, ChainGangError> + Sync,
+    {
+        let mut chains = parallel_map(&[true, false], 2, |external| {
+            self.scan_addresses_batched(*external, gap_limit, window, &are_used)
+        })?;
+        let internal = chains.pop().unwrap_or_default();
+        let external = chains.pop().unwrap_or_default();
+        Ok(ChainScan { external, internal })
+    }
+}
+
+/// Scans address windows until `gap_limit` consecutive unused addresses.
+///
+/// `address_range(start, count)` returns the addresses for indices `start..start + count` and
+/// `are_used` reports usage for a whole window, so each window costs one lookup round trip.
+/// Addresses past the point where the gap limit is reached are discarded, giving the same
+/// result as [`scan_address_indices`].
+pub fn scan_address_windows<G, H>(
+    address_range: G,
+    gap_limit: u32,
+    window: u32,
+    are_used: H,
+) -> Result<Vec<String>, ChainGangError>
+where
+    G: Fn(u32, u32) -> Result<Vec<String>, ChainGangError>,
+    H: Fn(&[String]) -> Result<Vec<bool>, ChainGangError>,
+{
+    if window == 0 {
+        return Err(ChainGangError::BadArgument(
+            "Scan window must be greater than zero".to_string(),
+        ));
+    }
+
+    let mut used_addresses = Vec::new();
+    let mut gap = 0u32;
+    let mut index = 0u32;
+
+    while gap < gap_limit {
+        let addresses = address_range(index, window)?;
+        let used = are_used(&addresses)?;
+        if used.len() != addresses.len() {
+            return Err(ChainGangError::BadData(format!(
+                "Usage lookup returned {} results for {} addresses",
+                used.len(),
+                addresses.len()
+            )));
+        }
+
+        for (addr, is_used) in addresses.into_iter().zip(used) {
+            if gap >= gap_limit {
+                break;
+            }
+            if is_used {
+                used_addresses.push(addr);
+                gap = 0;
+            } else {
+                gap += 1;
+            }
+        }
+
+        index = index
+            .checked_add(window)
+            .ok_or_else(|| ChainGangError::BadArgument("Index out of range".to_string()))?;
+    }
+
+    Ok(used_addresses)
 }
 
 /// Scans address indices until `gap_limit` consecutive unused addresses.
@@ -170,6 +388,112 @@ mod tests {
         assert_eq!(full_addr, watch_addr);
     }
 
+    #[test]
+    fn cached_chain_node_matches_uncached() {
+        let hd = HdWallet::from_seed(Network::BSV_Mainnet, &test_seed()).unwrap();
+        let account_xpub = hd
+            .derive_path("m/0'")
+            .unwrap()
+            .extended_public_key()
+            .unwrap()
+            .encode();
+        let watch = HdWatchWallet::from_xpub(&account_xpub).unwrap();
+        let uncached = HdWatchWallet::from_xpub(&account_xpub)
+            .unwrap()
+            .with_cache(DerivationCache::new(0));
+
+        for index in 0..4 {
+            assert_eq!(
+                watch.address_at(false, index).unwrap(),
+                uncached.address_at_path(&watch_bip32_path(1, index)).unwrap()
+            );
+        }
+        assert_eq!(watch.cache().len(), 1);
+        assert_eq!(watch.cache().hits(), 3);
+        assert!(uncached.cache().is_empty());
+    }
+
+    #[test]
+    fn ranges_match_single_derivation() {
+        let hd = HdWallet::from_seed(Network::BSV_Testnet, &test_seed()).unwrap();
+        let account_xpub = hd
+            .derive_path("m/0'")
+            .unwrap()
+            .extended_public_key()
+            .unwrap()
+            .encode();
+        let watch = HdWatchWallet::from_xpub(&account_xpub).unwrap();
+
+        let start = 7;
+        let count = 1200;
+        let addresses = watch.addresses_range(true, start, count).unwrap();
+        let hashes = watch.pubkey_hashes_range(true, start, count).unwrap();
+        let scripts = watch.locking_scripts_range(true, start, count).unwrap();
+        assert_eq!(addresses.len(), count as usize);
+        for i in [0u32, 1, 511, 512, 1199] {
+            let index = start + i;
+            let path = watch_bip32_path(0, index);
+            assert_eq!(addresses[i as usize], watch.address_at(true, index).unwrap());
+            assert_eq!(
+                hashes[i as usize].to_vec(),
+                hash160(&watch.public_key_at_path(&path).unwrap()).0.to_vec()
+            );
+            assert_eq!(scripts[i as usize], watch.locking_script_at_path(&path).unwrap());
+        }
+
+        assert!(watch.addresses_range(false, 0, 0).unwrap().is_empty());
+        assert!(watch
+            .addresses_range(true, crate::wallet::HARDENED_KEY - 1, 2)
+            .is_err());
+    }
+
+    #[test]
+    fn batched_scan_matches_sequential_scan() {
+        let hd = HdWallet::from_seed(Network::BSV_Mainnet, &test_seed()).unwrap();
+        let account_xpub = hd
+            .derive_path("m/0'")
+            .unwrap()
+            .extended_public_key()
+            .unwrap()
+            .encode();
+        let watch = HdWatchWallet::from_xpub(&account_xpub).unwrap();
+
+        // Index 9 is just past the gap limit of 4 after index 4 and must not be reported
+        let used: Vec<String> = [0, 1, 4, 9, 12]
+            .iter()
+            .map(|i| watch.address_at(true, *i).unwrap())
+            .collect();
+        let change = watch.address_at(false, 2).unwrap();
+        let is_used = |addr: &str| used.iter().any(|a| a == addr) || addr == change;
+        let lookups = std::sync::atomic::AtomicUsize::new(0);
+        let are_used = |addrs: &[String]| -> Result<Vec<bool>, ChainGangError> {
+            lookups.fetch_add(1, std::sync::atomic::Ordering::Relaxed);
+            Ok(addrs.iter().map(|a| is_used(a.as_str())).collect())
+        };
+
+        let sequential = watch.scan_addresses(true, 4, is_used).unwrap();
+        assert_eq!(sequential, used[..3].to_vec());
+        for window in [1, 3, 4, 20] {
+            assert_eq!(
+                watch
+                    .scan_addresses_batched(true, 4, window, are_used)
+                    .unwrap(),
+                sequential
+            );
+        }
+
+        lookups.store(0, std::sync::atomic::Ordering::Relaxed);
+        let chains = watch.scan_chains(4, 20, are_used).unwrap();
+        assert_eq!(chains.external, sequential);
+        assert_eq!(chains.internal, vec![change.clone()]);
+        assert_eq!(lookups.load(std::sync::atomic::Ordering::Relaxed), 2);
+
+        assert!(watch.scan_addresses_batched(true, 4, 0, are_used).is_err());
+        assert!(watch
+            .scan_addresses_batched(true, 4, 5, |_| Ok(vec![true]))
+            .is_err());
+    }
+
     #[test]
     fn gap_scan_collects_used_addresses() {
         let hd = HdWallet::from_seed(Network::BSV_Mainnet, &test_seed()).unwrap();
@@ -1,5 +1,6 @@
 //! Wallet and key management
 
+mod derivation_cache;
 mod extended_key;
 mod hd_wallet;
 mod hd_watch_wallet;
@@ -9,15 +10,20 @@ pub mod base58_checksum;
 #[allow(clippy::module_inception)]
 pub mod wallet;
 
+pub use self::derivation_cache::{DerivationCache, DEFAULT_DERIVATION_CACHE_SIZE};
 pub use self::extended_key::{
-    derive_extended_key, master_extended_key_from_seed, ExtendedKey, ExtendedKeyType,
+    derive_extended_key, derive_extended_key_indices, hardened_index,
+    master_extended_key_from_seed, parse_derivation_path, ExtendedKey, ExtendedKeyType,
     BIP32_MASTER_SEED_KEY, HARDENED_KEY, INVALID_CHILD_KEY_MSG, MIN_BIP32_SEED_LENGTH,
     MAINNET_PRIVATE_EXTENDED_KEY, MAINNET_PUBLIC_EXTENDED_KEY, TESTNET_PRIVATE_EXTENDED_KEY,
     TESTNET_PUBLIC_EXTENDED_KEY,
 };
-pub use self::hd_wallet::{bip32_path, bip44_path, BSV_COIN_TYPE, HdWallet};
+pub use self::hd_wallet::{
+    bip32_indices, bip32_path, bip44_indices, bip44_path, BSV_COIN_TYPE, HdWallet,
+};
 pub use self::hd_watch_wallet::{
-    scan_address_indices, watch_bip32_path, watch_bip44_path, DEFAULT_GAP_LIMIT, HdWatchWallet,
+    scan_address_indices, scan_address_windows, watch_bip32_path, watch_bip44_path, ChainScan,
+    HdWatchWallet, DEFAULT_GAP_LIMIT, DEFAULT_SCAN_CONCURRENCY,
 };
 pub use self::mnemonic::{
     load_wordlist, mnemonic_decode, mnemonic_encode, mnemonic_parse, mnemonic_to_seed,
@@ -25,6 +31,7 @@ pub use self::mnemonic::{
 };
 
 pub use self::wallet::{
-    create_sighash, create_sighash_checksig_index, public_key_to_address, Wallet, MAIN_PRIVATE_KEY,
-    TEST_PRIVATE_KEY,
+    address_to_public_key_hash, addresses_to_public_key_hashes, create_sighash,
+    create_sighash_checksig_index, public_key_hash_to_address, public_key_hashes_to_addresses,
+    public_key_to_address, Wallet, MAIN_PRIVATE_KEY, TEST_PRIVATE_KEY,
 };
@@ -8,12 +8,14 @@ use crate::{
         Script,
     },
     transaction::{
-        generate_signature,
         p2pkh::create_unlock_script,
         sighash::{sighash, sighash_checksig_index, SigHashCache},
+        sign_sighash,
+    },
+    util::{hash160, parallel::parallel_chunks, ChainGangError, Hash256},
+    wallet::base58_checksum::{
+        decode_base58_checksum, decode_base58_checksum_fixed, encode_base58_checksum,
     },
-    util::{hash160, ChainGangError, Hash256},
-    wallet::base58_checksum::{decode_base58_checksum, encode_base58_checksum},
 };
 
 pub const MAIN_PRIVATE_KEY: u8 = 0x80;
@@ -22,6 +24,9 @@ pub const TEST_PRIVATE_KEY: u8 = 0xef;
 const MAIN_PUBKEY_HASH: u8 = 0x00;
 const TEST_PUBKEY_HASH: u8 = 0x6f;
 
+/// Smallest number of addresses converted per worker thread by the bulk conversions.
+const MIN_ADDRESS_CHUNK: usize = 256;
+
 pub fn wif_to_network_and_private_key(wif: &str) -> Result<(Network, SigningKey), ChainGangError> {
     let decode = decode_base58_checksum(wif)?;
     // Get first byte
@@ -56,16 +61,7 @@ pub fn public_key_to_address(
     public_key: &[u8],
     network: Network,
 ) -> Result<String, ChainGangError> {
-    let prefix_as_bytes: u8 = match network {
-        Network::BSV_Mainnet => MAIN_PUBKEY_HASH,
-        Network::BSV_Testnet => TEST_PUBKEY_HASH,
-        _ => {
-            return Err(ChainGangError::BadArgument(format!(
-                "{} unknnown network.",
-                &network
-            )));
-        }
-    };
+    address_prefix(network)?;
     // # 33 bytes compressed, 65 uncompressed.
     if public_key.len() != 33 && public_key.len() != 65 {
         return Err(ChainGangError::BadArgument(format!(
@@ -73,11 +69,77 @@ pub fn public_key_to_address(
             public_key.len()
         )));
     }
-    let mut data: Vec<u8> = vec![prefix_as_bytes];
-    data.extend(hash160(public_key).0);
+    public_key_hash_to_address(&hash160(public_key).0, network)
+}
+
+// Given a hash160 of a public key and network return address as a string
+pub fn public_key_hash_to_address(
+    public_key_hash: &[u8],
+    network: Network,
+) -> Result<String, ChainGangError> {
+    let prefix_as_bytes = address_prefix(network)?;
+    if public_key_hash.len() != 20 {
+        return Err(ChainGangError::BadArgument(format!(
+            "{} is an invalid length for a public key hash.",
+            public_key_hash.len()
+        )));
+    }
+    let mut data: Vec<u8> = Vec::with_capacity(21);
+    data.push(prefix_as_bytes);
+    data.extend_from_slice(public_key_hash);
     Ok(encode_base58_checksum(&data))
 }
 
+// Given an address return the 20 byte hash it pays to
+pub fn address_to_public_key_hash(address: &str) -> Result<[u8; 20], ChainGangError> {
+    let payload = decode_base58_checksum_fixed::<21>(address)?;
+    let mut hash = [0u8; 20];
+    hash.copy_from_slice(&payload[1..]);
+    Ok(hash)
+}
+
+/// Decodes many addresses in parallel, returning one result per address so that bad rows can
+/// be reported individually.
+pub fn addresses_to_public_key_hashes<S>(addresses: &[S]) -> Vec<Result<[u8; 20], ChainGangError>>
+where
+    S: AsRef<str> + Sync,
+{
+    // Rows carry their own errors, so the chunks themselves never fail
+    parallel_chunks(addresses.len(), MIN_ADDRESS_CHUNK, |range| {
+        Ok(addresses[range]
+            .iter()
+            .map(|address| address_to_public_key_hash(address.as_ref()))
+            .collect())
+    })
+    .unwrap_or_default()
+}
+
+/// Encodes many public key hashes as P2PKH addresses in parallel.
+pub fn public_key_hashes_to_addresses(
+    public_key_hashes: &[[u8; 20]],
+    network: Network,
+) -> Result<Vec<String>, ChainGangError> {
+    address_prefix(network)?;
+    parallel_chunks(public_key_hashes.len(), MIN_ADDRESS_CHUNK, |range| {
+        public_key_hashes[range]
+            .iter()
+            .map(|hash| public_key_hash_to_address(hash, network))
+            .collect()
+    })
+}
+
+// P2PKH address version byte for the network
+fn address_prefix(network: Network) -> Result<u8, ChainGangError> {
+    match network {
+        Network::BSV_Mainnet => Ok(MAIN_PUBKEY_HASH),
+        Network::BSV_Testnet => Ok(TEST_PUBKEY_HASH),
+        _ => Err(ChainGangError::BadArgument(format!(
+            "{} unknnown network.",
+            &network
+        ))),
+    }
+}
+
 pub fn p2pkh_script(h160: &[u8]) -> Script {
     let mut script = Script::new();
     script.append_slice(&[OP_DUP, OP_HASH160]);
@@ -197,10 +259,7 @@ impl Wallet {
         sighash: Hash256,
         sighash_flags: u8,
     ) -> Result<Vec<u8>, ChainGangError> {
-        // Get private key
-        let private_key_as_bytes: [u8; 32] = self.private_key.to_bytes().into();
-        let signature = generate_signature(&private_key_as_bytes, &sighash, sighash_flags)?;
-        Ok(signature)
+        sign_sighash(&self.private_key, &sighash, sighash_flags)
     }
 
     // sign_transaction_with_inputs(input_txs, tx, self.private_key)
@@ -310,3 +369,32 @@ impl Wallet {
         Ok(new_tx)
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn bulk_address_conversion_reports_bad_rows() {
+        let hashes: Vec<[u8; 20]> = (0..600u32)
+            .map(|i| hash160(&i.to_le_bytes()).0)
+            .collect();
+        let mut addresses = public_key_hashes_to_addresses(&hashes, Network::BSV_Testnet).unwrap();
+        assert_eq!(
+            addresses[7],
+            public_key_hash_to_address(&hashes[7], Network::BSV_Testnet).unwrap()
+        );
+
+        addresses[3] = "not an address".to_string();
+        addresses[500].pop();
+        let decoded = addresses_to_public_key_hashes(&addresses);
+        assert_eq!(decoded.len(), hashes.len());
+        for (i, result) in decoded.iter().enumerate() {
+            match i {
+                3 | 500 => assert!(result.is_err()),
+                _ => assert_eq!(result.as_ref().unwrap(), &hashes[i]),
+            }
+        }
+        assert!(public_key_hashes_to_addresses(&hashes, Network::BTC_Mainnet).is_err());
+    }
+}